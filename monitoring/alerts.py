@@ -6,11 +6,7 @@ import asyncio
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
-import smtplib
-from email.mime.text import MimeText
-from email.mime.multipart import MimeMultipart
 import json
-import aiohttp
 
 from .metrics import metrics_collector
 from .health_checks import get_health_status
@@ -113,8 +109,13 @@ class AlertManager:
             smtp_config = self.config.get('smtp', {})
             if not smtp_config:
                 return
-            
-            msg = MimeMultipart()
+
+            # Loaded on first alert, not at import
+            import smtplib
+            from email.mime.multipart import MIMEMultipart
+            from email.mime.text import MIMEText
+
+            msg = MIMEMultipart()
             msg['From'] = smtp_config['from_email']
             msg['To'] = ', '.join(smtp_config['to_emails'])
             msg['Subject'] = f"Immigration AI Alert: {alert['type']}"
@@ -128,7 +129,7 @@ class AlertManager:
             Details: {json.dumps(alert.get('details', {}), indent=2)}
             """
             
-            msg.attach(MimeText(body, 'plain'))
+            msg.attach(MIMEText(body, 'plain'))
             
             server = smtplib.SMTP(smtp_config['server'], smtp_config['port'])
             if smtp_config.get('use_tls'):
@@ -163,6 +164,8 @@ class AlertManager:
                 }]
             }
             
+            import aiohttp
+
             async with aiohttp.ClientSession() as session:
                 async with session.post(webhook_url, json=payload) as response:
                     if response.status != 200:
@@ -3,13 +3,10 @@
 Health check endpoints and monitoring utilities for Immigration AI SaaS
 """
 import time
-import psutil
 import logging
 from datetime import datetime
 from typing import Dict, Any, List
 import asyncio
-import aiohttp
-from supabase import create_client, Client
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +14,10 @@ class HealthChecker:
     """Comprehensive health checking for all system components"""
     
     def __init__(self, supabase_url: str, supabase_key: str):
-        self.supabase: Client = create_client(supabase_url, supabase_key)
+        # Heavy client libraries load when a checker is built, not at import
+        from supabase import create_client
+
+        self.supabase = create_client(supabase_url, supabase_key)
         self.start_time = datetime.now()
     
     async def check_database_health(self) -> Dict[str, Any]:
@@ -71,6 +71,8 @@ class HealthChecker:
     def check_system_resources(self) -> Dict[str, Any]:
         """Check system resource usage"""
         try:
+            import psutil
+
             cpu_percent = psutil.cpu_percent(interval=1)
             memory = psutil.virtual_memory()
             disk = psutil.disk_usage('/')
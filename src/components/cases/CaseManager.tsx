@@ -55,6 +55,10 @@ interface CaseNote {
   };
 }
 
+// Only the columns the list and overview render
+const CASE_LIST_COLUMNS = 'id, case_number, title, case_type, status, priority, due_date, created_at, updated_at';
+const CASES_PAGE_SIZE = 50;
+
 export const CaseManager: React.FC = () => {
   const { user } = useAuth();
   const { toast } = useToast();
@@ -63,6 +67,7 @@ export const CaseManager: React.FC = () => {
   const [activities, setActivities] = useState<CaseActivity[]>([]);
   const [notes, setNotes] = useState<CaseNote[]>([]);
   const [loading, setLoading] = useState(true);
+  const [hasMoreCases, setHasMoreCases] = useState(false);
   const [newNote, setNewNote] = useState('');
   const [notePrivate, setNotePrivate] = useState(false);
 
@@ -76,31 +81,43 @@ export const CaseManager: React.FC = () => {
     }
   }, [selectedCase]);
 
-  const fetchCases = async () => {
+  const fetchCases = async (after?: Case) => {
     try {
-      const { data, error } = await supabase
+      // Keyset pagination on (updated_at, id): each page is an index range scan
+      let query = supabase
         .from('cases')
         .select(`
-          *,
+          ${CASE_LIST_COLUMNS},
           clients:client_id (
             id,
             users:user_id (first_name, last_name)
           ),
           assigned_user:assigned_to (first_name, last_name)
         `)
-        .order('updated_at', { ascending: false });
+        .order('updated_at', { ascending: false })
+        .order('id', { ascending: false })
+        .limit(CASES_PAGE_SIZE + 1);
+      if (after) {
+        query = query.or(
+          `updated_at.lt."${after.updated_at}",and(updated_at.eq."${after.updated_at}",id.lt.${after.id})`
+        );
+      }
+      const { data, error } = await query;
 
       if (error) throw error;
       
+      const rows = data || [];
+      setHasMoreCases(rows.length > CASES_PAGE_SIZE);
+
       // Transform the data to match our interface
-      const transformedCases = (data || []).map(caseItem => ({
+      const transformedCases = rows.slice(0, CASES_PAGE_SIZE).map(caseItem => ({
         ...caseItem,
         client: caseItem.clients,
         // Handle the assigned_to field properly
         assigned_user: caseItem.assigned_user || undefined
       }));
       
-      setCases(transformedCases);
+      setCases(previous => (after ? [...previous, ...transformedCases] : transformedCases));
     } catch (error) {
       console.error('Error fetching cases:', error);
       toast({
@@ -247,7 +264,7 @@ export const CaseManager: React.FC = () => {
             <CardHeader>
               <CardTitle>Cases</CardTitle>
               <CardDescription>
-                {cases.length} total cases
+                {cases.length}{hasMoreCases ? '+' : ''} cases
               </CardDescription>
             </CardHeader>
             <CardContent className="space-y-2 max-h-96 overflow-y-auto">
@@ -276,6 +293,16 @@ export const CaseManager: React.FC = () => {
                   </div>
                 </div>
               ))}
+              {hasMoreCases && (
+                <Button
+                  variant="outline"
+                  size="sm"
+                  className="w-full"
+                  onClick={() => fetchCases(cases[cases.length - 1])}
+                >
+                  Load more
+                </Button>
+              )}
             </CardContent>
           </Card>
         </div>
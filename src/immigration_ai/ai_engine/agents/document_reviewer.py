@@ -1 +1,102 @@
+"""
+Automated first-pass review of uploaded client documents
+"""
 
+import logging
+import re
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+from immigration_ai.ai_engine.models.document_analyzer import DocumentAnalyzer
+from immigration_ai.core.services.document_service import DocumentStore
+
+logger = logging.getLogger(__name__)
+
+REVIEW_ARTIFACT = 'document_review'
+
+# Fields a reviewer expects to find on each ``document_type``
+REQUIRED_FIELDS: Dict[str, List[str]] = {
+    'passport': ['passport_number', 'expiry_date'],
+    'birth_certificate': ['dates'],
+    'marriage_certificate': ['dates'],
+    'diploma': ['dates'],
+    'employment_letter': ['dates'],
+    'financial_statement': ['dates'],
+}
+
+EXPIRY_WARNING_DAYS = 180
+
+
+def parse_date(value: str) -> Optional[date]:
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+class DocumentReviewer:
+    """Flag documents that need a human's attention before verification
+
+    Reviews are derived from the analyzer output, the declared document
+    type and the review date, and are cached per content hash under a key
+    built from all three, so identical re-uploads are answered instantly.
+    """
+
+    version = '1'
+
+    def __init__(self, analyzer: Optional[DocumentAnalyzer] = None, min_confidence: float = 0.6):
+        self.analyzer = analyzer or DocumentAnalyzer()
+        self.min_confidence = min_confidence
+
+    def review(self, analysis: Dict[str, Any], declared_type: Optional[str] = None,
+               as_of: Optional[date] = None) -> Dict[str, Any]:
+        as_of = as_of or date.today()
+        findings: List[Dict[str, str]] = []
+        detected = analysis.get('document_type')
+        fields = analysis.get('fields', {})
+
+        if declared_type and detected and declared_type != 'other' and detected != declared_type:
+            findings.append({'severity': 'error', 'code': 'type_mismatch',
+                             'message': f'Uploaded as {declared_type} but looks like {detected}'})
+        if analysis.get('confidence', 1.0) < self.min_confidence:
+            findings.append({'severity': 'warning', 'code': 'low_confidence',
+                             'message': 'Document type could not be determined confidently'})
+
+        for name in REQUIRED_FIELDS.get(declared_type or detected or '', []):
+            if not fields.get(name):
+                findings.append({'severity': 'warning', 'code': f'missing_{name}',
+                                 'message': f"Could not find {name.replace('_', ' ')}"})
+
+        expiry = parse_date(fields.get('expiry_date', '')) if fields.get('expiry_date') else None
+        if expiry is not None:
+            days_left = (expiry - as_of).days
+            if days_left < 0:
+                findings.append({'severity': 'error', 'code': 'expired',
+                                 'message': f'Document expired on {expiry.isoformat()}'})
+            elif days_left < EXPIRY_WARNING_DAYS:
+                findings.append({'severity': 'warning', 'code': 'expiring_soon',
+                                 'message': f'Document expires in {days_left} days'})
+
+        if any(f['severity'] == 'error' for f in findings):
+            status = 'rejected'
+        elif findings:
+            status = 'needs_attention'
+        else:
+            status = 'looks_valid'
+        return {'status': status, 'findings': findings, 'reviewed_as_of': as_of.isoformat()}
+
+    def review_document(self, store: DocumentStore, agency_id: str, document_id: str,
+                        as_of: Optional[date] = None) -> Dict[str, Any]:
+        """Review a stored document, reusing prior results for identical content"""
+        as_of = as_of or date.today()
+        record = store.get_record(agency_id, document_id)
+        analysis = self.analyzer.analyze_document(store, agency_id, document_id)
+        declared = record.document_type or 'any'
+        version = f"{self.version}-{analysis['model_version']}-{re.sub(r'[^a-z0-9_]', '', declared)}-{as_of.isoformat()}"
+        result, cached = store.get_or_compute_artifact(
+            agency_id, document_id, REVIEW_ARTIFACT, version,
+            lambda _record: self.review(analysis, record.document_type, as_of),
+        )
+        return dict(result, analysis=analysis, cached=cached)
@@ -1 +1,47 @@
+"""
+Case type classifier backed by a registry-managed linear text model
+"""
 
+import logging
+from typing import Any, Dict, Optional
+
+from immigration_ai.ai_engine.models.registry import ModelRegistry, get_registry
+from immigration_ai.ai_engine.utils.activations import softmax
+from immigration_ai.ai_engine.utils.embeddings import hashed_bag_of_words
+
+logger = logging.getLogger(__name__)
+
+
+class CaseClassifier:
+    """Predict a ``case_type`` from a case title and description
+
+    Expected artifact layout: tensors ``weights`` (``[n_labels, n_features]``)
+    and ``bias`` (``[n_labels]``), with ``metadata['labels']`` and
+    ``metadata['n_features']`` describing the hashed feature space.
+    """
+
+    model_name = 'case_classifier'
+
+    def __init__(self, registry: Optional[ModelRegistry] = None):
+        self._registry = registry
+
+    @property
+    def registry(self) -> ModelRegistry:
+        return self._registry or get_registry()
+
+    def classify(self, text: str) -> Dict[str, Any]:
+        model = self.registry.get(self.model_name)
+        labels = model.metadata['labels']
+        features = hashed_bag_of_words(text, model.metadata['n_features'])
+
+        bias = model.tensor('bias')
+        raw = model.tensor('weights').sparse_dot_rows(features)
+        probabilities = softmax([score + bias[i] for i, score in enumerate(raw)])
+
+        best = max(range(len(labels)), key=probabilities.__getitem__)
+        return {
+            'case_type': labels[best],
+            'confidence': probabilities[best],
+            'scores': dict(zip(labels, probabilities)),
+            'model_version': model.version,
+        }
@@ -1 +1,106 @@
+"""
+Document analyzer: document type classification and key field extraction
+"""
 
+import logging
+import re
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from immigration_ai.ai_engine.models.registry import ModelRegistry, get_registry
+from immigration_ai.ai_engine.processors.pdf_processor import PDFProcessor
+from immigration_ai.core.services.document_service import DocumentRecord, DocumentStore
+from immigration_ai.ai_engine.utils.activations import softmax
+from immigration_ai.ai_engine.utils.embeddings import hashed_bag_of_words
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_ARTIFACT = 'document_analysis'
+
+PASSPORT_NUMBER_PATTERN = re.compile(r'\b(?:passport\s*(?:no\.?|number)?\s*[:#]?\s*)([A-Z]{1,2}\d{6,9})\b', re.IGNORECASE)
+DATE_PATTERN = re.compile(r'\b(\d{4}-\d{2}-\d{2}|\d{2}[/.]\d{2}[/.]\d{4})\b')
+EXPIRY_PATTERN = re.compile(r'\b(?:date\s+of\s+)?expir(?:y|es|ation)\b\D{0,20}(\d{4}-\d{2}-\d{2}|\d{2}[/.]\d{2}[/.]\d{4})', re.IGNORECASE)
+
+
+class DocumentAnalyzer:
+    """Classify OCR/PDF text into a ``document_type`` and pull key fields
+
+    Expected artifact layout matches :class:`CaseClassifier`: tensors
+    ``weights``/``bias`` with ``metadata['labels']`` drawn from the
+    ``document_type`` enum and ``metadata['n_features']``.
+    """
+
+    model_name = 'document_analyzer'
+
+    def __init__(self, registry: Optional[ModelRegistry] = None):
+        self._registry = registry
+
+    @property
+    def registry(self) -> ModelRegistry:
+        return self._registry or get_registry()
+
+    def classify(self, text: str) -> Dict[str, Any]:
+        model = self.registry.get(self.model_name)
+        labels = model.metadata['labels']
+        features = hashed_bag_of_words(text, model.metadata['n_features'])
+
+        bias = model.tensor('bias')
+        raw = model.tensor('weights').sparse_dot_rows(features)
+        probabilities = softmax([score + bias[i] for i, score in enumerate(raw)])
+
+        best = max(range(len(labels)), key=probabilities.__getitem__)
+        return {
+            'document_type': labels[best],
+            'confidence': probabilities[best],
+            'model_version': model.version,
+        }
+
+    def extract_fields(self, text: str) -> Dict[str, Any]:
+        fields: Dict[str, Any] = {}
+        passport = PASSPORT_NUMBER_PATTERN.search(text)
+        if passport:
+            fields['passport_number'] = passport.group(1).upper()
+        expiry = EXPIRY_PATTERN.search(text)
+        if expiry:
+            fields['expiry_date'] = expiry.group(1)
+        dates: List[str] = DATE_PATTERN.findall(text)
+        if dates:
+            fields['dates'] = dates
+        return fields
+
+    def analyze(self, text: str) -> Dict[str, Any]:
+        result = self.classify(text)
+        result['fields'] = self.extract_fields(text)
+        return result
+
+    def read_text(self, store: DocumentStore, record: DocumentRecord) -> str:
+        """Extract text from a stored document blob"""
+        key = record.file_path
+        mime_type = record.mime_type or ''
+        if mime_type == 'application/pdf':
+            path = store.storage.local_path(key)
+            if path is not None:
+                return PDFProcessor().extract_text(path)
+            with tempfile.NamedTemporaryFile(suffix='.pdf') as spool, store.storage.open(key) as fh:
+                shutil.copyfileobj(fh, spool)
+                spool.flush()
+                return PDFProcessor().extract_text(spool.name)
+        if mime_type.startswith('text/'):
+            return store.storage.read(key).decode('utf-8', errors='replace')
+        logger.info(f"No text extractor for {mime_type or 'unknown'} document {record.id}")
+        return ''
+
+    def analyze_document(self, store: DocumentStore, agency_id: str, document_id: str) -> Dict[str, Any]:
+        """Analyze a stored document, reusing the result for identical content
+
+        Results are cached per content hash and model version, so a re-upload
+        of the same file (by any agency) is answered without reprocessing,
+        and publishing a new model version naturally invalidates them.
+        """
+        version = self.registry.get(self.model_name).version
+        result, cached = store.get_or_compute_artifact(
+            agency_id, document_id, ANALYSIS_ARTIFACT, version,
+            lambda record: self.analyze(self.read_text(store, record)),
+        )
+        return dict(result, cached=cached)
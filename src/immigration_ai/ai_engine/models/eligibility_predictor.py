@@ -1 +1,64 @@
+"""
+Eligibility predictor backed by a registry-managed logistic model
+"""
 
+import logging
+from typing import Any, Dict, List, Mapping, Optional
+
+from immigration_ai.ai_engine.models.registry import ModelRegistry, get_registry
+from immigration_ai.ai_engine.utils.activations import sigmoid
+
+logger = logging.getLogger(__name__)
+
+
+class EligibilityPredictor:
+    """Score an applicant profile against a published eligibility model
+
+    The model is looked up in the registry on every call, which maps it on
+    first use and follows hot-swapped versions; no weights are held on the
+    predictor itself, so instances are cheap and safe to create per request.
+
+    Expected artifact layout: tensors ``coef`` (``[n_features]``) and
+    ``intercept`` (``[1]``), with ``metadata['features']`` naming the input
+    keys in coefficient order and an optional ``metadata['threshold']``.
+    """
+
+    model_name = 'eligibility_predictor'
+
+    def __init__(self, registry: Optional[ModelRegistry] = None):
+        self._registry = registry
+
+    @property
+    def registry(self) -> ModelRegistry:
+        return self._registry or get_registry()
+
+    def vectorize(self, applicant: Mapping[str, Any], features: List[str]) -> List[float]:
+        vector = []
+        for name in features:
+            value = applicant.get(name, 0.0)
+            if isinstance(value, bool):
+                value = 1.0 if value else 0.0
+            try:
+                vector.append(float(value or 0.0))
+            except (TypeError, ValueError):
+                vector.append(0.0)
+        return vector
+
+    def predict(self, applicant: Mapping[str, Any]) -> Dict[str, Any]:
+        model = self.registry.get(self.model_name)
+        features = model.metadata['features']
+        coef = model.tensor('coef')
+        intercept = model.tensor('intercept')[0]
+
+        vector = self.vectorize(applicant, features)
+        contributions = {name: coef[i] * x for i, (name, x) in enumerate(zip(features, vector))}
+        probability = sigmoid(intercept + sum(contributions.values()))
+        threshold = model.metadata.get('threshold', 0.5)
+
+        top_factors = sorted(contributions.items(), key=lambda kv: abs(kv[1]), reverse=True)[:5]
+        return {
+            'eligible': probability >= threshold,
+            'probability': probability,
+            'top_factors': [{'feature': name, 'contribution': value} for name, value in top_factors],
+            'model_version': model.version,
+        }
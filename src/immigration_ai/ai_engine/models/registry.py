@@ -0,0 +1,284 @@
+"""
+Model registry with memory-mapped, lazily loaded weights
+
+Model artifacts are stored on disk as a JSON manifest plus a flat binary
+weights file::
+
+    <root>/<model_name>/CURRENT                 # active version id
+    <root>/<model_name>/<version>/manifest.json
+    <root>/<model_name>/<version>/weights.bin
+
+Weights are mapped read-only with ``mmap`` instead of being copied into the
+Python heap, so every API and Celery worker process that maps the same
+version shares one set of physical pages through the OS page cache. Models
+are only mapped on first use, and publishing a new version (rewriting
+``CURRENT``) is picked up by running processes without a restart.
+"""
+
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from immigration_ai.core.exceptions import ConfigurationError, ModelNotFoundError
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR_ENV = 'IMMIGRATION_AI_MODEL_DIR'
+DEFAULT_MODEL_DIR = Path(__file__).resolve().parents[4] / 'data' / 'models'
+
+MANIFEST_FILE = 'manifest.json'
+WEIGHTS_FILE = 'weights.bin'
+CURRENT_FILE = 'CURRENT'
+DTYPE = 'd'
+
+
+class Tensor:
+    """Read-only float64 view over a slice of a mapped weights file"""
+
+    def __init__(self, name: str, shape: Sequence[int], values: memoryview):
+        self.name = name
+        self.shape = tuple(shape)
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def row(self, index: int) -> memoryview:
+        """Return one row of a 2-D tensor without copying"""
+        width = self.shape[-1]
+        return self.values[index * width:(index + 1) * width]
+
+    def tolist(self) -> List[float]:
+        return self.values.tolist()
+
+    def sparse_dot_rows(self, features: Mapping[int, float]) -> List[float]:
+        """Score sparse features against every row of a 2-D tensor"""
+        rows, width = self.shape
+        values = self.values
+        scores = []
+        for r in range(rows):
+            base = r * width
+            scores.append(sum(values[base + i] * v for i, v in features.items()))
+        return scores
+
+
+class LoadedModel:
+    """A specific model version mapped into this process"""
+
+    def __init__(self, name: str, version: str, path: Path, manifest: Dict,
+                 buffer, tensors: Dict[str, Tensor]):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.manifest = manifest
+        self.metadata = manifest.get('metadata', {})
+        self._buffer = buffer
+        self._tensors = tensors
+
+    def tensor(self, name: str) -> Tensor:
+        try:
+            return self._tensors[name]
+        except KeyError:
+            raise ConfigurationError(
+                f"Model {self.name}@{self.version} has no tensor '{name}'"
+            ) from None
+
+    @property
+    def tensor_names(self) -> List[str]:
+        return list(self._tensors)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(t) * t.values.itemsize for t in self._tensors.values())
+
+
+def save_model(root, name: str, version: str,
+               tensors: Mapping[str, Tuple[Sequence[int], Iterable[float]]],
+               metadata: Optional[Dict] = None, activate: bool = True) -> Path:
+    """Write a model version in the registry's memory-mappable format
+
+    ``tensors`` maps tensor names to ``(shape, flat_values)``. The version
+    directory is written under a temporary name and renamed into place, and
+    ``CURRENT`` is replaced atomically, so readers never observe a partial
+    artifact.
+    """
+    model_dir = Path(root) / name
+    version_dir = model_dir / version
+    if version_dir.exists():
+        raise ConfigurationError(f"Model {name}@{version} already exists")
+
+    staging_dir = model_dir / f'.{version}.{os.getpid()}.tmp'
+    staging_dir.mkdir(parents=True)
+
+    layout = {}
+    offset = 0
+    with open(staging_dir / WEIGHTS_FILE, 'wb') as fh:
+        for tensor_name, (shape, values) in tensors.items():
+            data = array(DTYPE, values)
+            expected = 1
+            for dim in shape:
+                expected *= dim
+            if len(data) != expected:
+                raise ConfigurationError(
+                    f"Tensor '{tensor_name}' has {len(data)} values, shape {tuple(shape)} needs {expected}"
+                )
+            data.tofile(fh)
+            layout[tensor_name] = {'offset': offset, 'shape': list(shape)}
+            offset += len(data) * data.itemsize
+
+    manifest = {
+        'name': name,
+        'version': version,
+        'dtype': DTYPE,
+        'byteorder': sys.byteorder,
+        'created_at': time.time(),
+        'tensors': layout,
+        'metadata': metadata or {},
+    }
+    with open(staging_dir / MANIFEST_FILE, 'w') as fh:
+        json.dump(manifest, fh, indent=2)
+
+    os.rename(staging_dir, version_dir)
+    if activate:
+        activate_version(root, name, version)
+    return version_dir
+
+
+def activate_version(root, name: str, version: str) -> None:
+    """Point ``CURRENT`` at ``version`` with an atomic rename"""
+    model_dir = Path(root) / name
+    if not (model_dir / version / MANIFEST_FILE).exists():
+        raise ModelNotFoundError(f"Model {name}@{version} is not published")
+    tmp = model_dir / f'.{CURRENT_FILE}.{os.getpid()}.tmp'
+    tmp.write_text(version)
+    os.replace(tmp, model_dir / CURRENT_FILE)
+    logger.info(f"Activated model {name}@{version}")
+
+
+def _open_version(name: str, version: str, version_dir: Path) -> LoadedModel:
+    with open(version_dir / MANIFEST_FILE) as fh:
+        manifest = json.load(fh)
+    if manifest.get('dtype') != DTYPE or manifest.get('byteorder') != sys.byteorder:
+        raise ConfigurationError(
+            f"Model {name}@{version} was written as {manifest.get('dtype')}/{manifest.get('byteorder')}, "
+            f"this host needs {DTYPE}/{sys.byteorder}"
+        )
+
+    weights_path = version_dir / WEIGHTS_FILE
+    if weights_path.stat().st_size == 0:
+        buffer = memoryview(b'')
+    else:
+        with open(weights_path, 'rb') as fh:
+            # MAP_SHARED + PROT_READ: pages come from the page cache and are
+            # shared by every process mapping this file.
+            buffer = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(buffer)
+    itemsize = array(DTYPE).itemsize
+    tensors = {}
+    for tensor_name, spec in manifest['tensors'].items():
+        count = 1
+        for dim in spec['shape']:
+            count *= dim
+        start = spec['offset']
+        tensors[tensor_name] = Tensor(
+            tensor_name, spec['shape'], view[start:start + count * itemsize].cast(DTYPE)
+        )
+    return LoadedModel(name, version, version_dir, manifest, buffer, tensors)
+
+
+class ModelRegistry:
+    """Process-wide cache of lazily mapped models with hot-swap support
+
+    ``get()`` maps the active version on first use and afterwards re-reads
+    ``CURRENT`` at most once every ``check_interval`` seconds. When the
+    active version changes the new weights are mapped and swapped in; the
+    previous mapping is released once the last caller holding it drops its
+    reference, so in-flight predictions finish on the version they started
+    with.
+    """
+
+    def __init__(self, root=None, check_interval: float = 5.0):
+        self.root = Path(root or os.environ.get(MODEL_DIR_ENV) or DEFAULT_MODEL_DIR)
+        self.check_interval = check_interval
+        self._models: Dict[str, LoadedModel] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def current_version(self, name: str) -> str:
+        current = self.root / name / CURRENT_FILE
+        try:
+            version = current.read_text().strip()
+        except FileNotFoundError:
+            raise ModelNotFoundError(f"No active version for model '{name}' in {self.root}") from None
+        if not version:
+            raise ModelNotFoundError(f"No active version for model '{name}' in {self.root}")
+        return version
+
+    def get(self, name: str) -> LoadedModel:
+        """Return the active version of ``name``, mapping it if needed"""
+        now = time.monotonic()
+        model = self._models.get(name)
+        if model is not None and now - self._checked_at.get(name, 0.0) < self.check_interval:
+            return model
+
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None and now - self._checked_at.get(name, 0.0) < self.check_interval:
+                return model
+            version = self.current_version(name)
+            if model is None or model.version != version:
+                loaded = _open_version(name, version, self.root / name / version)
+                if model is not None:
+                    logger.info(f"Hot-swapped model {name}: {model.version} -> {version}")
+                else:
+                    logger.info(f"Mapped model {name}@{version} ({loaded.nbytes} bytes)")
+                self._models[name] = model = loaded
+            self._checked_at[name] = now
+            return model
+
+    def preload(self, names: Iterable[str]) -> None:
+        """Map models eagerly, e.g. in a pre-fork master process"""
+        for name in names:
+            self.get(name)
+
+    def refresh(self, name: Optional[str] = None) -> None:
+        """Force the next ``get()`` to re-check ``CURRENT``"""
+        with self._lock:
+            if name is None:
+                self._checked_at.clear()
+            else:
+                self._checked_at.pop(name, None)
+
+    def evict(self, name: str) -> None:
+        with self._lock:
+            self._models.pop(name, None)
+            self._checked_at.pop(name, None)
+
+    def loaded(self) -> Dict[str, str]:
+        """Return ``{model_name: version}`` for models mapped in this process"""
+        return {name: model.version for name, model in self._models.items()}
+
+
+_default_registry: Optional[ModelRegistry] = None
+_default_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """Return the process-wide registry rooted at ``IMMIGRATION_AI_MODEL_DIR``"""
+    global _default_registry
+    if _default_registry is None:
+        with _default_lock:
+            if _default_registry is None:
+                _default_registry = ModelRegistry()
+    return _default_registry
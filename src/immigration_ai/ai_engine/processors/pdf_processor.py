@@ -1 +1,501 @@
+"""
+Streaming PDF processor for large document bundles
 
+Bank statements and employment reference bundles routinely run to hundreds
+of pages. Instead of reading the whole file and rendering every page up
+front, :class:`PDFProcessor` memory-maps the file, walks the page tree
+lazily and yields one :class:`PDFPage` at a time, so each page flows through
+the downstream stages before the next one is read. Only object offsets are
+indexed; page content is decoded on demand with a capped decompressor and
+the mapped pages are released back to the page cache after every page,
+which keeps peak RSS flat regardless of document size.
+"""
+
+import bisect
+import logging
+import mmap
+import re
+import zlib
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from immigration_ai.core.exceptions import DocumentProcessingError, MemoryLimitExceededError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_LIMIT_BYTES = 16 * 1024 * 1024
+SCAN_WINDOW_BYTES = 1024 * 1024
+SCAN_OVERLAP_BYTES = 256
+
+WHITESPACE = b' \t\r\n\f\x00'
+DELIMITERS = b'()<>[]{}/%'
+
+OBJECT_HEADER = re.compile(rb'(?m)^[ \t]*(\d+)[ \t\r\n]+(\d+)[ \t\r\n]+obj\b')
+ROOT_REF = re.compile(rb'/Root\s+(\d+)\s+(\d+)\s+R')
+OBJECT_STREAM = re.compile(rb'/Type\s*/ObjStm\b')
+
+TEXT_OPERATORS = re.compile(
+    rb'\[((?:\\.|[^\]\\])*)\]\s*TJ'
+    rb'|\(((?:\\.|[^\\)])*)\)\s*(?:Tj|\'|")'
+    rb'|<([0-9A-Fa-f\s]*)>\s*Tj'
+    rb'|(T\*|Td|TD|ET)(?![A-Za-z])',
+    re.S,
+)
+ARRAY_STRINGS = re.compile(rb'\(((?:\\.|[^\\)])*)\)|<([0-9A-Fa-f\s]*)>')
+ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f',
+           b'(': b'(', b')': b')', b'\\': b'\\'}
+
+
+class PDFRef(NamedTuple):
+    num: int
+    gen: int
+
+
+class PDFName(str):
+    """A PDF name object (``/Type``), kept distinct from strings"""
+
+
+@dataclass
+class PDFPage:
+    """One page of a streamed document"""
+    number: int
+    text: str
+    content_bytes: int
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+def _unescape_literal(raw: bytes) -> bytes:
+    out = bytearray()
+    i = 0
+    while i < len(raw):
+        ch = raw[i:i + 1]
+        if ch != b'\\':
+            out += ch
+            i += 1
+            continue
+        nxt = raw[i + 1:i + 2]
+        if nxt in ESCAPES:
+            out += ESCAPES[nxt]
+            i += 2
+        elif nxt.isdigit():
+            digits = re.match(rb'[0-7]{1,3}', raw[i + 1:i + 4]).group(0)
+            out.append(int(digits, 8) & 0xFF)
+            i += 1 + len(digits)
+        elif nxt in (b'\n', b'\r'):
+            i += 2
+        else:
+            out += nxt
+            i += 2
+    return bytes(out)
+
+
+def _decode_hex(raw: bytes) -> bytes:
+    digits = re.sub(rb'\s', b'', raw)
+    if len(digits) % 2:
+        digits += b'0'
+    return bytes.fromhex(digits.decode('ascii'))
+
+
+def extract_text(content: bytes) -> str:
+    """Extract readable text from a decoded page content stream"""
+    parts: List[bytes] = []
+    for match in TEXT_OPERATORS.finditer(content):
+        array_body, literal, hex_string, positioning = match.groups()
+        if literal is not None:
+            parts.append(_unescape_literal(literal))
+        elif hex_string is not None:
+            parts.append(_decode_hex(hex_string))
+        elif array_body is not None:
+            for item in ARRAY_STRINGS.finditer(array_body):
+                lit, hx = item.groups()
+                parts.append(_unescape_literal(lit) if lit is not None else _decode_hex(hx))
+        elif positioning and parts and not parts[-1].endswith(b'\n'):
+            parts.append(b'\n')
+    return b''.join(parts).decode('latin-1').strip()
+
+
+class _Parser:
+    """Minimal PDF object parser over a bytes-like buffer"""
+
+    def __init__(self, data, pos: int = 0):
+        self.data = data
+        self.pos = pos
+        self.end = len(data)
+
+    def skip_whitespace(self) -> None:
+        data = self.data
+        while self.pos < self.end:
+            ch = data[self.pos]
+            if ch in WHITESPACE:
+                self.pos += 1
+            elif ch == 0x25:  # % comment
+                while self.pos < self.end and data[self.pos] not in b'\r\n':
+                    self.pos += 1
+            else:
+                break
+
+    def read_token(self) -> bytes:
+        self.skip_whitespace()
+        start = self.pos
+        data = self.data
+        while self.pos < self.end and data[self.pos] not in WHITESPACE and data[self.pos] not in DELIMITERS:
+            self.pos += 1
+        return bytes(data[start:self.pos])
+
+    def peek(self, size: int = 1) -> bytes:
+        return bytes(self.data[self.pos:self.pos + size])
+
+    def parse(self) -> Any:
+        self.skip_whitespace()
+        head = self.peek(2)
+        if head == b'<<':
+            return self._parse_dict()
+        if head[:1] == b'<':
+            end = self.data.find(b'>', self.pos)
+            raw = bytes(self.data[self.pos + 1:end])
+            self.pos = end + 1
+            return _decode_hex(raw)
+        if head[:1] == b'[':
+            self.pos += 1
+            items = []
+            while True:
+                self.skip_whitespace()
+                if self.peek() == b']':
+                    self.pos += 1
+                    return items
+                if self.pos >= self.end:
+                    raise DocumentProcessingError('Unterminated array in PDF object')
+                items.append(self.parse())
+        if head[:1] == b'/':
+            self.pos += 1
+            return PDFName(self.read_token().decode('latin-1'))
+        if head[:1] == b'(':
+            return self._parse_literal()
+
+        token = self.read_token()
+        if not token:
+            raise DocumentProcessingError(f'Unexpected byte {head[:1]!r} at offset {self.pos}')
+        if token == b'true':
+            return True
+        if token == b'false':
+            return False
+        if token == b'null':
+            return None
+        try:
+            number = int(token)
+        except ValueError:
+            try:
+                return float(token)
+            except ValueError:
+                return token.decode('latin-1')
+
+        # "num gen R" indirect reference?
+        saved = self.pos
+        gen = self.read_token()
+        if gen.isdigit() and self.read_token() == b'R':
+            return PDFRef(number, int(gen))
+        self.pos = saved
+        return number
+
+    def _parse_dict(self) -> Dict[str, Any]:
+        self.pos += 2
+        result = {}
+        while True:
+            self.skip_whitespace()
+            if self.peek(2) == b'>>':
+                self.pos += 2
+                return result
+            if self.pos >= self.end:
+                raise DocumentProcessingError('Unterminated dictionary in PDF object')
+            key = self.parse()
+            result[str(key)] = self.parse()
+
+    def _parse_literal(self) -> bytes:
+        depth = 0
+        start = self.pos + 1
+        data = self.data
+        while self.pos < self.end:
+            ch = data[self.pos]
+            if ch == 0x5C:  # backslash
+                self.pos += 2
+                continue
+            if ch == 0x28:
+                depth += 1
+            elif ch == 0x29:
+                depth -= 1
+                if depth == 0:
+                    raw = bytes(data[start:self.pos])
+                    self.pos += 1
+                    return _unescape_literal(raw)
+            self.pos += 1
+        raise DocumentProcessingError('Unterminated string in PDF object')
+
+
+class StreamingPDFReader:
+    """Lazy, memory-mapped access to the pages of a PDF file
+
+    Only an ``object number -> byte offset`` index is built when the file is
+    opened; page dictionaries and content streams are parsed when the page
+    is reached. Use as a context manager so the mapping is closed promptly.
+    """
+
+    def __init__(self, source: Union[str, Path], memory_limit_bytes: int = DEFAULT_MEMORY_LIMIT_BYTES):
+        self.path = Path(source)
+        self.memory_limit_bytes = memory_limit_bytes
+        self._file = open(self.path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise DocumentProcessingError(f'{self.path} is empty') from None
+        if not self._map[:1024].lstrip().startswith(b'%PDF-'):
+            self.close()
+            raise DocumentProcessingError(f'{self.path} is not a PDF file')
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+
+        # Dense ``object number -> offset`` table (8 bytes per object, -1 = absent)
+        self._offsets = array('q')
+        for match in self._scan(OBJECT_HEADER):
+            num = int(match.group(1))
+            if num >= len(self._offsets):
+                self._offsets.extend([-1] * (num + 1 - len(self._offsets)))
+            self._offsets[num] = match.start(1)
+        self._compressed: Optional[Dict[int, Tuple[int, int]]] = None
+        self._objstm_cache: Tuple[Optional[int], bytes] = (None, b'')
+        self._page_count: Optional[int] = None
+        self._root_ref: Optional[PDFRef] = None
+        self.release_pages()
+
+    def __enter__(self) -> 'StreamingPDFReader':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if not self._map.closed:
+            self._map.close()
+        self._file.close()
+
+    def release_pages(self, start: int = 0, length: Optional[int] = None) -> None:
+        """Drop mapped file pages from this process's RSS (they stay in the page cache)"""
+        if hasattr(mmap, 'MADV_DONTNEED') and not self._map.closed:
+            aligned = start - start % mmap.PAGESIZE
+            if length is None:
+                length = len(self._map) - aligned
+            else:
+                length += start - aligned
+            self._map.madvise(mmap.MADV_DONTNEED, aligned, min(length, len(self._map) - aligned))
+
+    def _scan(self, pattern) -> Iterator[Any]:
+        """Yield pattern matches window by window, releasing each scanned window"""
+        size = len(self._map)
+        start = 0
+        last_end = -1
+        while start < size:
+            end = min(size, start + SCAN_WINDOW_BYTES + SCAN_OVERLAP_BYTES)
+            for match in pattern.finditer(self._map, start, end):
+                if match.start() > last_end:
+                    last_end = match.end() - 1
+                    yield match
+            self.release_pages(start, end - start)
+            start += SCAN_WINDOW_BYTES
+
+    # -- object access -------------------------------------------------
+
+    def resolve(self, value: Any) -> Any:
+        while isinstance(value, PDFRef):
+            value = self._read_object(value.num)[0]
+        return value
+
+    def _read_object(self, num: int) -> Tuple[Any, Optional[int]]:
+        """Return ``(object, stream_offset)`` for an indirect object"""
+        offset = self._offsets[num] if num < len(self._offsets) else -1
+        if offset < 0:
+            return self._read_compressed_object(num), None
+
+        parser = _Parser(self._map, offset)
+        parser.read_token()
+        parser.read_token()
+        if parser.read_token() != b'obj':
+            raise DocumentProcessingError(f'Object {num} header is corrupt')
+        value = parser.parse()
+        parser.skip_whitespace()
+        if parser.peek(6) == b'stream':
+            pos = parser.pos + 6
+            if self._map[pos:pos + 2] == b'\r\n':
+                pos += 2
+            elif self._map[pos:pos + 1] in (b'\n', b'\r'):
+                pos += 1
+            return value, pos
+        return value, None
+
+    def read_stream(self, num: int) -> bytes:
+        """Return the decoded data of stream object ``num`` within the memory ceiling"""
+        info, start = self._read_object(num)
+        if start is None:
+            raise DocumentProcessingError(f'Object {num} is not a stream')
+        length = self.resolve(info.get('Length'))
+        if not isinstance(length, int):
+            length = self._map.find(b'endstream', start) - start
+        raw = self._map[start:start + length]
+
+        filters = self.resolve(info.get('Filter'))
+        if filters is None:
+            filters = []
+        elif not isinstance(filters, list):
+            filters = [filters]
+
+        data = raw
+        for name in filters:
+            if name in ('FlateDecode', 'Fl'):
+                decoder = zlib.decompressobj()
+                data = decoder.decompress(data, self.memory_limit_bytes + 1)
+            else:
+                raise DocumentProcessingError(f'Unsupported stream filter /{name}')
+        if len(data) > self.memory_limit_bytes:
+            raise MemoryLimitExceededError(
+                f'Stream object {num} decodes to more than {self.memory_limit_bytes} bytes'
+            )
+        return data
+
+    def _read_compressed_object(self, num: int) -> Any:
+        if self._compressed is None:
+            self._compressed = {}
+            starts = sorted(((num, offset) for num, offset in enumerate(self._offsets) if offset >= 0),
+                            key=lambda item: item[1])
+            offsets = [offset for _, offset in starts]
+            seen = set()
+            for match in self._scan(OBJECT_STREAM):
+                index = bisect.bisect_right(offsets, match.start()) - 1
+                if index < 0 or starts[index][0] in seen:
+                    continue
+                stream_num = starts[index][0]
+                seen.add(stream_num)
+                info, _ = self._read_object(stream_num)
+                header = _Parser(self.read_stream(stream_num))
+                for _ in range(info.get('N', 0)):
+                    obj_num = int(header.read_token())
+                    rel = int(header.read_token())
+                    self._compressed.setdefault(obj_num, (stream_num, info.get('First', 0) + rel))
+
+        location = self._compressed.get(num)
+        if location is None:
+            raise DocumentProcessingError(f'Object {num} not found')
+        stream_num, rel = location
+        cached_num, data = self._objstm_cache
+        if cached_num != stream_num:
+            data = self.read_stream(stream_num)
+            self._objstm_cache = (stream_num, data)
+        return _Parser(data, rel).parse()
+
+    # -- page tree -----------------------------------------------------
+
+    def _root(self) -> Dict[str, Any]:
+        if self._root_ref is None:
+            # The last /Root wins (incremental updates append); scanned once per reader
+            for match in self._scan(ROOT_REF):
+                self._root_ref = PDFRef(int(match.group(1)), int(match.group(2)))
+            if self._root_ref is None:
+                raise DocumentProcessingError(f'{self.path} has no document catalog')
+        catalog = self.resolve(self._root_ref)
+        return self.resolve(catalog['Pages'])
+
+    def _walk(self, node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Leaf pages in document order; a page tree that refers back to itself is rejected"""
+        visited = set()
+        stack = [iter([node])]
+        while stack:
+            kid = next(stack[-1], None)
+            if kid is None:
+                stack.pop()
+                continue
+            if isinstance(kid, PDFRef):
+                if kid.num in visited:
+                    raise DocumentProcessingError(f'{self.path} has a cyclic page tree at object {kid.num}')
+                visited.add(kid.num)
+            kid = self.resolve(kid)
+            if not isinstance(kid, dict):
+                raise DocumentProcessingError(f'{self.path} has a malformed page tree')
+            if kid.get('Type') == 'Pages' or 'Kids' in kid:
+                stack.append(iter(self.resolve(kid.get('Kids', [])) or ()))
+            else:
+                yield kid
+
+    @property
+    def page_count(self) -> int:
+        if self._page_count is None:
+            root = self._root()
+            count = root.get('Count')
+            self._page_count = count if isinstance(count, int) else sum(1 for _ in self._walk(root))
+        return self._page_count
+
+    def _page_content(self, page: Dict[str, Any]) -> bytes:
+        contents = page.get('Contents')
+        if contents is None:
+            return b''
+        if isinstance(contents, PDFRef):
+            resolved = self._read_object(contents.num)
+            if resolved[1] is not None:
+                return self.read_stream(contents.num)
+            contents = resolved[0]
+        chunks = []
+        total = 0
+        for ref in contents:
+            chunk = self.read_stream(ref.num)
+            total += len(chunk)
+            if total > self.memory_limit_bytes:
+                raise MemoryLimitExceededError(
+                    f'Page content exceeds the {self.memory_limit_bytes} byte memory ceiling'
+                )
+            chunks.append(chunk)
+        return b'\n'.join(chunks)
+
+    def iter_pages(self) -> Iterator[PDFPage]:
+        """Yield pages one at a time, releasing mapped memory between pages"""
+        for number, page in enumerate(self._walk(self._root()), start=1):
+            content = self._page_content(page)
+            result = PDFPage(number=number, text=extract_text(content), content_bytes=len(content))
+            del content
+            self.release_pages()
+            yield result
+
+
+Stage = Callable[[Any], Any]
+
+
+class PDFProcessor:
+    """Run PDF pages through a generator pipeline of processing stages
+
+    Each stage receives the previous stage's output for a single page.
+    Pages are pulled from the reader only when the consumer asks for the
+    next result, so at most one page is resident at a time.
+    """
+
+    def __init__(self, memory_limit_bytes: int = DEFAULT_MEMORY_LIMIT_BYTES,
+                 stages: Optional[Sequence[Stage]] = None):
+        self.memory_limit_bytes = memory_limit_bytes
+        self.stages = list(stages or [])
+
+    def iter_pages(self, path: Union[str, Path]) -> Iterator[PDFPage]:
+        with StreamingPDFReader(path, memory_limit_bytes=self.memory_limit_bytes) as reader:
+            yield from reader.iter_pages()
+
+    def process(self, path: Union[str, Path], stages: Optional[Sequence[Stage]] = None) -> Iterator[Any]:
+        pipeline = list(stages) if stages is not None else self.stages
+        for page in self.iter_pages(path):
+            result: Any = page
+            for stage in pipeline:
+                result = stage(result)
+            yield result
+
+    def page_count(self, path: Union[str, Path]) -> int:
+        with StreamingPDFReader(path, memory_limit_bytes=self.memory_limit_bytes) as reader:
+            return reader.page_count
+
+    def extract_text(self, path: Union[str, Path]) -> str:
+        """Convenience wrapper returning all page text; prefer ``process`` for large files"""
+        return '\n\n'.join(page.text for page in self.iter_pages(path))
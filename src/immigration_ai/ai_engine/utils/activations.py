@@ -0,0 +1,22 @@
+"""
+Numerically stable activation functions for model outputs
+"""
+
+import math
+from typing import List, Sequence
+
+
+def sigmoid(x: float) -> float:
+    if x >= 0:
+        return 1.0 / (1.0 + math.exp(-x))
+    z = math.exp(x)
+    return z / (1.0 + z)
+
+
+def softmax(scores: Sequence[float]) -> List[float]:
+    if not scores:
+        return []
+    peak = max(scores)
+    exps = [math.exp(s - peak) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
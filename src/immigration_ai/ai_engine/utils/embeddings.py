@@ -1 +1,27 @@
+"""
+Text feature helpers shared by the AI models
+"""
 
+import re
+import zlib
+from typing import Dict
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str):
+    """Lowercase text and split it into alphanumeric tokens"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def hashed_bag_of_words(text: str, n_features: int) -> Dict[int, float]:
+    """Map text to sparse term counts using a process-stable hashing trick
+
+    ``zlib.crc32`` is used instead of ``hash()`` so feature indices match
+    across worker processes and interpreter restarts.
+    """
+    counts: Dict[int, float] = {}
+    for token in tokenize(text):
+        index = zlib.crc32(token.encode('utf-8')) % n_features
+        counts[index] = counts.get(index, 0.0) + 1.0
+    return counts
@@ -1 +1,71 @@
+"""
+FastAPI dependencies shared by the v1 routes
+"""
 
+from functools import lru_cache
+
+from fastapi import Depends, Header, HTTPException, status
+
+from immigration_ai.core.exceptions import AuthenticationError
+from immigration_ai.core.services.case_service import CaseService
+from immigration_ai.core.services.document_service import get_document_store
+from immigration_ai.core.services.upload_service import ChunkedUploadService
+from immigration_ai.crm.services import ClientService
+from immigration_ai.security import permissions
+from immigration_ai.security.auth import Authenticator, Principal
+from immigration_ai.utils.dataloader import RequestLoaders
+from immigration_ai.utils import database
+
+
+@lru_cache()
+def get_authenticator() -> Authenticator:
+    return Authenticator(user_lookup=database.fetch_user)
+
+
+def get_current_principal(authorization: str = Header(None),
+                          authenticator: Authenticator = Depends(get_authenticator)) -> Principal:
+    if not authorization or not authorization.lower().startswith('bearer '):
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, 'Missing bearer token',
+                            headers={'WWW-Authenticate': 'Bearer'})
+    try:
+        return authenticator.authenticate(authorization[7:].strip())
+    except AuthenticationError as e:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, str(e),
+                            headers={'WWW-Authenticate': 'Bearer'}) from None
+
+
+def require_agency_user(principal: Principal = Depends(get_current_principal)) -> Principal:
+    if not principal.is_agency_user or not principal.agency_id:
+        raise HTTPException(status.HTTP_403_FORBIDDEN, 'Agency staff only')
+    return principal
+
+
+def require_client_access(client_id: str, principal: Principal = Depends(get_current_principal)) -> Principal:
+    """Allow agency users of the client's agency, or the client themselves"""
+    client = database.fetch_client(client_id)
+    if client is None or client['agency_id'] != principal.agency_id:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, 'Client not found')
+    if not permissions.can(principal, 'clients', 'read', client):
+        raise HTTPException(status.HTTP_403_FORBIDDEN, 'Not allowed to access this client')
+    return principal
+
+
+@lru_cache()
+def get_upload_service() -> ChunkedUploadService:
+    return ChunkedUploadService(get_document_store())
+
+
+@lru_cache()
+def get_case_service() -> CaseService:
+    return CaseService()
+
+
+@lru_cache()
+def get_client_service() -> ClientService:
+    return ClientService()
+
+
+def get_request_loaders(principal: Principal = Depends(require_agency_user),
+                        cases: CaseService = Depends(get_case_service)) -> RequestLoaders:
+    """Fresh batch loaders for this request, scoped to the caller's agency"""
+    return RequestLoaders(cases.db, principal.agency_id)
@@ -1 +1,69 @@
+"""
+FastAPI application entry point
+"""
 
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from immigration_ai.api.dependencies import get_authenticator
+from immigration_ai.api.v1.routes import cases, clients, realtime, sms
+from immigration_ai.api.v1.utils import error_status
+from immigration_ai.communication.notifications.pusher import ChangeFeed, get_push_hub
+from immigration_ai.communication.sms.sender import get_sms_status_log
+from immigration_ai.core.exceptions import ImmigrationAIError
+from immigration_ai.security.auth import JWKS_URL_ENV
+from immigration_ai.utils.database import DATABASE_URL_ENV, get_database
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open this worker's pool up front so the first requests don't pay for it
+    pooled = bool(os.environ.get(DATABASE_URL_ENV))
+    feed = ChangeFeed(get_push_hub())
+    if pooled:
+        await get_database().connect()
+        # One LISTEN connection per worker serves every realtime subscriber
+        feed.start()
+    if os.environ.get(JWKS_URL_ENV):
+        # Fetch the signing keys now rather than on the first request
+        await asyncio.to_thread(get_authenticator().jwks.start)
+    try:
+        yield
+    finally:
+        if pooled:
+            await feed.stop()
+            # Write receipts still buffered from the webhook before the pool goes away
+            await get_sms_status_log().close()
+            await get_database().close()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(title='Immigration AI API', version='1.0.0', lifespan=lifespan)
+
+    @app.exception_handler(ImmigrationAIError)
+    async def handle_platform_error(request: Request, exc: ImmigrationAIError):
+        return JSONResponse(status_code=error_status(exc), content={'detail': str(exc)})
+
+    @app.get('/health/database', include_in_schema=False)
+    async def database_health():
+        if not os.environ.get(DATABASE_URL_ENV):
+            return {'pooled': False}
+        return {'pooled': True, **get_database().metrics().to_dict()}
+
+    @app.get('/health/realtime', include_in_schema=False)
+    async def realtime_health():
+        return asdict(get_push_hub().stats())
+
+    app.include_router(cases.router, prefix='/api/v1')
+    app.include_router(clients.router, prefix='/api/v1')
+    app.include_router(realtime.router, prefix='/api/v1')
+    app.include_router(sms.router, prefix='/api/v1')
+    return app
+
+
+app = create_app()
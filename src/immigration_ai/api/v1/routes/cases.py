@@ -1 +1,60 @@
+"""
+Case routes
+"""
 
+from itertools import chain
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from immigration_ai.api.dependencies import get_case_service, get_request_loaders, require_agency_user
+from immigration_ai.core.schemas.case import CaseOut
+from immigration_ai.core.schemas.encoding import encode_page, iter_json_array, model_encoder
+from immigration_ai.core.schemas.pagination import PageOut
+from immigration_ai.core.services.case_service import CaseService
+from immigration_ai.security.auth import Principal
+from immigration_ai.utils.dataloader import RequestLoaders
+from immigration_ai.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+router = APIRouter(prefix='/cases', tags=['cases'])
+
+CASE_EXPORT_ENCODER = model_encoder(CaseOut)
+
+
+@router.get('', response_class=JSONResponse, responses={200: {'model': PageOut}})
+def list_cases(cursor: Optional[str] = None,
+               limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+               fields: Optional[str] = None, status: Optional[str] = None,
+               client_id: Optional[str] = None,
+               principal: Principal = Depends(require_agency_user),
+               cases: CaseService = Depends(get_case_service)):
+    """Keyset-paginated case list; pass ``next_cursor`` back as ``cursor``"""
+    page = cases.list_cases(principal.agency_id, status=status, client_id=client_id,
+                            cursor=cursor, limit=limit, fields=fields)
+    # Rows are already projected; skip per-row model validation
+    return Response(encode_page(page.items, page.next_cursor, page.fields), media_type='application/json')
+
+
+@router.get('/export', response_class=StreamingResponse,
+            responses={200: {'model': List[CaseOut], 'content': {'application/json': {}}}})
+def export_cases(status: Optional[str] = None,
+                 principal: Principal = Depends(require_agency_user),
+                 cases: CaseService = Depends(get_case_service)):
+    """Every case of the agency as one JSON array, streamed in chunks
+
+    The first chunk is built before the response starts, so a failing
+    first query is an ordinary error response. A failure after that aborts
+    the transfer, leaving the array unterminated rather than looking complete.
+    """
+    chunks = iter_json_array(cases.iter_cases(principal.agency_id, status=status), CASE_EXPORT_ENCODER)
+    first = next(chunks)
+    return StreamingResponse(chain([first], chunks), media_type='application/json')
+
+
+@router.get('/{case_id}')
+def get_case(case_id: str, principal: Principal = Depends(require_agency_user),
+             cases: CaseService = Depends(get_case_service),
+             loaders: RequestLoaders = Depends(get_request_loaders)):
+    """A case with its client, assignee, documents, notes and timeline"""
+    return cases.get_case_detail(principal.agency_id, case_id, loaders=loaders)
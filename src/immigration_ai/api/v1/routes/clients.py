@@ -1 +1,124 @@
+"""
+Client routes: the client list and resumable document uploads
+"""
 
+import tempfile
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, Query, Request, Response, status
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from immigration_ai.api.dependencies import (
+    get_client_service,
+    get_upload_service,
+    require_agency_user,
+    require_client_access,
+)
+from immigration_ai.core.schemas.document import DocumentOut, UploadCreate, UploadStatus
+from immigration_ai.core.schemas.encoding import encode_page
+from immigration_ai.core.schemas.pagination import PageOut
+from immigration_ai.core.services.upload_service import ChunkedUploadService, UploadSession
+from immigration_ai.crm.services import ClientService
+from immigration_ai.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from immigration_ai.security.auth import Principal
+
+router = APIRouter(prefix='/clients', tags=['clients'])
+
+# Chunks are spooled to disk past this size while they are validated
+SPOOL_MEMORY_BYTES = 256 * 1024
+
+
+def _status(session: UploadSession) -> UploadStatus:
+    return UploadStatus(
+        upload_id=session.id, status=session.status, file_name=session.file_name,
+        file_size=session.file_size, chunk_size=session.chunk_size,
+        committed_offset=session.committed_offset, document_id=session.document_id,
+    )
+
+
+@router.get('', response_class=JSONResponse, responses={200: {'model': PageOut}})
+def list_clients(cursor: Optional[str] = None,
+                 limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                 fields: Optional[str] = None, immigration_status: Optional[str] = None,
+                 principal: Principal = Depends(require_agency_user),
+                 clients: ClientService = Depends(get_client_service)):
+    """Keyset-paginated client list; pass ``next_cursor`` back as ``cursor``"""
+    page = clients.list_clients(principal.agency_id, immigration_status=immigration_status,
+                                cursor=cursor, limit=limit, fields=fields)
+    return Response(encode_page(page.items, page.next_cursor, page.fields), media_type='application/json')
+
+
+@router.post('/{client_id}/uploads', response_model=UploadStatus, status_code=status.HTTP_201_CREATED)
+def create_upload(client_id: str, body: UploadCreate,
+                  principal: Principal = Depends(require_client_access),
+                  uploads: ChunkedUploadService = Depends(get_upload_service)):
+    """Open a resumable upload session for a client document"""
+    session = uploads.create(
+        principal.agency_id, client_id, body.file_name, body.file_size, body.mime_type,
+        document_type=body.document_type, case_id=body.case_id, uploaded_by=principal.user_id,
+    )
+    return _status(session)
+
+
+@router.get('/{client_id}/uploads/{upload_id}', response_model=UploadStatus)
+def get_upload(client_id: str, upload_id: str, response: Response,
+               principal: Principal = Depends(require_client_access),
+               uploads: ChunkedUploadService = Depends(get_upload_service)):
+    """Report the committed offset so an interrupted upload can resume"""
+    session = uploads.status(principal.agency_id, client_id, upload_id)
+    response.headers['Upload-Offset'] = str(session.committed_offset)
+    return _status(session)
+
+
+@router.put('/{client_id}/uploads/{upload_id}', response_model=UploadStatus)
+async def put_upload_chunk(client_id: str, upload_id: str, request: Request, response: Response,
+                           upload_offset: int = Header(..., ge=0),
+                           principal: Principal = Depends(require_client_access),
+                           uploads: ChunkedUploadService = Depends(get_upload_service)):
+    """Append the request body at ``Upload-Offset``
+
+    The offset and session state are checked before the body is read, and
+    every received block is validated on arrival, so a wrong file type is
+    rejected after its first bytes. Of two requests racing for the same
+    offset only one commits; the other gets 409 and should re-read the
+    offset.
+    """
+    validator = await run_in_threadpool(uploads.begin_chunk, principal.agency_id, client_id, upload_id,
+                                        upload_offset)
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES) as spool:
+        try:
+            async for block in request.stream():
+                validator.feed(block)
+                spool.write(block)
+            validator.finish()
+        except Exception:
+            await run_in_threadpool(uploads.abort, principal.agency_id, client_id, upload_id)
+            raise
+        spool.seek(0)
+        session = await run_in_threadpool(uploads.put_chunk, principal.agency_id, client_id, upload_id,
+                                          upload_offset, spool, validated=True)
+    response.headers['Upload-Offset'] = str(session.committed_offset)
+    return _status(session)
+
+
+@router.post('/{client_id}/uploads/{upload_id}/complete', response_model=DocumentOut)
+def complete_upload(client_id: str, upload_id: str,
+                    principal: Principal = Depends(require_client_access),
+                    uploads: ChunkedUploadService = Depends(get_upload_service)):
+    """Assemble the uploaded chunks into a stored (deduplicated) document"""
+    record, deduplicated = uploads.complete(principal.agency_id, client_id, upload_id)
+    return DocumentOut(
+        id=record.id, client_id=record.client_id, case_id=record.case_id, file_name=record.file_name,
+        file_size=record.file_size, mime_type=record.mime_type, document_type=record.document_type,
+        content_sha256=record.content_sha256, deduplicated=deduplicated,
+    )
+
+
+@router.delete('/{client_id}/uploads/{upload_id}', status_code=status.HTTP_204_NO_CONTENT)
+def abort_upload(client_id: str, upload_id: str,
+                 principal: Principal = Depends(require_client_access),
+                 uploads: ChunkedUploadService = Depends(get_upload_service)):
+    uploads.abort(principal.agency_id, client_id, upload_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,80 @@
+"""
+Realtime routes: one SSE or WebSocket stream per browser tab
+"""
+
+from typing import AsyncIterator, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, WebSocket, status
+from fastapi.responses import StreamingResponse
+
+from immigration_ai.api.dependencies import get_authenticator
+from immigration_ai.communication.notifications.pusher import PushHub, Subscriber, get_push_hub
+from immigration_ai.core.exceptions import AuthenticationError
+from immigration_ai.security.auth import Authenticator, Principal
+
+router = APIRouter(prefix='/realtime', tags=['realtime'])
+
+# "Try again later": the client should reconnect with backoff and refetch
+SLOW_CONSUMER_CLOSE_CODE = 1013
+POLICY_VIOLATION_CLOSE_CODE = 1008
+# Sent when the access token expires; the client reconnects with a fresh one
+TOKEN_EXPIRED_FRAME = b'event: expired\ndata: {}\n\n'
+
+
+def _authenticate(authenticator: Authenticator, authorization: Optional[str],
+                  access_token: Optional[str]) -> Principal:
+    # EventSource and browser WebSockets cannot set headers, so a query token is accepted too
+    token = access_token
+    if authorization and authorization.lower().startswith('bearer '):
+        token = authorization[7:].strip()
+    if not token:
+        raise AuthenticationError('Missing bearer token')
+    return authenticator.authenticate(token)
+
+
+async def _sse_frames(hub: PushHub, subscriber: Subscriber) -> AsyncIterator[bytes]:
+    yield b'retry: 5000\n\n'
+    async for message in hub.stream(subscriber):
+        yield message.sse if message is not None else b': ping\n\n'
+    if subscriber.expired:
+        yield TOKEN_EXPIRED_FRAME
+
+
+@router.get('/stream')
+async def stream_events(authorization: Optional[str] = Header(None), access_token: Optional[str] = Query(None),
+                        authenticator: Authenticator = Depends(get_authenticator)):
+    """Server-Sent Events for the caller's user channel and, for staff, their agency channel
+
+    The stream ends with an ``expired`` event when the access token expires.
+    """
+    try:
+        principal = _authenticate(authenticator, authorization, access_token)
+    except AuthenticationError as e:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, str(e)) from None
+    hub = get_push_hub()
+    subscriber = hub.subscribe(principal)
+    return StreamingResponse(_sse_frames(hub, subscriber), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@router.websocket('/ws')
+async def websocket_events(websocket: WebSocket, access_token: Optional[str] = Query(None)):
+    """The same channels as ``/stream`` over a WebSocket; heartbeats are ``{"event":"ping"}``"""
+    try:
+        principal = _authenticate(get_authenticator(), websocket.headers.get('authorization'), access_token)
+    except AuthenticationError:
+        await websocket.close(code=POLICY_VIOLATION_CLOSE_CODE)
+        return
+    await websocket.accept()
+    hub = get_push_hub()
+    subscriber = hub.subscribe(principal)
+    try:
+        async for message in hub.stream(subscriber):
+            await websocket.send_text(message.text if message is not None else '{"event":"ping"}')
+    finally:
+        # A disconnect surfaces as an exception from send_text
+        hub.unsubscribe(subscriber)
+    if subscriber.expired:
+        await websocket.close(code=POLICY_VIOLATION_CLOSE_CODE, reason='token expired')
+    elif subscriber.evicted:
+        await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
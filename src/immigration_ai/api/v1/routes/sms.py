@@ -0,0 +1,36 @@
+"""
+SMS provider webhooks
+"""
+
+import hmac
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Header, Request, status
+
+from immigration_ai.communication.sms.sender import DeliveryReceipt, get_sms_status_log
+from immigration_ai.core.exceptions import AuthenticationError, ValidationError
+
+router = APIRouter(prefix='/sms', tags=['sms'])
+
+WEBHOOK_TOKEN_ENV = 'SMS_WEBHOOK_TOKEN'
+
+
+@router.post('/receipts/{provider}', status_code=status.HTTP_202_ACCEPTED)
+async def ingest_receipts(provider: str, request: Request, x_webhook_token: Optional[str] = Header(None)):
+    """Delivery receipts (one object or a list), acknowledged once written to ``sms_messages``
+
+    Concurrent requests share one batched write. A full buffer or a failed
+    write answers 503, so the provider redelivers instead of the receipts
+    being lost.
+    """
+    expected = os.environ.get(WEBHOOK_TOKEN_ENV)
+    if not expected or not x_webhook_token or not hmac.compare_digest(expected, x_webhook_token):
+        raise AuthenticationError('Invalid webhook token')
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise ValidationError('Body must be JSON') from None
+    receipts = [DeliveryReceipt.from_payload(item) for item in (payload if isinstance(payload, list) else [payload])]
+    await get_sms_status_log().write_receipts(provider, receipts)
+    return {'accepted': len(receipts)}
@@ -1 +1,31 @@
+"""
+Shared helpers for v1 routes
+"""
 
+from immigration_ai.core.exceptions import (
+    AuthenticationError,
+    ConflictError,
+    ImmigrationAIError,
+    PermissionDeniedError,
+    ResourceNotFoundError,
+    ServiceUnavailableError,
+    ValidationError,
+)
+
+# Most specific classes first
+ERROR_STATUS_CODES = (
+    (AuthenticationError, 401),
+    (PermissionDeniedError, 403),
+    (ResourceNotFoundError, 404),
+    (ConflictError, 409),
+    (ValidationError, 422),
+    (ServiceUnavailableError, 503),
+    (ImmigrationAIError, 500),
+)
+
+
+def error_status(exc: ImmigrationAIError) -> int:
+    for exc_type, status_code in ERROR_STATUS_CODES:
+        if isinstance(exc, exc_type):
+            return status_code
+    return 500
@@ -1 +1,652 @@
+"""
+Pooled, pipelined email delivery through a durable outbox
 
+Bulk sends are rendered once (:mod:`.templates`) and written to
+``public.email_outbox`` by :class:`EmailSender`. Sending is a separate step.
+:class:`EmailDeliveryEngine` claims due rows in batches, hands them to an
+:class:`SMTPTransport`, and records the outcome. Failed rows are
+rescheduled with exponential backoff and given up after ``max_attempts``.
+
+The transport keeps ``pool_size`` authenticated SMTP connections open
+between batches. Each connection carries many messages instead of one
+TCP+TLS+AUTH handshake per message. When the server advertises PIPELINING
+(RFC 2920), a message's MAIL/RCPT/DATA go out in one write, together with
+the previous message's end of data. That is one round trip per message
+instead of four. Each provider has its own :class:`TokenBucket`, and
+every message waits for a token before it is written.
+
+Delivery is at least once. If a connection drops after a message's data
+was sent but before the server's reply, the row is retried.
+"""
+
+import asyncio
+import base64
+import binascii
+import logging
+import os
+import re
+import socket
+import ssl
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from email.header import Header
+from email.utils import formatdate, make_msgid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from immigration_ai.communication.email.templates import TemplateRegistry, database_override_loader
+from immigration_ai.core.exceptions import ConfigurationError, DeliveryError, ValidationError
+from immigration_ai.utils.rate_limit import TokenBucket, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROVIDER = 'default'
+DEFAULT_POOL_SIZE = 4
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_RATE_PER_SECOND = 50.0
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_IDLE_SECONDS = 60.0
+DEFAULT_MAX_MESSAGES_PER_CONNECTION = 1000
+
+DEFAULT_CLAIM_SIZE = 500
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_BACKOFF_BASE = 30.0
+DEFAULT_BACKOFF_CAP = 6 * 3600.0
+DEFAULT_LEASE_SECONDS = 300.0
+
+_LEADING_DOT = re.compile(rb'^\.', re.MULTILINE)
+
+
+@dataclass
+class EmailProviderSettings:
+    """Connection, pooling and rate-limit settings for one SMTP provider"""
+    host: str
+    port: int = 587
+    name: str = DEFAULT_PROVIDER
+    username: Optional[str] = None
+    password: Optional[str] = None
+    starttls: bool = True
+    implicit_tls: bool = False
+    from_address: str = 'no-reply@localhost'
+    pool_size: int = DEFAULT_POOL_SIZE
+    batch_size: int = DEFAULT_BATCH_SIZE
+    rate_per_second: float = DEFAULT_RATE_PER_SECOND
+    burst: Optional[float] = None
+    pipelining: bool = True
+    timeout: float = DEFAULT_TIMEOUT
+    max_idle_seconds: float = DEFAULT_MAX_IDLE_SECONDS
+    max_messages_per_connection: int = DEFAULT_MAX_MESSAGES_PER_CONNECTION
+    local_hostname: Optional[str] = None
+
+    @classmethod
+    def from_env(cls, name: str = DEFAULT_PROVIDER) -> 'EmailProviderSettings':
+        """Read ``SMTP_*`` (or ``SMTP_<NAME>_*`` for a named provider) variables"""
+        prefix = 'SMTP_' if name == DEFAULT_PROVIDER else f'SMTP_{name.upper()}_'
+
+        def env(key, default=None):
+            return os.environ.get(prefix + key, default)
+
+        host = env('HOST')
+        if not host:
+            raise ConfigurationError(f'{prefix}HOST is not set')
+        return cls(
+            host=host,
+            port=int(env('PORT', 587)),
+            name=name,
+            username=env('USERNAME'),
+            password=env('PASSWORD'),
+            starttls=env('STARTTLS', '1') == '1',
+            implicit_tls=env('IMPLICIT_TLS', '0') == '1',
+            from_address=env('FROM', 'no-reply@localhost'),
+            pool_size=int(env('POOL_SIZE', DEFAULT_POOL_SIZE)),
+            batch_size=int(env('BATCH_SIZE', DEFAULT_BATCH_SIZE)),
+            rate_per_second=float(env('RATE_PER_SECOND', DEFAULT_RATE_PER_SECOND)),
+        )
+
+
+@dataclass
+class OutgoingEmail:
+    """One rendered message; ``id`` is its outbox row"""
+    to: str
+    subject: str
+    text: str
+    html: Optional[str] = None
+    id: Optional[int] = None
+    sender: Optional[str] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def to_bytes(self, default_sender: str) -> bytes:
+        """The RFC 5322 message: text, or text and HTML as multipart/alternative"""
+        sender = self.sender or default_sender
+        for value in (sender, self.to, self.subject, *self.headers.values()):
+            if '\r' in value or '\n' in value:
+                raise ValidationError('Email header values must be a single line')
+        head = [
+            f'From: {sender}',
+            f'To: {self.to}',
+            f'Subject: {_header_value(self.subject)}',
+            f'Date: {formatdate(localtime=False)}',
+            f"Message-ID: {make_msgid(domain=sender.rpartition('@')[2] or None)}",
+            'MIME-Version: 1.0',
+        ]
+        head.extend(f'{name}: {_header_value(value)}' for name, value in self.headers.items())
+        if not self.html:
+            head.extend(_part_headers('plain'))
+            return ('\r\n'.join(head) + '\r\n\r\n').encode('ascii') + _quoted_printable(self.text)
+        boundary = f'=_{uuid.uuid4().hex}'
+        head.append(f'Content-Type: multipart/alternative; boundary="{boundary}"')
+        parts = [('\r\n'.join(head) + '\r\n\r\n').encode('ascii')]
+        for subtype, body in (('plain', self.text), ('html', self.html)):
+            parts.append(f'--{boundary}\r\n'.encode('ascii'))
+            parts.append(('\r\n'.join(_part_headers(subtype)) + '\r\n\r\n').encode('ascii'))
+            parts.append(_quoted_printable(body) + b'\r\n')
+        parts.append(f'--{boundary}--\r\n'.encode('ascii'))
+        return b''.join(parts)
+
+
+def _header_value(value: str) -> str:
+    return value if value.isascii() else Header(value, 'utf-8').encode()
+
+
+def _part_headers(subtype: str) -> List[str]:
+    return [f'Content-Type: text/{subtype}; charset="utf-8"', 'Content-Transfer-Encoding: quoted-printable']
+
+
+def _quoted_printable(text: str) -> bytes:
+    # b2a_qp keeps lines under 76 characters and escapes non-ASCII and stray "="
+    encoded = binascii.b2a_qp(text.replace('\r\n', '\n').encode('utf-8'))
+    return encoded.replace(b'\n', b'\r\n')
+
+
+@dataclass
+class DeliveryResult:
+    """The provider's answer for one message"""
+    id: Optional[int]
+    ok: bool
+    temporary: bool = False
+    code: Optional[int] = None
+    error: Optional[str] = None
+
+
+def _data_block(payload: bytes) -> bytes:
+    """Dot-stuff a message and terminate it for the DATA phase"""
+    payload = _LEADING_DOT.sub(b'..', payload)
+    if not payload.endswith(b'\r\n'):
+        payload += b'\r\n'
+    return payload + b'.\r\n'
+
+
+def _failure(message: OutgoingEmail, code: int, text: str) -> DeliveryResult:
+    return DeliveryResult(message.id, False, temporary=code < 500, code=code, error=f'{code} {text}')
+
+
+# -- SMTP --------------------------------------------------------------------
+
+class SMTPConnection:
+    """One authenticated SMTP session that sends many messages"""
+
+    def __init__(self, settings: EmailProviderSettings):
+        self.settings = settings
+        self.extensions: Dict[str, str] = {}
+        self.sent = 0
+        self.broken = False
+        self.last_used = time.monotonic()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._outgoing = bytearray()
+
+    @property
+    def pipelining(self) -> bool:
+        return self.settings.pipelining and 'PIPELINING' in self.extensions
+
+    def usable(self) -> bool:
+        settings = self.settings
+        return (not self.broken and self._writer is not None and not self._writer.is_closing()
+                and time.monotonic() - self.last_used < settings.max_idle_seconds
+                and self.sent < settings.max_messages_per_connection)
+
+    async def open(self) -> 'SMTPConnection':
+        settings = self.settings
+        context = ssl.create_default_context() if (settings.implicit_tls or settings.starttls) else None
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(settings.host, settings.port, ssl=context if settings.implicit_tls else None),
+            settings.timeout)
+        try:
+            await self._handshake(context)
+        except BaseException:
+            self.broken = True
+            await self.close()
+            raise
+        self.last_used = time.monotonic()
+        return self
+
+    async def _handshake(self, context: Optional[ssl.SSLContext]) -> None:
+        settings = self.settings
+        await self._expect(220)
+        await self._ehlo()
+        if settings.starttls and not settings.implicit_tls:
+            if 'STARTTLS' not in self.extensions:
+                raise DeliveryError(f'{settings.host} does not offer STARTTLS', temporary=False)
+            self._write(b'STARTTLS\r\n')
+            await self._expect(220)
+            await self._writer.start_tls(context, server_hostname=settings.host)
+            await self._ehlo()
+        if settings.username:
+            credentials = base64.b64encode(
+                f'\0{settings.username}\0{settings.password or ""}'.encode()).decode('ascii')
+            self._write(f'AUTH PLAIN {credentials}\r\n'.encode())
+            await self._expect(235)
+
+    async def close(self) -> None:
+        if self._writer is None:
+            return
+        try:
+            if not self.broken and not self._writer.is_closing():
+                self._write(b'QUIT\r\n')
+                await self._flush()
+                await asyncio.wait_for(self._read_reply(), 2.0)
+        except (OSError, asyncio.TimeoutError, DeliveryError):
+            pass
+        finally:
+            self._writer.close()
+            self._writer = None
+
+    def _write(self, data: bytes) -> None:
+        # Buffered until the next flush so pipelined commands leave in one segment
+        self._outgoing += data
+
+    async def _flush(self) -> None:
+        if self._outgoing:
+            self._writer.write(bytes(self._outgoing))
+            self._outgoing.clear()
+        await self._writer.drain()
+
+    async def _read_reply(self) -> Tuple[int, str]:
+        lines = []
+        while True:
+            raw = await asyncio.wait_for(self._reader.readline(), self.settings.timeout)
+            if not raw:
+                self.broken = True
+                raise DeliveryError('SMTP connection closed by server')
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            if len(line) < 3 or not line[:3].isdigit():
+                self.broken = True
+                raise DeliveryError(f'Malformed SMTP reply: {line!r}')
+            lines.append(line[4:])
+            if len(line) == 3 or line[3] != '-':
+                return int(line[:3]), '\n'.join(lines)
+
+    async def _expect(self, code: int) -> str:
+        await self._flush()
+        reply_code, text = await self._read_reply()
+        if reply_code != code:
+            raise DeliveryError(f'Expected {code}, got {reply_code} {text}', temporary=reply_code < 500,
+                                code=reply_code)
+        return text
+
+    async def _ehlo(self) -> None:
+        hostname = self.settings.local_hostname or socket.gethostname()
+        self._write(f'EHLO {hostname}\r\n'.encode())
+        await self._flush()
+        code, text = await self._read_reply()
+        if code != 250:
+            raise DeliveryError(f'EHLO rejected: {code} {text}', temporary=code < 500, code=code)
+        self.extensions = {}
+        for line in text.split('\n')[1:]:
+            keyword, _, parameters = line.partition(' ')
+            self.extensions[keyword.upper()] = parameters
+
+    def _envelope(self, message: OutgoingEmail) -> List[bytes]:
+        sender = message.sender or self.settings.from_address
+        recipients = [address.strip() for address in message.to.split(',') if address.strip()]
+        return ([f'MAIL FROM:<{sender}>\r\n'.encode()]
+                + [f'RCPT TO:<{address}>\r\n'.encode() for address in recipients]
+                + [b'DATA\r\n'])
+
+    async def send_batch(self, messages: List[OutgoingEmail],
+                         pace: Optional[Callable[[], Awaitable[None]]] = None) -> List[DeliveryResult]:
+        """Send ``messages`` in order on this session, one result per message
+
+        ``pace`` is awaited before each message (the provider's rate limit).
+        If the session breaks, unfinished messages get temporary failures.
+        """
+        results: List[Optional[DeliveryResult]] = [None] * len(messages)
+        trailing: Optional[Tuple[str, int]] = None
+        try:
+            for index, message in enumerate(messages):
+                payload = _data_block(message.to_bytes(self.settings.from_address))
+                envelope = self._envelope(message)
+                if pace is not None:
+                    await pace()
+                if self.pipelining:
+                    # The previous message's end of data and this envelope share one round trip
+                    self._write(b''.join(envelope))
+                    await self._flush()
+                    if trailing is not None:
+                        await self._finish(trailing, messages, results)
+                    replies = [await self._read_reply() for _ in envelope]
+                else:
+                    replies = []
+                    for command in envelope:
+                        self._write(command)
+                        await self._flush()
+                        replies.append(await self._read_reply())
+                        if len(replies) == 1 and replies[0][0] >= 400:
+                            break
+                trailing = self._after_envelope(index, message, payload, len(envelope), replies, results)
+                if trailing is not None and not self.pipelining:
+                    await self._flush()
+                    await self._finish(trailing, messages, results)
+                    trailing = None
+            if trailing is not None:
+                await self._flush()
+                await self._finish(trailing, messages, results)
+        except (DeliveryError, OSError, asyncio.TimeoutError) as e:
+            self.broken = True
+            logger.warning(f"SMTP session to {self.settings.host} failed mid-batch: {str(e)}")
+            for index, message in enumerate(messages):
+                if results[index] is None:
+                    results[index] = DeliveryResult(message.id, False, temporary=True, error=str(e))
+        self.last_used = time.monotonic()
+        self.sent += sum(1 for result in results if result is not None and result.ok)
+        return results
+
+    def _after_envelope(self, index: int, message: OutgoingEmail, payload: bytes, commands: int,
+                        replies: List[Tuple[int, str]], results: List[Optional[DeliveryResult]]
+                        ) -> Optional[Tuple[str, int]]:
+        """Write the body after a 354, or record the failure; returns the reply still owed"""
+        if len(replies) == commands and replies[-1][0] == 354:
+            self._write(payload)
+            return ('data', index)
+        # Report the first refusal (a rejected RCPT says more than the DATA 503 that follows it)
+        code, text = next((reply for reply in replies if reply[0] >= 400), replies[-1])
+        results[index] = _failure(message, code, text)
+        if replies[0][0] < 400:
+            self._write(b'RSET\r\n')
+            return ('rset', index)
+        return None
+
+    async def _finish(self, trailing: Tuple[str, int], messages: List[OutgoingEmail],
+                      results: List[Optional[DeliveryResult]]) -> None:
+        stage, index = trailing
+        code, text = await self._read_reply()
+        if stage == 'data':
+            message = messages[index]
+            results[index] = DeliveryResult(message.id, True, code=code) if code == 250 else \
+                _failure(message, code, text)
+
+
+class SMTPConnectionPool:
+    """Up to ``pool_size`` open sessions, reused LIFO so idle ones age out"""
+
+    def __init__(self, settings: EmailProviderSettings,
+                 connect: Optional[Callable[[EmailProviderSettings], Awaitable[SMTPConnection]]] = None):
+        self.settings = settings
+        self._connect = connect or (lambda s: SMTPConnection(s).open())
+        self._idle: List[SMTPConnection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.opened = 0
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[SMTPConnection]:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.settings.pool_size)
+        async with self._slots:
+            connection = None
+            while self._idle and connection is None:
+                candidate = self._idle.pop()
+                if candidate.usable():
+                    connection = candidate
+                else:
+                    await candidate.close()
+            if connection is None:
+                connection = await self._connect(self.settings)
+                self.opened += 1
+            try:
+                yield connection
+            finally:
+                if connection.usable():
+                    self._idle.append(connection)
+                else:
+                    await connection.close()
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await connection.close()
+
+
+class SMTPTransport:
+    """Pooled SMTP delivery for one provider, paced by its token bucket"""
+
+    def __init__(self, settings: EmailProviderSettings, pool: Optional[SMTPConnectionPool] = None,
+                 bucket: Optional[TokenBucket] = None):
+        self.settings = settings
+        self.pool = pool or SMTPConnectionPool(settings)
+        self.bucket = bucket or TokenBucket(settings.rate_per_second, settings.burst)
+
+    async def send(self, messages: List[OutgoingEmail]) -> List[DeliveryResult]:
+        """Send ``messages`` in ``batch_size`` chunks across the pool; results keep input order"""
+        size = max(1, self.settings.batch_size)
+        chunks = [messages[start:start + size] for start in range(0, len(messages), size)]
+
+        async def deliver(chunk: List[OutgoingEmail]) -> List[DeliveryResult]:
+            try:
+                async with self.pool.connection() as connection:
+                    return await connection.send_batch(chunk, pace=self.bucket.acquire)
+            except (DeliveryError, OSError, asyncio.TimeoutError) as e:
+                logger.warning(f"Could not open SMTP session to {self.settings.host}: {str(e)}")
+                return [DeliveryResult(message.id, False, temporary=True, error=str(e)) for message in chunk]
+
+        results: List[DeliveryResult] = []
+        for chunk_results in await asyncio.gather(*(deliver(chunk) for chunk in chunks)):
+            results.extend(chunk_results)
+        return results
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+
+# -- outbox ------------------------------------------------------------------
+
+ENQUEUE_SQL = """
+    INSERT INTO public.email_outbox
+        (agency_id, template_key, dedupe_key, provider, to_address, subject, text_body, html_body)
+    SELECT * FROM unnest($1::uuid[], $2::text[], $3::text[], $4::text[], $5::text[], $6::text[], $7::text[],
+                         $8::text[])
+    ON CONFLICT (agency_id, dedupe_key) DO NOTHING
+"""
+
+CLAIM_SQL = """
+    WITH due AS (
+        SELECT id FROM public.email_outbox
+        WHERE status = 'pending' AND provider = $1 AND next_attempt_at <= now()
+        ORDER BY next_attempt_at
+        LIMIT $2
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE public.email_outbox o
+    SET attempts = o.attempts + 1, next_attempt_at = now() + make_interval(secs => $3)
+    FROM due
+    WHERE o.id = due.id
+    RETURNING o.id, o.to_address, o.subject, o.text_body, o.html_body, o.attempts
+"""
+
+MARK_SENT_SQL = """
+    UPDATE public.email_outbox SET status = 'sent', sent_at = now(), last_error = NULL
+    WHERE id = ANY($1::bigint[])
+"""
+
+RESCHEDULE_SQL = """
+    UPDATE public.email_outbox o
+    SET next_attempt_at = now() + make_interval(secs => r.delay), last_error = r.error
+    FROM unnest($1::bigint[], $2::float8[], $3::text[]) AS r(id, delay, error)
+    WHERE o.id = r.id
+"""
+
+MARK_FAILED_SQL = """
+    UPDATE public.email_outbox o
+    SET status = 'failed', last_error = r.error
+    FROM unnest($1::bigint[], $2::text[]) AS r(id, error)
+    WHERE o.id = r.id
+"""
+
+
+@dataclass
+class OutboxRow:
+    """A message to enqueue"""
+    to: str
+    subject: str
+    text: str
+    html: Optional[str] = None
+    agency_id: Optional[str] = None
+    template_key: Optional[str] = None
+    dedupe_key: Optional[str] = None
+    provider: str = DEFAULT_PROVIDER
+
+
+class EmailOutbox:
+    """``public.email_outbox`` access: bulk enqueue, claim with a lease, record outcomes"""
+
+    def __init__(self, database=None):
+        if database is None:
+            from immigration_ai.utils.database import get_database
+
+            database = get_database()
+        self.database = database
+
+    async def enqueue(self, rows: List[OutboxRow]) -> str:
+        if not rows:
+            return 'INSERT 0 0'
+        columns = list(zip(*((row.agency_id, row.template_key, row.dedupe_key, row.provider, row.to,
+                              row.subject, row.text, row.html) for row in rows)))
+        return await self.database.execute(ENQUEUE_SQL, *(list(column) for column in columns))
+
+    async def claim(self, provider: str, limit: int, lease_seconds: float) -> List[Any]:
+        return await self.database.fetch(CLAIM_SQL, provider, limit, lease_seconds)
+
+    async def record(self, sent: List[int], retries: List[Tuple[int, float, str]],
+                     failures: List[Tuple[int, str]]) -> None:
+        async with self.database.transaction() as connection:
+            if sent:
+                await connection.execute(MARK_SENT_SQL, sent)
+            if retries:
+                ids, delays, errors = zip(*retries)
+                await connection.execute(RESCHEDULE_SQL, list(ids), list(delays), list(errors))
+            if failures:
+                ids, errors = zip(*failures)
+                await connection.execute(MARK_FAILED_SQL, list(ids), list(errors))
+
+
+@dataclass
+class DeliveryStats:
+    """Outcome counts for one or more engine passes"""
+    claimed: int = 0
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+
+    def add(self, other: 'DeliveryStats') -> None:
+        self.claimed += other.claimed
+        self.sent += other.sent
+        self.retried += other.retried
+        self.failed += other.failed
+
+
+class EmailDeliveryEngine:
+    """Drains one provider's due outbox rows through its transport"""
+
+    def __init__(self, outbox: EmailOutbox, transport: SMTPTransport, provider: str = DEFAULT_PROVIDER,
+                 claim_size: int = DEFAULT_CLAIM_SIZE, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 backoff_base: float = DEFAULT_BACKOFF_BASE, backoff_cap: float = DEFAULT_BACKOFF_CAP,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.outbox = outbox
+        self.transport = transport
+        self.provider = provider
+        self.claim_size = claim_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.lease_seconds = lease_seconds
+
+    async def run_once(self) -> DeliveryStats:
+        """Claim one batch, send it and record each row's outcome"""
+        rows = await self.outbox.claim(self.provider, self.claim_size, self.lease_seconds)
+        if not rows:
+            return DeliveryStats()
+        messages = [OutgoingEmail(to=row['to_address'], subject=row['subject'], text=row['text_body'],
+                                  html=row['html_body'], id=row['id']) for row in rows]
+        attempts = {row['id']: row['attempts'] for row in rows}
+        results = await self.transport.send(messages)
+
+        sent, retries, failures = [], [], []
+        for result in results:
+            if result.ok:
+                sent.append(result.id)
+            elif result.temporary and attempts[result.id] < self.max_attempts:
+                delay = backoff_delay(attempts[result.id], self.backoff_base, self.backoff_cap)
+                retries.append((result.id, delay, result.error or ''))
+            else:
+                failures.append((result.id, result.error or ''))
+        await self.outbox.record(sent, retries, failures)
+        if retries or failures:
+            logger.warning(f"Email provider '{self.provider}': {len(retries)} deferred, {len(failures)} failed")
+        return DeliveryStats(claimed=len(rows), sent=len(sent), retried=len(retries), failed=len(failures))
+
+    async def drain(self) -> DeliveryStats:
+        """Run batches until fewer than ``claim_size`` rows were due"""
+        total = DeliveryStats()
+        while True:
+            stats = await self.run_once()
+            total.add(stats)
+            if stats.claimed < self.claim_size:
+                return total
+
+
+class EmailSender:
+    """Renders a template for many recipients and queues the messages in one statement"""
+
+    def __init__(self, outbox: Optional[EmailOutbox] = None, templates: Optional[TemplateRegistry] = None,
+                 provider: str = DEFAULT_PROVIDER):
+        self.outbox = outbox or EmailOutbox()
+        self.templates = templates or TemplateRegistry(loader=database_override_loader)
+        self.provider = provider
+
+    async def send_bulk(self, agency_id: Optional[str], template_key: str,
+                        recipients: Iterable[Mapping[str, Any]], dedupe_key: Optional[str] = None) -> int:
+        """Queue ``template_key`` for each recipient (a mapping with ``email`` plus template values)
+
+        With ``dedupe_key`` (e.g. ``reminder:2025-07-10``), re-running the same
+        send skips recipients who already have that message queued.
+        """
+        template = await self.templates.get(agency_id, template_key)
+        rows = []
+        for recipient in recipients:
+            rendered = template.render(recipient)
+            rows.append(OutboxRow(
+                to=recipient['email'], subject=rendered.subject, text=rendered.text, html=rendered.html,
+                agency_id=agency_id, template_key=template_key,
+                dedupe_key=f"{dedupe_key}:{recipient['email']}" if dedupe_key else None,
+                provider=self.provider,
+            ))
+        await self.outbox.enqueue(rows)
+        return len(rows)
+
+
+_engines: Dict[Tuple[int, str], EmailDeliveryEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_delivery_engine(provider: str = DEFAULT_PROVIDER) -> EmailDeliveryEngine:
+    """This process's engine for ``provider``; its SMTP pool outlives individual tasks"""
+    key = (os.getpid(), provider)
+    engine = _engines.get(key)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(key)
+            if engine is None:
+                settings = EmailProviderSettings.from_env(provider)
+                engine = _engines[key] = EmailDeliveryEngine(EmailOutbox(), SMTPTransport(settings), provider)
+    return engine
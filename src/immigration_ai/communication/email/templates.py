@@ -1 +1,199 @@
+"""
+Email templates compiled once and cached per agency
 
+A template is a subject, a plain-text body and an HTML body with
+``{{ name }}`` or ``{{ client.first_name }}`` placeholders. Compiling
+splits the source into literal chunks and placeholder lookups once, so
+rendering a bulk send is a join over precomputed parts. Nothing is
+re-parsed per recipient. HTML bodies escape their values. Subjects are
+flattened to one line so a value can never inject a header.
+
+Agencies can override any built-in template with a row in
+``public.email_templates`` (``20250710_email_outbox.sql``). The registry
+loads all of an agency's overrides with one query, compiles them, and keeps
+them for ``ttl`` seconds. :meth:`TemplateRegistry.invalidate` drops them
+early after an edit.
+"""
+
+import html
+import logging
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from immigration_ai.core.exceptions import ResourceNotFoundError, ValidationError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 60.0
+DEFAULT_MAX_AGENCIES = 1024
+
+PLACEHOLDER = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)\s*\}\}')
+_MISSING = object()
+
+# agency_id -> rows with key, subject, text_body, html_body
+OverrideLoader = Callable[[str], Awaitable[Sequence[Mapping[str, Any]]]]
+
+
+def _lookup(context: Mapping[str, Any], path: Tuple[str, ...]) -> Any:
+    value: Any = context
+    for name in path:
+        if isinstance(value, Mapping):
+            value = value.get(name, _MISSING)
+        else:
+            value = getattr(value, name, _MISSING)
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+class CompiledTemplate:
+    """One template string split into literals and placeholder paths"""
+    __slots__ = ('source', 'fields', '_parts', '_escape')
+
+    def __init__(self, source: str, escape: bool = False):
+        self.source = source
+        self._escape = escape
+        parts: List[Any] = []
+        position = 0
+        for match in PLACEHOLDER.finditer(source):
+            if match.start() > position:
+                parts.append(source[position:match.start()])
+            parts.append(tuple(match.group(1).split('.')))
+            position = match.end()
+        if position < len(source):
+            parts.append(source[position:])
+        self._parts = tuple(parts)
+        self.fields = tuple(OrderedDict.fromkeys('.'.join(p) for p in parts if isinstance(p, tuple)))
+
+    def render(self, context: Mapping[str, Any]) -> str:
+        out = []
+        for part in self._parts:
+            if isinstance(part, str):
+                out.append(part)
+                continue
+            value = _lookup(context, part)
+            if value is _MISSING or value is None:
+                raise ValidationError(f"Template value '{'.'.join(part)}' is missing")
+            value = str(value)
+            out.append(html.escape(value) if self._escape else value)
+        return ''.join(out)
+
+
+@dataclass
+class RenderedEmail:
+    """Subject and bodies for one recipient"""
+    subject: str
+    text: str
+    html: Optional[str] = None
+
+
+class EmailTemplate:
+    """A compiled subject, text body and optional HTML body"""
+    __slots__ = ('key', 'subject', 'text', 'html')
+
+    def __init__(self, key: str, subject: str, text: str, html_body: Optional[str] = None):
+        self.key = key
+        self.subject = CompiledTemplate(subject)
+        self.text = CompiledTemplate(text)
+        self.html = CompiledTemplate(html_body, escape=True) if html_body else None
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        parts = self.subject.fields + self.text.fields + (self.html.fields if self.html else ())
+        return tuple(OrderedDict.fromkeys(parts))
+
+    def render(self, context: Mapping[str, Any]) -> RenderedEmail:
+        subject = ' '.join(self.subject.render(context).split())
+        return RenderedEmail(subject=subject, text=self.text.render(context),
+                             html=self.html.render(context) if self.html else None)
+
+
+DEFAULT_TEMPLATES: Dict[str, Tuple[str, str, Optional[str]]] = {
+    'case_update': (
+        'Update on your case {{ case_number }}',
+        'Hello {{ client_name }},\n\n'
+        'Your case {{ case_number }} ({{ case_title }}) is now {{ status }}.\n\n'
+        'Sign in to your client portal for details.\n\n{{ agency_name }}\n',
+        '<p>Hello {{ client_name }},</p>'
+        '<p>Your case <strong>{{ case_number }}</strong> ({{ case_title }}) is now {{ status }}.</p>'
+        '<p>Sign in to your client portal for details.</p><p>{{ agency_name }}</p>',
+    ),
+    'document_request': (
+        'Document needed: {{ document_label }}',
+        'Hello {{ client_name }},\n\n'
+        'To continue with case {{ case_number }} we need your {{ document_label }}.\n'
+        'Please upload it in your client portal by {{ due_date }}.\n\n{{ agency_name }}\n',
+        '<p>Hello {{ client_name }},</p>'
+        '<p>To continue with case <strong>{{ case_number }}</strong> we need your {{ document_label }}.</p>'
+        '<p>Please upload it in your client portal by {{ due_date }}.</p><p>{{ agency_name }}</p>',
+    ),
+    'reminder': (
+        'Reminder: {{ subject }}',
+        'Hello {{ client_name }},\n\n{{ message }}\n\n{{ agency_name }}\n',
+        '<p>Hello {{ client_name }},</p><p>{{ message }}</p><p>{{ agency_name }}</p>',
+    ),
+}
+
+
+async def database_override_loader(agency_id: str) -> Sequence[Mapping[str, Any]]:
+    """Load an agency's template overrides with the process's pooled :class:`Database`"""
+    from immigration_ai.utils.database import get_database
+
+    return await get_database().fetch(
+        'SELECT key, subject, text_body, html_body FROM public.email_templates WHERE agency_id = $1',
+        agency_id)
+
+
+class TemplateRegistry:
+    """Built-in templates plus cached, compiled per-agency overrides"""
+
+    def __init__(self, loader: Optional[OverrideLoader] = None,
+                 defaults: Optional[Mapping[str, Tuple[str, str, Optional[str]]]] = None,
+                 ttl: float = DEFAULT_TTL_SECONDS, max_agencies: int = DEFAULT_MAX_AGENCIES):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_agencies = max_agencies
+        self.defaults = {key: EmailTemplate(key, *source)
+                         for key, source in (defaults if defaults is not None else DEFAULT_TEMPLATES).items()}
+        self._overrides: 'OrderedDict[str, Tuple[float, Dict[str, EmailTemplate]]]' = OrderedDict()
+
+    async def _agency_overrides(self, agency_id: Optional[str]) -> Dict[str, EmailTemplate]:
+        if self.loader is None or not agency_id:
+            return {}
+        cached = self._overrides.get(agency_id)
+        now = time.monotonic()
+        if cached is not None and now - cached[0] < self.ttl:
+            self._overrides.move_to_end(agency_id)
+            return cached[1]
+        templates = {}
+        for row in await self.loader(agency_id):
+            try:
+                templates[row['key']] = EmailTemplate(row['key'], row['subject'], row['text_body'],
+                                                      row.get('html_body'))
+            except (KeyError, TypeError) as e:
+                logger.warning(f"Skipping malformed email template override for agency {agency_id}: {str(e)}")
+        self._overrides[agency_id] = (now, templates)
+        self._overrides.move_to_end(agency_id)
+        while len(self._overrides) > self.max_agencies:
+            self._overrides.popitem(last=False)
+        return templates
+
+    async def get(self, agency_id: Optional[str], key: str) -> EmailTemplate:
+        """The agency's override of ``key`` if it has one, else the built-in template"""
+        template = (await self._agency_overrides(agency_id)).get(key) or self.defaults.get(key)
+        if template is None:
+            raise ResourceNotFoundError(f"Email template '{key}' not found")
+        return template
+
+    async def render(self, agency_id: Optional[str], key: str, context: Mapping[str, Any]) -> RenderedEmail:
+        return (await self.get(agency_id, key)).render(context)
+
+    def invalidate(self, agency_id: Optional[str] = None) -> None:
+        """Forget cached overrides for one agency, or for all of them"""
+        if agency_id is None:
+            self._overrides.clear()
+        else:
+            self._overrides.pop(agency_id, None)
@@ -0,0 +1,292 @@
+"""
+Staff notification fan-out worker
+
+Document uploads no longer notify every staff member inside the upload
+transaction. ``handle_document_upload`` appends one ``notification_events``
+row and wakes this worker with ``pg_notify('notification_events', ...)``.
+The worker claims pending events in batches with ``FOR UPDATE SKIP LOCKED``,
+so several workers can run side by side. It loads the active staff of the
+batch's agencies once and writes every notification with a single
+``INSERT ... SELECT FROM unnest(...)``. The events are marked processed in
+the same transaction. Unread counters are kept by the triggers on
+``notifications`` (see ``20250708_notification_counters_fanout.sql``).
+
+A burst of ``digest_threshold`` or more events of one type for one agency
+in the same batch becomes a single digest per staff member, not one
+notification per upload. After a wake-up the worker waits
+``collapse_window`` seconds so a burst lands in one batch.
+
+Processed events are kept for ``retention`` seconds (for debugging a
+missed notification) and then deleted in batches, at most once every
+``purge_interval`` seconds, so the outbox does not grow without bound.
+
+Run with ``python -m immigration_ai.communication.notifications.fanout``.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = 'notification_events'
+STAFF_ROLES = ('agency_admin', 'agency_staff')
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_DIGEST_THRESHOLD = 5
+DEFAULT_COLLAPSE_WINDOW = 2.0
+DEFAULT_POLL_INTERVAL = 30.0
+DEFAULT_RETENTION_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_PURGE_INTERVAL = 60 * 60
+PURGE_BATCH_SIZE = 5000
+DIGEST_NAMES_SHOWN = 3
+
+# (type, title, message, data)
+Notification = Tuple[str, str, str, Dict[str, Any]]
+# (user_id, agency_id, type, title, message, data)
+NotificationRow = Tuple[Any, Any, str, str, str, Dict[str, Any]]
+
+CLAIM_EVENTS_SQL = """
+    SELECT id, agency_id, type, payload
+    FROM public.notification_events
+    WHERE processed_at IS NULL
+    ORDER BY id
+    LIMIT $1
+    FOR UPDATE SKIP LOCKED
+"""
+
+STAFF_SQL = """
+    SELECT id, agency_id
+    FROM public.users
+    WHERE agency_id = ANY($1::uuid[]) AND role = ANY($2::user_role[]) AND is_active
+    ORDER BY agency_id, id
+"""
+
+INSERT_NOTIFICATIONS_SQL = """
+    INSERT INTO public.notifications (user_id, agency_id, type, title, message, data)
+    SELECT * FROM unnest($1::uuid[], $2::uuid[], $3::text[], $4::text[], $5::text[], $6::jsonb[])
+"""
+
+MARK_PROCESSED_SQL = """
+    UPDATE public.notification_events SET processed_at = now() WHERE id = ANY($1::bigint[])
+"""
+
+PURGE_PROCESSED_SQL = """
+    WITH purged AS (
+        DELETE FROM public.notification_events
+        WHERE id IN (
+            SELECT id FROM public.notification_events
+            WHERE processed_at < now() - make_interval(secs => $1)
+            ORDER BY processed_at
+            LIMIT $2
+        )
+        RETURNING 1
+    )
+    SELECT count(*) FROM purged
+"""
+
+
+@dataclass
+class FanoutStats:
+    """What one :meth:`NotificationFanout.run_once` pass did"""
+    events: int = 0
+    notifications: int = 0
+    digests: int = 0
+    skipped: int = 0
+
+
+# -- rendering ---------------------------------------------------------------
+
+def _document_review(payload: Mapping[str, Any]) -> Notification:
+    client_name = payload.get('client_name') or 'A client'
+    return (
+        'document_review_needed',
+        'New Document Requires Review',
+        f"{client_name} has uploaded a new {payload.get('document_type_label')} document that requires review.",
+        {
+            'document_id': payload.get('document_id'),
+            'client_id': payload.get('client_id'),
+            'document_type': payload.get('document_type'),
+            'file_name': payload.get('file_name'),
+            'client_name': payload.get('client_name'),
+        },
+    )
+
+
+def _document_review_digest(payloads: Sequence[Mapping[str, Any]]) -> Notification:
+    names = list(OrderedDict.fromkeys(p.get('client_name') or 'A client' for p in payloads))
+    shown = ', '.join(names[:DIGEST_NAMES_SHOWN])
+    if len(names) > DIGEST_NAMES_SHOWN:
+        shown += f' and {len(names) - DIGEST_NAMES_SHOWN} more'
+    return (
+        'document_review_digest',
+        f'{len(payloads)} New Documents Require Review',
+        f'{shown} uploaded {len(payloads)} documents that require review.',
+        {
+            'count': len(payloads),
+            'document_ids': [p.get('document_id') for p in payloads],
+            'client_ids': list(OrderedDict.fromkeys(p.get('client_id') for p in payloads)),
+        },
+    )
+
+
+# event type -> (render one event, render a digest of many)
+RENDERERS: Dict[str, Tuple[Callable[[Mapping[str, Any]], Notification],
+                           Callable[[Sequence[Mapping[str, Any]]], Notification]]] = {
+    'document_review_needed': (_document_review, _document_review_digest),
+}
+
+
+def build_notifications(events: Sequence[Mapping[str, Any]], staff: Mapping[Any, Sequence[Any]],
+                        digest_threshold: int = DEFAULT_DIGEST_THRESHOLD
+                        ) -> Tuple[List[NotificationRow], FanoutStats]:
+    """Turn a batch of events into notification rows for each agency's staff
+
+    ``staff`` maps agency id to its recipients' user ids. Events are grouped
+    by (agency, type). A group of ``digest_threshold`` or more events is
+    rendered as one digest.
+    """
+    stats = FanoutStats(events=len(events))
+    groups: Dict[Tuple[Any, str], List[Mapping[str, Any]]] = OrderedDict()
+    for event in events:
+        groups.setdefault((event['agency_id'], event['type']), []).append(event['payload'] or {})
+
+    rows: List[NotificationRow] = []
+    for (agency_id, event_type), payloads in groups.items():
+        renderers = RENDERERS.get(event_type)
+        if renderers is None:
+            logger.warning(f"No renderer for notification event type {event_type!r}; skipping {len(payloads)}")
+            stats.skipped += len(payloads)
+            continue
+        recipients = staff.get(agency_id, ())
+        render_one, render_digest = renderers
+        if len(payloads) >= digest_threshold:
+            notifications = [render_digest(payloads)]
+            stats.digests += len(recipients)
+        else:
+            notifications = [render_one(payload) for payload in payloads]
+        rows.extend((user_id, agency_id, *notification)
+                    for notification in notifications for user_id in recipients)
+    stats.notifications = len(rows)
+    return rows, stats
+
+
+# -- worker ------------------------------------------------------------------
+
+class NotificationFanout:
+    """Claims pending notification events and writes staff notifications in batches"""
+
+    def __init__(self, database=None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 digest_threshold: int = DEFAULT_DIGEST_THRESHOLD,
+                 collapse_window: float = DEFAULT_COLLAPSE_WINDOW,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 retention: float = DEFAULT_RETENTION_SECONDS,
+                 purge_interval: float = DEFAULT_PURGE_INTERVAL):
+        if database is None:
+            from immigration_ai.utils.database import get_database
+
+            database = get_database()
+        self.database = database
+        self.batch_size = batch_size
+        self.digest_threshold = digest_threshold
+        self.collapse_window = collapse_window
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self._purged_at: Optional[float] = None
+
+    async def run_once(self) -> FanoutStats:
+        """Process one batch of pending events in a single transaction"""
+        async with self.database.transaction() as connection:
+            events = await connection.fetch(CLAIM_EVENTS_SQL, self.batch_size)
+            if not events:
+                return FanoutStats()
+            agency_ids = list(OrderedDict.fromkeys(event['agency_id'] for event in events))
+            staff: Dict[Any, List[Any]] = {}
+            for row in await connection.fetch(STAFF_SQL, agency_ids, list(STAFF_ROLES)):
+                staff.setdefault(row['agency_id'], []).append(row['id'])
+
+            rows, stats = build_notifications(events, staff, self.digest_threshold)
+            if rows:
+                await connection.execute(INSERT_NOTIFICATIONS_SQL, *(list(column) for column in zip(*rows)))
+            await connection.execute(MARK_PROCESSED_SQL, [event['id'] for event in events])
+        logger.info(f"Fanned out {stats.events} events as {stats.notifications} notifications "
+                    f"({stats.digests} digests)")
+        return stats
+
+    async def drain(self) -> FanoutStats:
+        """Run batches until no pending events remain"""
+        total = FanoutStats()
+        while True:
+            stats = await self.run_once()
+            total.events += stats.events
+            total.notifications += stats.notifications
+            total.digests += stats.digests
+            total.skipped += stats.skipped
+            if stats.events < self.batch_size:
+                return total
+
+    async def purge(self) -> int:
+        """Delete events processed more than ``retention`` seconds ago; returns how many"""
+        total = 0
+        while True:
+            deleted = await self.database.fetchval(PURGE_PROCESSED_SQL, float(self.retention), PURGE_BATCH_SIZE)
+            total += deleted
+            if deleted < PURGE_BATCH_SIZE:
+                break
+        self._purged_at = time.monotonic()
+        if total:
+            logger.info(f"Purged {total} processed notification events")
+        return total
+
+    async def _purge_if_due(self) -> None:
+        if self._purged_at is None or time.monotonic() - self._purged_at >= self.purge_interval:
+            await self.purge()
+
+    async def run_forever(self, stop: Optional[asyncio.Event] = None) -> None:
+        """Drain on every ``notification_events`` NOTIFY, or every ``poll_interval`` seconds"""
+        stop = stop or asyncio.Event()
+        wake = asyncio.Event()
+
+        def on_notify(*_args) -> None:
+            wake.set()
+
+        async with self.database.acquire() as listener:
+            await listener.add_listener(EVENTS_CHANNEL, on_notify)
+            try:
+                while not stop.is_set():
+                    wake.clear()
+                    try:
+                        await self.drain()
+                        await self._purge_if_due()
+                    except Exception as e:
+                        logger.error(f"Notification fan-out failed: {str(e)}")
+                    await _wait_for_either(wake, stop, self.poll_interval)
+                    if wake.is_set() and not stop.is_set():
+                        await asyncio.sleep(self.collapse_window)
+            finally:
+                await listener.remove_listener(EVENTS_CHANNEL, on_notify)
+
+
+async def _wait_for_either(first: asyncio.Event, second: asyncio.Event, timeout: float) -> None:
+    waiters = [asyncio.ensure_future(first.wait()), asyncio.ensure_future(second.wait())]
+    try:
+        await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(NotificationFanout().run_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,330 @@
+"""
+Realtime push hub
 
+Browsers hold one WebSocket or SSE stream (``api/v1/routes/realtime.py``)
+instead of polling. Each connection subscribes to ``user:<id>`` and, for
+agency staff, ``agency:<id>``. The process has one :class:`PushHub` and one
+:class:`ChangeFeed`. The feed is a single ``LISTEN realtime`` connection
+(see ``20250709_realtime_push.sql``), so the database sees one subscriber
+per API process, not one per browser tab.
+
+A message is encoded once per publish and the same bytes are queued on
+every subscriber of the channel. Each subscriber has a bounded buffer. A
+consumer that falls ``max_buffer`` messages behind is evicted rather than
+buffered without limit; its stream closes and the client reconnects and
+refetches. Idle connections cost one small object and a waiting task.
+
+A stream lives no longer than the access token it was opened with: the
+shared heartbeat closes subscribers whose token has expired (so within
+one heartbeat of expiry), and the client reconnects with a fresh token.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+FEED_CHANNEL = 'realtime'
+
+DEFAULT_MAX_BUFFER = 256
+DEFAULT_HEARTBEAT_SECONDS = 25.0
+FEED_RECONNECT_MAX_SECONDS = 30.0
+
+
+def user_channel(user_id: str) -> str:
+    return f'user:{user_id}'
+
+
+def agency_channel(agency_id: str) -> str:
+    return f'agency:{agency_id}'
+
+
+class Message:
+    """One published event, encoded once for every transport"""
+    __slots__ = ('channel', 'event', 'text', 'published_at', '_sse')
+
+    def __init__(self, channel: str, event: str, data: Any = None, text: Optional[str] = None,
+                 published_at: Optional[float] = None):
+        self.channel = channel
+        self.event = event
+        if text is None:
+            text = json.dumps({'channel': channel, 'event': event, 'data': data}, separators=(',', ':'),
+                              default=str)
+        self.text = text
+        self.published_at = published_at if published_at is not None else time.monotonic()
+        self._sse: Optional[bytes] = None
+
+    @property
+    def sse(self) -> bytes:
+        """The message as a Server-Sent Events frame"""
+        if self._sse is None:
+            self._sse = f'event: {self.event}\ndata: {self.text}\n\n'.encode()
+        return self._sse
+
+
+class Subscriber:
+    """One client connection's channels and bounded send buffer"""
+    __slots__ = ('user_id', 'channels', 'max_buffer', 'expires_at', 'evicted', 'expired', 'closed', '_buffer',
+                 '_ready')
+
+    def __init__(self, user_id: str, channels: Iterable[str], max_buffer: int = DEFAULT_MAX_BUFFER,
+                 expires_at: float = 0.0):
+        self.user_id = user_id
+        self.channels = tuple(channels)
+        self.max_buffer = max_buffer
+        # Wall-clock expiry of the connection's access token; 0 means none
+        self.expires_at = expires_at
+        self.evicted = False
+        self.expired = False
+        self.closed = False
+        self._buffer: Deque[Message] = deque()
+        self._ready: Optional[asyncio.Event] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def offer(self, message: Message) -> bool:
+        """Queue ``message``; returns False if the buffer was full and the subscriber is now evicted"""
+        if self.closed:
+            return False
+        if len(self._buffer) >= self.max_buffer:
+            self.evicted = True
+            self.close()
+            return False
+        self._buffer.append(message)
+        if self._ready is not None:
+            self._ready.set()
+        return True
+
+    def close(self) -> None:
+        self.closed = True
+        self._buffer.clear()
+        if self._ready is not None:
+            self._ready.set()
+
+    def expire(self, now: float) -> bool:
+        """Close the subscriber if its token expired before ``now``; returns whether it did"""
+        if self.expires_at and now >= self.expires_at and not self.closed:
+            self.expired = True
+            self.close()
+        return self.expired
+
+    def wake(self) -> None:
+        """Wake a waiting :meth:`next` so it returns None (a heartbeat is due)"""
+        if self._ready is not None:
+            self._ready.set()
+
+    async def next(self) -> Optional[Message]:
+        """The next buffered message, or None when woken for a heartbeat or once closed"""
+        if not self._buffer and not self.closed:
+            # Created lazily: most subscribers are idle between messages
+            if self._ready is None:
+                self._ready = asyncio.Event()
+            self._ready.clear()
+            await self._ready.wait()
+        return self._buffer.popleft() if self._buffer else None
+
+
+@dataclass
+class HubStats:
+    """Current connections and channels, and delivery counters since the hub started"""
+    connections: int = 0
+    channels: int = 0
+    published: int = 0
+    delivered: int = 0
+    evicted: int = 0
+
+
+class PushHub:
+    """In-process channel registry and fan-out"""
+
+    def __init__(self, max_buffer: int = DEFAULT_MAX_BUFFER, heartbeat: float = DEFAULT_HEARTBEAT_SECONDS):
+        self.max_buffer = max_buffer
+        self.heartbeat = heartbeat
+        self._channels: Dict[str, Set[Subscriber]] = {}
+        self._subscribers: Set[Subscriber] = set()
+        self._stats = HubStats()
+        self._ticker: Optional[asyncio.Task] = None
+
+    def subscribe(self, principal) -> Subscriber:
+        """Register a connection for ``principal``'s user channel and, for staff, its agency channel"""
+        channels = [user_channel(principal.user_id)]
+        if principal.is_agency_user and principal.agency_id:
+            channels.append(agency_channel(principal.agency_id))
+        subscriber = Subscriber(principal.user_id, channels, self.max_buffer, expires_at=principal.expires_at)
+        for channel in channels:
+            self._channels.setdefault(channel, set()).add(subscriber)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.discard(subscriber)
+        for channel in subscriber.channels:
+            members = self._channels.get(channel)
+            if members is None:
+                continue
+            members.discard(subscriber)
+            if not members:
+                del self._channels[channel]
+        subscriber.close()
+
+    def publish(self, channel: str, event: str, data: Any) -> int:
+        """Queue an event for every subscriber of ``channel``; returns how many accepted it"""
+        if channel not in self._channels:
+            self._stats.published += 1
+            return 0
+        return self._fan_out(Message(channel, event, data))
+
+    def dispatch(self, payload: str) -> int:
+        """Publish a raw ``realtime`` NOTIFY payload, forwarding its text as is"""
+        try:
+            notice = json.loads(payload)
+            message = Message(notice['channel'], notice['event'], text=payload)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Dropping malformed realtime payload: {str(e)}")
+            return 0
+        return self._fan_out(message)
+
+    def _fan_out(self, message: Message) -> int:
+        self._stats.published += 1
+        members = self._channels.get(message.channel)
+        if not members:
+            return 0
+        delivered = 0
+        evicted: List[Subscriber] = []
+        for subscriber in members:
+            if subscriber.offer(message):
+                delivered += 1
+            elif subscriber.evicted:
+                evicted.append(subscriber)
+        for subscriber in evicted:
+            logger.warning(f"Evicted slow realtime consumer for user {subscriber.user_id} "
+                           f"({self.max_buffer} messages behind)")
+            self._stats.evicted += 1
+            self.unsubscribe(subscriber)
+        self._stats.delivered += delivered
+        return delivered
+
+    async def stream(self, subscriber: Subscriber) -> AsyncIterator[Optional[Message]]:
+        """Messages for ``subscriber``; None means send a heartbeat. Ends when closed, evicted or expired"""
+        self._ensure_ticker()
+        try:
+            while True:
+                message = await subscriber.next()
+                if subscriber.expire(time.time()) or (message is None and subscriber.closed):
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def _ensure_ticker(self) -> None:
+        # One timer for the whole hub instead of a timeout per waiting connection
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.ensure_future(self._tick())
+
+    async def _tick(self) -> None:
+        while self._subscribers:
+            await asyncio.sleep(self.heartbeat)
+            now = time.time()
+            for subscriber in list(self._subscribers):
+                if subscriber.expire(now):
+                    logger.info(f"Closing realtime stream for user {subscriber.user_id}: token expired")
+                    self.unsubscribe(subscriber)
+                else:
+                    subscriber.wake()
+
+    def stats(self) -> HubStats:
+        stats = HubStats(**asdict(self._stats))
+        stats.connections = len(self._subscribers)
+        stats.channels = len(self._channels)
+        return stats
+
+
+class ChangeFeed:
+    """The process's single ``LISTEN realtime`` connection, feeding a :class:`PushHub`"""
+
+    def __init__(self, hub: PushHub, dsn: Optional[str] = None, connect=None):
+        self.hub = hub
+        self.dsn = dsn
+        self._connect = connect
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _on_notify(self, _connection, _pid, _channel, payload: str) -> None:
+        self.hub.dispatch(payload)
+
+    async def _run(self) -> None:
+        connect = self._connect
+        if connect is None:
+            import asyncpg
+
+            connect = asyncpg.connect
+        dsn = self.dsn
+        if dsn is None:
+            from immigration_ai.utils.database import DatabaseSettings
+
+            dsn = DatabaseSettings.from_env().dsn
+        delay = 1.0
+        while not self._stopping:
+            connection = None
+            try:
+                connection = await connect(dsn)
+                await connection.add_listener(FEED_CHANNEL, self._on_notify)
+                logger.info(f"Listening on '{FEED_CHANNEL}' for realtime events")
+                delay = 1.0
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _connection: closed.set())
+                await closed.wait()
+                logger.warning('Realtime change feed connection lost; reconnecting')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Realtime change feed failed: {str(e)}; retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, FEED_RECONNECT_MAX_SECONDS)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+
+
+_hubs: Dict[int, PushHub] = {}
+_hubs_lock = threading.Lock()
+
+
+def get_push_hub() -> PushHub:
+    """Return this process's :class:`PushHub` (keyed by pid, like ``get_database``)"""
+    pid = os.getpid()
+    hub = _hubs.get(pid)
+    if hub is None:
+        with _hubs_lock:
+            hub = _hubs.get(pid)
+            if hub is None:
+                _hubs.clear()
+                hub = _hubs[pid] = PushHub(
+                    max_buffer=int(os.environ.get('REALTIME_MAX_BUFFER', DEFAULT_MAX_BUFFER)),
+                    heartbeat=float(os.environ.get('REALTIME_HEARTBEAT_SECONDS', DEFAULT_HEARTBEAT_SECONDS)),
+                )
+    return hub
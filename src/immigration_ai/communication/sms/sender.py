@@ -1 +1,720 @@
+"""
+Rate-aware asynchronous SMS dispatch
 
+Reminder bursts and one-time passcodes go out through a provider's HTTP
+API. The provider throttles the whole account and also each sending number.
+:class:`SMSDispatcher` keeps one provider's outgoing messages in a priority
+heap. A message leaves the heap only when the provider's
+:class:`TokenBucket` and its sender number's bucket both have a token, and
+at most ``concurrency`` requests are in flight. Nothing is sent just to be
+throttled and retried.
+
+Tokens are taken when a message leaves the heap, not when it is submitted.
+An OTP submitted behind thousands of queued reminders therefore goes out
+with the next free token. Every message carries an idempotency key, and
+the provider receives it as ``Idempotency-Key``. Retries reuse the key.
+Submitting a key that is still queued, or finished recently, returns the
+same result instead of sending a second text.
+
+Delivery receipts arrive later on the provider's webhook.
+:class:`SMSStatusLog` buffers them together with send results and writes
+each batch to ``public.sms_messages`` in one transaction. The webhook waits
+for the batch holding its receipts to commit (concurrent requests share
+one commit) before it acknowledges them, so an acknowledged receipt is
+never only in memory.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from immigration_ai.core.exceptions import ConfigurationError, ServiceUnavailableError, ValidationError
+from immigration_ai.utils.rate_limit import TokenBucket, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROVIDER = 'default'
+MESSAGES_PATH = '/v1/messages'
+
+PRIORITY_OTP = 0
+PRIORITY_TRANSACTIONAL = 5
+PRIORITY_BULK = 10
+
+DEFAULT_RATE_PER_SECOND = 30.0
+DEFAULT_SENDER_RATE_PER_SECOND = 1.0
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE = 2.0
+DEFAULT_RETRY_CAP = 300.0
+DEFAULT_REMEMBER = 10_000
+
+DEFAULT_LOG_BATCH_SIZE = 500
+DEFAULT_LOG_FLUSH_INTERVAL = 1.0
+# Buffered entries past which the webhook refuses receipts (503) instead of queueing more
+DEFAULT_LOG_MAX_PENDING = 20_000
+# Receipts that arrived before their send result wait this long for it
+EARLY_RECEIPT_RETENTION_SECONDS = 86400
+EARLY_RECEIPT_PURGE_INTERVAL = 3600
+
+RECEIPT_STATUSES = ('queued', 'sending', 'sent', 'delivered', 'undelivered', 'failed')
+TERMINAL_STATUSES = ('delivered', 'undelivered', 'failed')
+
+
+@dataclass
+class SMSProviderSettings:
+    """API endpoint, sender numbers and rate limits for one SMS provider"""
+    base_url: str
+    senders: List[str]
+    name: str = DEFAULT_PROVIDER
+    api_key: Optional[str] = None
+    rate_per_second: float = DEFAULT_RATE_PER_SECOND
+    burst: Optional[float] = None
+    sender_rate_per_second: float = DEFAULT_SENDER_RATE_PER_SECOND
+    sender_burst: Optional[float] = None
+    concurrency: int = DEFAULT_CONCURRENCY
+    timeout: float = DEFAULT_TIMEOUT
+    status_callback: Optional[str] = None
+
+    @classmethod
+    def from_env(cls, name: str = DEFAULT_PROVIDER) -> 'SMSProviderSettings':
+        """Read ``SMS_*`` (or ``SMS_<NAME>_*`` for a named provider) variables"""
+        prefix = 'SMS_' if name == DEFAULT_PROVIDER else f'SMS_{name.upper()}_'
+
+        def env(key, default=None):
+            return os.environ.get(prefix + key, default)
+
+        base_url = env('API_URL')
+        if not base_url:
+            raise ConfigurationError(f'{prefix}API_URL is not set')
+        senders = [number.strip() for number in env('SENDERS', '').split(',') if number.strip()]
+        if not senders:
+            raise ConfigurationError(f'{prefix}SENDERS is not set')
+        return cls(
+            base_url=base_url,
+            senders=senders,
+            name=name,
+            api_key=env('API_KEY'),
+            rate_per_second=float(env('RATE_PER_SECOND', DEFAULT_RATE_PER_SECOND)),
+            sender_rate_per_second=float(env('SENDER_RATE_PER_SECOND', DEFAULT_SENDER_RATE_PER_SECOND)),
+            concurrency=int(env('CONCURRENCY', DEFAULT_CONCURRENCY)),
+            timeout=float(env('TIMEOUT', DEFAULT_TIMEOUT)),
+            status_callback=env('STATUS_CALLBACK'),
+        )
+
+
+@dataclass
+class SMSMessage:
+    """One text message; lower ``priority`` values are sent first"""
+    to: str
+    body: str
+    priority: int = PRIORITY_BULK
+    sender: Optional[str] = None
+    idempotency_key: str = field(default_factory=lambda: uuid.uuid4().hex)
+    agency_id: Optional[str] = None
+
+    @classmethod
+    def otp(cls, to: str, body: str, **kwargs) -> 'SMSMessage':
+        """A one-time passcode, sent ahead of everything else that is queued"""
+        return cls(to=to, body=body, priority=PRIORITY_OTP, **kwargs)
+
+
+@dataclass
+class SMSResult:
+    """The final outcome of one message"""
+    idempotency_key: str
+    ok: bool
+    sid: Optional[str] = None
+    sender: Optional[str] = None
+    temporary: bool = False
+    retry_after: Optional[float] = None
+    error: Optional[str] = None
+    code: Optional[str] = None
+    attempts: int = 0
+
+
+def provider_result(message: SMSMessage, sender: str, status: int, body: Any,
+                    retry_after: Optional[str] = None) -> SMSResult:
+    """Classify a provider response: 2xx sent, 408/429/5xx temporary, other 4xx permanent"""
+    body = body if isinstance(body, dict) else {}
+    if 200 <= status < 300:
+        return SMSResult(message.idempotency_key, True, sid=body.get('sid'), sender=sender)
+    try:
+        delay = float(retry_after) if retry_after else None
+    except ValueError:
+        delay = None
+    code = body.get('code')
+    return SMSResult(message.idempotency_key, False, sender=sender,
+                     temporary=status in (408, 429) or status >= 500, retry_after=delay,
+                     error=f"{status} {body.get('error') or body.get('message') or 'provider error'}",
+                     code=str(code) if code is not None else str(status))
+
+
+class HTTPSMSProvider:
+    """Posts messages to the provider's JSON API over one keep-alive aiohttp session"""
+
+    def __init__(self, settings: SMSProviderSettings):
+        self.settings = settings
+        self.url = settings.base_url.rstrip('/') + MESSAGES_PATH
+        self._session = None
+
+    def _client(self):
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            headers = {'Authorization': f'Bearer {self.settings.api_key}'} if self.settings.api_key else None
+            # The connector limit matches the dispatcher's, so every request reuses a warm connection
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.settings.concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.settings.timeout),
+                headers=headers,
+            )
+        return self._session
+
+    async def send(self, message: SMSMessage, sender: str) -> SMSResult:
+        import aiohttp
+
+        payload = {'to': message.to, 'from': sender, 'body': message.body}
+        if self.settings.status_callback:
+            payload['status_callback'] = self.settings.status_callback
+        try:
+            async with self._client().post(self.url, json=payload,
+                                           headers={'Idempotency-Key': message.idempotency_key}) as response:
+                try:
+                    body = await response.json(content_type=None)
+                except ValueError:
+                    body = None
+                return provider_result(message, sender, response.status, body, response.headers.get('Retry-After'))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return SMSResult(message.idempotency_key, False, sender=sender, temporary=True,
+                             error=f'{type(e).__name__}: {e}')
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+# -- dispatch -----------------------------------------------------------------
+
+class _Pending:
+    __slots__ = ('message', 'future', 'sender', 'attempts')
+
+    def __init__(self, message: SMSMessage, future: asyncio.Future):
+        self.message = message
+        self.future = future
+        self.sender: Optional[str] = None
+        self.attempts = 0
+
+
+@dataclass
+class DispatchStats:
+    """Counters since the dispatcher was created"""
+    submitted: int = 0
+    deduplicated: int = 0
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    queued: int = 0
+    in_flight: int = 0
+
+
+class SMSDispatcher:
+    """Priority queue, rate limits and bounded concurrency in front of one provider
+
+    ``provider`` is anything with ``async send(message, sender) ->
+    SMSResult`` (:class:`HTTPSMSProvider` in production). ``on_result`` is
+    called with each message and its final result, once.
+    """
+
+    def __init__(self, provider, settings: SMSProviderSettings,
+                 on_result: Optional[Callable[[SMSMessage, SMSResult], None]] = None,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, retry_base: float = DEFAULT_RETRY_BASE,
+                 retry_cap: float = DEFAULT_RETRY_CAP, remember: int = DEFAULT_REMEMBER,
+                 clock: Callable[[], float] = time.monotonic):
+        if not settings.senders:
+            raise ConfigurationError(f"SMS provider '{settings.name}' has no sender numbers")
+        self.provider = provider
+        self.settings = settings
+        self.on_result = on_result
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.remember = remember
+        self._clock = clock
+        self.bucket = TokenBucket(settings.rate_per_second, settings.burst, clock)
+        self._sender_buckets: Dict[str, TokenBucket] = {}
+        for sender in settings.senders:
+            self._sender_bucket(sender)
+        self._next_sender = 0
+        self._heap: List[Tuple[int, int, _Pending]] = []
+        self._sequence = itertools.count()
+        self._pending: Dict[str, _Pending] = {}
+        self._retries: Dict[str, asyncio.TimerHandle] = {}
+        self._recent: 'OrderedDict[str, SMSResult]' = OrderedDict()
+        self._tasks = set()
+        self._stats = DispatchStats()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._scheduler: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def _sender_bucket(self, sender: str) -> TokenBucket:
+        bucket = self._sender_buckets.get(sender)
+        if bucket is None:
+            bucket = self._sender_buckets[sender] = TokenBucket(
+                self.settings.sender_rate_per_second, self.settings.sender_burst, self._clock)
+        return bucket
+
+    def _start(self) -> None:
+        if self._scheduler is None or self._scheduler.done():
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.settings.concurrency)
+            self._scheduler = asyncio.get_running_loop().create_task(self._schedule())
+
+    def submit(self, message: SMSMessage) -> 'asyncio.Future[SMSResult]':
+        """Queue ``message`` and return a future for its result
+
+        A key that is already queued or in flight shares that message's
+        future. A key that finished recently gets its result back again.
+        """
+        self._start()
+        self._stats.submitted += 1
+        key = message.idempotency_key
+        pending = self._pending.get(key)
+        if pending is not None:
+            self._stats.deduplicated += 1
+            return pending.future
+        loop = asyncio.get_running_loop()
+        recent = self._recent.get(key)
+        if recent is not None:
+            self._stats.deduplicated += 1
+            future = loop.create_future()
+            future.set_result(recent)
+            return future
+        pending = self._pending[key] = _Pending(message, loop.create_future())
+        self._push(pending)
+        return pending.future
+
+    async def send(self, message: SMSMessage) -> SMSResult:
+        return await self.submit(message)
+
+    async def send_many(self, messages: Iterable[SMSMessage]) -> List[SMSResult]:
+        return list(await asyncio.gather(*(self.submit(message) for message in messages)))
+
+    def stats(self) -> DispatchStats:
+        stats = DispatchStats(**vars(self._stats))
+        stats.queued = len(self._heap) + len(self._retries)
+        return stats
+
+    def _push(self, pending: _Pending) -> None:
+        heapq.heappush(self._heap, (pending.message.priority, next(self._sequence), pending))
+        self._wakeup.set()
+
+    def _requeue(self, pending: _Pending) -> None:
+        self._retries.pop(pending.message.idempotency_key, None)
+        self._push(pending)
+
+    def _choose_sender(self, message: SMSMessage) -> Tuple[str, float]:
+        """The sender to use and how long until it has a token; rotates among free numbers"""
+        if message.sender:
+            return message.sender, self._sender_bucket(message.sender).delay()
+        senders = self.settings.senders
+        best, best_delay, best_index = senders[0], float('inf'), 0
+        for offset in range(len(senders)):
+            index = (self._next_sender + offset) % len(senders)
+            delay = self._sender_buckets[senders[index]].delay()
+            if delay < best_delay:
+                best, best_delay, best_index = senders[index], delay, index
+                if delay <= 0:
+                    break
+        if best_delay <= 0:
+            self._next_sender = best_index + 1
+        return best, best_delay
+
+    async def _next_ready(self) -> _Pending:
+        """Pop the most urgent message once the provider and its sender both have a token"""
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            pending = self._heap[0][2]
+            sender, wait = self._choose_sender(pending.message)
+            wait = max(wait, self.bucket.delay())
+            if wait <= 0:
+                heapq.heappop(self._heap)
+                self.bucket.try_acquire()
+                self._sender_bucket(sender).try_acquire()
+                pending.sender = sender
+                return pending
+            # A newly submitted message may be more urgent than the head, so wake on submit too
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _schedule(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            pending = await self._next_ready()
+            task = loop.create_task(self._deliver(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._delivered)
+
+    def _delivered(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._slots.release()
+
+    async def _deliver(self, pending: _Pending) -> None:
+        message = pending.message
+        pending.attempts += 1
+        self._stats.in_flight += 1
+        try:
+            result = await self.provider.send(message, pending.sender)
+        except Exception as e:
+            logger.error(f"SMS provider '{self.settings.name}' raised: {str(e)}")
+            result = SMSResult(message.idempotency_key, False, sender=pending.sender, temporary=True, error=str(e))
+        finally:
+            self._stats.in_flight -= 1
+        if not result.ok and result.temporary and pending.attempts < self.max_attempts and not self._closing:
+            delay = result.retry_after
+            if delay is None:
+                delay = backoff_delay(pending.attempts, self.retry_base, self.retry_cap)
+            self._stats.retried += 1
+            self._retries[message.idempotency_key] = asyncio.get_running_loop().call_later(
+                delay, self._requeue, pending)
+            return
+        result.attempts = pending.attempts
+        self._finish(pending, result)
+
+    def _finish(self, pending: _Pending, result: SMSResult) -> None:
+        key = pending.message.idempotency_key
+        self._pending.pop(key, None)
+        self._recent[key] = result
+        if len(self._recent) > self.remember:
+            self._recent.popitem(last=False)
+        if result.ok:
+            self._stats.sent += 1
+        else:
+            self._stats.failed += 1
+            logger.warning(f"SMS to {pending.message.to} failed after {result.attempts} attempt(s): {result.error}")
+        if not pending.future.done():
+            pending.future.set_result(result)
+        if self.on_result is not None:
+            try:
+                self.on_result(pending.message, result)
+            except Exception as e:
+                logger.error(f"SMS result callback failed: {str(e)}")
+
+    async def close(self) -> None:
+        """Stop scheduling, let in-flight requests finish, fail whatever is still queued"""
+        self._closing = True
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+            try:
+                await self._scheduler
+            except asyncio.CancelledError:
+                pass
+            self._scheduler = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+        self._heap.clear()
+        for pending in list(self._pending.values()):
+            self._finish(pending, SMSResult(pending.message.idempotency_key, False, temporary=True,
+                                            error='Dispatcher closed', attempts=pending.attempts))
+        close = getattr(self.provider, 'close', None)
+        if close is not None:
+            await close()
+
+
+# -- status log ---------------------------------------------------------------
+
+RECORD_RESULTS_SQL = """
+INSERT INTO public.sms_messages (provider, idempotency_key, agency_id, sender, to_number, priority,
+                                 provider_sid, status, attempts, last_error, error_code, sent_at)
+SELECT $1, r.idempotency_key, r.agency_id, r.sender, r.to_number, r.priority, r.provider_sid, r.status,
+       r.attempts, r.last_error, r.error_code, CASE WHEN r.status = 'sent' THEN now() END
+FROM unnest($2::text[], $3::uuid[], $4::text[], $5::text[], $6::smallint[], $7::text[], $8::text[],
+            $9::integer[], $10::text[], $11::text[])
+    AS r(idempotency_key, agency_id, sender, to_number, priority, provider_sid, status, attempts, last_error,
+         error_code)
+ON CONFLICT (provider, idempotency_key) DO UPDATE SET
+    provider_sid = COALESCE(EXCLUDED.provider_sid, sms_messages.provider_sid),
+    status = CASE WHEN sms_messages.status IN ('delivered', 'undelivered') THEN sms_messages.status
+                  ELSE EXCLUDED.status END,
+    attempts = sms_messages.attempts + EXCLUDED.attempts,
+    last_error = EXCLUDED.last_error,
+    error_code = EXCLUDED.error_code,
+    sent_at = COALESCE(sms_messages.sent_at, EXCLUDED.sent_at),
+    updated_at = now()
+"""
+
+# Terminal statuses are never overwritten. Receipts with no row yet are parked in sms_early_receipts
+APPLY_RECEIPTS_SQL = """
+WITH receipt AS (
+    SELECT * FROM unnest($2::text[], $3::text[], $4::text[]) AS r(provider_sid, status, error_code)
+), applied AS (
+    UPDATE public.sms_messages m
+    SET status = receipt.status,
+        error_code = COALESCE(receipt.error_code, m.error_code),
+        delivered_at = CASE WHEN receipt.status = 'delivered' THEN now() ELSE m.delivered_at END,
+        updated_at = now()
+    FROM receipt
+    WHERE m.provider = $1 AND m.provider_sid = receipt.provider_sid
+      AND m.status NOT IN ('delivered', 'undelivered', 'failed')
+)
+INSERT INTO public.sms_early_receipts AS e (provider, provider_sid, status, error_code)
+SELECT $1, receipt.provider_sid, receipt.status, receipt.error_code FROM receipt
+WHERE NOT EXISTS (
+    SELECT 1 FROM public.sms_messages m WHERE m.provider = $1 AND m.provider_sid = receipt.provider_sid
+)
+ON CONFLICT (provider, provider_sid) DO UPDATE SET
+    status = CASE WHEN e.status IN ('delivered', 'undelivered', 'failed') THEN e.status ELSE EXCLUDED.status END,
+    error_code = COALESCE(EXCLUDED.error_code, e.error_code),
+    received_at = now()
+"""
+
+# Runs after RECORD_RESULTS_SQL: parked receipts for the sids just recorded are applied and removed
+APPLY_EARLY_RECEIPTS_SQL = """
+WITH matched AS (
+    DELETE FROM public.sms_early_receipts e
+    WHERE e.provider = $1 AND e.provider_sid = ANY($2::text[])
+    RETURNING e.provider_sid, e.status, e.error_code
+)
+UPDATE public.sms_messages m
+SET status = matched.status,
+    error_code = COALESCE(matched.error_code, m.error_code),
+    delivered_at = CASE WHEN matched.status = 'delivered' THEN now() ELSE m.delivered_at END,
+    updated_at = now()
+FROM matched
+WHERE m.provider = $1 AND m.provider_sid = matched.provider_sid
+  AND m.status NOT IN ('delivered', 'undelivered', 'failed')
+"""
+
+PURGE_EARLY_RECEIPTS_SQL = """
+DELETE FROM public.sms_early_receipts WHERE received_at < now() - make_interval(secs => $1)
+"""
+
+
+@dataclass
+class DeliveryReceipt:
+    """A provider's status callback for one message"""
+    sid: str
+    status: str
+    error_code: Optional[str] = None
+
+    @classmethod
+    def from_payload(cls, payload: Mapping[str, Any]) -> 'DeliveryReceipt':
+        """Accept ``sid``/``status``/``error_code`` or Twilio-style ``MessageSid``/``MessageStatus``/``ErrorCode``"""
+        if not isinstance(payload, Mapping):
+            raise ValidationError('Receipt must be an object')
+        sid = payload.get('sid') or payload.get('MessageSid')
+        status = str(payload.get('status') or payload.get('MessageStatus') or '').lower()
+        if not sid or not status:
+            raise ValidationError('Receipt needs a sid and a status')
+        if status not in RECEIPT_STATUSES:
+            raise ValidationError(f"Unknown receipt status '{status}'")
+        code = payload.get('error_code', payload.get('ErrorCode'))
+        return cls(str(sid), status, str(code) if code not in (None, '') else None)
+
+
+class SMSStatusLog:
+    """Buffers send results and delivery receipts and writes them to ``sms_messages`` in batches
+
+    A flush happens every ``flush_interval`` seconds, as soon as
+    ``batch_size`` entries are waiting, or right away when the webhook is
+    waiting on :meth:`write_receipts`. A receipt can beat its send result
+    to the database when the webhook and the dispatcher run in different
+    processes. It is then parked in ``sms_early_receipts`` and applied when
+    the result is recorded, or purged after
+    ``EARLY_RECEIPT_RETENTION_SECONDS``.
+    """
+
+    def __init__(self, database=None, batch_size: int = DEFAULT_LOG_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_LOG_FLUSH_INTERVAL,
+                 max_pending: int = DEFAULT_LOG_MAX_PENDING):
+        if database is None:
+            from immigration_ai.utils.database import get_database
+
+            database = get_database()
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._results: Dict[Tuple[str, str], tuple] = {}
+        self._receipts: Dict[Tuple[str, str], DeliveryReceipt] = {}
+        self._waiters: List[asyncio.Future] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._purged_at = float('-inf')
+
+    def record_result(self, provider: str, message: SMSMessage, result: SMSResult) -> None:
+        """Buffer a final send result; a later result for the same key replaces it"""
+        self._results[(provider, message.idempotency_key)] = (
+            message.idempotency_key, message.agency_id, result.sender, message.to, message.priority,
+            result.sid, 'sent' if result.ok else 'failed', result.attempts, result.error,
+            None if result.ok else result.code,
+        )
+        self._buffered()
+
+    def add_receipts(self, provider: str, receipts: Iterable[DeliveryReceipt]) -> None:
+        """Buffer receipts; per message a final status wins over an interim one"""
+        for receipt in receipts:
+            key = (provider, receipt.sid)
+            current = self._receipts.get(key)
+            if current is None or receipt.status in TERMINAL_STATUSES or current.status not in TERMINAL_STATUSES:
+                self._receipts[key] = receipt
+        self._buffered()
+
+    async def write_receipts(self, provider: str, receipts: List[DeliveryReceipt]) -> None:
+        """Buffer receipts and wait until the batch holding them is committed
+
+        Raises :class:`ServiceUnavailableError` when the buffer is full or
+        the write fails. The provider then redelivers the receipts later.
+        """
+        if self.pending() + len(receipts) > self.max_pending:
+            raise ServiceUnavailableError('SMS status log is backed up; retry later')
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.add_receipts(provider, receipts)
+        self._wakeup.set()
+        try:
+            await waiter
+        except Exception as e:
+            raise ServiceUnavailableError(f'Could not store SMS receipts: {e}') from e
+
+    def pending(self) -> int:
+        return len(self._results) + len(self._receipts)
+
+    def _buffered(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        if self.pending() >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write SMS statuses: {str(e)}")
+
+    async def flush(self) -> Tuple[int, int]:
+        """Write everything buffered in one transaction; returns (results, receipts) written"""
+        results, self._results = self._results, {}
+        receipts, self._receipts = self._receipts, {}
+        waiters, self._waiters = self._waiters, []
+        if not results and not receipts:
+            _settle(waiters)
+            return 0, 0
+        purge = time.monotonic() - self._purged_at >= EARLY_RECEIPT_PURGE_INTERVAL
+        try:
+            async with self.database.transaction() as connection:
+                for provider, rows in _by_provider(results).items():
+                    columns = [list(column) for column in zip(*rows)]
+                    await connection.execute(RECORD_RESULTS_SQL, provider, *columns)
+                    sids = [sid for sid in columns[5] if sid]
+                    if sids:
+                        await connection.execute(APPLY_EARLY_RECEIPTS_SQL, provider, sids)
+                for provider, items in _by_provider(receipts).items():
+                    await connection.execute(APPLY_RECEIPTS_SQL, provider, [r.sid for r in items],
+                                             [r.status for r in items], [r.error_code for r in items])
+                if purge:
+                    await connection.execute(PURGE_EARLY_RECEIPTS_SQL, EARLY_RECEIPT_RETENTION_SECONDS)
+        except Exception as e:
+            # Keep what failed to write, unless something newer arrived meanwhile
+            self._results = {**results, **self._results}
+            for key, receipt in receipts.items():
+                self._receipts.setdefault(key, receipt)
+            _settle(waiters, e)
+            raise
+        if purge:
+            self._purged_at = time.monotonic()
+        _settle(waiters)
+        return len(results), len(receipts)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.pending() or self._waiters:
+            await self.flush()
+
+
+def _settle(waiters: List[asyncio.Future], error: Optional[BaseException] = None) -> None:
+    for waiter in waiters:
+        if waiter.done():
+            continue
+        if error is None:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(error)
+
+
+def _by_provider(buffer: Mapping[Tuple[str, str], Any]) -> Dict[str, List[Any]]:
+    grouped: Dict[str, List[Any]] = {}
+    for (provider, _), item in buffer.items():
+        grouped.setdefault(provider, []).append(item)
+    return grouped
+
+
+_dispatchers: Dict[Tuple[int, str], SMSDispatcher] = {}
+_status_logs: Dict[int, SMSStatusLog] = {}
+_lock = threading.Lock()
+
+
+def get_sms_status_log() -> SMSStatusLog:
+    """This process's status log, shared by its dispatchers and the receipt webhook"""
+    pid = os.getpid()
+    log = _status_logs.get(pid)
+    if log is None:
+        with _lock:
+            log = _status_logs.get(pid)
+            if log is None:
+                log = _status_logs[pid] = SMSStatusLog()
+    return log
+
+
+def get_sms_dispatcher(provider: str = DEFAULT_PROVIDER) -> SMSDispatcher:
+    """This process's dispatcher for ``provider``; its queue, buckets and connections outlive tasks"""
+    key = (os.getpid(), provider)
+    dispatcher = _dispatchers.get(key)
+    if dispatcher is None:
+        log = get_sms_status_log()
+        with _lock:
+            dispatcher = _dispatchers.get(key)
+            if dispatcher is None:
+                settings = SMSProviderSettings.from_env(provider)
+                dispatcher = _dispatchers[key] = SMSDispatcher(
+                    HTTPSMSProvider(settings), settings, on_result=partial(log.record_result, provider))
+    return dispatcher
@@ -1 +1,82 @@
+"""
+Exception hierarchy for the Immigration AI platform
+"""
 
+
+class ImmigrationAIError(Exception):
+    """Base class for all platform errors"""
+
+
+class ConfigurationError(ImmigrationAIError):
+    """Raised when required configuration or artifacts are missing or invalid"""
+
+
+class ValidationError(ImmigrationAIError):
+    """Raised when input fails validation"""
+
+
+class ConflictError(ImmigrationAIError):
+    """Raised when a request conflicts with the current state of a resource"""
+
+
+class ServiceUnavailableError(ImmigrationAIError):
+    """Raised when a request cannot be taken now (overload or a failing dependency); retrying later may succeed"""
+
+
+class AuthenticationError(ImmigrationAIError):
+    """Raised when credentials are missing, malformed or expired"""
+
+
+class ResourceNotFoundError(ImmigrationAIError):
+    """Raised when a requested resource does not exist"""
+
+
+class PermissionDeniedError(ImmigrationAIError):
+    """Raised when the caller is not allowed to access a resource"""
+
+
+class DeliveryError(ImmigrationAIError):
+    """Raised when an email or SMS provider refuses or fails a delivery
+
+    ``temporary`` is True when retrying later may succeed (4xx SMTP
+    replies, throttling, dropped connections).
+    """
+
+    def __init__(self, message, temporary=True, code=None):
+        super().__init__(message)
+        self.temporary = temporary
+        self.code = code
+
+
+class IntegrationError(ImmigrationAIError):
+    """Raised when an external system (a CRM, a government API) rejects or fails a call
+
+    ``status`` is the HTTP status when there was a response.
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class ModelNotFoundError(ResourceNotFoundError):
+    """Raised when a model has no published version in the registry"""
+
+
+class DocumentProcessingError(ImmigrationAIError):
+    """Raised when an uploaded document cannot be parsed or processed"""
+
+
+class MemoryLimitExceededError(DocumentProcessingError):
+    """Raised when processing a document would exceed its memory ceiling"""
+
+
+class ExtractionTimeoutError(DocumentProcessingError):
+    """Raised when a document misses its extraction deadline
+
+    ``partial`` holds the page results that completed before the deadline.
+    """
+
+    def __init__(self, message, partial=None):
+        super().__init__(message)
+        self.partial = partial or []
@@ -1 +1,24 @@
+"""
+Schemas for case responses
+"""
 
+from datetime import date, datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class CaseOut(BaseModel):
+    id: str
+    case_number: Optional[str] = None
+    client_id: Optional[str] = None
+    agency_id: Optional[str] = None
+    case_type: Optional[str] = None
+    status: Optional[str] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    priority: Optional[int] = None
+    assigned_to: Optional[str] = None
+    due_date: Optional[date] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
@@ -0,0 +1,37 @@
+"""
+Schemas for document uploads
+"""
+
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class UploadCreate(BaseModel):
+    file_name: str = Field(..., min_length=1, max_length=255)
+    file_size: int = Field(..., gt=0)
+    mime_type: str
+    document_type: str = 'other'
+    case_id: Optional[str] = None
+
+
+class UploadStatus(BaseModel):
+    upload_id: str
+    status: str
+    file_name: str
+    file_size: int
+    chunk_size: int
+    committed_offset: int
+    document_id: Optional[str] = None
+
+
+class DocumentOut(BaseModel):
+    id: str
+    client_id: Optional[str] = None
+    case_id: Optional[str] = None
+    file_name: str
+    file_size: int
+    mime_type: Optional[str] = None
+    document_type: Optional[str] = None
+    content_sha256: str
+    deduplicated: bool = False
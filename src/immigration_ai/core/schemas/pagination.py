@@ -0,0 +1,12 @@
+"""
+Schemas for keyset-paginated list responses
+"""
+
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class PageOut(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
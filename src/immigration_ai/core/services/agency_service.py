@@ -1 +1,86 @@
+"""
+Agency profile and staff service
 
+Agency reads are cached under the ``agency:{id}`` tag (staff changes also
+carry ``user:{id}``); every mutation invalidates those tags.
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from immigration_ai.core.exceptions import ResourceNotFoundError, ValidationError
+from immigration_ai.utils.cache import TwoTierCache, agency_tag, get_cache, user_tag
+from immigration_ai.utils.database import get_supabase_client
+from immigration_ai.utils.validators import validate_email
+
+logger = logging.getLogger(__name__)
+
+AGENCY_COLUMNS = 'id, name, email, phone, address, website, created_at, updated_at'
+STAFF_COLUMNS = 'id, agency_id, role, first_name, last_name, phone, is_active'
+AGENCY_ROLES = ('agency_admin', 'agency_staff')
+UPDATABLE_FIELDS = ('name', 'email', 'phone', 'address', 'website')
+
+AGENCY_TTL_SECONDS = 600
+
+
+class AgencyService:
+    """Read and update agency profiles and their staff"""
+
+    def __init__(self, db=None, cache: Optional[TwoTierCache] = None):
+        self._db = db
+        self.cache = cache or get_cache()
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else get_supabase_client()
+
+    def get_agency(self, agency_id: str) -> Dict[str, Any]:
+        def load():
+            rows = self.db.table('agencies').select(AGENCY_COLUMNS).eq('id', agency_id).limit(1).execute().data
+            if not rows:
+                raise ResourceNotFoundError(f'Agency {agency_id} not found')
+            return rows[0]
+
+        return self.cache.get_or_load(f'agency:{agency_id}', load, ttl=AGENCY_TTL_SECONDS,
+                                      tags=[agency_tag(agency_id)])
+
+    def list_staff(self, agency_id: str) -> List[Dict[str, Any]]:
+        def load():
+            return (
+                self.db.table('users').select(STAFF_COLUMNS)
+                .eq('agency_id', agency_id).in_('role', list(AGENCY_ROLES))
+                .order('last_name').execute().data
+            ) or []
+
+        return self.cache.get_or_load(f'agency_staff:{agency_id}', load, ttl=AGENCY_TTL_SECONDS,
+                                      tags=[agency_tag(agency_id)])
+
+    def update_agency(self, agency_id: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+        unknown = set(changes) - set(UPDATABLE_FIELDS)
+        if unknown:
+            raise ValidationError(f"Cannot update agency fields: {', '.join(sorted(unknown))}")
+        if 'name' in changes and not str(changes['name'] or '').strip():
+            raise ValidationError('Agency name is required')
+        if changes.get('email') and not validate_email(changes['email']):
+            raise ValidationError('Invalid agency email address')
+        rows = (
+            self.db.table('agencies')
+            .update({**changes, 'updated_at': datetime.now(timezone.utc).isoformat()})
+            .eq('id', agency_id).execute().data
+        )
+        if not rows:
+            raise ResourceNotFoundError(f'Agency {agency_id} not found')
+        self.cache.invalidate_tags(agency_tag(agency_id))
+        return rows[0]
+
+    def set_staff_active(self, agency_id: str, user_id: str, is_active: bool) -> Dict[str, Any]:
+        rows = (
+            self.db.table('users').update({'is_active': is_active})
+            .eq('id', user_id).eq('agency_id', agency_id).execute().data
+        )
+        if not rows:
+            raise ResourceNotFoundError(f'User {user_id} not found in agency {agency_id}')
+        self.cache.invalidate_tags(agency_tag(agency_id), user_tag(user_id))
+        logger.info(f"Set user {user_id} active={is_active} in agency {agency_id}")
+        return rows[0]
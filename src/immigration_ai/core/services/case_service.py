@@ -1 +1,283 @@
+"""
+Case management service
 
+Reads go through the shared :class:`TwoTierCache`: single cases are tagged
+``case:{id}`` only and agency-wide views (case lists, the dashboard
+summary) are tagged ``agency:{id}``, so every mutation here invalidates
+exactly the entries it can have changed. Changing one case keeps the
+agency's other cached cases. The dashboard is the hottest key in the app
+and relies on the cache's miss coalescing when it expires.
+"""
+
+import logging
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from immigration_ai.core.exceptions import ResourceNotFoundError, ValidationError
+from immigration_ai.utils.cache import TwoTierCache, agency_tag, case_tag, client_tag, get_cache
+from immigration_ai.utils.database import get_supabase_client
+from immigration_ai.utils.dataloader import RequestLoaders
+from immigration_ai.utils.pagination import (
+    Page,
+    apply_keyset,
+    build_page,
+    clamp_page_size,
+    select_clause,
+    select_fields,
+)
+
+logger = logging.getLogger(__name__)
+
+CASE_COLUMNS = ('id, case_number, client_id, agency_id, case_type, status, title, description, '
+                'priority, assigned_to, due_date, created_at, updated_at')
+# Columns list views may request with ``fields=``; the default matches the case list UI
+CASE_LIST_FIELDS = tuple(c.strip() for c in CASE_COLUMNS.split(','))
+DEFAULT_CASE_LIST_FIELDS = ('id', 'case_number', 'title', 'case_type', 'status', 'priority', 'client_id',
+                            'updated_at')
+CASE_STATUSES = ('new', 'in_progress', 'under_review', 'approved', 'rejected', 'completed')
+CLOSED_STATUSES = ('approved', 'rejected', 'completed')
+CASE_TYPES = ('family_based', 'employment_based', 'asylum', 'naturalization', 'other')
+UPDATABLE_FIELDS = ('status', 'title', 'description', 'priority', 'assigned_to', 'due_date', 'case_type')
+
+CASE_TTL_SECONDS = 300
+DASHBOARD_TTL_SECONDS = 60
+# Rows per keyset query when streaming an export
+EXPORT_BATCH_SIZE = 1000
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _validate_case_fields(fields: Dict[str, Any]) -> None:
+    if 'status' in fields and fields['status'] not in CASE_STATUSES:
+        raise ValidationError(f"Invalid case status {fields['status']!r}")
+    if 'case_type' in fields and fields['case_type'] not in CASE_TYPES:
+        raise ValidationError(f"Invalid case type {fields['case_type']!r}")
+    if 'priority' in fields and not (isinstance(fields['priority'], int) and 1 <= fields['priority'] <= 5):
+        raise ValidationError('Priority must be an integer between 1 and 5')
+    if 'title' in fields and not str(fields['title'] or '').strip():
+        raise ValidationError('Case title is required')
+
+
+class CaseService:
+    """Create, update and read cases for an agency"""
+
+    def __init__(self, db=None, cache: Optional[TwoTierCache] = None):
+        self._db = db
+        self.cache = cache or get_cache()
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else get_supabase_client()
+
+    # -- reads ---------------------------------------------------------
+
+    def get_case(self, agency_id: str, case_id: str) -> Dict[str, Any]:
+        def load():
+            rows = (
+                self.db.table('cases').select(CASE_COLUMNS)
+                .eq('id', case_id).eq('agency_id', agency_id).limit(1).execute().data
+            ) or []
+            if not rows:
+                raise ResourceNotFoundError(f'Case {case_id} not found')
+            return rows[0]
+
+        return self.cache.get_or_load(f'case:{agency_id}:{case_id}', load, ttl=CASE_TTL_SECONDS,
+                                      tags=[case_tag(case_id)])
+
+    def list_cases(self, agency_id: str, status: Optional[str] = None, client_id: Optional[str] = None,
+                   cursor: Optional[str] = None, limit: Optional[int] = None,
+                   fields: Optional[Iterable[str]] = None) -> Page:
+        """One keyset page of an agency's cases, most recently updated first"""
+        if status is not None:
+            _validate_case_fields({'status': status})
+        limit = clamp_page_size(limit)
+        fields = select_fields(fields, CASE_LIST_FIELDS, DEFAULT_CASE_LIST_FIELDS)
+
+        def load():
+            query = self.db.table('cases').select(select_clause(fields)).eq('agency_id', agency_id)
+            if status is not None:
+                query = query.eq('status', status)
+            if client_id is not None:
+                query = query.eq('client_id', client_id)
+            return build_page(apply_keyset(query, cursor, limit).execute().data or [], limit, fields).to_dict()
+
+        tags = [agency_tag(agency_id)] + ([client_tag(client_id)] if client_id else [])
+        key = f"cases:{agency_id}:{status}:{client_id}:{cursor}:{limit}:{','.join(fields)}"
+        return Page(**self.cache.get_or_load(key, load, ttl=CASE_TTL_SECONDS, tags=tags))
+
+    def iter_cases(self, agency_id: str, status: Optional[str] = None,
+                   fields: Optional[Iterable[str]] = None,
+                   batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+        """Every matching case, most recently updated first, fetched one keyset batch at a time
+
+        Uncached and unbounded: meant for streaming exports, which hold only
+        the current batch in memory. Arguments are validated here, before
+        the first row is read, so a streaming response can still fail cleanly.
+        """
+        if status is not None:
+            _validate_case_fields({'status': status})
+        fields = select_fields(fields, CASE_LIST_FIELDS, CASE_LIST_FIELDS)
+
+        def rows():
+            cursor = None
+            while True:
+                query = self.db.table('cases').select(select_clause(fields)).eq('agency_id', agency_id)
+                if status is not None:
+                    query = query.eq('status', status)
+                page = build_page(apply_keyset(query, cursor, batch_size).execute().data or [], batch_size, fields)
+                yield from page.items
+                if page.next_cursor is None:
+                    return
+                cursor = page.next_cursor
+
+        return rows()
+
+    def get_dashboard(self, agency_id: str, today: Optional[date] = None) -> Dict[str, Any]:
+        """Case counts by status, open high-priority and overdue cases
+
+        Counted in Postgres by ``public.case_dashboard``, one row per
+        status, so the cost does not grow with the agency's cases and no
+        response is cut off at PostgREST's row cap.
+        """
+        today = today or date.today()
+
+        def load():
+            rows = self.db.rpc('case_dashboard', {
+                'p_agency_id': agency_id, 'p_today': today.isoformat()}).execute().data or []
+            by_status = {row['status']: int(row['cases']) for row in rows}
+            return {
+                'total': sum(by_status.values()),
+                'by_status': {status: by_status.get(status, 0) for status in CASE_STATUSES},
+                'open': sum(count for status, count in by_status.items() if status not in CLOSED_STATUSES),
+                'high_priority': sum(int(row['high_priority']) for row in rows),
+                'overdue': sum(int(row['overdue']) for row in rows),
+            }
+
+        return self.cache.get_or_load(f'dashboard:{agency_id}:{today.isoformat()}', load,
+                                      ttl=DASHBOARD_TTL_SECONDS, tags=[agency_tag(agency_id)])
+
+    def get_case_details(self, agency_id: str, case_ids: List[str], include_private_notes: bool = True,
+                         loaders: Optional[RequestLoaders] = None) -> List[Dict[str, Any]]:
+        """Cases with their client, assignee, documents, notes and activity timeline
+
+        Relations are fetched through request loaders, so rendering any
+        number of cases costs one query per relation instead of one per row.
+        Unknown or foreign case ids are skipped.
+        """
+        loaders = loaders or RequestLoaders(self.db, agency_id)
+        cases = [case for case in loaders.cases.get_many(case_ids) if case is not None]
+        ids = [case['id'] for case in cases]
+
+        pending_clients = loaders.clients.load_many(case['client_id'] for case in cases)
+        pending_documents = loaders.documents_by_case.load_many(ids)
+        pending_notes = loaders.notes_by_case.load_many(ids)
+        pending_activities = loaders.activities_by_case.load_many(ids)
+        clients = [pending.result() for pending in pending_clients]
+        documents = [pending.result() for pending in pending_documents]
+        notes = [[note for note in pending.result() if include_private_notes or not note.get('is_private')]
+                 for pending in pending_notes]
+        activities = [pending.result() for pending in pending_activities]
+
+        # Every user the page mentions, resolved in one batch
+        loaders.users.load_many(
+            [case['assigned_to'] for case in cases if case.get('assigned_to')]
+            + [client['user_id'] for client in clients if client and client.get('user_id')]
+            + [note['author_id'] for case_notes in notes for note in case_notes if note.get('author_id')]
+            + [a['user_id'] for case_activities in activities for a in case_activities if a.get('user_id')]
+        )
+
+        def user(user_id):
+            return loaders.users.get(user_id) if user_id else None
+
+        details = []
+        for case, client, case_documents, case_notes, case_activities in zip(
+                cases, clients, documents, notes, activities):
+            details.append({
+                **case,
+                'client': {**client, 'user': user(client.get('user_id'))} if client else None,
+                'assigned_user': user(case.get('assigned_to')),
+                'documents': case_documents,
+                'notes': [{**note, 'author': user(note.get('author_id'))} for note in case_notes],
+                'activities': [{**a, 'user': user(a.get('user_id'))} for a in case_activities],
+            })
+        return details
+
+    def get_case_detail(self, agency_id: str, case_id: str, include_private_notes: bool = True,
+                        loaders: Optional[RequestLoaders] = None) -> Dict[str, Any]:
+        details = self.get_case_details(agency_id, [case_id], include_private_notes, loaders)
+        if not details:
+            raise ResourceNotFoundError(f'Case {case_id} not found')
+        return details[0]
+
+    def list_notes(self, agency_id: str, case_id: str, include_private: bool = True) -> List[Dict[str, Any]]:
+        self.get_case(agency_id, case_id)
+
+        def load():
+            query = self.db.table('case_notes').select('id, case_id, author_id, content, is_private, created_at')
+            query = query.eq('case_id', case_id)
+            if not include_private:
+                query = query.eq('is_private', False)
+            return query.order('created_at', desc=True).execute().data or []
+
+        return self.cache.get_or_load(f'case_notes:{case_id}:{include_private}', load,
+                                      ttl=CASE_TTL_SECONDS, tags=[case_tag(case_id)])
+
+    # -- mutations -----------------------------------------------------
+
+    def _invalidate(self, agency_id: str, case: Dict[str, Any]) -> None:
+        # The agency tag covers lists and the dashboard; other cases' entries carry only their own tag
+        tags = [agency_tag(agency_id), case_tag(case['id'])]
+        if case.get('client_id'):
+            tags.append(client_tag(case['client_id']))
+        self.cache.invalidate_tags(*tags)
+
+    def create_case(self, agency_id: str, client_id: str, case_type: str, title: str,
+                    description: Optional[str] = None, priority: int = 1,
+                    assigned_to: Optional[str] = None, due_date: Optional[str] = None) -> Dict[str, Any]:
+        row = {
+            'agency_id': agency_id, 'client_id': client_id, 'case_type': case_type, 'title': title,
+            'description': description, 'priority': priority, 'assigned_to': assigned_to,
+            'due_date': due_date, 'status': 'new',
+        }
+        _validate_case_fields(row)
+        case = self.db.table('cases').insert(row).execute().data[0]
+        self._invalidate(agency_id, case)
+        logger.info(f"Created case {case.get('case_number') or case['id']} for agency {agency_id}")
+        return case
+
+    def update_case(self, agency_id: str, case_id: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+        unknown = set(changes) - set(UPDATABLE_FIELDS)
+        if unknown:
+            raise ValidationError(f"Cannot update case fields: {', '.join(sorted(unknown))}")
+        _validate_case_fields(changes)
+        rows = (
+            self.db.table('cases').update({**changes, 'updated_at': _now()})
+            .eq('id', case_id).eq('agency_id', agency_id).execute().data
+        ) or []
+        if not rows:
+            raise ResourceNotFoundError(f'Case {case_id} not found')
+        self._invalidate(agency_id, rows[0])
+        return rows[0]
+
+    def delete_case(self, agency_id: str, case_id: str) -> None:
+        rows = (
+            self.db.table('cases').delete().eq('id', case_id).eq('agency_id', agency_id).execute().data
+        ) or []
+        if not rows:
+            raise ResourceNotFoundError(f'Case {case_id} not found')
+        self._invalidate(agency_id, rows[0])
+
+    def add_note(self, agency_id: str, case_id: str, author_id: str, content: str,
+                 is_private: bool = False) -> Dict[str, Any]:
+        if not content or not content.strip():
+            raise ValidationError('Note content is required')
+        case = self.get_case(agency_id, case_id)
+        note = self.db.table('case_notes').insert({
+            'case_id': case_id, 'author_id': author_id, 'content': content, 'is_private': is_private,
+        }).execute().data[0]
+        # Notes bump the case in "recently updated" lists
+        self.db.table('cases').update({'updated_at': _now()}).eq('id', case_id).execute()
+        self._invalidate(agency_id, case)
+        return note
@@ -0,0 +1,452 @@
+"""
+Content-addressed document storage with per-hash artifact reuse
+
+Clients frequently upload the same passport scan or certificate several
+times, across cases and across agencies through re-referrals. Documents are
+therefore stored once per SHA-256 of their content: every upload creates a
+tenant-scoped :class:`DocumentRecord` pointing at a shared blob, and
+expensive derived artifacts (analysis, AI review) are cached per content
+hash and model version so a re-upload reuses them immediately.
+
+Access control stays per tenant: an agency can only read a blob or its
+artifacts through a document record it owns. Records, blob reference
+counts and artifacts live in the tables added by
+``supabase/migrations/20250702_document_content_dedup.sql``
+(:class:`SupabaseDocumentIndex`), so every API worker sees the same state;
+:class:`InMemoryDocumentIndex` mirrors them for tests and local development.
+
+Blobs are never deleted on the request path. Deleting the last document
+for a hash only releases its blob; :meth:`DocumentStore.collect_garbage`
+later deletes blobs that have stayed unreferenced for a grace period.
+Every upload claims its blob first, which restarts that period, so a blob
+cannot be collected from under an upload that is reusing it. A blob that
+was collected and then uploaded again gets a new storage key, so a late
+delete of the old copy cannot remove the new one.
+"""
+
+import abc
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from immigration_ai.core.exceptions import PermissionDeniedError, ResourceNotFoundError
+from immigration_ai.utils.database import get_supabase_client
+from immigration_ai.utils.storage import BlobStorage, LocalBlobStorage
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_BYTES = 1024 * 1024
+BLOB_PREFIX = 'blobs/sha256'
+STAGING_PREFIX = 'staging'
+# How long a released blob is kept before collection; longer than any upload takes
+BLOB_GRACE_SECONDS = 60 * 60
+DOCUMENT_STORAGE_ENV = 'DOCUMENT_STORAGE_ROOT'
+DEFAULT_DOCUMENT_STORAGE = Path(__file__).resolve().parents[4] / 'data' / 'storage'
+
+DOCUMENT_COLUMNS = ('id, agency_id, content_sha256, file_name, file_path, file_size, mime_type, document_type, '
+                    'client_id, case_id, uploaded_by, created_at')
+
+
+def blob_key(content_hash: str) -> str:
+    """Storage key prefix for a content hash; each stored copy adds a unique suffix"""
+    return f'{BLOB_PREFIX}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}'
+
+
+def new_blob_key(content_hash: str) -> str:
+    return f'{blob_key(content_hash)}.{uuid.uuid4().hex[:12]}'
+
+
+@dataclass
+class DocumentRecord:
+    """A tenant's reference to a stored blob (one row in ``documents``)"""
+    id: str
+    agency_id: str
+    content_sha256: str
+    file_name: str
+    file_size: int
+    file_path: str
+    mime_type: Optional[str] = None
+    document_type: Optional[str] = None
+    client_id: Optional[str] = None
+    case_id: Optional[str] = None
+    uploaded_by: Optional[str] = None
+    created_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class _HashingReader:
+    """File-like wrapper hashing bytes as they are read"""
+
+    def __init__(self, source: BinaryIO):
+        self.source = source
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.source.read(size)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+
+class DocumentIndex(abc.ABC):
+    """Document records, blob reference counts and cached artifacts"""
+
+    @abc.abstractmethod
+    def add(self, record: DocumentRecord) -> None:
+        """Store a record; its blob must already be claimed"""
+
+    @abc.abstractmethod
+    def get(self, document_id: str) -> Optional[DocumentRecord]:
+        ...
+
+    @abc.abstractmethod
+    def remove(self, document_id: str) -> Optional[DocumentRecord]:
+        """Delete a record and release its blob reference; None if it was already gone"""
+
+    @abc.abstractmethod
+    def find(self, agency_id: str, content_hash: str) -> List[DocumentRecord]:
+        """The agency's records with this content"""
+
+    @abc.abstractmethod
+    def is_referenced(self, content_hash: str) -> bool:
+        """Whether any record of any agency still uses this content"""
+
+    @abc.abstractmethod
+    def claim_blob(self, content_hash: str, storage_key: str, size: int,
+                   mime_type: Optional[str] = None) -> Tuple[str, bool]:
+        """Reserve the blob for an upload and return ``(storage_key, created)``
+
+        If the hash is already known its existing key is returned and its
+        grace period restarts; otherwise ``storage_key`` is recorded and the
+        caller must store the content there.
+        """
+
+    @abc.abstractmethod
+    def collect(self, grace_seconds: float) -> List[str]:
+        """Forget blobs unreferenced for ``grace_seconds``; returns their storage keys"""
+
+    @abc.abstractmethod
+    def get_artifact(self, content_hash: str, kind: str, version: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def put_artifact(self, content_hash: str, kind: str, version: str, payload: Dict[str, Any]) -> None:
+        ...
+
+    def agency_has_hash(self, agency_id: str, content_hash: str) -> bool:
+        return bool(self.find(agency_id, content_hash))
+
+
+@dataclass
+class _Blob:
+    """An in-memory ``document_blobs`` row"""
+    storage_key: str
+    refs: int = 0
+    released_at: float = 0.0
+
+
+class InMemoryDocumentIndex(DocumentIndex):
+    """Process-local index with the same semantics as the database tables"""
+
+    def __init__(self):
+        self._records: Dict[str, DocumentRecord] = {}
+        self._blobs: Dict[str, _Blob] = {}
+        self._artifacts: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, record: DocumentRecord) -> None:
+        with self._lock:
+            blob = self._blobs.get(record.content_sha256)
+            if blob is None:
+                raise ResourceNotFoundError(f'No blob claimed for {record.content_sha256}')
+            self._records[record.id] = record
+            blob.refs += 1
+
+    def get(self, document_id: str) -> Optional[DocumentRecord]:
+        return self._records.get(document_id)
+
+    def remove(self, document_id: str) -> Optional[DocumentRecord]:
+        with self._lock:
+            record = self._records.pop(document_id, None)
+            blob = self._blobs.get(record.content_sha256) if record is not None else None
+            if blob is not None:
+                blob.refs -= 1
+                if blob.refs <= 0:
+                    blob.released_at = time.time()
+            return record
+
+    def find(self, agency_id: str, content_hash: str) -> List[DocumentRecord]:
+        return sorted((r for r in self._records.values()
+                       if r.agency_id == agency_id and r.content_sha256 == content_hash), key=lambda r: r.id)
+
+    def is_referenced(self, content_hash: str) -> bool:
+        blob = self._blobs.get(content_hash)
+        return blob is not None and blob.refs > 0
+
+    def claim_blob(self, content_hash: str, storage_key: str, size: int,
+                   mime_type: Optional[str] = None) -> Tuple[str, bool]:
+        with self._lock:
+            blob = self._blobs.get(content_hash)
+            created = blob is None
+            if created:
+                blob = self._blobs[content_hash] = _Blob(storage_key)
+            blob.released_at = time.time()
+            return blob.storage_key, created
+
+    def collect(self, grace_seconds: float) -> List[str]:
+        cutoff = time.time() - grace_seconds
+        with self._lock:
+            expired = [h for h, blob in self._blobs.items() if blob.refs <= 0 and blob.released_at <= cutoff]
+            keys = [self._blobs.pop(h).storage_key for h in expired]
+            for key in [k for k in self._artifacts if k[0] in expired]:
+                del self._artifacts[key]
+            return keys
+
+    def get_artifact(self, content_hash: str, kind: str, version: str) -> Optional[Dict[str, Any]]:
+        return self._artifacts.get((content_hash, kind, version))
+
+    def put_artifact(self, content_hash: str, kind: str, version: str, payload: Dict[str, Any]) -> None:
+        self._artifacts[(content_hash, kind, version)] = json.loads(json.dumps(payload, default=str))
+
+
+class SupabaseDocumentIndex(DocumentIndex):
+    """The index on ``documents``, ``document_blobs`` and ``document_artifacts``
+
+    Blob claims and collection are single statements in SQL functions
+    (``claim_document_blob``, ``collect_document_blobs``), and reference
+    counts are kept by the ``documents`` trigger, so concurrent workers
+    cannot lose a reference or collect a blob that an upload just reused.
+    """
+
+    def __init__(self, db=None):
+        self._db = db
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else get_supabase_client()
+
+    @staticmethod
+    def _record(row: Dict[str, Any]) -> DocumentRecord:
+        return DocumentRecord(
+            id=row['id'], agency_id=row['agency_id'], content_sha256=row['content_sha256'],
+            file_name=row['file_name'], file_size=row['file_size'], file_path=row['file_path'],
+            mime_type=row.get('mime_type'), document_type=row.get('document_type'),
+            client_id=row.get('client_id'), case_id=row.get('case_id'), uploaded_by=row.get('uploaded_by'),
+            created_at=row.get('created_at') or '',
+        )
+
+    def add(self, record: DocumentRecord) -> None:
+        row = record.to_dict()
+        # documents.document_type is a required enum
+        row['document_type'] = record.document_type or 'other'
+        self.db.table('documents').insert(row).execute()
+
+    def get(self, document_id: str) -> Optional[DocumentRecord]:
+        result = self.db.table('documents').select(DOCUMENT_COLUMNS).eq('id', document_id).limit(1).execute()
+        return self._record(result.data[0]) if result.data else None
+
+    def remove(self, document_id: str) -> Optional[DocumentRecord]:
+        # Only one of two concurrent deletes gets the row back
+        result = self.db.table('documents').delete().eq('id', document_id).execute()
+        return self._record(result.data[0]) if result.data else None
+
+    def find(self, agency_id: str, content_hash: str) -> List[DocumentRecord]:
+        result = (self.db.table('documents').select(DOCUMENT_COLUMNS)
+                  .eq('agency_id', agency_id).eq('content_sha256', content_hash).order('id').execute())
+        return [self._record(row) for row in result.data or []]
+
+    def is_referenced(self, content_hash: str) -> bool:
+        result = (self.db.table('document_blobs').select('ref_count')
+                  .eq('content_sha256', content_hash).limit(1).execute())
+        return bool(result.data) and result.data[0]['ref_count'] > 0
+
+    def claim_blob(self, content_hash: str, storage_key: str, size: int,
+                   mime_type: Optional[str] = None) -> Tuple[str, bool]:
+        result = self.db.rpc('claim_document_blob', {
+            'p_content_sha256': content_hash, 'p_storage_path': storage_key,
+            'p_file_size': size, 'p_mime_type': mime_type,
+        }).execute()
+        row = result.data[0]
+        return row['blob_path'], row['created']
+
+    def collect(self, grace_seconds: float) -> List[str]:
+        result = self.db.rpc('collect_document_blobs', {'p_grace_seconds': int(grace_seconds)}).execute()
+        return [row['blob_path'] for row in result.data or []]
+
+    def get_artifact(self, content_hash: str, kind: str, version: str) -> Optional[Dict[str, Any]]:
+        result = (self.db.table('document_artifacts').select('payload').eq('content_sha256', content_hash)
+                  .eq('kind', kind).eq('version', version).limit(1).execute())
+        return result.data[0]['payload'] if result.data else None
+
+    def put_artifact(self, content_hash: str, kind: str, version: str, payload: Dict[str, Any]) -> None:
+        self.db.table('document_artifacts').upsert({
+            'content_sha256': content_hash, 'kind': kind, 'version': version,
+            'payload': json.loads(json.dumps(payload, default=str)),
+        }).execute()
+
+
+class DocumentStore:
+    """Deduplicating document store with cached, tenant-checked artifacts"""
+
+    def __init__(self, storage: BlobStorage, index: Optional[DocumentIndex] = None):
+        self.storage = storage
+        self.index = index if index is not None else InMemoryDocumentIndex()
+        self._compute_locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    # -- uploads -------------------------------------------------------
+
+    def put(self, agency_id: str, data: Union[bytes, BinaryIO], file_name: str,
+            mime_type: Optional[str] = None, document_type: Optional[str] = None,
+            client_id: Optional[str] = None, case_id: Optional[str] = None,
+            uploaded_by: Optional[str] = None) -> Tuple[DocumentRecord, bool]:
+        """Store an upload and return ``(record, deduplicated)``
+
+        Streams are hashed while being spooled to a staging key, so the file
+        is never held in memory; if the content already exists the staged
+        copy is discarded and only a new tenant record is created.
+        ``deduplicated`` is true only when this agency already had a
+        document with the same content; it says nothing about other agencies.
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            content_hash, size, staging = hashlib.sha256(data).hexdigest(), len(data), None
+        else:
+            staging = f'{STAGING_PREFIX}/{uuid.uuid4().hex}'
+            reader = _HashingReader(data)
+            self.storage.put(staging, reader)
+            content_hash, size = reader.digest.hexdigest(), reader.size
+
+        deduplicated = self.index.agency_has_hash(agency_id, content_hash)
+        key, created = self.index.claim_blob(content_hash, new_blob_key(content_hash), size, mime_type)
+        # A claimed but never stored blob (its uploader failed) is stored by whoever claims it next
+        if created or not self.storage.exists(key):
+            if staging is None:
+                self.storage.put(key, bytes(data))
+            else:
+                self.storage.move(staging, key)
+                staging = None
+        if staging is not None:
+            self.storage.delete(staging)
+
+        return self._register(agency_id, content_hash, size, key, file_name, mime_type=mime_type,
+                              document_type=document_type, client_id=client_id, case_id=case_id,
+                              uploaded_by=uploaded_by), deduplicated
+
+    def _register(self, agency_id: str, content_hash: str, size: int, key: str, file_name: str,
+                  mime_type: Optional[str] = None, document_type: Optional[str] = None,
+                  client_id: Optional[str] = None, case_id: Optional[str] = None,
+                  uploaded_by: Optional[str] = None) -> DocumentRecord:
+        record = DocumentRecord(
+            id=str(uuid.uuid4()), agency_id=agency_id, content_sha256=content_hash,
+            file_name=file_name, file_size=size, file_path=key, mime_type=mime_type,
+            document_type=document_type, client_id=client_id, case_id=case_id, uploaded_by=uploaded_by,
+        )
+        self.index.add(record)
+        logger.info(f"Registered document {record.id} for agency {agency_id} ({content_hash[:12]})")
+        return record
+
+    # -- tenant-checked reads -----------------------------------------
+
+    def get_record(self, agency_id: str, document_id: str) -> DocumentRecord:
+        record = self.index.get(document_id)
+        if record is None:
+            raise ResourceNotFoundError(f'Document {document_id} not found')
+        if record.agency_id != agency_id:
+            raise PermissionDeniedError(f'Document {document_id} belongs to another agency')
+        return record
+
+    def open(self, agency_id: str, document_id: str) -> BinaryIO:
+        record = self.get_record(agency_id, document_id)
+        return self.storage.open(record.file_path)
+
+    def iter_chunks(self, agency_id: str, document_id: str, chunk_size: int = HASH_CHUNK_BYTES) -> Iterator[bytes]:
+        with self.open(agency_id, document_id) as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def delete(self, agency_id: str, document_id: str) -> bool:
+        """Remove a tenant record; returns True if that released the last reference to its blob
+
+        The blob itself is deleted later by :meth:`collect_garbage`.
+        """
+        record = self.get_record(agency_id, document_id)
+        if self.index.remove(document_id) is None:
+            raise ResourceNotFoundError(f'Document {document_id} not found')
+        return not self.index.is_referenced(record.content_sha256)
+
+    def collect_garbage(self, grace_seconds: float = BLOB_GRACE_SECONDS) -> int:
+        """Delete blobs (and their artifacts) unreferenced for ``grace_seconds``; returns how many"""
+        keys = self.index.collect(grace_seconds)
+        for key in keys:
+            self.storage.delete(key)
+        if keys:
+            logger.info(f"Collected {len(keys)} unreferenced document blobs")
+        return len(keys)
+
+    # -- artifacts -----------------------------------------------------
+
+    def _require_access(self, agency_id: str, content_hash: str) -> None:
+        if not self.index.agency_has_hash(agency_id, content_hash):
+            raise PermissionDeniedError(f'Agency {agency_id} has no document with this content')
+
+    def get_artifact(self, agency_id: str, content_hash: str, kind: str, version: str) -> Optional[Dict[str, Any]]:
+        self._require_access(agency_id, content_hash)
+        return self.index.get_artifact(content_hash, kind, version)
+
+    def put_artifact(self, agency_id: str, content_hash: str, kind: str, version: str,
+                     payload: Dict[str, Any]) -> None:
+        self._require_access(agency_id, content_hash)
+        self.index.put_artifact(content_hash, kind, version, payload)
+
+    def get_or_compute_artifact(self, agency_id: str, document_id: str, kind: str, version: str,
+                                compute: Callable[[DocumentRecord], Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+        """Return ``(artifact, cached)``, computing it at most once per content hash in this process"""
+        record = self.get_record(agency_id, document_id)
+        cached = self.get_artifact(agency_id, record.content_sha256, kind, version)
+        if cached is not None:
+            return cached, True
+
+        lock_key = (record.content_sha256, kind, version)
+        with self._locks_guard:
+            lock = self._compute_locks.setdefault(lock_key, threading.Lock())
+        with lock:
+            cached = self.get_artifact(agency_id, record.content_sha256, kind, version)
+            if cached is not None:
+                return cached, True
+            payload = compute(record)
+            self.put_artifact(agency_id, record.content_sha256, kind, version, payload)
+        with self._locks_guard:
+            self._compute_locks.pop(lock_key, None)
+        return payload, False
+
+
+_stores: Dict[int, DocumentStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_document_store() -> DocumentStore:
+    """Return this process's :class:`DocumentStore` on the configured storage and the database index"""
+    pid = os.getpid()
+    store = _stores.get(pid)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(pid)
+            if store is None:
+                _stores.clear()
+                root = os.environ.get(DOCUMENT_STORAGE_ENV) or DEFAULT_DOCUMENT_STORAGE
+                store = _stores[pid] = DocumentStore(LocalBlobStorage(root), SupabaseDocumentIndex())
+    return store
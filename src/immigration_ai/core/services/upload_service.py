@@ -0,0 +1,321 @@
+"""
+Chunked, resumable document uploads
+
+Clients open an upload session declaring the file's name, size and MIME
+type, then send the file as sequential chunks. Each chunk is streamed
+straight to storage as its own part while it is validated: size limits
+are enforced as bytes arrive, and the first chunk's magic bytes must match
+the declared type, so bad uploads are rejected after a few bytes rather
+than after the whole file. Session state lives in storage next to the
+parts, so any API worker can accept the next chunk, and an interrupted
+upload resumes from the last committed offset. Parts are keyed by their
+offset and created only if absent, so of two requests racing for one
+offset exactly one commits and the other gets a conflict. Completing a
+session hands the parts to :class:`DocumentStore` as one stream, which
+deduplicates the content by hash.
+"""
+
+import json
+import logging
+import re
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
+
+from immigration_ai.core.exceptions import (
+    ConflictError,
+    PermissionDeniedError,
+    ResourceNotFoundError,
+    ValidationError,
+)
+from immigration_ai.core.services.document_service import DocumentRecord, DocumentStore
+from immigration_ai.utils.validators import (
+    MAGIC_PREFIX_BYTES,
+    MAX_DOCUMENT_SIZE,
+    sanitize_filename,
+    validate_document_upload,
+    validate_magic_bytes,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+SESSION_TTL_SECONDS = 24 * 60 * 60
+UPLOAD_PREFIX = 'uploads'
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+@dataclass
+class UploadSession:
+    """Persistent state of one resumable upload"""
+    id: str
+    agency_id: str
+    client_id: str
+    file_name: str
+    file_size: int
+    mime_type: str
+    chunk_size: int
+    document_type: Optional[str] = None
+    case_id: Optional[str] = None
+    uploaded_by: Optional[str] = None
+    committed_offset: int = 0
+    parts: int = 0
+    status: str = 'open'  # open | completed | aborted
+    document_id: Optional[str] = None
+    deduplicated: bool = False
+    created_at: float = 0.0
+    expires_at: float = 0.0
+
+    @property
+    def remaining_bytes(self) -> int:
+        return self.file_size - self.committed_offset
+
+
+class ChunkValidator:
+    """Incremental checks applied to a chunk as its bytes arrive"""
+
+    def __init__(self, session: UploadSession):
+        self.session = session
+        self.received = 0
+        self._head: Optional[bytes] = b'' if session.committed_offset == 0 else None
+
+    def feed(self, block: bytes) -> None:
+        self.received += len(block)
+        if self.received > self.session.chunk_size:
+            raise ValidationError(f'Chunk exceeds the session chunk size of {self.session.chunk_size} bytes')
+        if self.session.committed_offset + self.received > self.session.file_size:
+            raise ValidationError('Upload is larger than its declared file size')
+        if self.session.mime_type == 'text/plain' and b'\x00' in block:
+            raise ValidationError('Text upload contains binary data')
+        if self._head is not None:
+            self._head += block[:MAGIC_PREFIX_BYTES - len(self._head)]
+            if len(self._head) >= MAGIC_PREFIX_BYTES:
+                validate_magic_bytes(self.session.mime_type, self._head)
+                self._head = None
+
+    def finish(self) -> None:
+        if self._head is not None:
+            # First chunk shorter than the longest magic prefix
+            validate_magic_bytes(self.session.mime_type, self._head)
+            self._head = None
+
+
+class _ValidatingChunkReader:
+    """Read-through wrapper running a :class:`ChunkValidator` while a chunk streams to storage"""
+
+    def __init__(self, source: Union[bytes, BinaryIO, Iterable[bytes]], validator: ChunkValidator):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._iter: Optional[Iterator[bytes]] = iter([bytes(source)])
+            self._file = None
+        elif hasattr(source, 'read'):
+            self._iter = None
+            self._file = source
+        else:
+            self._iter = iter(source)
+            self._file = None
+        self._buffer = b''
+        self.validator = validator
+
+    def _next_block(self, size: int) -> bytes:
+        if self._file is not None:
+            return self._file.read(size if size > 0 else DEFAULT_CHUNK_SIZE)
+        if self._buffer:
+            block, self._buffer = self._buffer, b''
+        else:
+            block = next(self._iter, b'')
+        if size > 0 and len(block) > size:
+            block, self._buffer = block[:size], block[size:]
+        return block
+
+    def read(self, size: int = -1) -> bytes:
+        block = self._next_block(size)
+        if block:
+            self.validator.feed(block)
+        else:
+            self.validator.finish()
+        return block
+
+
+class _ConcatenatedReader:
+    """Stream the committed parts of a session back as one file"""
+
+    def __init__(self, storage, keys: List[str]):
+        self.storage = storage
+        self.keys = list(keys)
+        self._current: Optional[BinaryIO] = None
+
+    def read(self, size: int = -1) -> bytes:
+        while True:
+            if self._current is None:
+                if not self.keys:
+                    return b''
+                self._current = self.storage.open(self.keys.pop(0))
+            block = self._current.read(size if size > 0 else DEFAULT_CHUNK_SIZE)
+            if block:
+                return block
+            self._current.close()
+            self._current = None
+
+
+class ChunkedUploadService:
+    """Manage resumable upload sessions on top of a :class:`DocumentStore`"""
+
+    def __init__(self, document_store: DocumentStore, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_size: int = MAX_DOCUMENT_SIZE, session_ttl: int = SESSION_TTL_SECONDS):
+        self.document_store = document_store
+        self.storage = document_store.storage
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.session_ttl = session_ttl
+
+    # -- storage layout ------------------------------------------------
+
+    def _session_key(self, upload_id: str) -> str:
+        return f'{UPLOAD_PREFIX}/{upload_id}/session.json'
+
+    def _part_key(self, upload_id: str, offset: int) -> str:
+        return f'{UPLOAD_PREFIX}/{upload_id}/part-{offset:012d}'
+
+    def _part_keys(self, upload_id: str) -> List[str]:
+        return sorted(key for key in self.storage.list(f'{UPLOAD_PREFIX}/{upload_id}')
+                      if key.rsplit('/', 1)[-1].startswith('part-'))
+
+    def _save(self, session: UploadSession) -> None:
+        self.storage.put(self._session_key(session.id), json.dumps(asdict(session)).encode('utf-8'))
+
+    def _load(self, agency_id: str, client_id: str, upload_id: str) -> UploadSession:
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            raise ResourceNotFoundError(f'Upload {upload_id} not found')
+        try:
+            session = UploadSession(**json.loads(self.storage.read(self._session_key(upload_id))))
+        except ResourceNotFoundError:
+            raise ResourceNotFoundError(f'Upload {upload_id} not found') from None
+        if session.agency_id != agency_id:
+            raise PermissionDeniedError(f'Upload {upload_id} belongs to another agency')
+        if session.client_id != client_id:
+            raise PermissionDeniedError(f'Upload {upload_id} belongs to another client')
+        if session.status == 'open':
+            self._catch_up(session)
+        return session
+
+    def _catch_up(self, session: UploadSession) -> None:
+        """Advance past parts whose writer's session save was lost or overtaken"""
+        while session.committed_offset < session.file_size:
+            try:
+                size = self.storage.size(self._part_key(session.id, session.committed_offset))
+            except ResourceNotFoundError:
+                return
+            if not size:
+                return
+            session.committed_offset += size
+            session.parts += 1
+
+    def _discard_parts(self, session: UploadSession) -> None:
+        for key in self._part_keys(session.id):
+            self.storage.delete(key)
+
+    # -- API -----------------------------------------------------------
+
+    def create(self, agency_id: str, client_id: str, file_name: str, file_size: int, mime_type: str,
+               document_type: Optional[str] = None, case_id: Optional[str] = None,
+               uploaded_by: Optional[str] = None) -> UploadSession:
+        validate_document_upload(file_name, file_size, mime_type, max_size=self.max_size)
+        if not file_size:
+            raise ValidationError('File size is required for resumable uploads')
+        now = time.time()
+        session = UploadSession(
+            id=uuid.uuid4().hex, agency_id=agency_id, client_id=client_id,
+            file_name=sanitize_filename(file_name), file_size=file_size, mime_type=mime_type,
+            chunk_size=self.chunk_size, document_type=document_type, case_id=case_id,
+            uploaded_by=uploaded_by, created_at=now, expires_at=now + self.session_ttl,
+        )
+        self._save(session)
+        logger.info(f"Opened upload {session.id} for client {client_id} ({file_size} bytes)")
+        return session
+
+    def status(self, agency_id: str, client_id: str, upload_id: str) -> UploadSession:
+        return self._load(agency_id, client_id, upload_id)
+
+    def begin_chunk(self, agency_id: str, client_id: str, upload_id: str, offset: int) -> ChunkValidator:
+        """Check a chunk may be written at ``offset`` before its body is read
+
+        A mismatched offset raises ``ConflictError`` so the client can fetch
+        :meth:`status` and resume from ``committed_offset``.
+        """
+        session = self._load(agency_id, client_id, upload_id)
+        if session.status != 'open':
+            raise ConflictError(f'Upload {upload_id} is {session.status}')
+        if time.time() > session.expires_at:
+            self.abort(agency_id, client_id, upload_id)
+            raise ConflictError(f'Upload {upload_id} has expired')
+        if offset != session.committed_offset:
+            raise ConflictError(
+                f'Upload {upload_id} expects offset {session.committed_offset}, got {offset}'
+            )
+        return ChunkValidator(session)
+
+    def put_chunk(self, agency_id: str, client_id: str, upload_id: str, offset: int,
+                  data: Union[bytes, BinaryIO, Iterable[bytes]], validated: bool = False) -> UploadSession:
+        """Append one chunk at ``offset``; it must equal the committed offset
+
+        The chunk is validated while it streams into storage; a chunk that
+        fails validation aborts the whole session. Callers that already ran
+        the :meth:`begin_chunk` validator over the body (the upload route
+        does while spooling it) pass ``validated=True`` to skip a second
+        pass. The part is created only if no other request has committed
+        one at ``offset``; losing that race raises ``ConflictError``.
+        """
+        validator = self.begin_chunk(agency_id, client_id, upload_id, offset)
+        session = validator.session
+        source = data if validated else _ValidatingChunkReader(data, validator)
+        part_key = self._part_key(upload_id, offset)
+        try:
+            written = self.storage.create(part_key, source)
+        except ValidationError:
+            self.abort(agency_id, client_id, upload_id)
+            raise
+        except ConflictError:
+            raise ConflictError(f'Upload {upload_id} already has a chunk at offset {offset}') from None
+        if written == 0:
+            self.storage.delete(part_key)
+            raise ValidationError('Empty chunk')
+
+        session.committed_offset = offset + written
+        session.parts += 1
+        self._save(session)
+        return session
+
+    def complete(self, agency_id: str, client_id: str, upload_id: str) -> Tuple[DocumentRecord, bool]:
+        """Assemble the parts into a stored document; idempotent once completed"""
+        session = self._load(agency_id, client_id, upload_id)
+        if session.status == 'completed':
+            return self.document_store.get_record(agency_id, session.document_id), session.deduplicated
+        if session.status != 'open':
+            raise ConflictError(f'Upload {upload_id} is {session.status}')
+        if session.committed_offset != session.file_size:
+            raise ConflictError(
+                f'Upload {upload_id} has {session.remaining_bytes} bytes outstanding'
+            )
+
+        parts = self._part_keys(upload_id)
+        record, deduplicated = self.document_store.put(
+            agency_id, _ConcatenatedReader(self.storage, parts), session.file_name,
+            mime_type=session.mime_type, document_type=session.document_type,
+            client_id=session.client_id, case_id=session.case_id, uploaded_by=session.uploaded_by,
+        )
+        self._discard_parts(session)
+        session.status = 'completed'
+        session.document_id = record.id
+        session.deduplicated = deduplicated
+        self._save(session)
+        logger.info(f"Completed upload {upload_id} as document {record.id}")
+        return record, deduplicated
+
+    def abort(self, agency_id: str, client_id: str, upload_id: str) -> None:
+        session = self._load(agency_id, client_id, upload_id)
+        if session.status == 'completed':
+            raise ConflictError(f'Upload {upload_id} is already completed')
+        self._discard_parts(session)
+        session.status = 'aborted'
+        self._save(session)
@@ -0,0 +1,385 @@
+"""
+Duplicate client detection
+
+Leads arrive from several CRMs and web forms, so one person can end up as
+several clients with slightly different names, emails and passport
+numbers. Comparing every client with every other is quadratic: 500k clients
+make 125 billion pairs. :class:`DuplicateIndex` only compares candidates:
+
+* **Blocking keys.** Clients sharing a key are compared. The keys are the
+  normalized email, the phonetic codes of both names plus the date of
+  birth, the passport number's blind index and the phone number's last
+  digits. A block larger than
+  ``max_block`` (a shared family email, say) is compared by window, like
+  the sorted neighbourhood below, rather than pair by pair.
+* **Sorted neighbourhood.** Clients are sorted by name (surname first,
+  then given name first) and each is compared with the ``window`` clients
+  either side. This catches typos that change a phonetic code, and
+  records missing the fields the blocks use.
+
+A candidate pair is scored field by field. Pairs with conflicting dates
+of birth and no shared identifier are dismissed before the names are
+compared. :meth:`DuplicateIndex.add` checks one new client against the
+index in O(block + window · log n), which keeps imports incremental.
+:func:`index_keys` gives the same keys as rows, so the index can be kept
+in the database and only a new client's candidates read back.
+"""
+
+import unicodedata
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+DEFAULT_WINDOW = 8
+DEFAULT_MAX_BLOCK = 50
+DEFAULT_THRESHOLD = 0.6
+# Mail providers that ignore dots in the local part
+DOTLESS_DOMAINS = ('gmail.com', 'googlemail.com')
+PHONE_DIGITS = 9
+
+WEIGHTS = {
+    'passport': 0.5,
+    'email': 0.4,
+    'phone': 0.2,
+    'date_of_birth': 0.2,
+    'name': 0.4,
+}
+# A date of birth both sides disagree on counts against the pair
+DOB_MISMATCH = -0.3
+# Name similarity (Jaro-Winkler) below the floor adds nothing; from the ceiling up it adds the full weight
+NAME_FLOOR = 0.85
+NAME_CEILING = 0.92
+
+_SOUNDEX = {letter: str(code) for code, letters in enumerate(
+    ('AEIOUYHW', 'BFPV', 'CGJKQSXZ', 'DT', 'L', 'MN', 'R')) for letter in letters}
+
+
+# -- normalization ----------------------------------------------------------
+
+def fold(value: Optional[str]) -> str:
+    """Upper case letters and digits only, accents removed"""
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', value)
+    return ''.join(ch for ch in decomposed if ch.isalnum()).upper()
+
+
+def normalize_email(email: Optional[str]) -> str:
+    """Lower case without ``+tags``; dots dropped for providers that ignore them"""
+    if not email or '@' not in email:
+        return ''
+    local, _, domain = email.strip().lower().rpartition('@')
+    local = local.split('+', 1)[0]
+    if domain in DOTLESS_DOMAINS:
+        local, domain = local.replace('.', ''), 'gmail.com'
+    return f'{local}@{domain}' if local else ''
+
+
+def normalize_phone(phone: Optional[str]) -> str:
+    """The last digits of a phone number, which survive country-code and trunk-prefix differences"""
+    digits = ''.join(ch for ch in phone or '' if ch.isdigit())
+    return digits[-PHONE_DIGITS:] if len(digits) >= 7 else ''
+
+
+def soundex(name: Optional[str]) -> str:
+    """American Soundex of the first word of ``name``; '' without letters"""
+    letters = ''.join(ch for ch in fold(name) if ch.isalpha())
+    if not letters:
+        return ''
+    code, previous = letters[0], _SOUNDEX.get(letters[0], '')
+    for ch in letters[1:]:
+        digit = _SOUNDEX.get(ch, '')
+        if digit not in ('0', previous):
+            code += digit
+        if ch not in 'HW':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def jaro_winkler(a: str, b: str) -> float:
+    if a == b:
+        return 1.0 if a else 0.0
+    if not a or not b:
+        return 0.0
+    reach = max(len(a), len(b)) // 2 - 1
+    taken = [False] * len(b)
+    matched_a = []
+    for i, ch in enumerate(a):
+        for j in range(max(0, i - reach), min(len(b), i + reach + 1)):
+            if not taken[j] and b[j] == ch:
+                taken[j] = True
+                matched_a.append(ch)
+                break
+    if not matched_a:
+        return 0.0
+    matched_b = [b[j] for j, hit in enumerate(taken) if hit]
+    transpositions = sum(x != y for x, y in zip(matched_a, matched_b)) / 2
+    m = len(matched_a)
+    jaro = (m / len(a) + m / len(b) + (m - transpositions) / m) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * 0.1 * (1 - jaro)
+
+
+def _dob(value) -> str:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()[:10]
+    return str(value).strip()[:10] if value else ''
+
+
+# -- records ----------------------------------------------------------------
+
+@dataclass
+class ClientIdentity:
+    """The fields duplicate detection reads from one client
+
+    ``passport_hash`` is the passport number's blind index
+    (``clients.passport_number_bidx``), never the number itself.
+    """
+    id: str
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    date_of_birth: Optional[str] = None
+    passport_hash: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+
+@dataclass
+class _Prepared:
+    """Normalized fields, computed once per client"""
+    identity: ClientIdentity
+    first: str
+    last: str
+    email: str
+    phone: str
+    dob: str
+    seq: int
+
+    @property
+    def full_name(self) -> str:
+        return f'{self.last} {self.first}'.strip()
+
+
+@dataclass
+class DuplicateMatch:
+    """A likely duplicate pair; ``client_id`` is the one indexed first"""
+    client_id: str
+    duplicate_id: str
+    score: float
+    reasons: List[str] = field(default_factory=list)
+
+
+def _prepare(identity: ClientIdentity, seq: int) -> _Prepared:
+    return _Prepared(identity, fold(identity.first_name), fold(identity.last_name),
+                     normalize_email(identity.email), normalize_phone(identity.phone),
+                     _dob(identity.date_of_birth), seq)
+
+
+def blocking_keys(record: _Prepared) -> List[str]:
+    keys = []
+    if record.email:
+        keys.append(f'e:{record.email}')
+    if record.identity.passport_hash:
+        keys.append(f'p:{record.identity.passport_hash}')
+    if record.phone:
+        keys.append(f't:{record.phone}')
+    codes = sorted(code for code in (soundex(record.first), soundex(record.last)) if code)
+    if codes and record.dob:
+        # Sorted codes, so swapped given and family names share the key
+        keys.append(f"n:{'.'.join(codes)}:{record.dob}")
+    return keys
+
+
+def sort_keys(record: _Prepared) -> List[Tuple[str, str]]:
+    """One key per sorted-neighbourhood pass: surname first, then given name first"""
+    if not record.first and not record.last:
+        return []
+    return [('last', f'{record.last} {record.first} {record.dob}'),
+            ('first', f'{record.first} {record.last} {record.dob}')]
+
+
+def index_keys(identity: ClientIdentity) -> List[Tuple[str, str]]:
+    """``(kind, key)`` rows for storing the index: ``block`` keys, then one per sort pass"""
+    record = _prepare(identity, 0)
+    return [('block', key) for key in blocking_keys(record)] + sort_keys(record)
+
+
+def compare(a: _Prepared, b: _Prepared) -> Tuple[float, List[str]]:
+    """Score one pair between 0 and 1, with the fields that agreed"""
+    reasons = []
+    score = 0.0
+    if a.identity.passport_hash and a.identity.passport_hash == b.identity.passport_hash:
+        score += WEIGHTS['passport']
+        reasons.append('passport')
+    if a.email and a.email == b.email:
+        score += WEIGHTS['email']
+        reasons.append('email')
+    if a.phone and a.phone == b.phone:
+        score += WEIGHTS['phone']
+        reasons.append('phone')
+    if a.dob and b.dob:
+        if a.dob == b.dob:
+            score += WEIGHTS['date_of_birth']
+            reasons.append('date_of_birth')
+        elif not reasons:
+            # Different people who sort next to each other: skip the name comparison
+            return 0.0, []
+        else:
+            score += DOB_MISMATCH
+    if a.full_name and b.full_name:
+        similarity = max(jaro_winkler(a.full_name, b.full_name),
+                         jaro_winkler(a.full_name, f'{b.first} {b.last}'.strip()))
+        if similarity >= NAME_FLOOR:
+            score += WEIGHTS['name'] * min(1.0, (similarity - NAME_FLOOR) / (NAME_CEILING - NAME_FLOOR))
+            reasons.append('name')
+    return max(0.0, min(1.0, score)), reasons
+
+
+# -- index ------------------------------------------------------------------
+
+class DuplicateIndex:
+    """Blocking and sorted-neighbourhood indexes over one agency's clients"""
+
+    def __init__(self, window: int = DEFAULT_WINDOW, max_block: int = DEFAULT_MAX_BLOCK,
+                 threshold: float = DEFAULT_THRESHOLD):
+        self.window = window
+        self.max_block = max_block
+        self.threshold = threshold
+        self.records: Dict[str, _Prepared] = {}
+        self.comparisons = 0
+        self._blocks: Dict[str, List[str]] = {}
+        self._sorted: Dict[str, List[Tuple[str, str]]] = {'last': [], 'first': []}
+        self._sorted_clean = True
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __contains__(self, client_id: str) -> bool:
+        return client_id in self.records
+
+    def _insert(self, identity: ClientIdentity, in_place: bool = False) -> _Prepared:
+        record = _prepare(identity, len(self.records))
+        self.records[identity.id] = record
+        for key in blocking_keys(record):
+            self._blocks.setdefault(key, []).append(identity.id)
+        # One insert goes in place; a bulk load appends and sorts once when next read
+        in_place = in_place and self._sorted_clean
+        for name, key in sort_keys(record):
+            if in_place:
+                insort(self._sorted[name], (key, identity.id))
+            else:
+                self._sorted[name].append((key, identity.id))
+        self._sorted_clean = in_place
+        return record
+
+    def extend(self, identities: Iterable[ClientIdentity]) -> None:
+        """Index clients without comparing them, e.g. before a full :meth:`find_duplicates`"""
+        for identity in identities:
+            if identity.id not in self.records:
+                self._insert(identity)
+
+    def _sort(self) -> None:
+        if not self._sorted_clean:
+            for entries in self._sorted.values():
+                entries.sort()
+            self._sorted_clean = True
+
+    # -- batch ------------------------------------------------------------
+
+    def candidate_pairs(self) -> Set[Tuple[str, str]]:
+        """Every pair sharing a block or a sorted-neighbourhood window, each once"""
+        self._sort()
+        pairs: Set[Tuple[str, str]] = set()
+
+        def add(a: str, b: str) -> None:
+            if a != b:
+                pairs.add((a, b) if self.records[a].seq < self.records[b].seq else (b, a))
+
+        for members in self._blocks.values():
+            if len(members) <= 1:
+                continue
+            if len(members) <= self.max_block:
+                for a, b in combinations(members, 2):
+                    add(a, b)
+            else:
+                ordered = sorted(members, key=lambda client_id: self.records[client_id].full_name)
+                for i, a in enumerate(ordered):
+                    for b in ordered[i + 1:i + 1 + self.window]:
+                        add(a, b)
+        for entries in self._sorted.values():
+            for i, (_, a) in enumerate(entries):
+                for _, b in entries[i + 1:i + 1 + self.window]:
+                    add(a, b)
+        return pairs
+
+    def find_duplicates(self) -> List[DuplicateMatch]:
+        """Score every candidate pair; the matches at or above ``threshold``, best first"""
+        matches = []
+        for a, b in self.candidate_pairs():
+            match = self._score(a, b)
+            if match is not None:
+                matches.append(match)
+        matches.sort(key=lambda match: (-match.score, match.client_id, match.duplicate_id))
+        return matches
+
+    def _score(self, a: str, b: str) -> Optional[DuplicateMatch]:
+        self.comparisons += 1
+        score, reasons = compare(self.records[a], self.records[b])
+        return DuplicateMatch(a, b, round(score, 4), reasons) if score >= self.threshold else None
+
+    # -- incremental ------------------------------------------------------
+
+    def candidates(self, identity: ClientIdentity) -> List[str]:
+        """Indexed clients worth comparing with ``identity``"""
+        self._sort()
+        record = _prepare(identity, len(self.records))
+        found: Dict[str, None] = {}
+        for key in blocking_keys(record):
+            # An oversized block contributes its most recent members only
+            for client_id in self._blocks.get(key, ())[-self.max_block:]:
+                found[client_id] = None
+        for name, key in sort_keys(record):
+            entries = self._sorted[name]
+            at = bisect_left(entries, (key, ''))
+            for _, client_id in entries[max(0, at - self.window):at + self.window]:
+                found[client_id] = None
+        found.pop(identity.id, None)
+        return list(found)
+
+    def add(self, identity: ClientIdentity) -> List[DuplicateMatch]:
+        """Index one new client; its matches among the clients indexed before it"""
+        if identity.id in self.records:
+            return []
+        candidates = self.candidates(identity)
+        self._insert(identity, in_place=True)
+        matches = [match for match in (self._score(client_id, identity.id) for client_id in candidates) if match]
+        matches.sort(key=lambda match: -match.score)
+        return matches
+
+
+def cluster(matches: Iterable[DuplicateMatch]) -> List[List[str]]:
+    """Group matched pairs into sets of clients that are the same person (union-find)"""
+    parent: Dict[str, str] = {}
+
+    def root(client_id: str) -> str:
+        parent.setdefault(client_id, client_id)
+        while parent[client_id] != client_id:
+            parent[client_id] = parent[parent[client_id]]
+            client_id = parent[client_id]
+        return client_id
+
+    for match in matches:
+        a, b = root(match.client_id), root(match.duplicate_id)
+        if a != b:
+            parent[b] = a
+    groups: Dict[str, List[str]] = {}
+    for client_id in parent:
+        groups.setdefault(root(client_id), []).append(client_id)
+    return sorted((sorted(group) for group in groups.values() if len(group) > 1), key=lambda group: group[0])
@@ -1 +1,28 @@
+"""
+CRM integrations
+"""
 
+from typing import Any, Mapping, Optional
+
+from immigration_ai.core.exceptions import ValidationError
+
+PROVIDERS = ('hubspot', 'salesforce')
+
+
+def create_adapter(provider: str, config: Mapping[str, Any], token: Optional[str],
+                   instance_url: Optional[str] = None):
+    """The sync adapter for ``provider``
+
+    ``token`` and ``instance_url`` come from ``crm_credentials``, which only
+    the service role reads. ``config`` is editable by agency admins and
+    never supplies a secret or a host.
+    """
+    if provider == 'hubspot':
+        from immigration_ai.crm.integrations.hubspot import HubSpotAdapter
+
+        return HubSpotAdapter.from_config(config, token, instance_url)
+    if provider == 'salesforce':
+        from immigration_ai.crm.integrations.salesforce import SalesforceAdapter
+
+        return SalesforceAdapter.from_config(config, token, instance_url)
+    raise ValidationError(f"Unknown CRM provider '{provider}'")
@@ -0,0 +1,124 @@
+"""
+JSON over HTTP for CRM integrations
+
+CRM syncs make a few large requests (bulk reads of hundreds of records,
+batch writes), not many small ones, so a stdlib ``http.client`` connection
+is enough. The connection is kept alive between requests, and calls run in
+a worker thread so they do not block the event loop. Throttling (429) and
+gateway errors are retried with backoff, honouring ``Retry-After``.
+"""
+
+import asyncio
+import http.client
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+from urllib.parse import urlencode, urlsplit
+
+from immigration_ai.core.exceptions import IntegrationError
+from immigration_ai.utils.rate_limit import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 502, 503, 504)
+# A whole run fails on these; anything else fails only the records in the request
+AUTH_STATUSES = (401, 403)
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_RETRY_BASE = 1.0
+DEFAULT_RETRY_CAP = 30.0
+
+
+class JSONClient:
+    """One keep-alive connection to ``base_url``; requests are serialized"""
+
+    def __init__(self, base_url: str, headers: Optional[Mapping[str, str]] = None,
+                 timeout: float = DEFAULT_TIMEOUT, max_retries: int = DEFAULT_MAX_RETRIES,
+                 retry_base: float = DEFAULT_RETRY_BASE, retry_cap: float = DEFAULT_RETRY_CAP):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f'Unsupported base URL: {base_url}')
+        self.base_url = base_url
+        self._https = parts.scheme == 'https'
+        self._host = parts.hostname
+        self._port = parts.port
+        self._prefix = parts.path.rstrip('/')
+        self.headers = {'Accept': 'application/json', **(headers or {})}
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.requests = 0
+        self._connection: Optional[http.client.HTTPConnection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._connection is None:
+            factory = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            self._connection = factory(self._host, self._port, timeout=self.timeout)
+        return self._connection
+
+    def _drop(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def request_sync(self, method: str, path: str, params: Optional[Mapping[str, Any]] = None,
+                     body: Any = None, headers: Optional[Mapping[str, str]] = None) -> Any:
+        """Send one request and return the decoded JSON body (None when empty)
+
+        ``path`` may be absolute on the same host (pagination links) or
+        relative to ``base_url``'s path.
+        """
+        target = path if path.startswith(self._prefix + '/') else self._prefix + path
+        if params:
+            target += '?' + urlencode(params)
+        payload = json.dumps(body).encode() if body is not None else None
+        request_headers = {**self.headers, **(headers or {})}
+        if payload is not None:
+            request_headers['Content-Type'] = 'application/json'
+
+        attempt = 0
+        with self._lock:
+            while True:
+                attempt += 1
+                try:
+                    connection = self._connect()
+                    connection.request(method, target, body=payload, headers=request_headers)
+                    response = connection.getresponse()
+                    raw = response.read()
+                    self.requests += 1
+                except (http.client.HTTPException, OSError) as e:
+                    self._drop()
+                    if attempt > self.max_retries:
+                        raise IntegrationError(f'{method} {target} failed: {str(e)}') from e
+                    time.sleep(backoff_delay(attempt, self.retry_base, self.retry_cap))
+                    continue
+                if response.getheader('Connection', '').lower() == 'close':
+                    self._drop()
+                if response.status in RETRY_STATUSES and attempt <= self.max_retries:
+                    retry_after = response.getheader('Retry-After')
+                    delay = float(retry_after) if retry_after and retry_after.isdigit() else \
+                        backoff_delay(attempt, self.retry_base, self.retry_cap)
+                    logger.warning(f'{method} {target} returned {response.status}; retrying in {delay:.1f}s')
+                    time.sleep(delay)
+                    continue
+                try:
+                    data = json.loads(raw) if raw else None
+                except ValueError:
+                    data = None
+                if response.status >= 400:
+                    detail = raw[:300].decode('utf-8', 'replace')
+                    raise IntegrationError(f'{method} {target} returned {response.status}: {detail}',
+                                           status=response.status)
+                return data
+
+    async def request(self, method: str, path: str, params: Optional[Mapping[str, Any]] = None,
+                      body: Any = None, headers: Optional[Dict[str, str]] = None) -> Any:
+        return await asyncio.to_thread(self.request_sync, method, path, params, body, headers)
+
+    def close(self) -> None:
+        with self._lock:
+            self._drop()
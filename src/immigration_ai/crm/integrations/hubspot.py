@@ -1 +1,184 @@
+"""
+HubSpot adapter for CRM sync
 
+Clients map to contacts and cases map to deals. Reads use the CRM search
+API, filtered to records carrying ``immigration_ai_id`` and modified since
+the watermark, sorted by modification time. A search pages at most
+10,000 results, so longer runs restart the search from the last
+timestamp seen. Writes use the batch create and update endpoints, 100
+records per call. Custom properties (``immigration_ai_*``) must exist in
+the portal. The API host is fixed; only the token comes from the
+integration's credentials.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from immigration_ai.core.exceptions import IntegrationError
+from immigration_ai.crm.integrations.http import AUTH_STATUSES, JSONClient
+from immigration_ai.crm.sync import OutboundRecord, RemoteRecord, UpsertResult, normalize, parse_timestamp
+
+DEFAULT_BASE_URL = 'https://api.hubapi.com'
+ID_PROPERTY = 'immigration_ai_id'
+SEARCH_LIMIT = 100
+SEARCH_WINDOW = 10_000
+BATCH_SIZE = 100
+DEAL_TO_CONTACT = 3
+
+OBJECTS = {'client': 'contacts', 'case': 'deals'}
+MODIFIED_PROPERTY = {'client': 'lastmodifieddate', 'case': 'hs_lastmodifieddate'}
+PROPERTIES = {
+    'client': {
+        'first_name': 'firstname',
+        'last_name': 'lastname',
+        'email': 'email',
+        'phone': 'phone',
+        'date_of_birth': 'date_of_birth',
+        'country_of_birth': 'immigration_ai_country_of_birth',
+        'nationality': 'immigration_ai_nationality',
+        'immigration_status': 'immigration_ai_immigration_status',
+    },
+    'case': {
+        'case_number': 'immigration_ai_case_number',
+        'title': 'dealname',
+        'status': 'immigration_ai_status',
+        'case_type': 'immigration_ai_case_type',
+        'priority': 'immigration_ai_priority',
+        'due_date': 'closedate',
+    },
+}
+DATE_FIELDS = ('date_of_birth', 'due_date')
+# Pipeline stage for each case status in the default sales pipeline
+DEFAULT_DEAL_STAGES = {
+    'new': 'appointmentscheduled',
+    'in_progress': 'qualifiedtobuy',
+    'under_review': 'decisionmakerboughtin',
+    'approved': 'closedwon',
+    'completed': 'closedwon',
+    'rejected': 'closedlost',
+}
+
+
+def _epoch_ms(moment: datetime) -> str:
+    return str(int(moment.timestamp() * 1000))
+
+
+class HubSpotAdapter:
+    """Reads and writes contacts and deals through one private-app token"""
+
+    provider = 'hubspot'
+    read_page_size = SEARCH_LIMIT
+    write_batch_size = BATCH_SIZE
+
+    def __init__(self, token: str, base_url: str = DEFAULT_BASE_URL, deal_stages: Optional[Mapping[str, str]] = None,
+                 client: Optional[JSONClient] = None):
+        self.client = client or JSONClient(base_url, headers={'Authorization': f'Bearer {token}'})
+        self.deal_stages = dict(deal_stages or DEFAULT_DEAL_STAGES)
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any], token: Optional[str],
+                    instance_url: Optional[str] = None) -> 'HubSpotAdapter':
+        """An adapter for a stored integration; ``config`` is tenant-editable and only sets deal stages"""
+        if not token:
+            raise IntegrationError('HubSpot access token is not configured')
+        return cls(token, DEFAULT_BASE_URL, config.get('deal_stages'))
+
+    @property
+    def requests(self) -> int:
+        return self.client.requests
+
+    async def fetch_changes(self, entity_type: str, since: Optional[datetime],
+                            token: Optional[Dict[str, Any]]) -> Tuple[List[RemoteRecord], Optional[Dict[str, Any]]]:
+        modified = MODIFIED_PROPERTY[entity_type]
+        # The token carries the window's lower bound so a restart keeps its place
+        token = token or {'since': _epoch_ms(since) if since else None, 'after': None}
+        filters = [{'propertyName': ID_PROPERTY, 'operator': 'HAS_PROPERTY'}]
+        if token['since']:
+            filters.append({'propertyName': modified, 'operator': 'GTE', 'value': token['since']})
+        body = {
+            'filterGroups': [{'filters': filters}],
+            'sorts': [{'propertyName': modified, 'direction': 'ASCENDING'}],
+            'properties': [*PROPERTIES[entity_type].values(), ID_PROPERTY, modified],
+            'limit': SEARCH_LIMIT,
+        }
+        if token['after']:
+            body['after'] = token['after']
+        data = await self.client.request('POST', f'/crm/v3/objects/{OBJECTS[entity_type]}/search', body=body)
+        records = [self._remote(entity_type, item) for item in data.get('results', [])]
+
+        after = ((data.get('paging') or {}).get('next') or {}).get('after')
+        if not after:
+            return records, None
+        if int(after) + SEARCH_LIMIT > SEARCH_WINDOW:
+            # Start a new search at the last timestamp; the overlap merges to nothing
+            last = records[-1].modified_at if records else None
+            since = _epoch_ms(last) if last else None
+            if since is None or since == token['since']:
+                raise IntegrationError(f'More than {SEARCH_WINDOW} {OBJECTS[entity_type]} share one '
+                                       f'modification time; the search cannot page past them')
+            return records, {'since': since, 'after': None}
+        return records, {'since': token['since'], 'after': after}
+
+    def _remote(self, entity_type: str, item: Mapping[str, Any]) -> RemoteRecord:
+        properties = item.get('properties') or {}
+        fields = {}
+        for name, prop in PROPERTIES[entity_type].items():
+            value = normalize(properties.get(prop))
+            fields[name] = value[:10] if value and name in DATE_FIELDS else value
+        modified = properties.get(MODIFIED_PROPERTY[entity_type]) or item.get('updatedAt')
+        return RemoteRecord(str(item['id']), fields, parse_timestamp(modified), properties.get(ID_PROPERTY))
+
+    def _properties(self, entity_type: str, record: OutboundRecord) -> Dict[str, Any]:
+        mapping = PROPERTIES[entity_type]
+        properties = {mapping[name]: '' if value is None else value
+                      for name, value in record.fields.items() if name in mapping}
+        if entity_type == 'case' and 'status' in record.fields and record.fields['status'] in self.deal_stages:
+            properties['dealstage'] = self.deal_stages[record.fields['status']]
+        if record.remote_id is None:
+            properties[ID_PROPERTY] = record.local_id
+        return properties
+
+    async def upsert(self, entity_type: str, records: Sequence[OutboundRecord]) -> List[UpsertResult]:
+        results = {}
+        creates = [record for record in records if record.remote_id is None]
+        updates = [record for record in records if record.remote_id is not None]
+        path = f'/crm/v3/objects/{OBJECTS[entity_type]}/batch'
+        if creates:
+            inputs = []
+            for record in creates:
+                item = {'properties': self._properties(entity_type, record)}
+                contact = record.related.get('client')
+                if entity_type == 'case' and contact:
+                    item['associations'] = [{'to': {'id': contact}, 'types': [
+                        {'associationCategory': 'HUBSPOT_DEFINED', 'associationTypeId': DEAL_TO_CONTACT}]}]
+                inputs.append(item)
+            # Batch results are not ordered; created records are matched by their platform id
+            results.update(await self._batch(f'{path}/create', inputs, creates,
+                                             lambda item: (item.get('properties') or {}).get(ID_PROPERTY)))
+        if updates:
+            by_remote = {record.remote_id: record.local_id for record in updates}
+            inputs = [{'id': record.remote_id, 'properties': self._properties(entity_type, record)}
+                      for record in updates]
+            results.update(await self._batch(f'{path}/update', inputs, updates,
+                                             lambda item: by_remote.get(str(item.get('id')))))
+        return [results.get(record.local_id) or UpsertResult(record.local_id, error='missing from batch response')
+                for record in records]
+
+    async def _batch(self, path: str, inputs: List[dict], records: Sequence[OutboundRecord],
+                     local_id_of) -> Dict[str, UpsertResult]:
+        try:
+            data = await self.client.request('POST', path, body={'inputs': inputs})
+        except IntegrationError as e:
+            if e.status in AUTH_STATUSES:
+                raise
+            return {record.local_id: UpsertResult(record.local_id, error=str(e)) for record in records}
+        results = {}
+        for item in data.get('results', []):
+            local_id = local_id_of(item)
+            if local_id:
+                results[local_id] = UpsertResult(local_id, str(item['id']), parse_timestamp(item.get('updatedAt')))
+        # A 207 lists per-record errors; they stay unmatched and are reported as failures
+        return results
+
+    async def close(self) -> None:
+        self.client.close()
@@ -1 +1,149 @@
+"""
+Salesforce adapter for CRM sync
 
+Clients map to contacts and cases map to opportunities, both keyed by the
+``Immigration_AI_Id__c`` external id field. Reads run one SOQL query over
+records modified since the watermark, ordered by ``SystemModstamp``, and
+follow ``nextRecordsUrl`` for the remaining batches. Writes use the
+sObject Collections upsert, 200 records per call with ``allOrNone`` off.
+Its results come back in request order. The custom fields (``__c``) must
+exist in the org. The instance URL must be https on ``*.my.salesforce.com``,
+so stored credentials cannot point the token at another host.
+"""
+
+import re
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from immigration_ai.core.exceptions import IntegrationError
+from immigration_ai.crm.integrations.http import AUTH_STATUSES, JSONClient
+from immigration_ai.crm.sync import OutboundRecord, RemoteRecord, UpsertResult, normalize, parse_timestamp
+
+API_VERSION = 'v59.0'
+INSTANCE_URL_PATTERN = re.compile(r'^https://[a-z0-9-]+(\.sandbox)?\.my\.salesforce\.com$')
+EXTERNAL_ID = 'Immigration_AI_Id__c'
+QUERY_BATCH_SIZE = 2000
+BATCH_SIZE = 200
+
+OBJECTS = {'client': 'Contact', 'case': 'Opportunity'}
+FIELDS = {
+    'client': {
+        'first_name': 'FirstName',
+        'last_name': 'LastName',
+        'email': 'Email',
+        'phone': 'Phone',
+        'date_of_birth': 'Birthdate',
+        'country_of_birth': 'Country_of_Birth__c',
+        'nationality': 'Nationality__c',
+        'immigration_status': 'Immigration_Status__c',
+    },
+    'case': {
+        'case_number': 'Case_Number__c',
+        'title': 'Name',
+        'status': 'Case_Status__c',
+        'case_type': 'Case_Type__c',
+        'priority': 'Priority__c',
+        'due_date': 'Due_Date__c',
+    },
+}
+NUMBER_FIELDS = ('priority',)
+DEFAULT_STAGES = {
+    'new': 'Prospecting',
+    'in_progress': 'Qualification',
+    'under_review': 'Negotiation/Review',
+    'approved': 'Closed Won',
+    'completed': 'Closed Won',
+    'rejected': 'Closed Lost',
+}
+
+
+def _soql_datetime(moment: datetime) -> str:
+    # SOQL literals take whole seconds; rounding down keeps the bound inclusive
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class SalesforceAdapter:
+    """Reads and writes contacts and opportunities through the REST API"""
+
+    provider = 'salesforce'
+    read_page_size = QUERY_BATCH_SIZE
+    write_batch_size = BATCH_SIZE
+
+    def __init__(self, instance_url: str, token: str, stages: Optional[Mapping[str, str]] = None,
+                 client: Optional[JSONClient] = None):
+        self.client = client or JSONClient(instance_url, headers={
+            'Authorization': f'Bearer {token}', 'Sforce-Query-Options': f'batchSize={QUERY_BATCH_SIZE}'})
+        self.stages = dict(stages or DEFAULT_STAGES)
+        self.api = f'/services/data/{API_VERSION}'
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any], token: Optional[str],
+                    instance_url: Optional[str] = None) -> 'SalesforceAdapter':
+        """An adapter for a stored integration; ``config`` is tenant-editable and only sets stages"""
+        if not token or not instance_url:
+            raise IntegrationError('Salesforce instance URL and access token are not configured')
+        if not INSTANCE_URL_PATTERN.match(instance_url.lower()):
+            raise IntegrationError(f'Salesforce instance URL {instance_url} is not an https my.salesforce.com domain')
+        return cls(instance_url.lower(), token, config.get('stages'))
+
+    @property
+    def requests(self) -> int:
+        return self.client.requests
+
+    async def fetch_changes(self, entity_type: str, since: Optional[datetime],
+                            token: Optional[str]) -> Tuple[List[RemoteRecord], Optional[str]]:
+        if token:
+            data = await self.client.request('GET', token)
+        else:
+            columns = ', '.join(['Id', EXTERNAL_ID, 'SystemModstamp', *FIELDS[entity_type].values()])
+            where = f'{EXTERNAL_ID} != null'
+            if since:
+                where += f' AND SystemModstamp >= {_soql_datetime(since)}'
+            query = f'SELECT {columns} FROM {OBJECTS[entity_type]} WHERE {where} ORDER BY SystemModstamp, Id'
+            data = await self.client.request('GET', f'{self.api}/query', params={'q': query})
+        records = [self._remote(entity_type, row) for row in data.get('records', [])]
+        return records, None if data.get('done', True) else data.get('nextRecordsUrl')
+
+    def _remote(self, entity_type: str, row: Mapping[str, Any]) -> RemoteRecord:
+        fields = {name: normalize(row.get(column)) for name, column in FIELDS[entity_type].items()}
+        return RemoteRecord(row['Id'], fields, parse_timestamp(row.get('SystemModstamp')), row.get(EXTERNAL_ID))
+
+    def _sobject(self, entity_type: str, record: OutboundRecord) -> Dict[str, Any]:
+        mapping = FIELDS[entity_type]
+        sobject = {'attributes': {'type': OBJECTS[entity_type]}, EXTERNAL_ID: record.local_id}
+        for name, value in record.fields.items():
+            if name in mapping:
+                sobject[mapping[name]] = int(value) if value is not None and name in NUMBER_FIELDS else value
+        if entity_type == 'case':
+            status = record.fields.get('status')
+            if status in self.stages:
+                sobject['StageName'] = self.stages[status]
+            if record.remote_id is None:
+                # Opportunities need a close date; after creation it belongs to the sales team
+                sobject['CloseDate'] = record.fields.get('due_date') or date.today().isoformat()
+                if record.related.get('client'):
+                    sobject['ContactId'] = record.related['client']
+        return sobject
+
+    async def upsert(self, entity_type: str, records: Sequence[OutboundRecord]) -> List[UpsertResult]:
+        path = f'{self.api}/composite/sobjects/{OBJECTS[entity_type]}/{EXTERNAL_ID}'
+        body = {'allOrNone': False, 'records': [self._sobject(entity_type, record) for record in records]}
+        try:
+            data = await self.client.request('PATCH', path, body=body)
+        except IntegrationError as e:
+            if e.status in AUTH_STATUSES:
+                raise
+            return [UpsertResult(record.local_id, error=str(e)) for record in records]
+        results = []
+        for record, item in zip(records, data or []):
+            if item.get('success'):
+                results.append(UpsertResult(record.local_id, item['id']))
+            else:
+                errors = '; '.join(error.get('message', '') for error in item.get('errors') or [])
+                results.append(UpsertResult(record.local_id, error=errors or 'rejected'))
+        results.extend(UpsertResult(record.local_id, error='missing from response')
+                       for record in records[len(results):])
+        return results
+
+    async def close(self) -> None:
+        self.client.close()
@@ -1 +1,588 @@
+"""
+CRM services: the agency's client book, staff tasks and duplicate clients
+"""
 
+import logging
+import threading
+import time
+import uuid
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from immigration_ai.core.exceptions import ResourceNotFoundError, ValidationError
+from immigration_ai.crm.dedupe import (
+    DEFAULT_MAX_BLOCK,
+    DEFAULT_THRESHOLD,
+    DEFAULT_WINDOW,
+    ClientIdentity,
+    DuplicateIndex,
+    DuplicateMatch,
+    index_keys,
+)
+from immigration_ai.crm.tasks import OPEN_STATUSES, PRIORITIES, AssignmentEngine, Move, StaffMember, Task
+from immigration_ai.security.encryption import ENCRYPTED_CLIENT_FIELDS, FieldEncryptor, is_encrypted
+from immigration_ai.utils.cache import TwoTierCache, agency_tag, client_tag, get_cache
+from immigration_ai.utils.database import get_supabase_client
+from immigration_ai.utils.dataloader import RequestLoaders
+from immigration_ai.utils.pagination import (
+    Page,
+    apply_keyset,
+    build_page,
+    clamp_page_size,
+    iter_all,
+    select_clause,
+    select_fields,
+)
+
+logger = logging.getLogger(__name__)
+
+CLIENT_COLUMNS = ('id, user_id, agency_id, date_of_birth, country_of_birth, nationality, '
+                  'passport_number, address, emergency_contact, immigration_status, created_at, updated_at')
+# ``passport_number`` is deliberately not listable
+CLIENT_LIST_FIELDS = ('id', 'user_id', 'date_of_birth', 'country_of_birth', 'nationality',
+                      'immigration_status', 'created_at', 'updated_at')
+DEFAULT_CLIENT_LIST_FIELDS = ('id', 'user_id', 'nationality', 'immigration_status', 'updated_at')
+UPDATABLE_FIELDS = ('date_of_birth', 'country_of_birth', 'nationality', 'passport_number', 'address',
+                    'emergency_contact', 'immigration_status')
+
+CLIENT_TTL_SECONDS = 300
+
+TASK_COLUMNS = ('id, agency_id, title, category, case_id, client_id, skill, priority, effort, status, '
+                'assigned_to, due_date, created_at')
+TASK_FIELDS = ('title', 'description', 'category', 'case_id', 'client_id', 'skill', 'priority', 'effort',
+               'due_date', 'assigned_to')
+STAFF_ROLES = ('agency_admin', 'agency_staff')
+# Other processes' task writes show up in this process's index within this long
+TASK_INDEX_TTL_SECONDS = 60
+
+# What duplicate detection compares. The blind index is only trusted next to
+# a sealed passport number: a plaintext value has no blind index of its own.
+_IDENTITY_SELECT = """
+SELECT c.id, u.first_name, u.last_name, au.email, u.phone, c.date_of_birth,
+       CASE WHEN c.passport_number LIKE 'enc:%' THEN c.passport_number_bidx END AS passport_number_bidx,
+       c.created_at
+FROM public.clients c
+LEFT JOIN public.users u ON u.id = c.user_id
+LEFT JOIN auth.users au ON au.id = c.user_id
+"""
+# Clients in (created_at, id) order past a watermark
+LOAD_IDENTITIES_SQL = _IDENTITY_SELECT + """WHERE c.agency_id = $1 AND (c.created_at, c.id) > ($2, $3::uuid)
+ORDER BY c.created_at, c.id
+LIMIT $4
+"""
+LOAD_IDENTITIES_BY_ID_SQL = _IDENTITY_SELECT + """WHERE c.agency_id = $1 AND c.id = ANY($2::uuid[])
+ORDER BY c.created_at, c.id
+"""
+# Indexed clients sharing a block key (its most recent $4 members) or
+# within $5 places of a sort key, for each (kind, key) of the new clients
+FIND_CANDIDATES_SQL = """
+SELECT DISTINCT n.client_id
+FROM unnest($2::text[], $3::text[]) AS q(kind, key)
+CROSS JOIN LATERAL (
+    (SELECT k.client_id FROM public.client_dedupe_keys k
+     WHERE q.kind = 'block' AND k.agency_id = $1 AND k.kind = 'block' AND k.key = q.key
+     ORDER BY k.created_at DESC LIMIT $4)
+    UNION ALL
+    (SELECT k.client_id FROM public.client_dedupe_keys k
+     WHERE q.kind <> 'block' AND k.agency_id = $1 AND k.kind = q.kind AND k.key < q.key
+     ORDER BY k.key DESC LIMIT $5)
+    UNION ALL
+    (SELECT k.client_id FROM public.client_dedupe_keys k
+     WHERE q.kind <> 'block' AND k.agency_id = $1 AND k.kind = q.kind AND k.key >= q.key
+     ORDER BY k.key LIMIT $5)
+) n
+"""
+KEYED_CLIENTS_SQL = """
+SELECT DISTINCT client_id FROM public.client_dedupe_keys WHERE agency_id = $1 AND client_id = ANY($2::uuid[])
+"""
+CLEAR_KEYS_SQL = "DELETE FROM public.client_dedupe_keys WHERE agency_id = $1"
+SAVE_KEYS_SQL = """
+INSERT INTO public.client_dedupe_keys (agency_id, client_id, kind, key, created_at)
+VALUES ($1, $2, $3, $4, $5)
+ON CONFLICT DO NOTHING
+"""
+LOAD_WATERMARK_SQL = "SELECT watermark_at, watermark_id FROM public.client_dedupe_state WHERE agency_id = $1"
+# Concurrent checks only ever move the watermark forward
+SAVE_WATERMARK_SQL = """
+INSERT INTO public.client_dedupe_state (agency_id, watermark_at, watermark_id)
+VALUES ($1, $2, $3)
+ON CONFLICT (agency_id) DO UPDATE
+SET watermark_at = EXCLUDED.watermark_at, watermark_id = EXCLUDED.watermark_id, updated_at = now()
+WHERE (client_dedupe_state.watermark_at, client_dedupe_state.watermark_id)
+    < (EXCLUDED.watermark_at, EXCLUDED.watermark_id)
+"""
+# A pair staff already dismissed or merged keeps its review
+SAVE_DUPLICATES_SQL = """
+INSERT INTO public.client_duplicates (agency_id, client_id, duplicate_id, score, reasons)
+VALUES ($1, $2, $3, $4, $5)
+ON CONFLICT (client_id, duplicate_id) DO UPDATE
+SET score = EXCLUDED.score, reasons = EXCLUDED.reasons, updated_at = now()
+WHERE client_duplicates.status = 'pending'
+"""
+IDENTITY_PAGE_SIZE = 10000
+START_WATERMARK = (datetime(1970, 1, 1, tzinfo=timezone.utc), '00000000-0000-0000-0000-000000000000')
+# Rows committed late can carry an earlier created_at; incremental reads look back this far
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+class ClientService:
+    """Read and maintain an agency's clients
+
+    ``passport_number`` is written encrypted with its blind index (see
+    ``security/encryption.py``) and decrypted on read. The cache holds the
+    ciphertext, never the plaintext.
+    """
+
+    def __init__(self, db=None, cache: Optional[TwoTierCache] = None, encryptor: Optional[FieldEncryptor] = None):
+        self._db = db
+        self.cache = cache or get_cache()
+        self._encryptor = encryptor
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else get_supabase_client()
+
+    @property
+    def encryptor(self) -> FieldEncryptor:
+        if self._encryptor is None:
+            self._encryptor = FieldEncryptor()
+        return self._encryptor
+
+    def _decrypt(self, agency_id: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        # Rows not yet backfilled still hold plaintext and are returned as is
+        fields = [f for f in ENCRYPTED_CLIENT_FIELDS if is_encrypted(row.get(f))]
+        return self.encryptor.decrypt_rows(agency_id, [row], fields)[0] if fields else row
+
+    def get_client(self, agency_id: str, client_id: str) -> Dict[str, Any]:
+        def load():
+            rows = (
+                self.db.table('clients').select(CLIENT_COLUMNS)
+                .eq('id', client_id).eq('agency_id', agency_id).limit(1).execute().data
+            )
+            if not rows:
+                raise ResourceNotFoundError(f'Client {client_id} not found')
+            return rows[0]
+
+        row = self.cache.get_or_load(f'client:{agency_id}:{client_id}', load, ttl=CLIENT_TTL_SECONDS,
+                                     tags=[client_tag(client_id), agency_tag(agency_id)])
+        return self._decrypt(agency_id, row)
+
+    def list_clients(self, agency_id: str, immigration_status: Optional[str] = None,
+                     cursor: Optional[str] = None, limit: Optional[int] = None,
+                     fields: Optional[Iterable[str]] = None) -> Page:
+        """One keyset page of an agency's clients, most recently updated first"""
+        limit = clamp_page_size(limit)
+        fields = select_fields(fields, CLIENT_LIST_FIELDS, DEFAULT_CLIENT_LIST_FIELDS)
+
+        def load():
+            query = self.db.table('clients').select(select_clause(fields)).eq('agency_id', agency_id)
+            if immigration_status is not None:
+                query = query.eq('immigration_status', immigration_status)
+            return build_page(apply_keyset(query, cursor, limit).execute().data or [], limit, fields).to_dict()
+
+        key = f"clients:{agency_id}:{immigration_status}:{cursor}:{limit}:{','.join(fields)}"
+        return Page(**self.cache.get_or_load(key, load, ttl=CLIENT_TTL_SECONDS, tags=[agency_tag(agency_id)]))
+
+    def get_client_profiles(self, agency_id: str, client_ids: List[str],
+                            loaders: Optional[RequestLoaders] = None) -> List[Dict[str, Any]]:
+        """Clients with their user record and cases, batched per relation"""
+        loaders = loaders or RequestLoaders(self.db, agency_id)
+        clients = [client for client in loaders.clients.get_many(client_ids) if client is not None]
+        pending_cases = loaders.cases_by_client.load_many(client['id'] for client in clients)
+        loaders.users.load_many(client['user_id'] for client in clients if client.get('user_id'))
+        profiles = []
+        for client, cases in zip(clients, pending_cases):
+            profiles.append({
+                **client,
+                'user': loaders.users.get(client['user_id']) if client.get('user_id') else None,
+                'cases': cases.result(),
+            })
+        return profiles
+
+    def update_client(self, agency_id: str, client_id: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+        unknown = set(changes) - set(UPDATABLE_FIELDS)
+        if unknown:
+            raise ValidationError(f"Cannot update client fields: {', '.join(sorted(unknown))}")
+        encrypted = [field for field in ENCRYPTED_CLIENT_FIELDS if field in changes]
+        if encrypted:
+            changes = self.encryptor.encrypt_rows(agency_id, [changes], encrypted)[0]
+        rows = (
+            self.db.table('clients')
+            .update({**changes, 'updated_at': datetime.now(timezone.utc).isoformat()})
+            .eq('id', client_id).eq('agency_id', agency_id).execute().data
+        )
+        if not rows:
+            raise ResourceNotFoundError(f'Client {client_id} not found')
+        self.cache.invalidate_tags(agency_tag(agency_id), client_tag(client_id))
+        return self._decrypt(agency_id, rows[0])
+
+
+def _timestamp(value: Any) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(str(value))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _task(row: Dict[str, Any]) -> Task:
+    return Task(
+        id=row['id'], title=row.get('title') or '', priority=row.get('priority') or 'medium',
+        due_date=_timestamp(row.get('due_date')), skill=row.get('skill'), effort=float(row.get('effort') or 1),
+        assigned_to=row.get('assigned_to'), status=row.get('status') or 'open', category=row.get('category'),
+        case_id=row.get('case_id'), client_id=row.get('client_id'), created_at=_timestamp(row.get('created_at')),
+    )
+
+
+def _task_out(task: Task) -> Dict[str, Any]:
+    out = asdict(task)
+    for name in ('due_date', 'created_at'):
+        out[name] = out[name].isoformat() if out[name] else None
+    return out
+
+
+class TaskService:
+    """Create, assign and list staff tasks through a per-agency assignment index
+
+    Each process keeps one :class:`AssignmentEngine` per agency, built from
+    the agency's open tasks and staff, read in batches below PostgREST's
+    row cap. Writes made through this service update the database and the
+    index together. The index is rebuilt after ``index_ttl`` seconds, which
+    bounds how long other processes' writes stay out of the views; a task
+    the index does not know yet is read from the database before it is
+    assigned or completed. Each agency's index has its own lock,
+    held only while the index is read or changed, never across a query.
+    """
+
+    def __init__(self, db=None, index_ttl: float = TASK_INDEX_TTL_SECONDS):
+        self._db = db
+        self.index_ttl = index_ttl
+        self._indexes: Dict[str, Tuple[AssignmentEngine, float]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else get_supabase_client()
+
+    def _load(self, agency_id: str) -> AssignmentEngine:
+        users = list(iter_all(
+            lambda: self.db.table('users').select('id, role').eq('agency_id', agency_id).in_('role', STAFF_ROLES)))
+        profiles = {
+            row['user_id']: row for row in iter_all(
+                lambda: self.db.table('staff_workload_profiles').select('user_id, skills, capacity, available')
+                .eq('agency_id', agency_id), key='user_id')
+        }
+        staff = []
+        for user in users:
+            profile = profiles.get(user['id'], {})
+            staff.append(StaffMember(user['id'], frozenset(profile.get('skills') or ()),
+                                     float(profile.get('capacity') or 20), profile.get('available', True)))
+        rows = iter_all(
+            lambda: self.db.table('tasks').select(TASK_COLUMNS).eq('agency_id', agency_id)
+            .in_('status', OPEN_STATUSES))
+        return AssignmentEngine(staff, (_task(row) for row in rows))
+
+    def _index(self, agency_id: str) -> Tuple[AssignmentEngine, threading.Lock]:
+        """The agency's index and the lock guarding it; a stale index is rebuilt outside the lock"""
+        with self._lock:
+            lock = self._locks.setdefault(agency_id, threading.Lock())
+        with lock:
+            cached = self._indexes.get(agency_id)
+            if cached is not None and time.monotonic() - cached[1] < self.index_ttl:
+                return cached[0], lock
+        engine = self._load(agency_id)
+        with lock:
+            cached = self._indexes.get(agency_id)
+            if cached is not None and time.monotonic() - cached[1] < self.index_ttl:
+                # Another caller rebuilt it meanwhile; keep theirs and whatever was applied to it since
+                return cached[0], lock
+            self._indexes[agency_id] = (engine, time.monotonic())
+        return engine, lock
+
+    def index(self, agency_id: str) -> AssignmentEngine:
+        """The agency's assignment index, rebuilt when older than ``index_ttl``"""
+        return self._index(agency_id)[0]
+
+    def invalidate(self, agency_id: str) -> None:
+        with self._lock:
+            self._indexes.pop(agency_id, None)
+
+    def _with_task(self, agency_id: str, task_id: str) -> Tuple[AssignmentEngine, threading.Lock]:
+        """The agency's index, holding ``task_id`` if it is open, even when another process created it"""
+        engine, lock = self._index(agency_id)
+        with lock:
+            if task_id in engine.tasks:
+                return engine, lock
+        # One row, not a rebuild: unknown ids would otherwise reload the whole index
+        rows = (
+            self.db.table('tasks').select(TASK_COLUMNS).eq('id', task_id).eq('agency_id', agency_id)
+            .in_('status', OPEN_STATUSES).execute().data or []
+        )
+        if rows:
+            with lock:
+                if task_id not in engine.tasks:
+                    engine.add_task(_task(rows[0]), assign=False)
+        return engine, lock
+
+    def _update(self, agency_id: str, task_ids: List[str], changes: Dict[str, Any]) -> List[Dict[str, Any]]:
+        changes = {**changes, 'updated_at': datetime.now(timezone.utc).isoformat()}
+        return (
+            self.db.table('tasks').update(changes)
+            .in_('id', task_ids).eq('agency_id', agency_id).execute().data or []
+        )
+
+    def create_task(self, agency_id: str, fields: Dict[str, Any], auto_assign: bool = True,
+                    created_by: Optional[str] = None) -> Dict[str, Any]:
+        """Insert a task, giving it to the least loaded suitable staff member unless ``assigned_to`` is set
+
+        The task is added to the index before the insert, so concurrent
+        creates see its load, and taken out again if the insert fails.
+        """
+        unknown = set(fields) - set(TASK_FIELDS)
+        if unknown:
+            raise ValidationError(f"Unknown task fields: {', '.join(sorted(unknown))}")
+        if not fields.get('title'):
+            raise ValidationError('Task title is required')
+        if fields.get('priority', 'medium') not in PRIORITIES:
+            raise ValidationError(f"Unknown task priority '{fields['priority']}'")
+        row = {**fields, 'id': str(uuid.uuid4()), 'agency_id': agency_id, 'status': 'open',
+               'created_by': created_by}
+        engine, lock = self._index(agency_id)
+        with lock:
+            if row.get('assigned_to'):
+                if row['assigned_to'] not in engine.staff:
+                    raise ValidationError(f"{row['assigned_to']} is not a staff member of this agency")
+                row['assignment'] = 'manual'
+            elif auto_assign:
+                chosen = engine.choose(row.get('skill'), float(row.get('effort') or 1))
+                if chosen is not None:
+                    row['assigned_to'], row['assignment'] = chosen.id, 'auto'
+            engine.add_task(_task(row), assign=False)
+        try:
+            created = self.db.table('tasks').insert(row).execute().data[0]
+        except Exception:
+            with lock:
+                if row['id'] in engine.tasks:
+                    engine.remove_task(row['id'])
+            raise
+        with lock:
+            engine.add_task(_task(created), assign=False)
+        return created
+
+    def suggest_assignees(self, agency_id: str, skill: Optional[str] = None,
+                          limit: int = 3) -> List[Dict[str, Any]]:
+        """The least loaded staff for a task needing ``skill``, with their current workload"""
+        engine, lock = self._index(agency_id)
+        with lock:
+            return [{'staff_id': member.id, 'load': member.load, 'capacity': member.capacity,
+                     'open_tasks': member.open_tasks}
+                    for member in engine.candidates(skill, limit)]
+
+    def assign_task(self, agency_id: str, task_id: str, staff_id: Optional[str] = None) -> Dict[str, Any]:
+        """Hand a task to ``staff_id``, or to the best candidate when None
+
+        The database is written first; the index follows only once the
+        update has matched the task.
+        """
+        engine, lock = self._with_task(agency_id, task_id)
+        with lock:
+            engine.get(task_id)
+            if staff_id is not None and staff_id not in engine.staff:
+                raise ResourceNotFoundError(f'Staff member {staff_id} not found')
+            owner = staff_id if staff_id is not None else engine.suggest(task_id)
+        rows = self._update(agency_id, [task_id], {
+            'assigned_to': owner, 'assignment': 'manual' if staff_id else 'auto' if owner else None})
+        if not rows:
+            self.invalidate(agency_id)
+            raise ResourceNotFoundError(f'Task {task_id} not found')
+        with lock:
+            if task_id in engine.tasks:
+                if owner is None:
+                    engine.unassign(task_id)
+                else:
+                    engine.assign(task_id, owner)
+        return rows[0]
+
+    def complete_task(self, agency_id: str, task_id: str, status: str = 'done') -> Dict[str, Any]:
+        if status not in ('done', 'cancelled'):
+            raise ValidationError(f"Tasks are closed as 'done' or 'cancelled', not '{status}'")
+        engine, lock = self._with_task(agency_id, task_id)
+        with lock:
+            engine.get(task_id)
+        rows = self._update(agency_id, [task_id], {
+            'status': status, 'completed_at': datetime.now(timezone.utc).isoformat()})
+        if not rows:
+            raise ResourceNotFoundError(f'Task {task_id} not found')
+        with lock:
+            if task_id in engine.tasks:
+                engine.remove_task(task_id)
+        return rows[0]
+
+    def my_tasks(self, agency_id: str, staff_id: Optional[str]) -> List[Dict[str, Any]]:
+        """Open tasks assigned to ``staff_id`` (None: unassigned), due soonest first"""
+        engine, lock = self._index(agency_id)
+        with lock:
+            return [_task_out(task) for task in engine.my_tasks(staff_id)]
+
+    def overdue_tasks(self, agency_id: str, staff_id: Optional[str] = None,
+                      now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Open tasks past their due date, most overdue first"""
+        engine, lock = self._index(agency_id)
+        with lock:
+            return [_task_out(task) for task in engine.overdue(now or datetime.now(timezone.utc), staff_id)]
+
+    def set_staff_availability(self, agency_id: str, staff_ids: Iterable[str], available: bool) -> List[Move]:
+        """Mark staff in or out; tasks of staff going out are redistributed in bulk
+
+        Profiles are written before the index changes. If writing the moved
+        tasks fails, the index is dropped and rebuilt from the database.
+        """
+        staff_ids = list(dict.fromkeys(staff_ids))
+        engine, lock = self._index(agency_id)
+        with lock:
+            unknown = [staff_id for staff_id in staff_ids if staff_id not in engine.staff]
+        if unknown:
+            raise ResourceNotFoundError(f"Staff members not found: {', '.join(unknown)}")
+        (
+            self.db.table('staff_workload_profiles')
+            .update({'available': available, 'updated_at': datetime.now(timezone.utc).isoformat()})
+            .in_('user_id', staff_ids).eq('agency_id', agency_id).execute()
+        )
+        existing = {row['user_id'] for row in (
+            self.db.table('staff_workload_profiles').select('user_id')
+            .in_('user_id', staff_ids).eq('agency_id', agency_id).execute().data or [])}
+        missing = [{'user_id': staff_id, 'agency_id': agency_id, 'available': available}
+                   for staff_id in staff_ids if staff_id not in existing]
+        if missing:
+            self.db.table('staff_workload_profiles').insert(missing).execute()
+        with lock:
+            if available:
+                for staff_id in staff_ids:
+                    engine.set_available(staff_id, True)
+                moves = engine.assign_unassigned()
+            else:
+                moves = engine.rebalance(staff_ids)
+        try:
+            self._persist_moves(agency_id, moves)
+        except Exception:
+            self.invalidate(agency_id)
+            raise
+        return moves
+
+    def _persist_moves(self, agency_id: str, moves: List[Move]) -> None:
+        # One update per new assignee, not one per task
+        by_assignee: Dict[Optional[str], List[str]] = {}
+        for move in moves:
+            by_assignee.setdefault(move.to, []).append(move.task_id)
+        for assignee, task_ids in by_assignee.items():
+            self._update(agency_id, task_ids, {'assigned_to': assignee,
+                                               'assignment': 'rebalance' if assignee else None})
+
+
+class DuplicateClientService:
+    """Find clients who are probably the same person
+
+    :meth:`scan` reads the agency's clients once, in pages, and compares
+    the candidate pairs of a :class:`DuplicateIndex`. It stores the index's
+    keys in ``client_dedupe_keys`` and a watermark in ``client_dedupe_state``,
+    so :meth:`check_new_clients`, in any process, reads only the clients
+    created since and the indexed clients they share a key with. Nothing is
+    held in memory between calls. Matches go to ``client_duplicates`` for
+    staff to merge or dismiss.
+    """
+
+    def __init__(self, database=None, window: int = DEFAULT_WINDOW, threshold: float = DEFAULT_THRESHOLD,
+                 max_block: int = DEFAULT_MAX_BLOCK):
+        if database is None:
+            from immigration_ai.utils.database import get_database
+
+            database = get_database()
+        self.database = database
+        self.window = window
+        self.threshold = threshold
+        self.max_block = max_block
+
+    @staticmethod
+    def _identities(rows) -> List[ClientIdentity]:
+        return [ClientIdentity(str(row['id']), row['first_name'], row['last_name'], row['email'], row['phone'],
+                               row['date_of_birth'], row['passport_number_bidx'], row['created_at'])
+                for row in rows]
+
+    async def _load(self, agency_id: str, after: Tuple[datetime, str]) -> List[ClientIdentity]:
+        identities = []
+        while True:
+            rows = await self.database.fetch(LOAD_IDENTITIES_SQL, agency_id, after[0], after[1],
+                                             IDENTITY_PAGE_SIZE)
+            identities.extend(self._identities(rows))
+            if len(rows) < IDENTITY_PAGE_SIZE:
+                return identities
+            after = (rows[-1]['created_at'], str(rows[-1]['id']))
+
+    async def _candidates(self, agency_id: str, identities: List[ClientIdentity]) -> List[ClientIdentity]:
+        """Indexed clients sharing a block with, or sorting near, any of ``identities``"""
+        keys = list(dict.fromkeys(key for identity in identities for key in index_keys(identity)))
+        if not keys:
+            return []
+        rows = await self.database.fetch(FIND_CANDIDATES_SQL, agency_id, [kind for kind, _ in keys],
+                                         [key for _, key in keys], self.max_block, self.window)
+        if not rows:
+            return []
+        return self._identities(await self.database.fetch(LOAD_IDENTITIES_BY_ID_SQL, agency_id,
+                                                          [str(row['client_id']) for row in rows]))
+
+    async def _save(self, agency_id: str, matches: List[DuplicateMatch]) -> None:
+        if matches:
+            await self.database.executemany(SAVE_DUPLICATES_SQL, [
+                (agency_id, match.client_id, match.duplicate_id, match.score, match.reasons)
+                for match in matches])
+
+    async def _save_keys(self, agency_id: str, identities: List[ClientIdentity]) -> None:
+        rows = [(agency_id, identity.id, kind, key, identity.created_at)
+                for identity in identities for kind, key in index_keys(identity)]
+        if rows:
+            await self.database.executemany(SAVE_KEYS_SQL, rows)
+
+    @staticmethod
+    def _watermark(identities: List[ClientIdentity], previous: Tuple[datetime, str]) -> Tuple[datetime, str]:
+        return max([previous, *((identity.created_at, identity.id) for identity in identities)])
+
+    async def scan(self, agency_id: str) -> Dict[str, Any]:
+        """Compare all of the agency's clients, store the matches and rebuild the stored index"""
+        identities = await self._load(agency_id, START_WATERMARK)
+        index = DuplicateIndex(window=self.window, max_block=self.max_block, threshold=self.threshold)
+        index.extend(identities)
+        matches = index.find_duplicates()
+        async with self.database.transaction():
+            await self._save(agency_id, matches)
+            # Rebuilt rather than merged, so edited names and emails drop their old keys
+            await self.database.execute(CLEAR_KEYS_SQL, agency_id)
+            await self._save_keys(agency_id, identities)
+            await self.database.execute(SAVE_WATERMARK_SQL, agency_id,
+                                        *self._watermark(identities, START_WATERMARK))
+        logger.info(f"Duplicate scan for agency {agency_id}: {len(identities)} clients, "
+                    f"{index.comparisons} comparisons, {len(matches)} matches")
+        return {'clients': len(identities), 'comparisons': index.comparisons, 'matches': len(matches)}
+
+    async def check_new_clients(self, agency_id: str) -> List[DuplicateMatch]:
+        """Compare clients created since the last scan or check with their indexed candidates, and store the matches"""
+        row = await self.database.fetchrow(LOAD_WATERMARK_SQL, agency_id)
+        if row is None:
+            await self.scan(agency_id)
+            return []
+        watermark = (row['watermark_at'], str(row['watermark_id']))
+        loaded = await self._load(agency_id, (watermark[0] - WATERMARK_OVERLAP, watermark[1]))
+        if not loaded:
+            return []
+        # The overlap re-reads clients an earlier check already indexed
+        keyed = {str(row['client_id']) for row in await self.database.fetch(
+            KEYED_CLIENTS_SQL, agency_id, [identity.id for identity in loaded])}
+        new = [identity for identity in loaded if identity.id not in keyed]
+        index = DuplicateIndex(window=self.window, max_block=self.max_block, threshold=self.threshold)
+        index.extend(await self._candidates(agency_id, new))
+        matches = [match for identity in new for match in index.add(identity)]
+        async with self.database.transaction():
+            await self._save(agency_id, matches)
+            await self._save_keys(agency_id, new)
+            await self.database.execute(SAVE_WATERMARK_SQL, agency_id, *self._watermark(loaded, watermark))
+        return matches
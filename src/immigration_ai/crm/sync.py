@@ -0,0 +1,742 @@
+"""
+Incremental CRM sync
+
+Keeps an agency's clients and cases in step with HubSpot contacts/deals or
+Salesforce contacts/opportunities without re-reading or re-writing the
+whole client book. A run costs in proportion to what changed since the last
+run:
+
+* **Pull.** The adapter pages through records the CRM modified since this
+  integration's watermark, using bulk reads (HubSpot search, Salesforce
+  SOQL). The watermark moves forward after every page. Each query reaches
+  back ``pull_overlap`` seconds, so writes that commit late are not missed.
+  Records seen twice merge to nothing.
+* **Push.** Statement-level triggers append local changes to
+  ``crm_change_log``. Each integration keeps a ``(txid, id)`` cursor into
+  it, and only the entities logged after the cursor are loaded. Only fields
+  that differ from the last synced snapshot are sent, in the CRM's batch
+  write size.
+* **Conflicts.** Every link stores the field values both sides last agreed
+  on. A field changed on one side only takes that side's value. A field
+  changed on both sides is a conflict, settled by ``policy``: ``newest``
+  (later modification time wins), ``local`` or ``remote``.
+
+Writes made by the sync itself set ``immigration_ai.crm_sync``, which the
+triggers skip, so pulled changes are not echoed back. Records created in
+the CRM are not imported; only linked records flow back to the platform.
+Adapters (``integrations/hubspot.py``, ``integrations/salesforce.py``)
+translate between CRM properties and the field names used here.
+"""
+
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from immigration_ai.core.exceptions import IntegrationError, ValidationError
+
+logger = logging.getLogger(__name__)
+
+ENTITY_TYPES = ('client', 'case')
+CONFLICT_POLICIES = ('newest', 'local', 'remote')
+
+# Field names shared by every adapter; values are compared as strings
+SYNC_FIELDS = {
+    'client': ('first_name', 'last_name', 'email', 'phone', 'date_of_birth', 'country_of_birth', 'nationality',
+               'immigration_status'),
+    'case': ('case_number', 'title', 'status', 'case_type', 'priority', 'due_date'),
+}
+# Fields a CRM edit may change locally; the rest are owned by the platform
+PULL_FIELDS = {
+    'client': ('first_name', 'last_name', 'phone', 'country_of_birth', 'nationality', 'immigration_status'),
+    'case': ('title', 'status', 'priority', 'due_date'),
+}
+CASE_STATUSES = ('new', 'in_progress', 'under_review', 'approved', 'rejected', 'completed')
+
+DEFAULT_PUSH_PAGE_SIZE = 500
+DEFAULT_PULL_OVERLAP = 60.0
+
+
+def normalize(value: Any) -> Optional[str]:
+    """The comparable form of a field value: None, or a string (dates as ISO)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """A CRM timestamp (``2025-07-01T09:30:00.000Z``, ``...+0000``) as an aware datetime"""
+    if not value:
+        return None
+    value = re.sub(r'([+-]\d\d)(\d\d)$', r'\1:\2', value.replace('Z', '+00:00'))
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _pullable(entity_type: str, name: str, value: Optional[str]) -> bool:
+    """Whether a CRM value is acceptable for the local column"""
+    if value is None:
+        return name not in ('first_name', 'title', 'status')
+    if name == 'status':
+        return value in CASE_STATUSES
+    if name == 'priority':
+        return value in ('1', '2', '3', '4', '5')
+    if name in ('due_date', 'date_of_birth'):
+        try:
+            date.fromisoformat(value)
+        except ValueError:
+            return False
+    return True
+
+
+@dataclass
+class SyncCursor:
+    """Where one integration is up to for one entity type"""
+    pull_since: Optional[datetime] = None
+    push_txid: int = 0
+    push_id: int = 0
+
+
+@dataclass
+class Link:
+    """A local entity's CRM record and the field values both sides last agreed on"""
+    local_id: str
+    remote_id: str
+    synced: Dict[str, Optional[str]] = field(default_factory=dict)
+    remote_modified_at: Optional[datetime] = None
+
+
+@dataclass
+class LocalRecord:
+    """A client or case as the sync sees it"""
+    local_id: str
+    fields: Dict[str, Optional[str]]
+    modified_at: Optional[datetime] = None
+    link: Optional[Link] = None
+    # Remote ids of related records (a case's ``client``)
+    related: Dict[str, Optional[str]] = field(default_factory=dict)
+
+
+@dataclass
+class RemoteRecord:
+    """A CRM record translated to sync field names
+
+    ``local_id`` is the platform id the CRM record carries, when it has one.
+    """
+    remote_id: str
+    fields: Dict[str, Optional[str]]
+    modified_at: Optional[datetime] = None
+    local_id: Optional[str] = None
+
+
+@dataclass
+class OutboundRecord:
+    """Fields to write to the CRM; ``remote_id`` is None for records not linked yet"""
+    local_id: str
+    remote_id: Optional[str]
+    fields: Dict[str, Optional[str]]
+    related: Dict[str, Optional[str]] = field(default_factory=dict)
+
+
+@dataclass
+class UpsertResult:
+    """The CRM's answer for one outbound record"""
+    local_id: str
+    remote_id: Optional[str] = None
+    modified_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.remote_id is not None
+
+
+@dataclass
+class MergeResult:
+    """What a pulled record changes on each side"""
+    to_local: Dict[str, Optional[str]] = field(default_factory=dict)
+    to_remote: Dict[str, Optional[str]] = field(default_factory=dict)
+    conflicts: List[str] = field(default_factory=list)
+
+
+def merge_fields(base: Mapping[str, Optional[str]], local: Mapping[str, Optional[str]],
+                 remote: Mapping[str, Optional[str]], pullable: Sequence[str], policy: str = 'newest',
+                 local_modified: Optional[datetime] = None,
+                 remote_modified: Optional[datetime] = None) -> MergeResult:
+    """Three-way merge of one record against the last synced snapshot ``base``
+
+    Fields outside ``pullable`` belong to the platform: a CRM edit to them
+    is overwritten on the next push.
+    """
+    if policy not in CONFLICT_POLICIES:
+        raise ValidationError(f"Unknown conflict policy '{policy}'")
+    local_wins = policy == 'local' or (
+        policy == 'newest' and local_modified is not None
+        and (remote_modified is None or local_modified > remote_modified))
+    result = MergeResult()
+    for name in set(local) | set(remote):
+        mine, theirs = local.get(name), remote.get(name)
+        if mine == theirs:
+            continue
+        if name not in pullable:
+            result.to_remote[name] = mine
+        elif mine == base.get(name):
+            result.to_local[name] = theirs
+        elif theirs == base.get(name):
+            result.to_remote[name] = mine
+        else:
+            result.conflicts.append(name)
+            if local_wins:
+                result.to_remote[name] = mine
+            else:
+                result.to_local[name] = theirs
+    return result
+
+
+@dataclass
+class SyncStats:
+    """Work done by one run"""
+    pulled: int = 0
+    applied: int = 0
+    pushed: int = 0
+    created: int = 0
+    unchanged: int = 0
+    unlinked: int = 0
+    conflicts: int = 0
+    failed: int = 0
+    remote_requests: int = 0
+
+
+# -- stores -------------------------------------------------------------------
+
+class InMemorySyncStore:
+    """Local records, change log, links and cursors held in process (tests, benchmarks)
+
+    :meth:`put` stands in for application writes and logs the change the way
+    the database triggers do.
+    """
+
+    def __init__(self):
+        self.records: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.changes: List[Tuple[int, str, str, str]] = []
+        self.links: Dict[Tuple[str, str, str, str], Link] = {}
+        self.cursors: Dict[Tuple[str, str, str], SyncCursor] = {}
+        self._next_change = 0
+
+    def put(self, agency_id: str, entity_type: str, local_id: str, fields: Mapping[str, Any],
+            modified_at: Optional[datetime] = None, client_id: Optional[str] = None) -> None:
+        record = self.records.setdefault((entity_type, local_id), {
+            'agency_id': agency_id, 'fields': {name: None for name in SYNC_FIELDS[entity_type]},
+            'client_id': client_id})
+        record['fields'].update({name: normalize(value) for name, value in fields.items()})
+        record['modified_at'] = modified_at or datetime.now(timezone.utc)
+        self._log(agency_id, entity_type, [local_id])
+
+    def _log(self, agency_id: str, entity_type: str, local_ids: Iterable[str]) -> None:
+        for local_id in local_ids:
+            self._next_change += 1
+            self.changes.append((self._next_change, agency_id, entity_type, local_id))
+
+    async def load_cursor(self, agency_id: str, provider: str, entity_type: str) -> Optional[SyncCursor]:
+        cursor = self.cursors.get((agency_id, provider, entity_type))
+        return SyncCursor(**vars(cursor)) if cursor else None
+
+    async def save_cursor(self, agency_id: str, provider: str, entity_type: str, cursor: SyncCursor) -> None:
+        self.cursors[(agency_id, provider, entity_type)] = SyncCursor(**vars(cursor))
+
+    async def seed(self, agency_id: str, entity_type: str) -> None:
+        self._log(agency_id, entity_type, [local_id for (kind, local_id), record in self.records.items()
+                                           if kind == entity_type and record['agency_id'] == agency_id])
+
+    async def read_changes(self, agency_id: str, entity_type: str, cursor: SyncCursor,
+                           limit: int) -> Tuple[List[str], Optional[Tuple[int, int]]]:
+        rows = [row for row in self.changes
+                if row[0] > cursor.push_id and row[1] == agency_id and row[2] == entity_type][:limit]
+        if not rows:
+            return [], None
+        return list(dict.fromkeys(row[3] for row in rows)), (0, rows[-1][0])
+
+    async def load_local(self, agency_id: str, provider: str, entity_type: str,
+                         local_ids: Iterable[str]) -> Dict[str, LocalRecord]:
+        loaded = {}
+        for local_id in local_ids:
+            record = self.records.get((entity_type, local_id))
+            if record is None or record['agency_id'] != agency_id:
+                continue
+            related = {}
+            if entity_type == 'case':
+                client_link = self.links.get((agency_id, provider, 'client', record['client_id']))
+                related['client'] = client_link.remote_id if client_link else None
+            loaded[local_id] = LocalRecord(local_id, dict(record['fields']), record['modified_at'],
+                                           self.links.get((agency_id, provider, entity_type, local_id)), related)
+        return loaded
+
+    async def links_by_remote(self, agency_id: str, provider: str, entity_type: str,
+                              remote_ids: Iterable[str]) -> Dict[str, Link]:
+        wanted = set(remote_ids)
+        return {link.remote_id: link for (agency, name, kind, _), link in self.links.items()
+                if (agency, name, kind) == (agency_id, provider, entity_type) and link.remote_id in wanted}
+
+    async def save_links(self, agency_id: str, provider: str, entity_type: str, links: Iterable[Link]) -> None:
+        for link in links:
+            self.links[(agency_id, provider, entity_type, link.local_id)] = link
+
+    async def apply_remote(self, agency_id: str, entity_type: str,
+                           updates: Sequence[Tuple[str, Dict[str, Optional[str]]]]) -> None:
+        # Sync writes are not logged, like the triggers under immigration_ai.crm_sync
+        for local_id, changes in updates:
+            record = self.records[(entity_type, local_id)]
+            record['fields'].update(changes)
+            record['modified_at'] = datetime.now(timezone.utc)
+
+    async def requeue(self, agency_id: str, entity_type: str, local_ids: Sequence[str]) -> None:
+        self._log(agency_id, entity_type, local_ids)
+
+    async def prune(self, agency_id: str) -> None:
+        # Drop what every integration's cursor has passed, per entity type
+        floors = {}
+        for (agency, _, entity_type), cursor in self.cursors.items():
+            if agency == agency_id:
+                floors[entity_type] = min(floors.get(entity_type, cursor.push_id), cursor.push_id)
+        self.changes = [row for row in self.changes
+                        if row[1] != agency_id or row[2] not in floors or row[0] > floors[row[2]]]
+
+
+LOAD_CURSOR_SQL = """
+SELECT pull_since, push_txid, push_id FROM public.crm_sync_state
+WHERE agency_id = $1 AND provider = $2 AND entity_type = $3
+"""
+
+SAVE_CURSOR_SQL = """
+INSERT INTO public.crm_sync_state (agency_id, provider, entity_type, pull_since, push_txid, push_id)
+VALUES ($1, $2, $3, $4, $5, $6)
+ON CONFLICT (agency_id, provider, entity_type) DO UPDATE
+    SET pull_since = EXCLUDED.pull_since, push_txid = EXCLUDED.push_txid, push_id = EXCLUDED.push_id,
+        updated_at = now()
+"""
+
+SEED_SQL = {
+    'client': """
+INSERT INTO public.crm_change_log (agency_id, entity_type, entity_id)
+SELECT agency_id, 'client', id FROM public.clients WHERE agency_id = $1
+""",
+    'case': """
+INSERT INTO public.crm_change_log (agency_id, entity_type, entity_id)
+SELECT agency_id, 'case', id FROM public.cases WHERE agency_id = $1
+""",
+}
+
+# Rows from transactions still in flight are invisible, and may hold lower
+# ids than rows already committed. Reading in (txid, id) order, and only
+# below the oldest running transaction, means the cursor never passes a row
+# that has yet to become visible.
+READ_CHANGES_SQL = """
+SELECT txid, id, entity_id FROM public.crm_change_log
+WHERE agency_id = $1 AND entity_type = $2 AND (txid, id) > ($3, $4)
+  AND txid < txid_snapshot_xmin(txid_current_snapshot())
+ORDER BY txid, id
+LIMIT $5
+"""
+
+LOAD_LOCAL_SQL = {
+    'client': """
+SELECT c.id, u.first_name, u.last_name, au.email, u.phone, c.date_of_birth, c.country_of_birth, c.nationality,
+       c.immigration_status, greatest(c.updated_at, u.updated_at) AS modified_at,
+       l.remote_id, l.synced, l.remote_modified_at
+FROM public.clients c
+LEFT JOIN public.users u ON u.id = c.user_id
+LEFT JOIN auth.users au ON au.id = c.user_id
+LEFT JOIN public.crm_links l
+    ON l.agency_id = c.agency_id AND l.provider = $2 AND l.entity_type = 'client' AND l.entity_id = c.id
+WHERE c.agency_id = $1 AND c.id = ANY($3::uuid[])
+""",
+    'case': """
+SELECT k.id, k.case_number, k.title, k.status, k.case_type, k.priority, k.due_date, k.updated_at AS modified_at,
+       l.remote_id, l.synced, l.remote_modified_at, cl.remote_id AS client_remote_id
+FROM public.cases k
+LEFT JOIN public.crm_links l
+    ON l.agency_id = k.agency_id AND l.provider = $2 AND l.entity_type = 'case' AND l.entity_id = k.id
+LEFT JOIN public.crm_links cl
+    ON cl.agency_id = k.agency_id AND cl.provider = $2 AND cl.entity_type = 'client' AND cl.entity_id = k.client_id
+WHERE k.agency_id = $1 AND k.id = ANY($3::uuid[])
+""",
+}
+
+LINKS_BY_REMOTE_SQL = """
+SELECT entity_id, remote_id, synced, remote_modified_at FROM public.crm_links
+WHERE agency_id = $1 AND provider = $2 AND entity_type = $3 AND remote_id = ANY($4::text[])
+"""
+
+SAVE_LINKS_SQL = """
+INSERT INTO public.crm_links (agency_id, provider, entity_type, entity_id, remote_id, synced, remote_modified_at)
+SELECT $1, $2, $3, l.entity_id, l.remote_id, l.synced, l.remote_modified_at
+FROM unnest($4::uuid[], $5::text[], $6::jsonb[], $7::timestamptz[])
+    AS l(entity_id, remote_id, synced, remote_modified_at)
+ON CONFLICT (agency_id, provider, entity_type, entity_id) DO UPDATE
+    SET remote_id = EXCLUDED.remote_id, synced = EXCLUDED.synced,
+        remote_modified_at = COALESCE(EXCLUDED.remote_modified_at, crm_links.remote_modified_at),
+        synced_at = now()
+"""
+
+SUPPRESS_LOGGING_SQL = "SELECT set_config('immigration_ai.crm_sync', 'on', true)"
+
+APPLY_REMOTE_SQL = {
+    'client': ("""
+UPDATE public.users u SET
+    first_name = CASE WHEN x.changes ? 'first_name' THEN x.changes ->> 'first_name' ELSE u.first_name END,
+    last_name = CASE WHEN x.changes ? 'last_name' THEN x.changes ->> 'last_name' ELSE u.last_name END,
+    phone = CASE WHEN x.changes ? 'phone' THEN x.changes ->> 'phone' ELSE u.phone END,
+    updated_at = now()
+FROM unnest($2::uuid[], $3::jsonb[]) AS x(id, changes)
+JOIN public.clients c ON c.id = x.id
+WHERE c.agency_id = $1 AND u.id = c.user_id
+  AND x.changes ?| ARRAY['first_name', 'last_name', 'phone']
+""", """
+UPDATE public.clients c SET
+    country_of_birth = CASE WHEN x.changes ? 'country_of_birth' THEN x.changes ->> 'country_of_birth'
+                            ELSE c.country_of_birth END,
+    nationality = CASE WHEN x.changes ? 'nationality' THEN x.changes ->> 'nationality' ELSE c.nationality END,
+    immigration_status = CASE WHEN x.changes ? 'immigration_status' THEN x.changes ->> 'immigration_status'
+                              ELSE c.immigration_status END,
+    updated_at = now()
+FROM unnest($2::uuid[], $3::jsonb[]) AS x(id, changes)
+WHERE c.agency_id = $1 AND c.id = x.id
+"""),
+    'case': ("""
+UPDATE public.cases k SET
+    title = CASE WHEN x.changes ? 'title' THEN x.changes ->> 'title' ELSE k.title END,
+    status = CASE WHEN x.changes ? 'status' THEN (x.changes ->> 'status')::public.case_status ELSE k.status END,
+    priority = CASE WHEN x.changes ? 'priority' THEN (x.changes ->> 'priority')::integer ELSE k.priority END,
+    due_date = CASE WHEN x.changes ? 'due_date' THEN (x.changes ->> 'due_date')::date ELSE k.due_date END,
+    updated_at = now()
+FROM unnest($2::uuid[], $3::jsonb[]) AS x(id, changes)
+WHERE k.agency_id = $1 AND k.id = x.id
+""",),
+}
+
+REQUEUE_SQL = """
+INSERT INTO public.crm_change_log (agency_id, entity_type, entity_id)
+SELECT $1, $2, id FROM unnest($3::uuid[]) AS id
+"""
+
+PRUNE_SQL = """
+DELETE FROM public.crm_change_log l
+USING (
+    SELECT DISTINCT ON (entity_type) entity_type, push_txid, push_id FROM public.crm_sync_state
+    WHERE agency_id = $1 ORDER BY entity_type, push_txid, push_id
+) floor
+WHERE l.agency_id = $1 AND l.entity_type = floor.entity_type
+  AND (l.txid, l.id) <= (floor.push_txid, floor.push_id)
+"""
+
+
+def _link(row: Mapping[str, Any], local_id: str) -> Optional[Link]:
+    if row['remote_id'] is None:
+        return None
+    return Link(local_id, row['remote_id'], dict(row['synced'] or {}), row['remote_modified_at'])
+
+
+class DatabaseSyncStore:
+    """Sync state in Postgres: ``crm_sync_state``, ``crm_change_log`` and ``crm_links``"""
+
+    def __init__(self, database=None):
+        if database is None:
+            from immigration_ai.utils.database import get_database
+
+            database = get_database()
+        self.database = database
+
+    async def load_cursor(self, agency_id: str, provider: str, entity_type: str) -> Optional[SyncCursor]:
+        row = await self.database.fetchrow(LOAD_CURSOR_SQL, agency_id, provider, entity_type)
+        return SyncCursor(row['pull_since'], row['push_txid'], row['push_id']) if row else None
+
+    async def save_cursor(self, agency_id: str, provider: str, entity_type: str, cursor: SyncCursor) -> None:
+        await self.database.execute(SAVE_CURSOR_SQL, agency_id, provider, entity_type, cursor.pull_since,
+                                    cursor.push_txid, cursor.push_id)
+
+    async def seed(self, agency_id: str, entity_type: str) -> None:
+        await self.database.execute(SEED_SQL[entity_type], agency_id)
+
+    async def read_changes(self, agency_id: str, entity_type: str, cursor: SyncCursor,
+                           limit: int) -> Tuple[List[str], Optional[Tuple[int, int]]]:
+        rows = await self.database.fetch(READ_CHANGES_SQL, agency_id, entity_type, cursor.push_txid,
+                                         cursor.push_id, limit)
+        if not rows:
+            return [], None
+        return list(dict.fromkeys(str(row['entity_id']) for row in rows)), (rows[-1]['txid'], rows[-1]['id'])
+
+    async def load_local(self, agency_id: str, provider: str, entity_type: str,
+                         local_ids: Iterable[str]) -> Dict[str, LocalRecord]:
+        rows = await self.database.fetch(LOAD_LOCAL_SQL[entity_type], agency_id, provider, list(local_ids))
+        loaded = {}
+        for row in rows:
+            local_id = str(row['id'])
+            fields = {name: normalize(row[name]) for name in SYNC_FIELDS[entity_type]}
+            related = {'client': row['client_remote_id']} if entity_type == 'case' else {}
+            loaded[local_id] = LocalRecord(local_id, fields, row['modified_at'], _link(row, local_id), related)
+        return loaded
+
+    async def links_by_remote(self, agency_id: str, provider: str, entity_type: str,
+                              remote_ids: Iterable[str]) -> Dict[str, Link]:
+        rows = await self.database.fetch(LINKS_BY_REMOTE_SQL, agency_id, provider, entity_type, list(remote_ids))
+        return {row['remote_id']: _link(row, str(row['entity_id'])) for row in rows}
+
+    async def save_links(self, agency_id: str, provider: str, entity_type: str, links: Iterable[Link]) -> None:
+        links = list(links)
+        if links:
+            await self.database.execute(
+                SAVE_LINKS_SQL, agency_id, provider, entity_type, [link.local_id for link in links],
+                [link.remote_id for link in links], [link.synced for link in links],
+                [link.remote_modified_at for link in links])
+
+    async def apply_remote(self, agency_id: str, entity_type: str,
+                           updates: Sequence[Tuple[str, Dict[str, Optional[str]]]]) -> None:
+        if not updates:
+            return
+        ids, changes = [local_id for local_id, _ in updates], [dict(fields) for _, fields in updates]
+        async with self.database.transaction() as connection:
+            await connection.execute(SUPPRESS_LOGGING_SQL)
+            for statement in APPLY_REMOTE_SQL[entity_type]:
+                await connection.execute(statement, agency_id, ids, changes)
+
+    async def requeue(self, agency_id: str, entity_type: str, local_ids: Sequence[str]) -> None:
+        if local_ids:
+            await self.database.execute(REQUEUE_SQL, agency_id, entity_type, list(local_ids))
+
+    async def prune(self, agency_id: str) -> None:
+        await self.database.execute(PRUNE_SQL, agency_id)
+
+
+# -- engine -------------------------------------------------------------------
+
+class CRMSyncEngine:
+    """Pulls then pushes one agency's clients and cases against one CRM adapter
+
+    An adapter has ``provider`` and ``write_batch_size`` attributes, plus:
+
+    * ``fetch_changes(entity_type, since, token)``, which returns
+      ``(records, next_token)``: one page of :class:`RemoteRecord` modified
+      at or after ``since``, oldest first
+    * ``upsert(entity_type, records)``, which returns one
+      :class:`UpsertResult` per :class:`OutboundRecord`, in order
+    * ``requests``, the number of HTTP requests made so far
+    """
+
+    def __init__(self, adapter, store, agency_id: str, policy: str = 'newest',
+                 push_page_size: int = DEFAULT_PUSH_PAGE_SIZE, pull_overlap: float = DEFAULT_PULL_OVERLAP):
+        if policy not in CONFLICT_POLICIES:
+            raise ValidationError(f"Unknown conflict policy '{policy}'")
+        self.adapter = adapter
+        self.store = store
+        self.agency_id = agency_id
+        self.policy = policy
+        self.push_page_size = push_page_size
+        self.pull_overlap = timedelta(seconds=pull_overlap)
+
+    @property
+    def provider(self) -> str:
+        return self.adapter.provider
+
+    async def run_once(self) -> SyncStats:
+        """Pull clients and cases, then push them (clients first, so cases can reference them)"""
+        stats = SyncStats()
+        requests = getattr(self.adapter, 'requests', 0)
+        cursors = {}
+        for entity_type in ENTITY_TYPES:
+            cursor = await self.store.load_cursor(self.agency_id, self.provider, entity_type)
+            if cursor is None:
+                # First run: queue every existing entity once for the initial push
+                await self.store.seed(self.agency_id, entity_type)
+                cursor = SyncCursor()
+            cursors[entity_type] = cursor
+        for entity_type in ENTITY_TYPES:
+            await self._pull(entity_type, cursors[entity_type], stats)
+        for entity_type in ENTITY_TYPES:
+            await self._push(entity_type, cursors[entity_type], stats)
+        await self.store.prune(self.agency_id)
+        stats.remote_requests = getattr(self.adapter, 'requests', 0) - requests
+        logger.info(f"CRM sync {self.provider}/{self.agency_id}: pulled {stats.pulled}, applied {stats.applied}, "
+                    f"pushed {stats.pushed} ({stats.created} new), {stats.conflicts} conflicts, "
+                    f"{stats.failed} failed")
+        return stats
+
+    async def _pull(self, entity_type: str, cursor: SyncCursor, stats: SyncStats) -> None:
+        since = cursor.pull_since - self.pull_overlap if cursor.pull_since else None
+        token = None
+        while True:
+            records, token = await self.adapter.fetch_changes(entity_type, since, token)
+            stats.pulled += len(records)
+            if records:
+                await self._apply_pulled(entity_type, records, stats)
+                newest = max((record.modified_at for record in records if record.modified_at), default=None)
+                if newest and (cursor.pull_since is None or newest > cursor.pull_since):
+                    cursor.pull_since = newest
+                await self.store.save_cursor(self.agency_id, self.provider, entity_type, cursor)
+            if token is None:
+                return
+
+    async def _apply_pulled(self, entity_type: str, records: List[RemoteRecord], stats: SyncStats) -> None:
+        links = await self.store.links_by_remote(self.agency_id, self.provider, entity_type,
+                                                 [record.remote_id for record in records])
+        owners = {}
+        for record in records:
+            link = links.get(record.remote_id)
+            if link and link.remote_modified_at and record.modified_at and \
+                    record.modified_at <= link.remote_modified_at:
+                # Already merged: the pull overlap, or the echo of our own write
+                stats.unchanged += 1
+                continue
+            # A record carrying our id but no link (created by an earlier run whose link write was lost) is adopted
+            owner = link.local_id if link else record.local_id
+            if owner:
+                owners[record.remote_id] = owner
+            else:
+                stats.unlinked += 1
+        local = await self.store.load_local(self.agency_id, self.provider, entity_type, set(owners.values()))
+
+        updates, new_links, pending_push = [], [], []
+        pullable = PULL_FIELDS[entity_type]
+        for record in records:
+            current = local.get(owners.get(record.remote_id))
+            if current is None:
+                continue
+            remote = {name: value for name, value in record.fields.items() if name in SYNC_FIELDS[entity_type]}
+            base = current.link.synced if current.link and current.link.remote_id == record.remote_id else {}
+            merged = merge_fields(base, current.fields, remote, pullable, self.policy,
+                                  current.modified_at, record.modified_at)
+            accepted = {name: value for name, value in merged.to_local.items()
+                        if _pullable(entity_type, name, value)}
+            if len(accepted) < len(merged.to_local):
+                logger.warning(f"Ignoring invalid {self.provider} values for {entity_type} {current.local_id}: "
+                               f"{sorted(set(merged.to_local) - set(accepted))}")
+            if accepted:
+                updates.append((current.local_id, accepted))
+            if merged.to_remote or len(accepted) < len(merged.to_local):
+                pending_push.append(current.local_id)
+            stats.conflicts += len(merged.conflicts)
+            # The snapshot is what the CRM holds now; local-only differences are pushed against it
+            new_links.append(Link(current.local_id, record.remote_id, {**current.fields, **remote},
+                                  record.modified_at))
+        await self.store.apply_remote(self.agency_id, entity_type, updates)
+        await self.store.save_links(self.agency_id, self.provider, entity_type, new_links)
+        await self.store.requeue(self.agency_id, entity_type, pending_push)
+        stats.applied += len(updates)
+
+    async def _push(self, entity_type: str, cursor: SyncCursor, stats: SyncStats) -> None:
+        failed = set()
+        while True:
+            local_ids, position = await self.store.read_changes(self.agency_id, entity_type, cursor,
+                                                                self.push_page_size)
+            # Failures are requeued behind the cursor; once only they remain, leave them for the next run
+            if position is None or failed.issuperset(local_ids):
+                return
+            local = await self.store.load_local(self.agency_id, self.provider, entity_type, local_ids)
+            outbound = []
+            for record in local.values():
+                if record.link is None:
+                    outbound.append(OutboundRecord(record.local_id, None, dict(record.fields), record.related))
+                    continue
+                changed = {name: value for name, value in record.fields.items()
+                           if record.link.synced.get(name) != value}
+                if changed:
+                    outbound.append(OutboundRecord(record.local_id, record.link.remote_id, changed, record.related))
+                else:
+                    stats.unchanged += 1
+            size = self.adapter.write_batch_size
+            for start in range(0, len(outbound), size):
+                failed.update(await self._write(entity_type, outbound[start:start + size], local, stats))
+            cursor.push_txid, cursor.push_id = position
+            await self.store.save_cursor(self.agency_id, self.provider, entity_type, cursor)
+
+    async def _write(self, entity_type: str, batch: List[OutboundRecord], local: Dict[str, LocalRecord],
+                     stats: SyncStats) -> List[str]:
+        results = await self.adapter.upsert(entity_type, batch)
+        links, failed = [], []
+        for record, result in zip(batch, results):
+            if not result.ok:
+                failed.append(record.local_id)
+                logger.warning(f"{self.provider} rejected {entity_type} {record.local_id}: {result.error}")
+                continue
+            previous = local[record.local_id].link
+            synced = {**(previous.synced if previous else {}), **record.fields}
+            links.append(Link(record.local_id, result.remote_id, synced, result.modified_at))
+            stats.pushed += 1
+            stats.created += record.remote_id is None
+        await self.store.save_links(self.agency_id, self.provider, entity_type, links)
+        # Failures go back on the log before the cursor moves past them
+        await self.store.requeue(self.agency_id, entity_type, failed)
+        stats.failed += len(failed)
+        return failed
+
+# -- runs ---------------------------------------------------------------------
+
+ENABLED_INTEGRATIONS_SQL = """
+SELECT agency_id, provider FROM public.crm_integrations WHERE enabled ORDER BY last_synced_at NULLS FIRST
+"""
+
+# Tokens live in Vault; config is tenant-editable and never supplies a secret or host
+LOAD_INTEGRATION_SQL = """
+SELECT i.conflict_policy, i.config, c.instance_url, s.decrypted_secret AS token
+FROM public.crm_integrations i
+LEFT JOIN public.crm_credentials c ON c.agency_id = i.agency_id AND c.provider = i.provider
+LEFT JOIN vault.decrypted_secrets s ON s.id = c.token_secret_id
+WHERE i.agency_id = $1 AND i.provider = $2 AND i.enabled
+"""
+
+RECORD_RUN_SQL = """
+UPDATE public.crm_integrations SET last_synced_at = CASE WHEN $3::text IS NULL THEN now() ELSE last_synced_at END,
+    last_error = $3, updated_at = now()
+WHERE agency_id = $1 AND provider = $2
+"""
+
+
+async def enabled_integrations(database=None) -> List[Tuple[str, str]]:
+    """``(agency_id, provider)`` for every enabled integration, least recently synced first"""
+    if database is None:
+        from immigration_ai.utils.database import get_database
+
+        database = get_database()
+    return [(str(row['agency_id']), row['provider']) for row in await database.fetch(ENABLED_INTEGRATIONS_SQL)]
+
+
+async def sync_integration(agency_id: str, provider: str, database=None) -> Optional[SyncStats]:
+    """Run one integration once; None when it is disabled or another worker is already running it"""
+    from immigration_ai.crm.integrations import create_adapter
+
+    if database is None:
+        from immigration_ai.utils.database import get_database
+
+        database = get_database()
+    row = await database.fetchrow(LOAD_INTEGRATION_SQL, agency_id, provider)
+    if row is None:
+        return None
+    try:
+        adapter = create_adapter(provider, row['config'] or {}, row['token'], row['instance_url'])
+    except IntegrationError as e:
+        await database.execute(RECORD_RUN_SQL, agency_id, provider, str(e))
+        raise
+    # Two runs of one integration would race on its cursors; the lock lives as long as this connection
+    async with database.connection() as connection:
+        lock = f'crm-sync:{agency_id}:{provider}'
+        if not await connection.fetchval('SELECT pg_try_advisory_lock(hashtext($1))', lock):
+            logger.info(f"CRM sync {provider}/{agency_id} is already running")
+            await adapter.close()
+            return None
+        try:
+            stats = await CRMSyncEngine(adapter, DatabaseSyncStore(database), agency_id,
+                                        policy=row['conflict_policy']).run_once()
+        except Exception as e:
+            await database.execute(RECORD_RUN_SQL, agency_id, provider, str(e))
+            raise
+        finally:
+            await adapter.close()
+            await connection.execute('SELECT pg_advisory_unlock(hashtext($1))', lock)
+        await database.execute(RECORD_RUN_SQL, agency_id, provider, None)
+        return stats
@@ -1 +1,380 @@
+"""
+Workload-aware task assignment
 
+An in-memory index of one agency's open tasks and the staff who can take
+them. It answers three questions without scanning the task table:
+
+* **Who should take this task?** Staff sit in one min-heap per skill (a
+  case type or task category), plus one heap of everyone. Each heap is
+  keyed by open workload relative to capacity. Picking an assignee is a
+  heap peek. Recording the assignment pushes the staff member's new key,
+  O(log n) per heap they belong to. Superseded heap entries are skipped
+  when they surface and compacted away in bulk.
+* **What is on my plate?** Every staff member has a task heap ordered by
+  due date, then priority. The next task is its top, and the full list is
+  a sort of that member's tasks only.
+* **What is overdue?** One due-date index. New due dates are appended and
+  the index is re-sorted when next read; Timsort merges the sorted prefix
+  with the short appended run. The overdue tasks are the prefix before
+  ``now``, found with ``bisect``.
+
+When staff are out, :meth:`AssignmentEngine.rebalance` hands their tasks to
+the rest of the team, earliest due first, so the most urgent work lands
+on the least loaded people. ``crm/services.py`` keeps one engine per
+agency, loaded from the ``tasks`` table, and writes assignments back.
+"""
+
+import heapq
+from bisect import bisect_left
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from immigration_ai.core.exceptions import ResourceNotFoundError, ValidationError
+
+PRIORITIES = {'urgent': 0, 'high': 1, 'medium': 2, 'low': 3}
+OPEN_STATUSES = ('open', 'in_progress')
+ANY_SKILL = '*'
+DEFAULT_CAPACITY = 20.0
+
+# Rebuild a heap once superseded entries outnumber live ones this many times over
+COMPACT_RATIO = 3
+
+
+@dataclass
+class Task:
+    """An open task as the index sees it
+
+    ``skill`` is what the assignee needs, usually the case type or the
+    task category. ``effort`` is the task's weight against the assignee's
+    capacity.
+    """
+    id: str
+    title: str = ''
+    priority: str = 'medium'
+    due_date: Optional[datetime] = None
+    skill: Optional[str] = None
+    effort: float = 1.0
+    assigned_to: Optional[str] = None
+    status: str = 'open'
+    category: Optional[str] = None
+    case_id: Optional[str] = None
+    client_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+
+@dataclass
+class StaffMember:
+    """Someone who can be assigned tasks; ``load`` is the effort of their open tasks"""
+    id: str
+    skills: FrozenSet[str] = frozenset()
+    capacity: float = DEFAULT_CAPACITY
+    available: bool = True
+    load: float = 0.0
+    open_tasks: int = 0
+
+    @property
+    def utilization(self) -> float:
+        return self.load / self.capacity if self.capacity > 0 else float('inf')
+
+
+@dataclass
+class Move:
+    """One task moved by a rebalance; ``to`` is None when nobody could take it"""
+    task_id: str
+    source: Optional[str]
+    to: Optional[str]
+
+
+def _order(task: Task, seq: int) -> Tuple:
+    # Due date first (undated last), then priority, then arrival
+    due = (0, task.due_date.timestamp()) if task.due_date else (1, 0.0)
+    return due + (PRIORITIES.get(task.priority, len(PRIORITIES)), seq)
+
+
+class TaskQueue:
+    """One person's open tasks, due soonest first; removal is lazy"""
+
+    def __init__(self):
+        self._heap: List[Tuple[Tuple, str]] = []
+        self._live: Dict[str, Tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._live
+
+    def push(self, key: Tuple, task_id: str) -> None:
+        self._live[task_id] = key
+        heapq.heappush(self._heap, (key, task_id))
+
+    def remove(self, task_id: str) -> None:
+        self._live.pop(task_id, None)
+        if len(self._heap) > COMPACT_RATIO * (len(self._live) + 1):
+            self._heap = [(key, task_id) for task_id, key in self._live.items()]
+            heapq.heapify(self._heap)
+
+    def peek(self) -> Optional[str]:
+        while self._heap and self._live.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][1] if self._heap else None
+
+    def ordered(self) -> List[str]:
+        return [task_id for key, task_id in sorted((key, task_id) for task_id, key in self._live.items())]
+
+
+class _StaffHeap:
+    """Staff with one skill, least loaded first; superseded keys are skipped lazily"""
+
+    def __init__(self):
+        self.heap: List[Tuple[float, float, str]] = []
+        self.members: Set[str] = set()
+
+    def push(self, member: StaffMember) -> None:
+        heapq.heappush(self.heap, (member.utilization, member.load, member.id))
+
+    def compact(self, staff: Dict[str, StaffMember]) -> None:
+        if len(self.heap) > COMPACT_RATIO * (len(self.members) + 1):
+            self.heap = [(staff[i].utilization, staff[i].load, i) for i in self.members if staff[i].available]
+            heapq.heapify(self.heap)
+
+
+class AssignmentEngine:
+    """Open tasks and staff workload for one agency"""
+
+    def __init__(self, staff: Iterable[StaffMember] = (), tasks: Iterable[Task] = ()):
+        self.staff: Dict[str, StaffMember] = {}
+        self.tasks: Dict[str, Task] = {}
+        self._heaps: Dict[str, _StaffHeap] = {ANY_SKILL: _StaffHeap()}
+        self._queues: Dict[Optional[str], TaskQueue] = {None: TaskQueue()}
+        self._keys: Dict[str, Tuple] = {}
+        self._due: List[Tuple[float, str]] = []
+        self._due_sorted = True
+        self._seq = 0
+        for member in staff:
+            self.add_staff(member)
+        for task in tasks:
+            self.add_task(task, assign=False)
+
+    # -- staff ----------------------------------------------------------------
+
+    def add_staff(self, member: StaffMember) -> None:
+        """Add or update a staff member, keeping the load of tasks already indexed"""
+        previous = self.staff.get(member.id)
+        if previous is not None:
+            member.load, member.open_tasks = previous.load, previous.open_tasks
+            for skill in previous.skills - member.skills:
+                self._heaps[skill].members.discard(member.id)
+        self.staff[member.id] = member
+        self._queues.setdefault(member.id, TaskQueue())
+        for skill in (ANY_SKILL, *member.skills):
+            self._heaps.setdefault(skill, _StaffHeap()).members.add(member.id)
+        self._reindex(member)
+
+    def _member(self, staff_id: str) -> StaffMember:
+        member = self.staff.get(staff_id)
+        if member is None:
+            raise ResourceNotFoundError(f'Staff member {staff_id} not found')
+        return member
+
+    def _reindex(self, member: StaffMember) -> None:
+        if not member.available:
+            return
+        for skill in (ANY_SKILL, *member.skills):
+            heap = self._heaps[skill]
+            heap.push(member)
+            heap.compact(self.staff)
+
+    def set_available(self, staff_id: str, available: bool) -> None:
+        member = self._member(staff_id)
+        if member.available != available:
+            member.available = available
+            self._reindex(member)
+
+    # -- choosing -------------------------------------------------------------
+
+    def _heaps_for(self, skill: Optional[str]) -> List[_StaffHeap]:
+        # Skilled staff first; when none is free, the whole team rather than leave the task unowned
+        heap = self._heaps.get(skill) if skill else None
+        return [heap, self._heaps[ANY_SKILL]] if heap is not None and heap.members else [self._heaps[ANY_SKILL]]
+
+    def _current(self, entry: Tuple[float, float, str], heap: _StaffHeap) -> bool:
+        member = self.staff.get(entry[2])
+        return (member is not None and member.available and entry[2] in heap.members
+                and entry[:2] == (member.utilization, member.load))
+
+    def candidates(self, skill: Optional[str] = None, limit: int = 3) -> List[StaffMember]:
+        """The ``limit`` least loaded available staff with ``skill``, in O(limit · log n)"""
+        chosen: Dict[str, StaffMember] = {}
+        for heap in self._heaps_for(skill):
+            taken = []
+            while heap.heap and len(chosen) < limit:
+                entry = heapq.heappop(heap.heap)
+                if self._current(entry, heap):
+                    taken.append(entry)
+                    chosen.setdefault(entry[2], self.staff[entry[2]])
+            for entry in taken:
+                heapq.heappush(heap.heap, entry)
+        return list(chosen.values())
+
+    def choose(self, skill: Optional[str] = None, effort: float = 1.0,
+               respect_capacity: bool = True) -> Optional[StaffMember]:
+        """The least loaded available staff member with ``skill``; None when everyone is full"""
+        for heap in self._heaps_for(skill):
+            while heap.heap and not self._current(heap.heap[0], heap):
+                heapq.heappop(heap.heap)
+            if not heap.heap:
+                continue
+            member = self.staff[heap.heap[0][2]]
+            if not respect_capacity or member.load == 0 or member.load + effort <= member.capacity:
+                return member
+        return None
+
+    # -- tasks ----------------------------------------------------------------
+
+    def add_task(self, task: Task, assign: bool = True, respect_capacity: bool = True) -> Optional[str]:
+        """Index an open task, choosing an assignee when it has none and ``assign`` is set"""
+        if task.id in self.tasks:
+            self.remove_task(task.id)
+        if task.priority not in PRIORITIES:
+            raise ValidationError(f"Unknown task priority '{task.priority}'")
+        self.tasks[task.id] = task
+        if task.due_date is not None:
+            self._due.append((task.due_date.timestamp(), task.id))
+            self._due_sorted = False
+        owner = task.assigned_to
+        if owner is None and assign:
+            chosen = self.choose(task.skill, task.effort, respect_capacity)
+            owner = chosen.id if chosen else None
+        elif owner is not None and owner not in self.staff:
+            # Assigned to someone outside the team (a former member): keep it visible, count no load
+            self.add_staff(StaffMember(owner, available=False))
+        self._place(task, owner)
+        return owner
+
+    def _place(self, task: Task, owner: Optional[str]) -> None:
+        self._seq += 1
+        key = _order(task, self._seq)
+        self._keys[task.id] = key
+        task.assigned_to = owner
+        self._queues[owner].push(key, task.id)
+        if owner is not None:
+            member = self.staff[owner]
+            member.load += task.effort
+            member.open_tasks += 1
+            self._reindex(member)
+
+    def _unplace(self, task: Task) -> None:
+        self._queues[task.assigned_to].remove(task.id)
+        if task.assigned_to is not None:
+            member = self.staff[task.assigned_to]
+            member.load = max(0.0, member.load - task.effort)
+            member.open_tasks -= 1
+            self._reindex(member)
+
+    def assign(self, task_id: str, staff_id: Optional[str] = None,
+               respect_capacity: bool = True) -> Optional[str]:
+        """Give a task to ``staff_id``, or to the best available candidate; returns the assignee"""
+        task = self.get(task_id)
+        if staff_id is None:
+            self._unplace(task)
+            chosen = self.choose(task.skill, task.effort, respect_capacity)
+            staff_id = chosen.id if chosen else None
+        else:
+            self._member(staff_id)
+            self._unplace(task)
+        self._place(task, staff_id)
+        return staff_id
+
+    def suggest(self, task_id: str, respect_capacity: bool = True) -> Optional[str]:
+        """Who :meth:`assign` would give ``task_id`` to, without moving it"""
+        task = self.get(task_id)
+        owner = task.assigned_to
+        self._unplace(task)
+        try:
+            chosen = self.choose(task.skill, task.effort, respect_capacity)
+        finally:
+            self._place(task, owner)
+        return chosen.id if chosen else None
+
+    def unassign(self, task_id: str) -> None:
+        task = self.get(task_id)
+        self._unplace(task)
+        self._place(task, None)
+
+    def remove_task(self, task_id: str) -> Task:
+        """Drop a task that was completed or cancelled"""
+        task = self.get(task_id)
+        self._unplace(task)
+        del self.tasks[task_id]
+        del self._keys[task_id]
+        if task.due_date is not None:
+            index = bisect_left(self._sorted_due(), (task.due_date.timestamp(), task_id))
+            if index < len(self._due) and self._due[index][1] == task_id:
+                del self._due[index]
+        return task
+
+    def get(self, task_id: str) -> Task:
+        task = self.tasks.get(task_id)
+        if task is None:
+            raise ResourceNotFoundError(f'Task {task_id} not found')
+        return task
+
+    def _sorted_due(self) -> List[Tuple[float, str]]:
+        if not self._due_sorted:
+            self._due.sort()
+            self._due_sorted = True
+        return self._due
+
+    # -- views ----------------------------------------------------------------
+
+    def my_tasks(self, staff_id: Optional[str]) -> List[Task]:
+        """``staff_id``'s open tasks (None: the unassigned ones), due soonest first"""
+        queue = self._queues.get(staff_id)
+        return [self.tasks[task_id] for task_id in queue.ordered()] if queue else []
+
+    def next_task(self, staff_id: Optional[str]) -> Optional[Task]:
+        queue = self._queues.get(staff_id)
+        task_id = queue.peek() if queue else None
+        return self.tasks[task_id] if task_id else None
+
+    def overdue(self, now: datetime, staff_id: Optional[str] = None) -> List[Task]:
+        """Open tasks due before ``now``, most overdue first"""
+        due = self._sorted_due()
+        end = bisect_left(due, (now.timestamp(), ''))
+        tasks = [self.tasks[task_id] for _, task_id in due[:end]]
+        if staff_id is not None:
+            tasks = [task for task in tasks if task.assigned_to == staff_id]
+        return tasks
+
+    def workload(self) -> List[StaffMember]:
+        return sorted(self.staff.values(), key=lambda member: (member.utilization, member.id))
+
+    # -- rebalancing ----------------------------------------------------------
+
+    def rebalance(self, staff_ids: Iterable[str], respect_capacity: bool = True) -> List[Move]:
+        """Mark ``staff_ids`` unavailable and hand their open tasks to everyone else
+
+        Tasks move earliest due first. A task nobody can take (no one
+        available, or everyone at capacity) becomes unassigned.
+        """
+        leaving = list(dict.fromkeys(staff_ids))
+        for staff_id in leaving:
+            self.set_available(staff_id, False)
+        queue = sorted((self._keys[task_id], task_id)
+                       for staff_id in leaving for task_id in self._queues[staff_id].ordered())
+        moves = []
+        for _, task_id in queue:
+            source = self.tasks[task_id].assigned_to
+            moves.append(Move(task_id, source, self.assign(task_id, respect_capacity=respect_capacity)))
+        return moves
+
+    def assign_unassigned(self, respect_capacity: bool = True) -> List[Move]:
+        """Offer unassigned tasks to the team again, earliest due first"""
+        moves = []
+        for task_id in self._queues[None].ordered():
+            owner = self.assign(task_id, respect_capacity=respect_capacity)
+            if owner is not None:
+                moves.append(Move(task_id, None, owner))
+        return moves
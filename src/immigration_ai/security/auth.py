@@ -1 +1,326 @@
+"""
+Authentication of Supabase-issued JWT access tokens
 
+Verifying a token and resolving the caller's role and agency happens once
+per token, not once per request. :class:`TokenCache` keeps the derived
+:class:`Principal` keyed by the token's SHA-256, for no longer than the
+token's own expiry and ``max_age``. ``max_age`` bounds how long a role
+change or deactivation can go unnoticed: role and agency claims in a token
+are only trusted while the token is younger than ``max_age``, after which
+``public.users`` is read again. Signing keys are either the project's
+HS256 secret or the project's JWKS (RS256). :class:`JWKSCache` holds the
+JWKS locally and refreshes it in the background. The API fetches it at
+startup; after that only a token signed with a key id it has not seen
+fetches inline, at most once per ``min_refresh_interval``.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from immigration_ai.core.exceptions import AuthenticationError, ConfigurationError
+
+logger = logging.getLogger(__name__)
+
+JWT_SECRET_ENV = 'SUPABASE_JWT_SECRET'
+JWKS_URL_ENV = 'SUPABASE_JWKS_URL'
+DEFAULT_AUDIENCE = 'authenticated'
+CLOCK_SKEW_SECONDS = 30
+
+TOKEN_CACHE_MAX_ENTRIES = 10000
+# How long a derived principal is trusted before role/agency are re-read
+PRINCIPAL_MAX_AGE_SECONDS = 60
+JWKS_REFRESH_SECONDS = 600
+# Unknown key ids trigger a refresh, at most this often
+JWKS_MIN_REFRESH_SECONDS = 30
+# Custom access token hook claims: {"app_metadata": {"agency_id": ..., "role": ...}}
+PRINCIPAL_CLAIMS = 'app_metadata'
+
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated caller: who they are, which agency, which role"""
+    user_id: str
+    agency_id: Optional[str]
+    role: str
+    expires_at: float = 0.0
+
+    @property
+    def is_agency_user(self) -> bool:
+        return self.role in ('agency_admin', 'agency_staff')
+
+
+UserLookup = Callable[[str], Optional[Dict[str, Any]]]
+
+
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def _b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def encode_jwt(claims: Dict[str, Any], secret: str) -> str:
+    """Sign ``claims`` as an HS256 JWT (used by tests and service tokens)"""
+    header = _b64url_encode(json.dumps({'alg': 'HS256', 'typ': 'JWT'}, separators=(',', ':')).encode())
+    payload = _b64url_encode(json.dumps(claims, separators=(',', ':')).encode())
+    signature = hmac.new(secret.encode(), f'{header}.{payload}'.encode(), hashlib.sha256).digest()
+    return f'{header}.{payload}.{_b64url_encode(signature)}'
+
+
+# ASN.1 DigestInfo prefix for SHA-256 in PKCS#1 v1.5 signatures
+_SHA256_DIGEST_INFO = bytes.fromhex('3031300d060960864801650304020105000420')
+
+
+def _b64url_int(segment: str) -> int:
+    return int.from_bytes(_b64url_decode(segment), 'big')
+
+
+def verify_rs256(signing_input: bytes, signature: bytes, jwk: Dict[str, Any]) -> bool:
+    """Check an RSASSA-PKCS1-v1_5 SHA-256 signature against an RSA JWK"""
+    n, e = _b64url_int(jwk['n']), _b64url_int(jwk['e'])
+    size = (n.bit_length() + 7) // 8
+    if len(signature) != size:
+        return False
+    encoded = pow(int.from_bytes(signature, 'big'), e, n).to_bytes(size, 'big')
+    digest_info = _SHA256_DIGEST_INFO + hashlib.sha256(signing_input).digest()
+    expected = b'\x00\x01' + b'\xff' * (size - len(digest_info) - 3) + b'\x00' + digest_info
+    return hmac.compare_digest(encoded, expected)
+
+
+class JWKSCache:
+    """The project's signing keys, held locally and refreshed in the background
+
+    ``fetch`` returns the JWKS document (``{"keys": [...]}``); by default it
+    is read from ``url``. A token signed with an unknown ``kid`` triggers an
+    immediate refresh, rate-limited to one per ``min_refresh_interval``.
+    """
+
+    def __init__(self, url: Optional[str] = None, fetch: Optional[Callable[[], Dict[str, Any]]] = None,
+                 refresh_interval: float = JWKS_REFRESH_SECONDS,
+                 min_refresh_interval: float = JWKS_MIN_REFRESH_SECONDS):
+        if url is None and fetch is None:
+            raise ConfigurationError('JWKSCache needs a url or a fetch function')
+        self.url = url
+        self._fetch = fetch or self._fetch_url
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self._keys: Dict[str, Dict[str, Any]] = {}
+        self._attempted_at = float('-inf')
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _fetch_url(self) -> Dict[str, Any]:
+        from urllib.request import urlopen
+
+        with urlopen(self.url, timeout=5) as response:
+            return json.loads(response.read())
+
+    def refresh(self) -> None:
+        self._attempted_at = time.monotonic()
+        document = self._fetch()
+        keys = {key['kid']: key for key in document.get('keys', []) if key.get('kid')}
+        with self._lock:
+            self._keys = keys
+        logger.debug(f"Loaded {len(keys)} signing keys")
+
+    def get(self, kid: Optional[str]) -> Optional[Dict[str, Any]]:
+        self.start()
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._attempted_at >= self.min_refresh_interval:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"JWKS refresh failed: {e}")
+            key = self._keys.get(kid)
+        return key
+
+    def start(self) -> None:
+        """Start the background refresher (idempotent)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='jwks-refresh', daemon=True)
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning(f"Initial JWKS fetch failed: {e}")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the last good keys
+                logger.warning(f"JWKS refresh failed: {e}")
+
+
+def verify_jwt(token: str, secret: Optional[str] = None, audience: Optional[str] = DEFAULT_AUDIENCE,
+               now: Optional[float] = None, jwks: Optional[JWKSCache] = None) -> Dict[str, Any]:
+    """Verify a Supabase JWT (HS256 with ``secret``, RS256 with ``jwks``) and return its claims"""
+    try:
+        header_segment, payload_segment, signature_segment = token.split('.')
+        header = json.loads(_b64url_decode(header_segment))
+        claims = json.loads(_b64url_decode(payload_segment))
+        signature = _b64url_decode(signature_segment)
+    except ValueError:
+        raise AuthenticationError('Malformed access token') from None
+
+    signing_input = f'{header_segment}.{payload_segment}'.encode()
+    algorithm = header.get('alg')
+    if algorithm == 'HS256' and secret:
+        expected = hmac.new(secret.encode(), signing_input, hashlib.sha256).digest()
+        valid = hmac.compare_digest(signature, expected)
+    elif algorithm == 'RS256' and jwks is not None:
+        key = jwks.get(header.get('kid'))
+        if key is None or key.get('kty') != 'RSA':
+            raise AuthenticationError('Unknown token signing key')
+        valid = verify_rs256(signing_input, signature, key)
+    else:
+        raise AuthenticationError(f"Unsupported token algorithm {algorithm!r}")
+    if not valid:
+        raise AuthenticationError('Invalid token signature')
+
+    now = time.time() if now is None else now
+    # A token that never expires would also never end a realtime stream
+    if 'exp' not in claims:
+        raise AuthenticationError('Token has no expiry')
+    if now > claims['exp'] + CLOCK_SKEW_SECONDS:
+        raise AuthenticationError('Access token has expired')
+    if 'nbf' in claims and now < claims['nbf'] - CLOCK_SKEW_SECONDS:
+        raise AuthenticationError('Access token is not valid yet')
+    if audience is not None:
+        token_audience = claims.get('aud')
+        audiences = token_audience if isinstance(token_audience, list) else [token_audience]
+        if audience not in audiences:
+            raise AuthenticationError('Access token has the wrong audience')
+    if not claims.get('sub'):
+        raise AuthenticationError('Access token has no subject')
+    return claims
+
+
+class TokenCache:
+    """LRU of verified tokens, keyed by SHA-256 of the token
+
+    An entry lives until the token expires or ``max_age`` passes, whichever
+    comes first. Raw tokens are never stored. Entries are per process, so
+    ``max_age`` rather than explicit eviction is what bounds staleness.
+    """
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_MAX_ENTRIES, max_age: float = PRINCIPAL_MAX_AGE_SECONDS):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries: 'OrderedDict[str, Tuple[Principal, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, key: str, now: Optional[float] = None) -> Optional[Principal]:
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, principal: Principal, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        valid_until = now + self.max_age
+        if principal.expires_at:
+            valid_until = min(valid_until, principal.expires_at)
+        with self._lock:
+            self._entries[key] = (principal, valid_until)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class Authenticator:
+    """Turn a bearer token into a :class:`Principal`
+
+    The token signature is verified with the project's JWT secret or JWKS.
+    Role and agency come from the token's ``app_metadata`` claims when the
+    custom access token hook sets them and the token was issued less than
+    ``cache.max_age`` ago. Otherwise they are read from ``public.users``
+    through ``user_lookup`` (a callable returning the user row or ``None``),
+    which also catches deactivated users. Either way the result is cached
+    per token, so repeat requests skip both the signature check and the
+    lookup.
+    """
+
+    def __init__(self, secret: Optional[str] = None, user_lookup: Optional[UserLookup] = None,
+                 audience: Optional[str] = DEFAULT_AUDIENCE, jwks: Optional[JWKSCache] = None,
+                 cache: Optional[TokenCache] = None):
+        self.secret = secret or os.environ.get(JWT_SECRET_ENV)
+        if jwks is None and os.environ.get(JWKS_URL_ENV):
+            jwks = JWKSCache(os.environ[JWKS_URL_ENV])
+        self.jwks = jwks
+        if not self.secret and self.jwks is None:
+            raise ConfigurationError(f'{JWT_SECRET_ENV} or {JWKS_URL_ENV} must be set')
+        self.user_lookup = user_lookup
+        self.audience = audience
+        self.cache = cache if cache is not None else TokenCache()
+
+    def authenticate(self, token: str) -> Principal:
+        key = TokenCache.key(token)
+        principal = self.cache.get(key)
+        if principal is not None:
+            return principal
+        claims = verify_jwt(token, self.secret, audience=self.audience, jwks=self.jwks)
+        principal = self._principal(claims)
+        self.cache.put(key, principal)
+        return principal
+
+    def _principal(self, claims: Dict[str, Any], now: Optional[float] = None) -> Principal:
+        user_id = claims['sub']
+        expires_at = float(claims['exp'])
+        metadata = claims.get(PRINCIPAL_CLAIMS) or {}
+        now = time.time() if now is None else now
+        # Claims are a snapshot from when the token was issued; past max_age the database decides
+        fresh = 'iat' in claims and now - float(claims['iat']) <= self.cache.max_age
+        if metadata.get('role') and fresh:
+            return Principal(user_id=user_id, agency_id=metadata.get('agency_id'), role=str(metadata['role']),
+                             expires_at=expires_at)
+        if self.user_lookup is None:
+            raise ConfigurationError('No user lookup configured for authentication')
+        user = self.user_lookup(user_id)
+        if not user or user.get('is_active') is False:
+            raise AuthenticationError('User is not active')
+        return Principal(
+            user_id=user_id,
+            agency_id=user.get('agency_id'),
+            role=str(user.get('role') or 'client'),
+            expires_at=expires_at,
+        )
@@ -1 +1,355 @@
+"""
+Field-level envelope encryption for client PII
 
+Passport numbers, dates of birth and similar fields are encrypted per
+agency:
+
+* Each agency has versioned random **data keys**. They are stored wrapped
+  (AES-GCM) under the deployment's master key in
+  ``public.agency_data_keys`` and, once unwrapped, cached in memory. A bulk
+  import or export unwraps a key once, not once per field. :meth:`rotate`
+  adds a new version for new writes. Older versions stay readable, so
+  existing ciphertext keeps working until it is re-encrypted.
+* Values are sealed with AES-GCM in **batches** over a column of values:
+  one key lookup, one cipher object and one ``os.urandom`` call per batch.
+  The agency id and field name are bound in as associated data, so a
+  ciphertext cannot be moved to another agency or column.
+* **Blind indexes** are keyed HMACs of the normalized plaintext. They let
+  encrypted fields be looked up by equality (e.g. a passport number
+  search) without decrypting. Index keys are per agency, derived from a
+  separate index key rather than the master key, and do not rotate with
+  the data keys, so indexes stay valid across rotations.
+
+Ciphertexts are text: ``enc:v{version}:{base64(nonce || ciphertext)}``.
+AES-GCM comes from the optional ``cryptography`` package. The master key is
+32 random bytes, base64 encoded, in ``FIELD_ENCRYPTION_KEY``; the blind
+index key is another 32 random bytes in ``FIELD_INDEX_KEY``.
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from immigration_ai.core.exceptions import ConfigurationError, ServiceUnavailableError, ValidationError
+
+logger = logging.getLogger(__name__)
+
+MASTER_KEY_ENV = 'FIELD_ENCRYPTION_KEY'
+INDEX_KEY_ENV = 'FIELD_INDEX_KEY'
+CIPHERTEXT_PREFIX = 'enc:'
+NONCE_BYTES = 12
+KEY_BYTES = 32
+DATA_KEY_TTL_SECONDS = 3600
+DATA_KEY_CACHE_SIZE = 1024
+BLIND_INDEX_BYTES = 16
+
+# How PII fields are normalized before blind indexing; others are whitespace- and case-folded
+NORMALIZERS: Dict[str, Callable[[str], str]] = {
+    'passport_number': lambda value: ''.join(ch for ch in value.upper() if ch.isalnum()),
+    'date_of_birth': lambda value: value.strip()[:10],
+}
+# Client columns stored encrypted, each with a ``{field}_bidx`` blind index column
+ENCRYPTED_CLIENT_FIELDS = ('passport_number',)
+
+AEADFactory = Callable[[bytes], Any]
+
+
+def _aes_gcm(key: bytes):
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise ConfigurationError('Field encryption requires the cryptography package') from None
+    return AESGCM(key)
+
+
+def _default_normalize(value: str) -> str:
+    return ' '.join(value.split()).casefold()
+
+
+def is_encrypted(value: Any) -> bool:
+    """Whether a stored value is already ciphertext (rather than legacy plaintext)"""
+    return isinstance(value, str) and value.startswith(CIPHERTEXT_PREFIX)
+
+
+def _key_from_env(name: str) -> bytes:
+    encoded = os.environ.get(name)
+    if not encoded:
+        raise ConfigurationError(f'{name} is not set')
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except binascii.Error:
+        raise ConfigurationError(f'{name} is not valid base64') from None
+
+
+@dataclass(frozen=True)
+class DataKey:
+    """One unwrapped version of an agency's data key"""
+    agency_id: str
+    version: int
+    key: bytes
+
+
+# -- key storage ------------------------------------------------------
+
+class InMemoryKeyStore:
+    """Wrapped data keys held in process (tests, scripts)"""
+
+    def __init__(self):
+        self._keys: Dict[Tuple[str, int], bytes] = {}
+        self._lock = threading.Lock()
+
+    def latest_version(self, agency_id: str) -> Optional[int]:
+        versions = [version for agency, version in self._keys if agency == agency_id]
+        return max(versions) if versions else None
+
+    def get(self, agency_id: str, version: int) -> Optional[bytes]:
+        return self._keys.get((agency_id, version))
+
+    def add(self, agency_id: str, version: int, wrapped: bytes) -> bool:
+        """Store a new version; False if another writer created it first"""
+        with self._lock:
+            if (agency_id, version) in self._keys:
+                return False
+            self._keys[(agency_id, version)] = wrapped
+            return True
+
+
+# Postgres unique_violation, as PostgREST reports it in the error's ``code``
+UNIQUE_VIOLATION = '23505'
+
+
+class SupabaseKeyStore:
+    """Wrapped data keys in ``public.agency_data_keys`` (service role only)"""
+
+    def __init__(self, db=None):
+        self._db = db
+
+    @property
+    def db(self):
+        if self._db is None:
+            from immigration_ai.utils.database import get_supabase_client
+            self._db = get_supabase_client()
+        return self._db
+
+    def latest_version(self, agency_id: str) -> Optional[int]:
+        rows = (self.db.table('agency_data_keys').select('version').eq('agency_id', agency_id)
+                .order('version', desc=True).limit(1).execute().data) or []
+        return rows[0]['version'] if rows else None
+
+    def get(self, agency_id: str, version: int) -> Optional[bytes]:
+        rows = (self.db.table('agency_data_keys').select('wrapped_key').eq('agency_id', agency_id)
+                .eq('version', version).limit(1).execute().data) or []
+        return base64.b64decode(rows[0]['wrapped_key']) if rows else None
+
+    def add(self, agency_id: str, version: int, wrapped: bytes) -> bool:
+        try:
+            self.db.table('agency_data_keys').insert({
+                'agency_id': agency_id, 'version': version,
+                'wrapped_key': base64.b64encode(wrapped).decode('ascii'),
+            }).execute()
+        except Exception as e:
+            # (agency_id, version) is the primary key: a concurrent rotation won. Anything else is a real failure
+            if getattr(e, 'code', None) != UNIQUE_VIOLATION:
+                raise
+            logger.info(f"Data key v{version} for agency {agency_id} already created by another writer")
+            return False
+        return True
+
+
+# -- engine -----------------------------------------------------------
+
+class FieldEncryptor:
+    """Encrypt, decrypt and blind-index PII fields with per-agency data keys"""
+
+    def __init__(self, master_key: Optional[bytes] = None, index_key: Optional[bytes] = None, store=None,
+                 aead: AEADFactory = _aes_gcm, key_ttl: float = DATA_KEY_TTL_SECONDS,
+                 max_cached_keys: int = DATA_KEY_CACHE_SIZE):
+        if master_key is None:
+            master_key = _key_from_env(MASTER_KEY_ENV)
+        if index_key is None:
+            index_key = _key_from_env(INDEX_KEY_ENV)
+        if len(master_key) != KEY_BYTES or len(index_key) != KEY_BYTES:
+            raise ConfigurationError(f'The field encryption and index keys must be {KEY_BYTES} bytes')
+        if hmac.compare_digest(master_key, index_key):
+            # Blind indexes are stored next to the ciphertext; they must not be keyed by the master key
+            raise ConfigurationError('The blind index key must differ from the master key')
+        self.store = store if store is not None else SupabaseKeyStore()
+        self._aead = aead
+        self._master = aead(master_key)
+        self._index_root = index_key
+        self.key_ttl = key_ttl
+        self.max_cached_keys = max_cached_keys
+        self._keys: 'OrderedDict[Tuple[str, int], Tuple[DataKey, Any, float]]' = OrderedDict()
+        self._current: Dict[str, Tuple[int, float]] = {}
+        self._index_keys: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        self.unwraps = 0
+
+    # -- data keys ------------------------------------------------------
+
+    def _wrap_aad(self, agency_id: str, version: int) -> bytes:
+        return f'data-key:{agency_id}:{version}'.encode()
+
+    def _cipher(self, agency_id: str, version: int) -> Tuple[DataKey, Any]:
+        """The unwrapped key and a ready AEAD for one key version, from cache when fresh"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._keys.get((agency_id, version))
+            if entry is not None and entry[2] > now:
+                self._keys.move_to_end((agency_id, version))
+                return entry[0], entry[1]
+        wrapped = self.store.get(agency_id, version)
+        if wrapped is None:
+            raise ValidationError(f'Agency {agency_id} has no data key v{version}')
+        key = self._master.decrypt(wrapped[:NONCE_BYTES], wrapped[NONCE_BYTES:], self._wrap_aad(agency_id, version))
+        data_key, cipher = DataKey(agency_id, version, key), self._aead(key)
+        with self._lock:
+            self.unwraps += 1
+            self._keys[(agency_id, version)] = (data_key, cipher, now + self.key_ttl)
+            self._keys.move_to_end((agency_id, version))
+            while len(self._keys) > self.max_cached_keys:
+                self._keys.popitem(last=False)
+        return data_key, cipher
+
+    def _create(self, agency_id: str, version: int) -> None:
+        nonce = os.urandom(NONCE_BYTES)
+        wrapped = nonce + self._master.encrypt(nonce, os.urandom(KEY_BYTES), self._wrap_aad(agency_id, version))
+        if self.store.add(agency_id, version, wrapped):
+            logger.info(f"Created data key v{version} for agency {agency_id}")
+
+    def current_version(self, agency_id: str) -> int:
+        """The version new writes use, creating v1 on first use"""
+        now = time.monotonic()
+        cached = self._current.get(agency_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        version = self.store.latest_version(agency_id)
+        if version is None:
+            self._create(agency_id, 1)
+            version = self.store.latest_version(agency_id)
+            if version is None:
+                # Not cached, so the next write tries again
+                raise ServiceUnavailableError(f'No data key is available for agency {agency_id}')
+        self._current[agency_id] = (version, now + self.key_ttl)
+        return version
+
+    def rotate(self, agency_id: str) -> int:
+        """Start writing with a new data key version; old versions stay readable"""
+        version = (self.store.latest_version(agency_id) or 0) + 1
+        self._create(agency_id, version)
+        self._current.pop(agency_id, None)
+        return self.current_version(agency_id)
+
+    # -- encryption -----------------------------------------------------
+
+    @staticmethod
+    def _aad(agency_id: str, field: str) -> bytes:
+        return f'{agency_id}:{field}'.encode()
+
+    def encrypt_many(self, agency_id: str, field: str, values: Sequence[Optional[Any]]) -> List[Optional[str]]:
+        """Encrypt a column of values with the agency's current key; ``None`` stays ``None``"""
+        version = self.current_version(agency_id)
+        _, cipher = self._cipher(agency_id, version)
+        aad = self._aad(agency_id, field)
+        nonces = os.urandom(NONCE_BYTES * len(values))
+        prefix = f'{CIPHERTEXT_PREFIX}v{version}:'
+        encrypted = []
+        for i, value in enumerate(values):
+            if value is None:
+                encrypted.append(None)
+                continue
+            nonce = nonces[i * NONCE_BYTES:(i + 1) * NONCE_BYTES]
+            sealed = cipher.encrypt(nonce, str(value).encode('utf-8'), aad)
+            encrypted.append(prefix + base64.b64encode(nonce + sealed).decode('ascii'))
+        return encrypted
+
+    def decrypt_many(self, agency_id: str, field: str, tokens: Sequence[Optional[str]]) -> List[Optional[str]]:
+        """Decrypt a column; mixed key versions are fine, each is unwrapped once"""
+        aad = self._aad(agency_id, field)
+        ciphers: Dict[str, Any] = {}
+        decrypted = []
+        for token in tokens:
+            if token is None:
+                decrypted.append(None)
+                continue
+            try:
+                if not token.startswith(CIPHERTEXT_PREFIX):
+                    raise ValueError(token)
+                version_part, payload = token[len(CIPHERTEXT_PREFIX):].split(':', 1)
+                cipher = ciphers.get(version_part)
+                if cipher is None:
+                    cipher = ciphers[version_part] = self._cipher(agency_id, int(version_part.lstrip('v')))[1]
+                raw = base64.b64decode(payload, validate=True)
+            except (ValueError, binascii.Error):
+                raise ValidationError(f'Malformed encrypted {field} value') from None
+            try:
+                plaintext = cipher.decrypt(raw[:NONCE_BYTES], raw[NONCE_BYTES:], aad)
+            except Exception:
+                # InvalidTag: tampered, or sealed for another agency or field
+                raise ValidationError(f'Encrypted {field} value failed authentication') from None
+            decrypted.append(plaintext.decode('utf-8'))
+        return decrypted
+
+    def encrypt(self, agency_id: str, field: str, value: Optional[Any]) -> Optional[str]:
+        return self.encrypt_many(agency_id, field, [value])[0]
+
+    def decrypt(self, agency_id: str, field: str, token: Optional[str]) -> Optional[str]:
+        return self.decrypt_many(agency_id, field, [token])[0]
+
+    # -- blind indexes --------------------------------------------------
+
+    def _index_key(self, agency_id: str, field: str) -> bytes:
+        cache_key = f'{agency_id}:{field}'
+        key = self._index_keys.get(cache_key)
+        if key is None:
+            key = self._index_keys[cache_key] = hmac.new(self._index_root, cache_key.encode(), hashlib.sha256).digest()
+        return key
+
+    def blind_index_many(self, agency_id: str, field: str, values: Iterable[Optional[Any]]) -> List[Optional[str]]:
+        """Equality-searchable tokens for ``values`` (normalized, keyed per agency and field)"""
+        normalize = NORMALIZERS.get(field, _default_normalize)
+        key = self._index_key(agency_id, field)
+        return [
+            None if value is None else
+            hmac.new(key, normalize(str(value)).encode('utf-8'), hashlib.sha256).hexdigest()[:BLIND_INDEX_BYTES * 2]
+            for value in values
+        ]
+
+    def blind_index(self, agency_id: str, field: str, value: Optional[Any]) -> Optional[str]:
+        return self.blind_index_many(agency_id, field, [value])[0]
+
+    # -- rows -----------------------------------------------------------
+
+    def encrypt_rows(self, agency_id: str, rows: Sequence[Mapping[str, Any]],
+                     fields: Sequence[str] = ENCRYPTED_CLIENT_FIELDS) -> List[Dict[str, Any]]:
+        """Copies of ``rows`` with ``fields`` encrypted column by column, plus ``{field}_bidx`` indexes"""
+        out = [dict(row) for row in rows]
+        for field in fields:
+            if not any(field in row for row in rows):
+                continue
+            column = [row.get(field) for row in rows]
+            for row, token, index in zip(out, self.encrypt_many(agency_id, field, column),
+                                         self.blind_index_many(agency_id, field, column)):
+                if field in row:
+                    row[field] = token
+                    row[f'{field}_bidx'] = index
+        return out
+
+    def decrypt_rows(self, agency_id: str, rows: Sequence[Mapping[str, Any]],
+                     fields: Sequence[str] = ENCRYPTED_CLIENT_FIELDS) -> List[Dict[str, Any]]:
+        out = [dict(row) for row in rows]
+        for field in fields:
+            if not any(field in row for row in rows):
+                continue
+            for row, value in zip(out, self.decrypt_many(agency_id, field, [row.get(field) for row in rows])):
+                if field in row:
+                    row[field] = value
+        return out
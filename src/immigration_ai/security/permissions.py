@@ -1 +1,190 @@
+"""
+Role and permission model
 
+Mirrors the row-level security policies in ``supabase/migrations`` so the API
+can make the same decisions without a round trip to
+``get_user_role``/``get_user_agency_id``. Every ``(resource, action)`` pair
+gets one bit. Each role compiles at import to three integer masks, one per
+scope in which it may act:
+
+* ``any``: every row (e.g. reading active FAQ answers)
+* ``agency``: rows whose ``agency_id`` is the caller's agency
+* ``own``: rows the caller owns (their own profile, cases and documents)
+
+A check is then a dict lookup and a couple of ``&`` operations. For result
+sets, :func:`filter_authorized` resolves the role's scopes once and filters
+in a single pass, and :func:`row_permissions` returns each row's allowed
+actions as a bitmask the UI can test.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from immigration_ai.core.exceptions import PermissionDeniedError
+
+ROLES = ('agency_admin', 'agency_staff', 'client')
+ACTIONS = ('read', 'create', 'update', 'delete')
+
+# Resource -> column naming the owning user when rows are checked in the ``own`` scope
+# (``None``: rows have no owner). Case, document and conversation rows must be joined
+# with their client's ``user_id`` for that.
+RESOURCES: Dict[str, Optional[str]] = {
+    'agencies': None,
+    'users': 'id',
+    'clients': 'user_id',
+    'cases': 'client_user_id',
+    'case_notes': 'author_id',
+    'documents': 'client_user_id',
+    'conversations': 'client_user_id',
+    'messages': 'sender_id',
+    'faq': None,
+    'notifications': 'user_id',
+}
+
+ALL = ACTIONS
+# role -> scope -> resource -> actions; kept in step with the RLS policies
+ROLE_GRANTS: Dict[str, Dict[str, Dict[str, Sequence[str]]]] = {
+    'agency_admin': {
+        'any': {'faq': ALL},
+        'agency': {'agencies': ('read', 'update'), 'users': ALL, 'clients': ALL, 'cases': ALL,
+                   'case_notes': ALL, 'documents': ALL, 'conversations': ALL, 'messages': ('read', 'create')},
+        'own': {'users': ('read', 'update'), 'notifications': ('read', 'update', 'delete')},
+    },
+    'agency_staff': {
+        'any': {'faq': ('read',)},
+        'agency': {'agencies': ('read',), 'users': ('read',), 'clients': ALL, 'cases': ALL,
+                   'case_notes': ALL, 'documents': ALL, 'conversations': ALL, 'messages': ('read', 'create')},
+        'own': {'users': ('read', 'update'), 'notifications': ('read', 'update', 'delete')},
+    },
+    'client': {
+        'any': {'faq': ('read',)},
+        'agency': {'agencies': ('read',)},
+        'own': {'users': ('read', 'update'), 'clients': ('read',), 'cases': ('read',),
+                'documents': ('read', 'create'), 'conversations': ('read', 'create'),
+                'messages': ('read', 'create'), 'notifications': ('read', 'update', 'delete')},
+    },
+}
+
+BITS: Dict[Tuple[str, str], int] = {
+    (resource, action): 1 << (i * len(ACTIONS) + j)
+    for i, resource in enumerate(RESOURCES) for j, action in enumerate(ACTIONS)
+}
+
+
+@dataclass(frozen=True)
+class RoleMasks:
+    """A role's permissions compiled to one bitmask per scope"""
+    any: int = 0
+    agency: int = 0
+    own: int = 0
+
+    @property
+    def all(self) -> int:
+        return self.any | self.agency | self.own
+
+
+def permission(resource: str, action: str) -> int:
+    try:
+        return BITS[(resource, action)]
+    except KeyError:
+        raise ValueError(f'Unknown permission {resource}:{action}') from None
+
+
+def resource_mask(resource: str) -> int:
+    """Every action bit of ``resource``"""
+    return sum(permission(resource, action) for action in ACTIONS)
+
+
+def compile_roles(grants: Mapping[str, Mapping[str, Mapping[str, Sequence[str]]]]) -> Dict[str, RoleMasks]:
+    compiled = {}
+    for role, scopes in grants.items():
+        masks = {scope: 0 for scope in ('any', 'agency', 'own')}
+        for scope, resources in scopes.items():
+            if scope not in masks:
+                raise ValueError(f'Unknown permission scope {scope!r} for role {role}')
+            for resource, actions in resources.items():
+                for action in actions:
+                    masks[scope] |= permission(resource, action)
+        compiled[role] = RoleMasks(**masks)
+    return compiled
+
+
+ROLE_MASKS: Dict[str, RoleMasks] = compile_roles(ROLE_GRANTS)
+_NO_PERMISSIONS = RoleMasks()
+
+
+def masks_for(role: str) -> RoleMasks:
+    return ROLE_MASKS.get(role, _NO_PERMISSIONS)
+
+
+def decode(mask: int, resource: str) -> List[str]:
+    """Action names set in ``mask`` for ``resource``"""
+    return [action for action in ACTIONS if mask & BITS[(resource, action)]]
+
+
+# -- checks -----------------------------------------------------------
+
+def can(principal, resource: str, action: str, row: Optional[Mapping[str, Any]] = None,
+        owner_key: Optional[str] = None) -> bool:
+    """Whether ``principal`` may perform ``action`` on ``resource``
+
+    Without a row this answers "in some scope", which is what route-level
+    guards need. With a row the scope has to match it.
+    """
+    bit = permission(resource, action)
+    masks = masks_for(principal.role)
+    if masks.any & bit:
+        return True
+    if row is None:
+        return bool(masks.all & bit)
+    if masks.agency & bit and principal.agency_id is not None and row.get('agency_id') == principal.agency_id:
+        return True
+    owner_key = owner_key or RESOURCES[resource]
+    return bool(masks.own & bit and owner_key and row.get(owner_key) == principal.user_id)
+
+
+def require(principal, resource: str, action: str, row: Optional[Mapping[str, Any]] = None,
+            owner_key: Optional[str] = None) -> None:
+    if not can(principal, resource, action, row, owner_key):
+        raise PermissionDeniedError(f'Not allowed to {action} {resource}')
+
+
+def filter_authorized(principal, resource: str, action: str, rows: Iterable[Mapping[str, Any]],
+                      owner_key: Optional[str] = None) -> List[Mapping[str, Any]]:
+    """The rows ``principal`` may ``action``, in one pass
+
+    The role's scopes are resolved once, outside the loop. The loop then
+    only compares ``agency_id``/owner columns.
+    """
+    bit = permission(resource, action)
+    masks = masks_for(principal.role)
+    if masks.any & bit:
+        return list(rows)
+    owner_key = owner_key or RESOURCES[resource]
+    agency_id = principal.agency_id if masks.agency & bit else None
+    user_id = principal.user_id if masks.own & bit and owner_key else None
+    if agency_id is not None and user_id is not None:
+        return [row for row in rows if row.get('agency_id') == agency_id or row.get(owner_key) == user_id]
+    if agency_id is not None:
+        return [row for row in rows if row.get('agency_id') == agency_id]
+    if user_id is not None:
+        return [row for row in rows if row.get(owner_key) == user_id]
+    return []
+
+
+def row_permissions(principal, resource: str, rows: Iterable[Mapping[str, Any]],
+                    owner_key: Optional[str] = None) -> List[int]:
+    """Each row's allowed ``resource`` actions as a bitmask (test with :func:`permission`)"""
+    masks = masks_for(principal.role)
+    scope = resource_mask(resource)
+    any_actions, agency_actions, own_actions = masks.any & scope, masks.agency & scope, masks.own & scope
+    owner_key = owner_key or RESOURCES[resource]
+    if not owner_key:
+        own_actions = 0
+    agency_id, user_id = principal.agency_id, principal.user_id
+    return [
+        any_actions
+        | (agency_actions if agency_id is not None and row.get('agency_id') == agency_id else 0)
+        | (own_actions if row.get(owner_key) == user_id else 0)
+        for row in rows
+    ]
@@ -1 +1,408 @@
+"""
+Two-tier read cache with tag-based invalidation
 
+Case, client and agency reads go through a small in-process LRU/TTL tier in
+front of a shared tier that speaks the Redis command subset used here
+(``get``/``mget``/``set``/``delete``/``incr``/``expire``, and ``eval`` of
+one compare-and-delete script). Setting ``REDIS_URL`` uses a
+real Redis; otherwise :class:`InMemoryBackend` stands in for it, which is
+what tests and single-process development use.
+
+Every entry carries tags such as ``agency:{id}`` and ``case:{id}``. Each tag
+has a version counter in the shared tier; an entry records the versions
+of its tags when its value was loaded, and a read that finds a newer tag
+version treats the entry as a miss. Invalidating a tag is therefore a
+single ``INCR`` however many keys carry it, and a load that races with a
+mutation can never resurrect stale data. Tag keys expire
+``TAG_TTL_SECONDS`` after their last invalidation, which is longer than
+any entry may live, so a tag that has gone back to version 0 can no
+longer match an entry stored before it moved on. The local tier keeps its TTL
+short because invalidations from other processes only reach it when its
+entries expire.
+
+Misses are coalesced: within a process one caller loads while the others
+wait for its result, and across processes a short ``SET NX`` lock lets one
+worker rebuild an expired hot key (e.g. an agency dashboard) while the
+rest briefly poll the shared tier instead of all hitting the database.
+The lock holds a random token and is released only while it still holds
+that token, so a load that outlives ``LOCK_TTL_SECONDS`` cannot release a
+lock another worker has taken since.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL_ENV = 'REDIS_URL'
+DEFAULT_TTL_SECONDS = 300
+LOCAL_TTL_SECONDS = 5.0
+LOCAL_MAX_ENTRIES = 2048
+LOCK_TTL_SECONDS = 10
+LOCK_WAIT_SECONDS = 2.0
+LOCK_POLL_SECONDS = 0.02
+TTL_JITTER = 0.1
+# Entries live at most MAX_TTL_SECONDS; tag versions outlive them
+MAX_TTL_SECONDS = 12 * 3600
+TAG_TTL_SECONDS = 24 * 3600
+
+# Delete KEYS[1] only if it still holds ARGV[1]
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def agency_tag(agency_id: str) -> str:
+    return f'agency:{agency_id}'
+
+
+def case_tag(case_id: str) -> str:
+    return f'case:{case_id}'
+
+
+def client_tag(client_id: str) -> str:
+    return f'client:{client_id}'
+
+
+def user_tag(user_id: str) -> str:
+    return f'user:{user_id}'
+
+
+class InMemoryBackend:
+    """Process-local stand-in for Redis implementing the commands the cache uses"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._live(key)
+
+    def mget(self, keys: Iterable[str]) -> List[Optional[bytes]]:
+        with self._lock:
+            return [self._live(key) for key in keys]
+
+    def set(self, key: str, value: Any, ex: Optional[float] = None, nx: bool = False) -> Optional[bool]:
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        elif isinstance(value, int):
+            value = str(value).encode('ascii')
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return None
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+            return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            current = self._live(key)
+            value = int(current or 0) + 1
+            expires_at = self._data[key][1] if current is not None else None
+            self._data[key] = (str(value).encode('ascii'), expires_at)
+            return value
+
+    def expire(self, key: str, seconds: float) -> bool:
+        with self._lock:
+            current = self._live(key)
+            if current is None:
+                return False
+            self._data[key] = (current, time.monotonic() + seconds)
+            return True
+
+    def eval(self, script: str, numkeys: int, *keys_and_args: Any) -> int:
+        """Only :data:`RELEASE_LOCK_SCRIPT`, run atomically"""
+        if script != RELEASE_LOCK_SCRIPT:
+            raise NotImplementedError('InMemoryBackend only runs the lock release script')
+        key, token = keys_and_args
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        with self._lock:
+            if self._live(key) != token:
+                return 0
+            del self._data[key]
+            return 1
+
+    def flushdb(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+def create_backend(url: Optional[str] = None):
+    """Return a Redis client for ``url``/``REDIS_URL``, or an in-memory backend"""
+    url = url or os.environ.get(REDIS_URL_ENV)
+    if not url:
+        return InMemoryBackend()
+    import redis
+
+    return redis.Redis.from_url(url)
+
+
+@dataclass
+class _LocalEntry:
+    payload: bytes
+    tag_versions: Dict[str, int]
+    expires_at: float
+
+
+@dataclass
+class CacheStats:
+    local_hits: int = 0
+    shared_hits: int = 0
+    misses: int = 0
+    loads: int = 0
+    coalesced: int = 0
+    invalidations: int = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+@dataclass
+class _Flight:
+    """An in-progress load other callers for the same key wait on"""
+    done: threading.Event = field(default_factory=threading.Event)
+    value: Any = None
+    error: Optional[BaseException] = None
+
+
+class LocalCache:
+    """Bounded LRU of encoded entries with per-entry expiry"""
+
+    def __init__(self, max_entries: int = LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, _LocalEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[_LocalEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry.expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: _LocalEntry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_tagged(self, tags: Iterable[str]) -> None:
+        tags = set(tags)
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if tags.intersection(e.tag_versions)]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TwoTierCache:
+    """JSON-value cache: in-process LRU in front of a shared Redis-compatible tier"""
+
+    def __init__(self, backend=None, namespace: str = 'immigration_ai',
+                 default_ttl: float = DEFAULT_TTL_SECONDS, local_ttl: float = LOCAL_TTL_SECONDS,
+                 local_max_entries: int = LOCAL_MAX_ENTRIES, lock_wait: float = LOCK_WAIT_SECONDS):
+        self.backend = backend if backend is not None else create_backend()
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+        self.local_ttl = local_ttl
+        self.lock_wait = lock_wait
+        self.local = LocalCache(local_max_entries)
+        self.stats = CacheStats()
+        self._flights: Dict[str, _Flight] = {}
+        self._flights_lock = threading.Lock()
+
+    # -- keys ----------------------------------------------------------
+
+    def _value_key(self, key: str) -> str:
+        return f'{self.namespace}:v:{key}'
+
+    def _tag_key(self, tag: str) -> str:
+        return f'{self.namespace}:t:{tag}'
+
+    def _lock_key(self, key: str) -> str:
+        return f'{self.namespace}:l:{key}'
+
+    def tag_versions(self, tags: Iterable[str]) -> Dict[str, int]:
+        tags = list(tags)
+        if not tags:
+            return {}
+        raw = self.backend.mget([self._tag_key(tag) for tag in tags])
+        return {tag: int(value or 0) for tag, value in zip(tags, raw)}
+
+    # -- reads ---------------------------------------------------------
+
+    def _decode_shared(self, raw: Optional[bytes]) -> Optional[Tuple[bytes, Dict[str, int]]]:
+        if raw is None:
+            return None
+        header, _, payload = raw.partition(b'\n')
+        return payload, json.loads(header)
+
+    def _lookup(self, key: str, count: bool = True) -> Tuple[bool, Any]:
+        """``count=False`` for re-reads within one logical lookup (lock-wait polling)"""
+        entry = self.local.get(key)
+        if entry is not None:
+            self.stats.local_hits += count
+            return True, json.loads(entry.payload)
+
+        shared = self._decode_shared(self.backend.get(self._value_key(key)))
+        if shared is not None:
+            payload, versions = shared
+            if self.tag_versions(versions) == versions:
+                self.stats.shared_hits += count
+                self.local.set(key, _LocalEntry(payload, versions, time.monotonic() + self.local_ttl))
+                return True, json.loads(payload)
+        self.stats.misses += count
+        return False, None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        found, value = self._lookup(key)
+        return value if found else default
+
+    # -- writes --------------------------------------------------------
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, tags: Iterable[str] = (),
+            tag_versions: Optional[Dict[str, int]] = None) -> None:
+        """Store ``value`` under ``key``
+
+        ``tag_versions`` should be the versions read *before* the value was
+        loaded, so an invalidation that happened during the load wins.
+        """
+        tags = list(tags)
+        current = self.tag_versions(tags)
+        if tag_versions is not None and tag_versions != current:
+            # A tag was invalidated while the value was loading; don't cache it
+            return
+        versions = current
+        payload = json.dumps(value, default=str, separators=(',', ':')).encode('utf-8')
+        header = json.dumps(versions, separators=(',', ':')).encode('utf-8')
+        ttl = min(ttl or self.default_ttl, MAX_TTL_SECONDS)
+        ttl = ttl * (1 + random.uniform(0, TTL_JITTER))
+        self.backend.set(self._value_key(key), header + b'\n' + payload, ex=max(1, int(ttl)))
+        self.local.set(key, _LocalEntry(payload, versions, time.monotonic() + min(ttl, self.local_ttl)))
+
+    def delete(self, key: str) -> None:
+        self.local.delete(key)
+        self.backend.delete(self._value_key(key))
+
+    def invalidate_tags(self, *tags: str) -> None:
+        """Expire every entry carrying any of ``tags``"""
+        for tag in tags:
+            tag_key = self._tag_key(tag)
+            self.backend.incr(tag_key)
+            self.backend.expire(tag_key, TAG_TTL_SECONDS)
+        self.local.discard_tagged(tags)
+        self.stats.invalidations += len(tags)
+        logger.debug(f"Invalidated cache tags {', '.join(tags)}")
+
+    def clear_local(self) -> None:
+        self.local.clear()
+
+    # -- read-through with stampede protection -------------------------
+
+    def get_or_load(self, key: str, loader: Callable[[], Any], ttl: Optional[float] = None,
+                    tags: Iterable[str] = ()) -> Any:
+        """Return the cached value for ``key``, calling ``loader`` at most once on a miss"""
+        found, value = self._lookup(key)
+        if found:
+            return value
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self.stats.coalesced += 1
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._load(key, loader, ttl, list(tags))
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _load(self, key: str, loader: Callable[[], Any], ttl: Optional[float], tags: List[str]) -> Any:
+        lock_key = self._lock_key(key)
+        token = uuid.uuid4().hex
+        have_lock = bool(self.backend.set(lock_key, token, ex=LOCK_TTL_SECONDS, nx=True))
+        if not have_lock:
+            # Another process is rebuilding this key; wait for it to publish
+            deadline = time.monotonic() + self.lock_wait
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_SECONDS)
+                found, value = self._lookup(key, count=False)
+                if found:
+                    self.stats.coalesced += 1
+                    return value
+            logger.warning(f"Cache lock wait for {key} timed out; loading directly")
+        try:
+            versions = self.tag_versions(tags)
+            value = loader()
+            self.stats.loads += 1
+            self.set(key, value, ttl=ttl, tags=tags, tag_versions=versions)
+            return value
+        finally:
+            if have_lock:
+                self.backend.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+
+_cache: Optional[TwoTierCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> TwoTierCache:
+    """Return the process-wide cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TwoTierCache()
+    return _cache
@@ -1 +1,385 @@
+"""
+Database access for the API and workers
 
+Two paths exist. ``get_supabase_client()`` is the PostgREST client used by
+the synchronous services, where every query is an HTTP round trip.
+:class:`Database` is a pooled asyncpg connection layer for hot paths that
+need to talk to Postgres directly. Each process (a uvicorn worker or a
+Celery child) gets its own pool of ``DB_POOL_MIN_SIZE``..``DB_POOL_MAX_SIZE``
+connections. Statements are prepared once per connection and kept in
+asyncpg's per-connection LRU. :meth:`Database.transaction` is tracked in a
+context variable, so a service called inside another's transaction reuses
+its connection as a savepoint. Pool saturation is tracked in :class:`PoolMetrics`.
+
+Which path a service uses: the outboxes (email, SMS), notification
+fan-out, CRM sync and duplicate detection run on :class:`Database`. The
+request-path services (cases, clients, tasks, agencies and the document
+index) still go through PostgREST, behind the two-tier cache, and run as
+synchronous route handlers. Moving them onto the pool means making them
+async and is not done here.
+
+There is no transaction spanning a whole request. Handlers that need
+one open :meth:`Database.transaction` themselves. A scope held for the
+whole request would keep a pooled connection idle through the handler's
+other I/O. It would also delay commits the SMS and email outboxes must
+make before they acknowledge a request.
+
+``DB_STATEMENT_CACHE_SIZE=0`` must be set when connecting through a
+transaction-mode pooler (Supavisor/PgBouncer on port 6543), because
+prepared statements cannot outlive a transaction there.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from immigration_ai.core.exceptions import ConfigurationError
+
+logger = logging.getLogger(__name__)
+
+SUPABASE_URL_ENV = 'SUPABASE_URL'
+SUPABASE_KEY_ENV = 'SUPABASE_SERVICE_ROLE_KEY'
+DATABASE_URL_ENV = 'DATABASE_URL'
+
+DEFAULT_POOL_MIN_SIZE = 2
+DEFAULT_POOL_MAX_SIZE = 10
+DEFAULT_STATEMENT_CACHE_SIZE = 512
+DEFAULT_ACQUIRE_TIMEOUT = 5.0
+DEFAULT_STATEMENT_TIMEOUT_MS = 15000
+
+T = TypeVar('T')
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_supabase_client():
+    """Return the process-wide Supabase client (service role)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                url = os.environ.get(SUPABASE_URL_ENV)
+                key = os.environ.get(SUPABASE_KEY_ENV)
+                if not url or not key:
+                    raise ConfigurationError(f'{SUPABASE_URL_ENV} and {SUPABASE_KEY_ENV} must be set')
+                from supabase import create_client
+
+                _client = create_client(url, key)
+    return _client
+
+
+def fetch_user(user_id: str) -> Optional[Dict[str, Any]]:
+    """Return the ``public.users`` row used for authorization decisions"""
+    response = (
+        get_supabase_client()
+        .table('users')
+        .select('id, agency_id, role, is_active')
+        .eq('id', user_id)
+        .limit(1)
+        .execute()
+    )
+    rows = response.data or []
+    return rows[0] if rows else None
+
+
+def fetch_client(client_id: str) -> Optional[Dict[str, Any]]:
+    response = (
+        get_supabase_client()
+        .table('clients')
+        .select('id, user_id, agency_id')
+        .eq('id', client_id)
+        .limit(1)
+        .execute()
+    )
+    rows = response.data or []
+    return rows[0] if rows else None
+
+
+class QueryCounter:
+    """Wrap a Supabase client and record every query it executes
+
+    Tests wrap the service's client and use :func:`assert_num_queries` to
+    pin how many round trips an endpoint makes.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.queries: List[str] = []
+
+    def table(self, name: str) -> '_CountingQuery':
+        return _CountingQuery(self, name, self.client.table(name))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+
+class _CountingQuery:
+    def __init__(self, counter: QueryCounter, table: str, query):
+        self._counter = counter
+        self._table = table
+        self._query = query
+
+    def execute(self, *args, **kwargs):
+        self._counter.queries.append(self._table)
+        return self._query.execute(*args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._query, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return _CountingQuery(self._counter, self._table, result) if hasattr(result, 'execute') else result
+        return call
+
+
+@contextmanager
+def assert_num_queries(counter: QueryCounter, expected: int) -> Iterator[List[str]]:
+    """Fail unless exactly ``expected`` queries run inside the block"""
+    start = len(counter.queries)
+    executed: List[str] = []
+    yield executed
+    executed.extend(counter.queries[start:])
+    if len(executed) != expected:
+        raise AssertionError(f'Expected {expected} queries, {len(executed)} ran: {executed}')
+
+
+@dataclass
+class DatabaseSettings:
+    dsn: str
+    min_size: int = DEFAULT_POOL_MIN_SIZE
+    max_size: int = DEFAULT_POOL_MAX_SIZE
+    statement_cache_size: int = DEFAULT_STATEMENT_CACHE_SIZE
+    acquire_timeout: float = DEFAULT_ACQUIRE_TIMEOUT
+    statement_timeout_ms: int = DEFAULT_STATEMENT_TIMEOUT_MS
+    max_inactive_connection_lifetime: float = 300.0
+
+    @classmethod
+    def from_env(cls) -> 'DatabaseSettings':
+        dsn = os.environ.get(DATABASE_URL_ENV)
+        if not dsn:
+            raise ConfigurationError(f'{DATABASE_URL_ENV} is not set')
+        return cls(
+            dsn=dsn,
+            min_size=int(os.environ.get('DB_POOL_MIN_SIZE', DEFAULT_POOL_MIN_SIZE)),
+            max_size=int(os.environ.get('DB_POOL_MAX_SIZE', DEFAULT_POOL_MAX_SIZE)),
+            statement_cache_size=int(os.environ.get('DB_STATEMENT_CACHE_SIZE', DEFAULT_STATEMENT_CACHE_SIZE)),
+            acquire_timeout=float(os.environ.get('DB_ACQUIRE_TIMEOUT', DEFAULT_ACQUIRE_TIMEOUT)),
+            statement_timeout_ms=int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', DEFAULT_STATEMENT_TIMEOUT_MS)),
+        )
+
+
+@dataclass
+class PoolMetrics:
+    """Point-in-time pool usage plus counters since the pool opened"""
+    min_size: int
+    max_size: int
+    size: int = 0
+    idle: int = 0
+    in_use: int = 0
+    waiting: int = 0
+    peak_in_use: int = 0
+    peak_waiting: int = 0
+    acquisitions: int = 0
+    timeouts: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    @property
+    def saturation(self) -> float:
+        """Share of the maximum pool size currently checked out"""
+        return self.in_use / self.max_size if self.max_size else 0.0
+
+    @property
+    def mean_wait_ms(self) -> float:
+        return 1000 * self.total_wait_seconds / self.acquisitions if self.acquisitions else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data['saturation'] = self.saturation
+        data['mean_wait_ms'] = self.mean_wait_ms
+        return data
+
+
+async def _init_connection(connection, statement_timeout_ms: int) -> None:
+    """Per-connection setup: JSON codecs and a statement timeout"""
+    for type_name in ('json', 'jsonb'):
+        await connection.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+    await connection.execute(f'SET statement_timeout = {int(statement_timeout_ms)}')
+
+
+class Database:
+    """Per-process asyncpg pool with nestable transactions and metrics"""
+
+    def __init__(self, settings: Optional[DatabaseSettings] = None,
+                 pool_factory: Optional[Callable[..., Awaitable[Any]]] = None):
+        self.settings = settings or DatabaseSettings.from_env()
+        self._pool_factory = pool_factory
+        self._pool = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._metrics = PoolMetrics(min_size=self.settings.min_size, max_size=self.settings.max_size)
+        self._current: contextvars.ContextVar = contextvars.ContextVar(f'db_connection_{id(self)}', default=None)
+
+    async def connect(self) -> None:
+        if self._pool is not None:
+            return
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._pool is not None:
+                return
+            factory = self._pool_factory
+            if factory is None:
+                import asyncpg
+
+                factory = asyncpg.create_pool
+            settings = self.settings
+            self._pool = await factory(
+                settings.dsn, min_size=settings.min_size, max_size=settings.max_size,
+                statement_cache_size=settings.statement_cache_size,
+                max_inactive_connection_lifetime=settings.max_inactive_connection_lifetime,
+                init=lambda conn: _init_connection(conn, settings.statement_timeout_ms),
+            )
+            logger.info(f"Opened database pool ({settings.min_size}-{settings.max_size} connections)")
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    # -- connections ---------------------------------------------------
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Any]:
+        """Check a connection out of the pool, recording wait time and saturation"""
+        await self.connect()
+        metrics = self._metrics
+        metrics.waiting += 1
+        metrics.peak_waiting = max(metrics.peak_waiting, metrics.waiting)
+        started = time.perf_counter()
+        try:
+            connection = await self._pool.acquire(timeout=self.settings.acquire_timeout)
+        except asyncio.TimeoutError:
+            metrics.timeouts += 1
+            logger.warning(f"Database pool exhausted: waited {self.settings.acquire_timeout}s for a connection")
+            raise
+        finally:
+            metrics.waiting -= 1
+        waited = time.perf_counter() - started
+        metrics.acquisitions += 1
+        metrics.total_wait_seconds += waited
+        metrics.max_wait_seconds = max(metrics.max_wait_seconds, waited)
+        metrics.in_use += 1
+        metrics.peak_in_use = max(metrics.peak_in_use, metrics.in_use)
+        try:
+            yield connection
+        finally:
+            metrics.in_use -= 1
+            await self._pool.release(connection)
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Any]:
+        """The current request's connection if inside :meth:`transaction`, else a pooled one"""
+        current = self._current.get()
+        if current is not None:
+            yield current
+            return
+        async with self.acquire() as connection:
+            yield connection
+
+    @asynccontextmanager
+    async def transaction(self, isolation: str = 'read_committed', readonly: bool = False) -> AsyncIterator[Any]:
+        """Run the enclosed queries in one transaction on one connection
+
+        Nested calls (a service called from within a request transaction)
+        become savepoints on the same connection.
+        """
+        current = self._current.get()
+        if current is not None:
+            async with current.transaction():
+                yield current
+            return
+        async with self.acquire() as connection:
+            async with connection.transaction(isolation=isolation, readonly=readonly):
+                token = self._current.set(connection)
+                try:
+                    yield connection
+                finally:
+                    self._current.reset(token)
+
+    # -- queries -------------------------------------------------------
+
+    async def fetch(self, query: str, *args, timeout: Optional[float] = None) -> List[Any]:
+        async with self.connection() as connection:
+            return await connection.fetch(query, *args, timeout=timeout)
+
+    async def fetchrow(self, query: str, *args, timeout: Optional[float] = None) -> Optional[Any]:
+        async with self.connection() as connection:
+            return await connection.fetchrow(query, *args, timeout=timeout)
+
+    async def fetchval(self, query: str, *args, timeout: Optional[float] = None) -> Any:
+        async with self.connection() as connection:
+            return await connection.fetchval(query, *args, timeout=timeout)
+
+    async def execute(self, query: str, *args, timeout: Optional[float] = None) -> str:
+        async with self.connection() as connection:
+            return await connection.execute(query, *args, timeout=timeout)
+
+    async def executemany(self, query: str, args: List[tuple], timeout: Optional[float] = None) -> None:
+        async with self.connection() as connection:
+            await connection.executemany(query, args, timeout=timeout)
+
+    def metrics(self) -> PoolMetrics:
+        metrics = self._metrics
+        if self._pool is not None:
+            metrics.size = self._pool.get_size()
+            metrics.idle = self._pool.get_idle_size()
+        return PoolMetrics(**asdict(metrics))
+
+
+_databases: Dict[int, Database] = {}
+_databases_lock = threading.Lock()
+
+
+def get_database() -> Database:
+    """Return this process's :class:`Database`
+
+    Pools are keyed by pid: a forked Celery or gunicorn child must never
+    reuse sockets inherited from its parent.
+    """
+    pid = os.getpid()
+    database = _databases.get(pid)
+    if database is None:
+        with _databases_lock:
+            database = _databases.get(pid)
+            if database is None:
+                _databases.clear()
+                database = _databases[pid] = Database()
+    return database
+
+
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+_worker_loop_pid: Optional[int] = None
+
+
+def run_sync(coroutine: Awaitable[T]) -> T:
+    """Run ``coroutine`` on this process's long-lived event loop
+
+    Celery tasks are synchronous; the pool is bound to the loop it was
+    created on, so worker code reuses a single loop per process instead of
+    ``asyncio.run`` (which would open and close a pool per task).
+    """
+    global _worker_loop, _worker_loop_pid
+    if _worker_loop is None or _worker_loop.is_closed() or _worker_loop_pid != os.getpid():
+        _worker_loop = asyncio.new_event_loop()
+        _worker_loop_pid = os.getpid()
+    return _worker_loop.run_until_complete(coroutine)
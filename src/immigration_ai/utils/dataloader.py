@@ -0,0 +1,173 @@
+"""
+Request-scoped batch loaders
+
+Rendering a list of cases with their client, documents, notes and activity
+timeline issues one query per relation per row when each row is fetched on
+its own. A :class:`DataLoader` collects every key requested in the same
+"tick" and resolves them with one ``IN (...)`` query per relation. A tick is
+everything queued before the first result is read. Each loader also
+memoizes results for the life of the request, so asking for the same
+client twice costs nothing.
+
+Loaders hold per-request data and must not be shared between requests;
+build a fresh :class:`RequestLoaders` for each one.
+"""
+
+import logging
+from collections import defaultdict
+from typing import Any, Callable, Dict, Generic, Hashable, Iterable, List, Optional, Sequence, TypeVar
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+# PostgREST puts ``in.(...)`` filters in the URL; keep batches well under URL limits
+MAX_BATCH_SIZE = 200
+
+BatchFunction = Callable[[List[Any]], Dict[Any, Any]]
+
+
+class _Pending(Generic[V]):
+    """Handle for a value that resolves when its loader dispatches"""
+
+    def __init__(self, loader: 'DataLoader', key: Hashable):
+        self._loader = loader
+        self._key = key
+
+    def result(self) -> V:
+        return self._loader._resolve(self._key)
+
+
+class DataLoader(Generic[K, V]):
+    """Batch and memoize lookups by key
+
+    ``batch_fn`` receives a list of distinct keys and returns a mapping from
+    key to value; keys it omits resolve to ``default``.
+    """
+
+    def __init__(self, batch_fn: BatchFunction, default: Any = None, max_batch_size: int = MAX_BATCH_SIZE,
+                 name: Optional[str] = None):
+        self.batch_fn = batch_fn
+        self.default = default
+        self.max_batch_size = max_batch_size
+        self.name = name or getattr(batch_fn, '__name__', 'loader')
+        self._memo: Dict[Hashable, Any] = {}
+        self._queue: Dict[Hashable, None] = {}  # insertion-ordered set
+        self.batches = 0
+
+    def load(self, key: K) -> _Pending[V]:
+        if key not in self._memo:
+            self._queue[key] = None
+        return _Pending(self, key)
+
+    def load_many(self, keys: Iterable[K]) -> List[_Pending[V]]:
+        return [self.load(key) for key in keys]
+
+    def get(self, key: K) -> V:
+        return self.load(key).result()
+
+    def get_many(self, keys: Iterable[K]) -> List[V]:
+        return [pending.result() for pending in self.load_many(list(keys))]
+
+    def prime(self, key: K, value: V) -> None:
+        self._memo.setdefault(key, value)
+
+    def clear(self, key: Optional[K] = None) -> None:
+        if key is None:
+            self._memo.clear()
+        else:
+            self._memo.pop(key, None)
+
+    def dispatch(self) -> None:
+        """Resolve every queued key, ``max_batch_size`` keys per query"""
+        queue, self._queue = list(self._queue), {}
+        for start in range(0, len(queue), self.max_batch_size):
+            keys = queue[start:start + self.max_batch_size]
+            results = self.batch_fn(list(keys))
+            self.batches += 1
+            for key in keys:
+                self._memo[key] = results.get(key, self.default)
+        if queue:
+            logger.debug(f"{self.name}: resolved {len(queue)} keys in {self.batches} batches so far")
+
+    def _resolve(self, key: Hashable) -> Any:
+        if key not in self._memo:
+            self._queue[key] = None
+            self.dispatch()
+        value = self._memo[key]
+        # Group loaders share one default list object; hand out copies
+        return list(value) if isinstance(value, list) else value
+
+
+def index_rows(rows: Sequence[Dict[str, Any]], column: str = 'id') -> Dict[Any, Dict[str, Any]]:
+    return {row[column]: row for row in rows}
+
+
+def group_rows(rows: Sequence[Dict[str, Any]], column: str) -> Dict[Any, List[Dict[str, Any]]]:
+    grouped: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
+    for row in rows:
+        grouped[row[column]].append(row)
+    return grouped
+
+
+class RequestLoaders:
+    """The loaders one request uses, all scoped to the caller's agency"""
+
+    USER_COLUMNS = 'id, first_name, last_name, role'
+    CLIENT_COLUMNS = 'id, user_id, agency_id, nationality, immigration_status, updated_at'
+    CASE_COLUMNS = ('id, case_number, client_id, agency_id, case_type, status, title, priority, '
+                    'assigned_to, due_date, created_at, updated_at')
+    DOCUMENT_COLUMNS = 'id, case_id, client_id, document_type, file_name, is_verified, created_at'
+    NOTE_COLUMNS = 'id, case_id, author_id, content, is_private, created_at'
+    ACTIVITY_COLUMNS = 'id, case_id, user_id, activity_type, description, created_at'
+
+    def __init__(self, db, agency_id: str):
+        self.db = db
+        self.agency_id = agency_id
+        self.cases = DataLoader(self._load_cases, name='cases')
+        self.users = DataLoader(self._load_users, name='users')
+        self.clients = DataLoader(self._load_clients, name='clients')
+        self.cases_by_client = DataLoader(self._load_cases_by_client, default=[], name='cases_by_client')
+        self.documents_by_case = DataLoader(self._load_documents_by_case, default=[], name='documents_by_case')
+        self.notes_by_case = DataLoader(self._load_notes_by_case, default=[], name='notes_by_case')
+        self.activities_by_case = DataLoader(self._load_activities_by_case, default=[],
+                                             name='activities_by_case')
+
+    def _select(self, table: str, columns: str):
+        return self.db.table(table).select(columns)
+
+    def _load_cases(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        rows = (self._select('cases', self.CASE_COLUMNS)
+                .eq('agency_id', self.agency_id).in_('id', ids).execute().data) or []
+        return index_rows(rows)
+
+    def _load_users(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        rows = self._select('users', self.USER_COLUMNS).in_('id', ids).execute().data or []
+        return index_rows(rows)
+
+    def _load_clients(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        rows = (self._select('clients', self.CLIENT_COLUMNS)
+                .eq('agency_id', self.agency_id).in_('id', ids).execute().data) or []
+        return index_rows(rows)
+
+    def _load_cases_by_client(self, client_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        rows = (self._select('cases', self.CASE_COLUMNS).eq('agency_id', self.agency_id)
+                .in_('client_id', client_ids).order('updated_at', desc=True).execute().data) or []
+        return group_rows(rows, 'client_id')
+
+    def _load_documents_by_case(self, case_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        rows = (self._select('documents', self.DOCUMENT_COLUMNS).eq('agency_id', self.agency_id)
+                .in_('case_id', case_ids).order('created_at', desc=True).execute().data) or []
+        return group_rows(rows, 'case_id')
+
+    def _load_notes_by_case(self, case_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        # Callers only pass ids of cases already checked to belong to the agency
+        rows = (self._select('case_notes', self.NOTE_COLUMNS)
+                .in_('case_id', case_ids).order('created_at', desc=True).execute().data) or []
+        return group_rows(rows, 'case_id')
+
+    def _load_activities_by_case(self, case_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        rows = (self._select('case_activities', self.ACTIVITY_COLUMNS)
+                .in_('case_id', case_ids).order('created_at', desc=True).execute().data) or []
+        return group_rows(rows, 'case_id')
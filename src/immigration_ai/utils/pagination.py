@@ -0,0 +1,127 @@
+"""
+Keyset pagination and sparse fieldsets for list endpoints
+
+List endpoints page on ``(updated_at, id)`` in descending order. The cursor
+is the sort key of the last row returned, so the next page is an index
+range scan starting right after it. Page 100 costs the same as page 1,
+unlike ``OFFSET``, which has to read and discard every earlier row. The
+composite indexes that back this are in
+``supabase/migrations/20250703_keyset_pagination_indexes.sql``.
+
+Callers pick columns with ``fields=a,b,c`` so list views fetch and ship
+only what they render. The sort-key columns are always selected because
+the cursor is built from them.
+"""
+
+import base64
+import binascii
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from immigration_ai.core.exceptions import ValidationError
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+SORT_COLUMNS = ('updated_at', 'id')
+# PostgREST's default max-rows: a larger response is cut off without an error
+MAX_ROWS = 1000
+
+
+@dataclass
+class Page:
+    """One page of a keyset-paginated list"""
+    items: List[Dict[str, Any]] = field(default_factory=list)
+    next_cursor: Optional[str] = None
+    # The fieldset every item was projected to, in order
+    fields: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def encode_cursor(updated_at: Any, row_id: Any) -> str:
+    raw = json.dumps([str(updated_at), str(row_id)], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        updated_at, row_id = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValidationError('Invalid pagination cursor') from None
+    return str(updated_at), str(row_id)
+
+
+def clamp_page_size(limit: Optional[int]) -> int:
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    if limit < 1:
+        raise ValidationError('Page size must be at least 1')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def select_fields(requested: Optional[Iterable[str]], allowed: Sequence[str],
+                  default: Sequence[str]) -> List[str]:
+    """Resolve a sparse fieldset against the columns a list endpoint exposes"""
+    if isinstance(requested, str):
+        requested = requested.split(',')
+    fields = list(dict.fromkeys(f.strip() for f in requested or () if f.strip())) or list(default)
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValidationError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def select_clause(fields: Sequence[str]) -> str:
+    """Columns to fetch for ``fields``, including the sort key the cursor needs"""
+    return ', '.join(list(fields) + [c for c in SORT_COLUMNS if c not in fields])
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def apply_keyset(query, cursor: Optional[str], limit: int):
+    """Order ``query`` by ``(updated_at, id)`` descending and seek past ``cursor``
+
+    One extra row is requested so :func:`build_page` can tell whether a
+    next page exists without a count query.
+    """
+    if cursor:
+        updated_at, row_id = decode_cursor(cursor)
+        updated_at, row_id = _quote(updated_at), _quote(row_id)
+        query = query.or_(f'updated_at.lt.{updated_at},and(updated_at.eq.{updated_at},id.lt.{row_id})')
+    return query.order('updated_at', desc=True).order('id', desc=True).limit(limit + 1)
+
+
+def iter_all(make_query: Callable[[], Any], key: str = 'id',
+             batch_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Every row of ``make_query()``, read in ``key`` order one batch at a time
+
+    An unbounded select is silently truncated at ``max-rows``, so whole
+    sets (an index load, say) seek past the last ``key`` seen instead.
+    ``key`` must be unique and selected.
+    """
+    batch_size = batch_size or MAX_ROWS
+    last = None
+    while True:
+        query = make_query()
+        if last is not None:
+            query = query.gt(key, last)
+        rows = query.order(key).limit(batch_size).execute().data or []
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last = rows[-1][key]
+
+
+def build_page(rows: List[Dict[str, Any]], limit: int, fields: Optional[Sequence[str]] = None) -> Page:
+    """Trim the look-ahead row, build the next cursor and drop unrequested sort columns"""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]['updated_at'], rows[-1]['id']) if has_more and rows else None
+    if fields is not None:
+        rows = [{k: row.get(k) for k in fields} for row in rows]
+    return Page(items=rows, next_cursor=next_cursor, fields=list(fields) if fields is not None else [])
@@ -0,0 +1,62 @@
+"""
+Token-bucket rate limiting for outbound providers
+
+Email and SMS providers cap how fast an account may send. A bucket holds up
+to ``burst`` tokens and refills at ``rate`` tokens per second. Each send
+takes one token. :meth:`TokenBucket.acquire` waits until a token is
+available instead of sending and being throttled. Waiters are served in
+arrival order. :func:`backoff_delay` spaces out retries of sends that were
+throttled or failed anyway.
+"""
+
+import asyncio
+import random
+import time
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    """``rate`` tokens per second with bursts of up to ``burst``"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1.0))
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take ``tokens`` if available now; never waits"""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Seconds until ``tokens`` would be available"""
+        self._refill()
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """Wait for and take ``tokens`` (at most ``burst`` at a time)"""
+        tokens = min(tokens, self.burst)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(self.delay(tokens))
+
+
+def backoff_delay(attempt: int, base: float, cap: float, jitter: float = 0.2) -> float:
+    """Seconds before retry number ``attempt`` (1-based): exponential, capped, with +/- jitter"""
+    delay = min(cap, base * (2 ** max(attempt - 1, 0)))
+    return delay * (1 + random.uniform(-jitter, jitter))
@@ -0,0 +1,159 @@
+"""
+Blob storage backends
+
+``BlobStorage`` is the minimal interface the document pipeline needs from
+object storage (Supabase Storage / S3 in production). ``LocalBlobStorage``
+implements it on the local filesystem and doubles as the stand-in used by
+tests and local development.
+"""
+
+import abc
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Union
+
+from immigration_ai.core.exceptions import ConflictError, ResourceNotFoundError
+
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class BlobStorage(abc.ABC):
+    """Interface for key/value blob storage"""
+
+    @abc.abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def put(self, key: str, data: Union[bytes, BinaryIO]) -> int:
+        """Store ``data`` under ``key`` and return the number of bytes written"""
+
+    @abc.abstractmethod
+    def create(self, key: str, data: Union[bytes, BinaryIO]) -> int:
+        """Store ``data`` only if ``key`` does not exist yet; raise ``ConflictError`` if it does
+
+        This is the compare-and-set the upload sessions rely on; object
+        stores provide it as a conditional put (``If-None-Match: *``).
+        """
+
+    @abc.abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        ...
+
+    @abc.abstractmethod
+    def size(self, key: str) -> int:
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def list(self, prefix: str = '') -> Iterator[str]:
+        ...
+
+    def move(self, source: str, destination: str) -> None:
+        """Rename a blob; backends without server-side rename copy then delete"""
+        with self.open(source) as fh:
+            self.put(destination, fh)
+        self.delete(source)
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Return a filesystem path for ``key`` when the backend has one"""
+        return None
+
+    def read(self, key: str) -> bytes:
+        with self.open(key) as fh:
+            return fh.read()
+
+
+class LocalBlobStorage(BlobStorage):
+    """Filesystem-backed storage; writes are atomic via rename"""
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f'Invalid storage key: {key!r}')
+        return path
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def _write(self, key: str, data: Union[bytes, BinaryIO], overwrite: bool) -> int:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    fh.write(data)
+                else:
+                    shutil.copyfileobj(data, fh, COPY_CHUNK_BYTES)
+                written = fh.tell()
+            if overwrite:
+                os.replace(tmp, path)
+            else:
+                # link() fails if the target exists, so only one writer wins
+                try:
+                    os.link(tmp, path)
+                except FileExistsError:
+                    raise ConflictError(f'Blob {key} already exists') from None
+                os.unlink(tmp)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return written
+
+    def put(self, key: str, data: Union[bytes, BinaryIO]) -> int:
+        return self._write(key, data, overwrite=True)
+
+    def create(self, key: str, data: Union[bytes, BinaryIO]) -> int:
+        return self._write(key, data, overwrite=False)
+
+    def open(self, key: str) -> BinaryIO:
+        try:
+            return open(self._path(key), 'rb')
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f'Blob {key} not found') from None
+
+    def size(self, key: str) -> int:
+        try:
+            return self._path(key).stat().st_size
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f'Blob {key} not found') from None
+
+    def delete(self, key: str) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix: str = '') -> Iterator[str]:
+        base = self._path(prefix) if prefix else self.root
+        if base.is_file():
+            yield prefix
+            return
+        if not base.exists():
+            return
+        for path in sorted(base.rglob('*')):
+            if path.is_file() and not path.name.startswith('.upload-'):
+                yield path.relative_to(self.root).as_posix()
+
+    def move(self, source: str, destination: str) -> None:
+        target = self._path(destination)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(self._path(source), target)
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f'Blob {source} not found') from None
+
+    def local_path(self, key: str) -> Optional[Path]:
+        path = self._path(key)
+        return path if path.is_file() else None
@@ -1 +1,75 @@
+"""
+Input validation helpers
 
+Document rules mirror ``public.validate_document_upload`` in
+``supabase/migrations/20250628071832_teal_tooth.sql`` so the API rejects
+uploads before they ever reach storage.
+"""
+
+import re
+from typing import Dict, Optional, Tuple
+
+from immigration_ai.core.exceptions import ValidationError
+
+MAX_DOCUMENT_SIZE = 10 * 1024 * 1024  # 10MB, same as validate_document_upload
+
+ALLOWED_MIME_TYPES = (
+    'application/pdf',
+    'application/msword',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'image/jpeg',
+    'image/png',
+    'image/gif',
+    'text/plain',
+)
+
+# Leading bytes each declared MIME type must start with
+MAGIC_NUMBERS: Dict[str, Tuple[bytes, ...]] = {
+    'application/pdf': (b'%PDF-',),
+    'application/msword': (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',),
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': (b'PK\x03\x04',),
+    'image/jpeg': (b'\xff\xd8\xff',),
+    'image/png': (b'\x89PNG\r\n\x1a\n',),
+    'image/gif': (b'GIF87a', b'GIF89a'),
+}
+MAGIC_PREFIX_BYTES = max(len(m) for magics in MAGIC_NUMBERS.values() for m in magics)
+
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+UNSAFE_FILENAME_CHARS = re.compile(r'[^A-Za-z0-9._ -]+')
+
+
+def validate_email(email: str) -> bool:
+    return bool(email) and EMAIL_PATTERN.match(email) is not None
+
+
+def sanitize_filename(file_name: str) -> str:
+    """Strip path components and unsafe characters from an uploaded file name"""
+    base = file_name.replace('\\', '/').rsplit('/', 1)[-1]
+    cleaned = UNSAFE_FILENAME_CHARS.sub('_', base).strip(' .')
+    return cleaned[:255] or 'document'
+
+
+def validate_document_upload(file_name: str, file_size: Optional[int], mime_type: str,
+                             max_size: int = MAX_DOCUMENT_SIZE) -> None:
+    """Validate declared upload metadata; raises ``ValidationError``"""
+    if not file_name or not file_name.strip():
+        raise ValidationError('File name is required')
+    if file_size is not None and file_size < 0:
+        raise ValidationError('File size cannot be negative')
+    if file_size is not None and file_size > max_size:
+        raise ValidationError(f'File size exceeds maximum allowed size of {max_size // (1024 * 1024)}MB')
+    if mime_type not in ALLOWED_MIME_TYPES:
+        raise ValidationError('File type not allowed. Supported types: PDF, DOC, DOCX, JPG, PNG, GIF, TXT')
+
+
+def validate_magic_bytes(mime_type: str, head: bytes) -> None:
+    """Check the first bytes of an upload match its declared MIME type"""
+    if mime_type == 'text/plain':
+        if b'\x00' in head:
+            raise ValidationError('Text upload contains binary data')
+        return
+    expected = MAGIC_NUMBERS.get(mime_type)
+    if expected is None:
+        raise ValidationError(f'File type {mime_type} not allowed')
+    if not any(head.startswith(magic) for magic in expected):
+        raise ValidationError(f'File content does not match declared type {mime_type}')
@@ -1 +1,69 @@
+"""
+Celery application
 
+The API imports this module only to enqueue work, so it must stay cheap:
+nothing here imports a task module. Workers load the modules listed in
+``TASK_MODULES`` when they boot. Tasks that need the AI engine, the PDF
+processors or an integration client import them inside the task body, so
+a worker that only serves the email queue never loads them.
+``tools/import_profiler.py`` reports what a cold import of this module
+costs.
+"""
+
+import os
+
+from celery import Celery
+
+BROKER_URL_ENV = 'CELERY_BROKER_URL'
+RESULT_BACKEND_ENV = 'CELERY_RESULT_BACKEND'
+DEFAULT_BROKER_URL = 'redis://localhost:6379/0'
+EMAIL_OUTBOX_INTERVAL_ENV = 'EMAIL_OUTBOX_INTERVAL_SECONDS'
+CRM_SYNC_INTERVAL_ENV = 'CRM_SYNC_INTERVAL_SECONDS'
+BLOB_COLLECTION_INTERVAL_ENV = 'BLOB_COLLECTION_INTERVAL_SECONDS'
+
+TASK_MODULES = (
+    'immigration_ai.workers.tasks.ai_tasks',
+    'immigration_ai.workers.tasks.crm_tasks',
+    'immigration_ai.workers.tasks.data_tasks',
+    'immigration_ai.workers.tasks.email_tasks',
+    'immigration_ai.workers.tasks.sms_tasks',
+)
+
+
+def create_celery_app() -> Celery:
+    broker = os.environ.get(BROKER_URL_ENV) or os.environ.get('REDIS_URL') or DEFAULT_BROKER_URL
+    app = Celery('immigration_ai', broker=broker, backend=os.environ.get(RESULT_BACKEND_ENV),
+                 include=list(TASK_MODULES))
+    app.conf.update(
+        task_serializer='json',
+        accept_content=['json'],
+        result_serializer='json',
+        task_acks_late=True,
+        worker_prefetch_multiplier=1,
+        task_routes={
+            'immigration_ai.workers.tasks.ai_tasks.*': {'queue': 'ai'},
+            'immigration_ai.workers.tasks.crm_tasks.*': {'queue': 'crm'},
+            'immigration_ai.workers.tasks.email_tasks.*': {'queue': 'email'},
+            # Exact names win over patterns: passcodes get a queue of their own
+            'immigration_ai.workers.tasks.sms_tasks.send_otp': {'queue': 'sms-otp'},
+            'immigration_ai.workers.tasks.sms_tasks.*': {'queue': 'sms'},
+        },
+        beat_schedule={
+            'deliver-email-outbox': {
+                'task': 'immigration_ai.workers.tasks.email_tasks.deliver_outbox',
+                'schedule': float(os.environ.get(EMAIL_OUTBOX_INTERVAL_ENV, 15)),
+            },
+            'sync-crm-integrations': {
+                'task': 'immigration_ai.workers.tasks.crm_tasks.sync_all',
+                'schedule': float(os.environ.get(CRM_SYNC_INTERVAL_ENV, 300)),
+            },
+            'collect-document-blobs': {
+                'task': 'immigration_ai.workers.tasks.data_tasks.collect_document_blobs',
+                'schedule': float(os.environ.get(BLOB_COLLECTION_INTERVAL_ENV, 3600)),
+            },
+        },
+    )
+    return app
+
+
+app = create_celery_app()
@@ -0,0 +1,46 @@
+"""
+CRM sync and duplicate detection tasks
+"""
+
+from dataclasses import asdict
+
+from immigration_ai.workers.celery_app import app
+
+# Per worker process: holds each agency's duplicate index between runs
+_duplicates = None
+
+
+@app.task(name='immigration_ai.workers.tasks.crm_tasks.sync_all')
+def sync_all():
+    """Queue one sync per enabled CRM integration"""
+    from immigration_ai.crm.sync import enabled_integrations
+    from immigration_ai.utils.database import run_sync
+
+    integrations = run_sync(enabled_integrations())
+    for agency_id, provider in integrations:
+        sync_integration.delay(agency_id, provider)
+    return {'queued': len(integrations)}
+
+
+@app.task(name='immigration_ai.workers.tasks.crm_tasks.sync_integration')
+def sync_integration(agency_id: str, provider: str):
+    """Pull and push what changed since the integration's last run"""
+    from immigration_ai.crm.sync import sync_integration as run_integration
+    from immigration_ai.utils.database import run_sync
+
+    stats = run_sync(run_integration(agency_id, provider))
+    return asdict(stats) if stats else None
+
+
+@app.task(name='immigration_ai.workers.tasks.crm_tasks.find_duplicate_clients')
+def find_duplicate_clients(agency_id: str, full: bool = False):
+    """Look for duplicate clients: everyone when ``full``, otherwise clients created since the last run"""
+    from immigration_ai.crm.services import DuplicateClientService
+    from immigration_ai.utils.database import run_sync
+
+    global _duplicates
+    if _duplicates is None:
+        _duplicates = DuplicateClientService()
+    if full:
+        return run_sync(_duplicates.scan(agency_id))
+    return {'matches': len(run_sync(_duplicates.check_new_clients(agency_id)))}
@@ -1 +1,13 @@
+"""
+Document storage maintenance tasks
+"""
 
+from immigration_ai.workers.celery_app import app
+
+
+@app.task(name='immigration_ai.workers.tasks.data_tasks.collect_document_blobs')
+def collect_document_blobs():
+    """Delete document blobs that have had no references for the grace period"""
+    from immigration_ai.core.services.document_service import get_document_store
+
+    return {'collected': get_document_store().collect_garbage()}
@@ -1 +1,20 @@
+"""
+Email delivery tasks
+"""
 
+from dataclasses import asdict
+
+from immigration_ai.workers.celery_app import app
+
+
+@app.task(name='immigration_ai.workers.tasks.email_tasks.deliver_outbox')
+def deliver_outbox(provider: str = 'default'):
+    """Send every due ``email_outbox`` row for ``provider``
+
+    The engine and its SMTP pool live as long as the worker process, so
+    consecutive runs reuse the same open sessions.
+    """
+    from immigration_ai.communication.email.sender import get_delivery_engine
+    from immigration_ai.utils.database import run_sync
+
+    return asdict(run_sync(get_delivery_engine(provider).drain()))
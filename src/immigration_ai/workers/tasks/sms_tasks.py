@@ -0,0 +1,39 @@
+"""
+SMS delivery tasks
+"""
+
+from typing import List, Optional
+
+from immigration_ai.workers.celery_app import app
+
+
+def _dispatch(messages, provider: str) -> dict:
+    from immigration_ai.communication.sms.sender import get_sms_dispatcher, get_sms_status_log
+    from immigration_ai.utils.database import run_sync
+
+    async def run():
+        results = await get_sms_dispatcher(provider).send_many(messages)
+        # The log's background flush only runs while a task is running, so write before returning
+        await get_sms_status_log().flush()
+        return results
+
+    results = run_sync(run())
+    sent = sum(1 for result in results if result.ok)
+    return {'sent': sent, 'failed': len(results) - sent}
+
+
+@app.task(name='immigration_ai.workers.tasks.sms_tasks.send_messages')
+def send_messages(messages: List[dict], provider: str = 'default'):
+    """Send a batch of texts (``SMSMessage`` fields as dicts) within the provider's rate limits"""
+    from immigration_ai.communication.sms.sender import SMSMessage
+
+    return _dispatch([SMSMessage(**message) for message in messages], provider)
+
+
+@app.task(name='immigration_ai.workers.tasks.sms_tasks.send_otp')
+def send_otp(to: str, body: str, idempotency_key: str, agency_id: Optional[str] = None,
+             provider: str = 'default'):
+    """Send one passcode; routed to its own queue so reminder batches never sit in front of it"""
+    from immigration_ai.communication.sms.sender import SMSMessage
+
+    return _dispatch([SMSMessage.otp(to, body, idempotency_key=idempotency_key, agency_id=agency_id)], provider)
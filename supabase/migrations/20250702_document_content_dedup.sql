@@ -0,0 +1,162 @@
+/*
+  # Content-addressed document storage
+
+  1. Documents
+    - Add `content_sha256` (hex SHA-256 of the uploaded bytes), referencing
+      its `document_blobs` row; `file_path` is the blob's storage key
+    - Index by (agency_id, content_sha256) for per-tenant duplicate lookups
+
+  2. New Tables
+    - `document_blobs`: one row per distinct content hash, with a reference
+      count maintained by triggers on `documents`. `released_at` is when
+      the count last dropped to zero or an upload last claimed the blob
+    - `document_artifacts`: cached analysis/review output per content hash,
+      artifact kind and model version
+
+  3. Functions
+    - `claim_document_blob(hash, path, size, mime_type)` reserves a blob
+      for an upload before its document row is inserted and returns the
+      blob's storage path and whether this call created it
+    - `collect_document_blobs(grace_seconds)` deletes blobs unreferenced
+      for longer than the grace period and returns their storage paths so
+      the caller can delete the objects. A claim restarts the grace period,
+      so a blob being reused by an upload is never collected
+    - Both are `service_role` only
+
+  4. Security
+    - Blobs and artifacts are only visible to agencies that own a document
+      with the same content hash
+*/
+
+CREATE TABLE IF NOT EXISTS public.document_blobs (
+    content_sha256 text PRIMARY KEY CHECK (content_sha256 ~ '^[0-9a-f]{64}$'),
+    storage_path text NOT NULL,
+    file_size bigint NOT NULL,
+    mime_type text,
+    ref_count integer NOT NULL DEFAULT 0,
+    released_at timestamp with time zone DEFAULT now(),
+    created_at timestamp with time zone DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_document_blobs_released
+    ON public.document_blobs(released_at)
+    WHERE ref_count <= 0;
+
+ALTER TABLE public.documents ADD COLUMN IF NOT EXISTS content_sha256 text
+    REFERENCES public.document_blobs(content_sha256);
+
+CREATE INDEX IF NOT EXISTS idx_documents_content_sha256 ON public.documents(content_sha256);
+CREATE INDEX IF NOT EXISTS idx_documents_agency_content_sha256 ON public.documents(agency_id, content_sha256);
+
+CREATE TABLE IF NOT EXISTS public.document_artifacts (
+    content_sha256 text REFERENCES public.document_blobs(content_sha256) ON DELETE CASCADE NOT NULL,
+    kind text NOT NULL,
+    version text NOT NULL,
+    payload jsonb NOT NULL,
+    created_at timestamp with time zone DEFAULT now(),
+    PRIMARY KEY (content_sha256, kind, version)
+);
+
+ALTER TABLE public.document_blobs ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.document_artifacts ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Agency users can view blobs of their documents" ON public.document_blobs
+    FOR SELECT USING (
+        EXISTS (
+            SELECT 1 FROM public.documents d
+            WHERE d.content_sha256 = document_blobs.content_sha256
+            AND d.agency_id = public.get_user_agency_id(auth.uid())
+        )
+    );
+
+CREATE POLICY "Agency users can view artifacts of their documents" ON public.document_artifacts
+    FOR SELECT USING (
+        EXISTS (
+            SELECT 1 FROM public.documents d
+            WHERE d.content_sha256 = document_artifacts.content_sha256
+            AND d.agency_id = public.get_user_agency_id(auth.uid())
+        )
+    );
+
+-- Keep blob reference counts in step with document rows
+CREATE OR REPLACE FUNCTION public.update_document_blob_refs()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.content_sha256 IS NOT NULL THEN
+        UPDATE public.document_blobs
+        SET ref_count = ref_count - 1,
+            released_at = CASE WHEN ref_count <= 1 THEN now() ELSE released_at END
+        WHERE content_sha256 = OLD.content_sha256;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.content_sha256 IS NOT NULL THEN
+        UPDATE public.document_blobs
+        SET ref_count = ref_count + 1
+        WHERE content_sha256 = NEW.content_sha256;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER document_blob_refs_trigger
+    AFTER INSERT OR DELETE OR UPDATE OF content_sha256 ON public.documents
+    FOR EACH ROW EXECUTE FUNCTION public.update_document_blob_refs();
+
+-- Reserve a blob for an upload; the row lock orders it against collection
+CREATE OR REPLACE FUNCTION public.claim_document_blob(
+    p_content_sha256 text, p_storage_path text, p_file_size bigint, p_mime_type text)
+RETURNS TABLE (blob_path text, created boolean)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    INSERT INTO public.document_blobs AS b (content_sha256, storage_path, file_size, mime_type, released_at)
+    VALUES (p_content_sha256, p_storage_path, p_file_size, p_mime_type, now())
+    ON CONFLICT (content_sha256) DO UPDATE SET released_at = now()
+    RETURNING b.storage_path, (b.xmax = 0);
+$$;
+
+CREATE OR REPLACE FUNCTION public.collect_document_blobs(p_grace_seconds integer, p_limit integer DEFAULT 1000)
+RETURNS TABLE (blob_path text)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    DELETE FROM public.document_blobs
+    WHERE content_sha256 IN (
+        SELECT content_sha256 FROM public.document_blobs
+        WHERE ref_count <= 0 AND released_at < now() - make_interval(secs => p_grace_seconds)
+        ORDER BY released_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    AND ref_count <= 0
+    AND released_at < now() - make_interval(secs => p_grace_seconds)
+    RETURNING storage_path;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.claim_document_blob(text, text, bigint, text) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.collect_document_blobs(integer, integer) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.claim_document_blob(text, text, bigint, text) TO service_role;
+GRANT EXECUTE ON FUNCTION public.collect_document_blobs(integer, integer) TO service_role;
+
+-- Find an existing copy of the same content within the caller's agency
+CREATE OR REPLACE FUNCTION public.find_duplicate_document(p_content_sha256 text)
+RETURNS uuid
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT id FROM public.documents
+    WHERE agency_id = public.get_user_agency_id(auth.uid())
+    AND content_sha256 = p_content_sha256
+    ORDER BY created_at
+    LIMIT 1;
+$$;
@@ -0,0 +1,20 @@
+/*
+  # Indexes for keyset-paginated list views
+
+  1. Indexes
+    - `cases` and `clients`: (agency_id, updated_at DESC, id DESC) so a page
+      seek `WHERE agency_id = $1 AND (updated_at, id) < ($2, $3)
+      ORDER BY updated_at DESC, id DESC LIMIT n` is a single index range
+      scan, however deep the page
+    - `cases`: (agency_id, status, updated_at DESC, id DESC) for the
+      status-filtered case list
+*/
+
+CREATE INDEX IF NOT EXISTS idx_cases_agency_updated_id
+    ON public.cases(agency_id, updated_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_cases_agency_status_updated_id
+    ON public.cases(agency_id, status, updated_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_clients_agency_updated_id
+    ON public.clients(agency_id, updated_at DESC, id DESC);
@@ -0,0 +1,37 @@
+/*
+  # Envelope encryption for client PII
+
+  1. New Tables
+    - `agency_data_keys`: versioned per-agency data keys, each wrapped
+      (AES-GCM) under the deployment master key. Rows are only ever added;
+      old versions stay so older ciphertext remains readable after rotation
+
+  2. Clients
+    - `passport_number` holds `enc:v{version}:...` ciphertext, sealed by
+      `security/encryption.py` in `ClientService.update_client` and the bulk
+      importer (`tools/data_migration.py import`). Rows written before this
+      migration stay plaintext until `tools/data_migration.py
+      encrypt-clients` backfills them; reads accept both meanwhile
+    - Add `passport_number_bidx`, a keyed HMAC blind index, and index it per
+      agency for equality lookups on the encrypted value. It is keyed by
+      `FIELD_INDEX_KEY`, separate from the master key that wraps data keys
+
+  3. Security
+    - RLS enabled with no policies: only the service role reads wrapped keys
+*/
+
+CREATE TABLE IF NOT EXISTS public.agency_data_keys (
+    agency_id uuid REFERENCES public.agencies(id) ON DELETE CASCADE NOT NULL,
+    version integer NOT NULL CHECK (version > 0),
+    wrapped_key text NOT NULL,
+    created_at timestamp with time zone DEFAULT now(),
+    PRIMARY KEY (agency_id, version)
+);
+
+ALTER TABLE public.agency_data_keys ENABLE ROW LEVEL SECURITY;
+
+ALTER TABLE public.clients ADD COLUMN IF NOT EXISTS passport_number_bidx text;
+
+CREATE INDEX IF NOT EXISTS idx_clients_agency_passport_bidx
+    ON public.clients(agency_id, passport_number_bidx)
+    WHERE passport_number_bidx IS NOT NULL;
@@ -0,0 +1,393 @@
+/*
+  # Claim-based tenancy for row level security
+
+  Policies used to call `get_user_agency_id(auth.uid())` and
+  `get_user_role(auth.uid())` directly, and the case timeline tables nested
+  `IN (SELECT ...)` subqueries through `cases` and `clients`. Postgres could
+  evaluate those per row, and every subquery went through the RLS of the
+  table it read.
+
+  1. Claims
+    - `public.users` role and agency are mirrored into
+      `auth.users.raw_app_meta_data`, which Supabase issues as the
+      `app_metadata` claim of every access token (read by
+      `security/auth.py` as well). A role or agency change takes effect
+      when the user's token is next refreshed
+    - `auth_agency_id()` / `auth_role()` read the claim and fall back to the
+      `users` lookup for tokens issued before this migration
+    - `auth_client_ids()` / `auth_case_ids()` resolve a client user's own
+      rows once, as SECURITY DEFINER, instead of through nested RLS
+
+  2. Policies
+    - Rewritten so every auth call is a scalar subquery, e.g.
+      `agency_id = (SELECT public.auth_agency_id())`. The planner runs it
+      once per statement as an InitPlan and the predicate becomes a plain
+      comparison against an indexed column
+    - Client-only policies are gated on the role first, so staff queries
+      never evaluate them
+    - "Users can update their own profile" gains a `WITH CHECK` that keeps
+      `role` and `agency_id` at their stored values. Without it a user
+      could promote themselves, and the claims trigger would copy the new
+      role into their next token
+
+  3. Denormalization
+    - `case_activities` and `case_notes` get `agency_id`, backfilled from
+      `cases` and kept in step by triggers, so their agency policies no
+      longer join `cases`
+
+  Benchmark: `python tools/performance_testing.py rls`
+*/
+
+-- -- claims --------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION public.sync_user_claims()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public, auth
+AS $$
+BEGIN
+    UPDATE auth.users
+    SET raw_app_meta_data = COALESCE(raw_app_meta_data, '{}'::jsonb)
+        || jsonb_build_object('agency_id', NEW.agency_id, 'role', NEW.role)
+    WHERE id = NEW.id;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS sync_user_claims_trigger ON public.users;
+CREATE TRIGGER sync_user_claims_trigger
+    AFTER INSERT OR UPDATE OF role, agency_id ON public.users
+    FOR EACH ROW EXECUTE FUNCTION public.sync_user_claims();
+
+UPDATE auth.users a
+SET raw_app_meta_data = COALESCE(a.raw_app_meta_data, '{}'::jsonb)
+    || jsonb_build_object('agency_id', u.agency_id, 'role', u.role)
+FROM public.users u
+WHERE u.id = a.id;
+
+CREATE OR REPLACE FUNCTION public.auth_agency_id()
+RETURNS uuid
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(
+        NULLIF(auth.jwt() -> 'app_metadata' ->> 'agency_id', '')::uuid,
+        public.get_user_agency_id(auth.uid())
+    );
+$$;
+
+CREATE OR REPLACE FUNCTION public.auth_role()
+RETURNS public.user_role
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(
+        NULLIF(auth.jwt() -> 'app_metadata' ->> 'role', '')::public.user_role,
+        public.get_user_role(auth.uid())
+    );
+$$;
+
+CREATE OR REPLACE FUNCTION public.auth_client_ids()
+RETURNS uuid[]
+LANGUAGE sql
+SECURITY DEFINER
+STABLE
+SET search_path = public
+AS $$
+    SELECT COALESCE(array_agg(id), '{}') FROM public.clients WHERE user_id = auth.uid();
+$$;
+
+CREATE OR REPLACE FUNCTION public.auth_case_ids()
+RETURNS uuid[]
+LANGUAGE sql
+SECURITY DEFINER
+STABLE
+SET search_path = public
+AS $$
+    SELECT COALESCE(array_agg(c.id), '{}')
+    FROM public.cases c
+    JOIN public.clients cl ON cl.id = c.client_id
+    WHERE cl.user_id = auth.uid();
+$$;
+
+-- -- agency_id on case timeline tables -----------------------------------
+
+ALTER TABLE public.case_activities
+    ADD COLUMN IF NOT EXISTS agency_id uuid REFERENCES public.agencies(id) ON DELETE CASCADE;
+ALTER TABLE public.case_notes
+    ADD COLUMN IF NOT EXISTS agency_id uuid REFERENCES public.agencies(id) ON DELETE CASCADE;
+
+UPDATE public.case_activities a SET agency_id = c.agency_id
+FROM public.cases c
+WHERE c.id = a.case_id AND a.agency_id IS DISTINCT FROM c.agency_id;
+
+UPDATE public.case_notes n SET agency_id = c.agency_id
+FROM public.cases c
+WHERE c.id = n.case_id AND n.agency_id IS DISTINCT FROM c.agency_id;
+
+CREATE INDEX IF NOT EXISTS idx_case_activities_agency_case
+    ON public.case_activities(agency_id, case_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_case_notes_agency_case
+    ON public.case_notes(agency_id, case_id, created_at DESC);
+
+CREATE OR REPLACE FUNCTION public.set_case_child_agency_id()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    SELECT agency_id INTO NEW.agency_id FROM public.cases WHERE id = NEW.case_id;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS set_case_activity_agency_id ON public.case_activities;
+CREATE TRIGGER set_case_activity_agency_id
+    BEFORE INSERT OR UPDATE OF case_id ON public.case_activities
+    FOR EACH ROW EXECUTE FUNCTION public.set_case_child_agency_id();
+
+DROP TRIGGER IF EXISTS set_case_note_agency_id ON public.case_notes;
+CREATE TRIGGER set_case_note_agency_id
+    BEFORE INSERT OR UPDATE OF case_id ON public.case_notes
+    FOR EACH ROW EXECUTE FUNCTION public.set_case_child_agency_id();
+
+CREATE OR REPLACE FUNCTION public.propagate_case_agency_id()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE public.case_activities SET agency_id = NEW.agency_id WHERE case_id = NEW.id;
+    UPDATE public.case_notes SET agency_id = NEW.agency_id WHERE case_id = NEW.id;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS propagate_case_agency_id_trigger ON public.cases;
+CREATE TRIGGER propagate_case_agency_id_trigger
+    AFTER UPDATE OF agency_id ON public.cases
+    FOR EACH ROW WHEN (OLD.agency_id IS DISTINCT FROM NEW.agency_id)
+    EXECUTE FUNCTION public.propagate_case_agency_id();
+
+-- -- policies --------------------------------------------------------------
+
+DO $$
+BEGIN
+    DROP POLICY IF EXISTS "Agency admins can view their own agency" ON public.agencies;
+    DROP POLICY IF EXISTS "Agency admins can update their own agency" ON public.agencies;
+    DROP POLICY IF EXISTS "Users can view users in their agency" ON public.users;
+    DROP POLICY IF EXISTS "Users can view their own profile" ON public.users;
+    DROP POLICY IF EXISTS "Users can update their own profile" ON public.users;
+    DROP POLICY IF EXISTS "Agency admins can manage users in their agency" ON public.users;
+    DROP POLICY IF EXISTS "Agency users can view clients in their agency" ON public.clients;
+    DROP POLICY IF EXISTS "Clients can view their own profile" ON public.clients;
+    DROP POLICY IF EXISTS "Agency users can manage clients in their agency" ON public.clients;
+    DROP POLICY IF EXISTS "Agency users can view cases in their agency" ON public.cases;
+    DROP POLICY IF EXISTS "Clients can view their own cases" ON public.cases;
+    DROP POLICY IF EXISTS "Agency users can manage cases in their agency" ON public.cases;
+    DROP POLICY IF EXISTS "Agency users can view documents in their agency" ON public.documents;
+    DROP POLICY IF EXISTS "Clients can view their own documents" ON public.documents;
+    DROP POLICY IF EXISTS "Agency users can manage documents in their agency" ON public.documents;
+    DROP POLICY IF EXISTS "Agency users can manage case activities in their agency" ON public.case_activities;
+    DROP POLICY IF EXISTS "Clients can view their case activities" ON public.case_activities;
+    DROP POLICY IF EXISTS "Agency users can manage case notes in their agency" ON public.case_notes;
+    DROP POLICY IF EXISTS "Clients can view non-private case notes" ON public.case_notes;
+    DROP POLICY IF EXISTS "Clients can view their own conversations" ON public.chat_conversations;
+    DROP POLICY IF EXISTS "Agency users can view conversations in their agency" ON public.chat_conversations;
+    DROP POLICY IF EXISTS "Clients can create conversations" ON public.chat_conversations;
+    DROP POLICY IF EXISTS "Agency users can manage conversations in their agency" ON public.chat_conversations;
+    DROP POLICY IF EXISTS "Users can view messages in their conversations" ON public.chat_messages;
+    DROP POLICY IF EXISTS "Users can create messages in their conversations" ON public.chat_messages;
+    DROP POLICY IF EXISTS "Agency admins can manage FAQ responses" ON public.chat_faq_responses;
+    DROP POLICY IF EXISTS "Users can view their own notifications" ON public.notifications;
+    DROP POLICY IF EXISTS "Agency staff can view agency notifications" ON public.notifications;
+    DROP POLICY IF EXISTS "Users can update their own notifications" ON public.notifications;
+    DROP POLICY IF EXISTS "Agency users can view blobs of their documents" ON public.document_blobs;
+    DROP POLICY IF EXISTS "Agency users can view artifacts of their documents" ON public.document_artifacts;
+    DROP POLICY IF EXISTS "Agency staff can view agency documents" ON storage.objects;
+END $$;
+
+-- agencies
+CREATE POLICY "Agency admins can view their own agency" ON public.agencies
+    FOR SELECT USING (id = (SELECT public.auth_agency_id()));
+
+CREATE POLICY "Agency admins can update their own agency" ON public.agencies
+    FOR UPDATE USING (
+        id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) = 'agency_admin'
+    );
+
+-- users
+CREATE POLICY "Users can view users in their agency" ON public.users
+    FOR SELECT USING (agency_id = (SELECT public.auth_agency_id()));
+
+CREATE POLICY "Users can view their own profile" ON public.users
+    FOR SELECT USING (id = (SELECT auth.uid()));
+
+-- role and agency_id are what the claims are built from: a user may edit
+-- their own profile but not change either. The SECURITY DEFINER lookups
+-- read the row as it was before the update.
+CREATE POLICY "Users can update their own profile" ON public.users
+    FOR UPDATE USING (id = (SELECT auth.uid()))
+    WITH CHECK (
+        id = (SELECT auth.uid())
+        AND role = (SELECT public.get_user_role(auth.uid()))
+        AND agency_id IS NOT DISTINCT FROM (SELECT public.get_user_agency_id(auth.uid()))
+    );
+
+CREATE POLICY "Agency admins can manage users in their agency" ON public.users
+    FOR ALL USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) = 'agency_admin'
+    );
+
+-- clients
+CREATE POLICY "Agency users can view clients in their agency" ON public.clients
+    FOR SELECT USING (agency_id = (SELECT public.auth_agency_id()));
+
+CREATE POLICY "Clients can view their own profile" ON public.clients
+    FOR SELECT USING (user_id = (SELECT auth.uid()));
+
+CREATE POLICY "Agency users can manage clients in their agency" ON public.clients
+    FOR ALL USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+-- cases
+CREATE POLICY "Agency users can view cases in their agency" ON public.cases
+    FOR SELECT USING (agency_id = (SELECT public.auth_agency_id()));
+
+CREATE POLICY "Clients can view their own cases" ON public.cases
+    FOR SELECT USING (
+        (SELECT public.auth_role()) = 'client'
+        AND client_id = ANY ((SELECT public.auth_client_ids()))
+    );
+
+CREATE POLICY "Agency users can manage cases in their agency" ON public.cases
+    FOR ALL USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+-- documents
+CREATE POLICY "Agency users can view documents in their agency" ON public.documents
+    FOR SELECT USING (agency_id = (SELECT public.auth_agency_id()));
+
+CREATE POLICY "Clients can view their own documents" ON public.documents
+    FOR SELECT USING (
+        (SELECT public.auth_role()) = 'client'
+        AND client_id = ANY ((SELECT public.auth_client_ids()))
+    );
+
+CREATE POLICY "Agency users can manage documents in their agency" ON public.documents
+    FOR ALL USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+-- case activities and notes
+CREATE POLICY "Agency users can manage case activities in their agency" ON public.case_activities
+    FOR ALL USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+CREATE POLICY "Clients can view their case activities" ON public.case_activities
+    FOR SELECT USING (
+        (SELECT public.auth_role()) = 'client'
+        AND case_id = ANY ((SELECT public.auth_case_ids()))
+    );
+
+CREATE POLICY "Agency users can manage case notes in their agency" ON public.case_notes
+    FOR ALL USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+CREATE POLICY "Clients can view non-private case notes" ON public.case_notes
+    FOR SELECT USING (
+        is_private = false
+        AND (SELECT public.auth_role()) = 'client'
+        AND case_id = ANY ((SELECT public.auth_case_ids()))
+    );
+
+-- chat
+CREATE POLICY "Clients can view their own conversations" ON public.chat_conversations
+    FOR SELECT USING (client_id = ANY ((SELECT public.auth_client_ids())));
+
+CREATE POLICY "Agency users can view conversations in their agency" ON public.chat_conversations
+    FOR SELECT USING (agency_id = (SELECT public.auth_agency_id()));
+
+CREATE POLICY "Clients can create conversations" ON public.chat_conversations
+    FOR INSERT WITH CHECK (client_id = ANY ((SELECT public.auth_client_ids())));
+
+CREATE POLICY "Agency users can manage conversations in their agency" ON public.chat_conversations
+    FOR ALL USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+CREATE POLICY "Users can view messages in their conversations" ON public.chat_messages
+    FOR SELECT USING (
+        conversation_id IN (
+            SELECT id FROM public.chat_conversations
+            WHERE client_id = ANY ((SELECT public.auth_client_ids()))
+            OR agency_id = (SELECT public.auth_agency_id())
+        )
+    );
+
+CREATE POLICY "Users can create messages in their conversations" ON public.chat_messages
+    FOR INSERT WITH CHECK (
+        conversation_id IN (
+            SELECT id FROM public.chat_conversations
+            WHERE client_id = ANY ((SELECT public.auth_client_ids()))
+            OR agency_id = (SELECT public.auth_agency_id())
+        )
+    );
+
+CREATE POLICY "Agency admins can manage FAQ responses" ON public.chat_faq_responses
+    FOR ALL USING ((SELECT public.auth_role()) = 'agency_admin');
+
+-- notifications
+CREATE POLICY "Users can view their own notifications" ON public.notifications
+    FOR SELECT USING (user_id = (SELECT auth.uid()));
+
+CREATE POLICY "Agency staff can view agency notifications" ON public.notifications
+    FOR SELECT USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+CREATE POLICY "Users can update their own notifications" ON public.notifications
+    FOR UPDATE USING (user_id = (SELECT auth.uid()));
+
+-- content-addressed blobs
+CREATE POLICY "Agency users can view blobs of their documents" ON public.document_blobs
+    FOR SELECT USING (
+        EXISTS (
+            SELECT 1 FROM public.documents d
+            WHERE d.content_sha256 = document_blobs.content_sha256
+            AND d.agency_id = (SELECT public.auth_agency_id())
+        )
+    );
+
+CREATE POLICY "Agency users can view artifacts of their documents" ON public.document_artifacts
+    FOR SELECT USING (
+        EXISTS (
+            SELECT 1 FROM public.documents d
+            WHERE d.content_sha256 = document_artifacts.content_sha256
+            AND d.agency_id = (SELECT public.auth_agency_id())
+        )
+    );
+
+-- storage
+CREATE POLICY "Agency staff can view agency documents" ON storage.objects
+    FOR SELECT USING (
+        bucket_id = 'documents'
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+        AND EXISTS (
+            SELECT 1 FROM public.documents d
+            WHERE d.file_path = name
+            AND d.agency_id = (SELECT public.auth_agency_id())
+        )
+    );
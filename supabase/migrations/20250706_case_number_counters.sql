@@ -0,0 +1,125 @@
+/*
+  # Per-agency case number counters
+
+  `generate_case_number()` counted every case created this year (a
+  sequential scan: `EXTRACT(YEAR FROM created_at)` cannot use an index) on
+  each insert, and two concurrent inserts could count the same total and
+  get the same number.
+
+  1. New Tables
+    - `case_number_counters`: the last number handed out per agency and
+      year. Allocation is one `INSERT ... ON CONFLICT DO UPDATE ... RETURNING`
+      on that row, so it is atomic and O(1). Concurrent inserts queue on
+      the row lock only within the same agency and year, until their
+      transaction ends; a rolled-back insert leaves no gap
+
+  2. Functions
+    - `allocate_case_numbers(agency, year, count)` reserves a contiguous
+      range and returns its first value (bulk imports reserve a whole batch
+      at once). `count` must be between 1 and 100000. Only `service_role`
+      and `set_case_number()` may call it: a client that could would burn
+      through an agency's numbers
+    - `format_case_number(year, n)`: `CASE-YYYY-NNNN`, widening past 9999
+      instead of truncating as `LPAD` did
+    - `set_case_number()` now numbers per agency by the case's
+      `created_at` year. A case inserted with an explicit `CASE-YYYY-N`
+      number moves that year's counter up to at least `N`, so later
+      allocated numbers cannot collide with it. It runs as its owner, since
+      callers cannot execute `allocate_case_numbers` themselves. The
+      no-argument `generate_case_number()` is dropped
+
+  3. Cases
+    - Numbers are unique per agency: `UNIQUE (case_number)` becomes
+      `UNIQUE (agency_id, case_number)`
+    - Counters start after the highest `CASE-YYYY-N` number each agency
+      already has for that year
+*/
+
+CREATE TABLE IF NOT EXISTS public.case_number_counters (
+    agency_id uuid REFERENCES public.agencies(id) ON DELETE CASCADE NOT NULL,
+    year integer NOT NULL,
+    last_value integer NOT NULL DEFAULT 0 CHECK (last_value >= 0),
+    PRIMARY KEY (agency_id, year)
+);
+
+ALTER TABLE public.case_number_counters ENABLE ROW LEVEL SECURITY;
+
+INSERT INTO public.case_number_counters (agency_id, year, last_value)
+SELECT agency_id, (m[1])::int, max((m[2])::int)
+FROM public.cases, regexp_match(case_number, '^CASE-(\d{4})-(\d+)$') AS m
+WHERE m IS NOT NULL
+GROUP BY agency_id, (m[1])::int
+ON CONFLICT (agency_id, year) DO UPDATE
+    SET last_value = GREATEST(public.case_number_counters.last_value, EXCLUDED.last_value);
+
+CREATE OR REPLACE FUNCTION public.allocate_case_numbers(p_agency_id uuid, p_year integer, p_count integer)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    first_value integer;
+BEGIN
+    IF p_count IS NULL OR p_count < 1 OR p_count > 100000 THEN
+        RAISE EXCEPTION 'case number count must be between 1 and 100000, got %', p_count
+            USING ERRCODE = 'invalid_parameter_value';
+    END IF;
+    INSERT INTO public.case_number_counters AS c (agency_id, year, last_value)
+    VALUES (p_agency_id, p_year, p_count)
+    ON CONFLICT (agency_id, year) DO UPDATE SET last_value = c.last_value + EXCLUDED.last_value
+    RETURNING last_value - p_count + 1 INTO first_value;
+    RETURN first_value;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.allocate_case_numbers(uuid, integer, integer) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.allocate_case_numbers(uuid, integer, integer) TO service_role;
+
+CREATE OR REPLACE FUNCTION public.format_case_number(p_year integer, p_value integer)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT 'CASE-' || p_year || '-' || LPAD(p_value::text, GREATEST(4, length(p_value::text)), '0');
+$$;
+
+CREATE OR REPLACE FUNCTION public.set_case_number()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    case_year integer;
+    explicit text[];
+BEGIN
+    IF NEW.case_number IS NULL OR NEW.case_number = '' THEN
+        case_year := EXTRACT(YEAR FROM COALESCE(NEW.created_at, now()))::integer;
+        NEW.case_number := public.format_case_number(
+            case_year, public.allocate_case_numbers(NEW.agency_id, case_year, 1));
+    ELSE
+        explicit := regexp_match(NEW.case_number, '^CASE-(\d{4})-(\d{1,9})$');
+        IF explicit IS NOT NULL THEN
+            INSERT INTO public.case_number_counters AS c (agency_id, year, last_value)
+            VALUES (NEW.agency_id, explicit[1]::int, explicit[2]::int)
+            ON CONFLICT (agency_id, year) DO UPDATE
+                SET last_value = GREATEST(c.last_value, EXCLUDED.last_value);
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP FUNCTION IF EXISTS public.generate_case_number();
+
+ALTER TABLE public.cases DROP CONSTRAINT IF EXISTS cases_case_number_key;
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'cases_agency_case_number_key'
+    ) THEN
+        ALTER TABLE public.cases
+            ADD CONSTRAINT cases_agency_case_number_key UNIQUE (agency_id, case_number);
+    END IF;
+END $$;
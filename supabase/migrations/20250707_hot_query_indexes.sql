@@ -0,0 +1,50 @@
+/*
+  # Composite and partial indexes for the hot query shapes
+
+  The indexes `tools/query_plans.py advise --before 20250707` suggests for
+  the shapes it checks. Before these, each shape below found its rows
+  through a single-column index and then sorted them or filtered out most
+  of them. Re-run `tools/query_plans.py check` after schema changes.
+
+  1. Chat history (`conversation_id = $1 ORDER BY created_at DESC LIMIT n`)
+    - (conversation_id, created_at DESC) replaces `idx_chat_messages_conversation_id`
+
+  2. Notifications
+    - (user_id, created_at DESC) replaces `idx_notifications_user_id` for
+      the notification list
+    - Partial (user_id, created_at DESC) WHERE read_at IS NULL for the
+      unread list and badge count. It only holds unread rows, so it stays small
+
+  3. Case timeline (`case_id = ANY($1) ORDER BY created_at DESC`)
+    - (case_id, created_at DESC) on `case_activities` and `case_notes`. The
+      (agency_id, case_id, ...) indexes only serve agency-scoped lookups
+
+  4. Documents
+    - (case_id, verification_status, created_at DESC) replaces
+      `idx_documents_case_id`, for documents by case and status
+    - Partial (agency_id, created_at) WHERE verification_status = 'pending'
+      for the review queue
+*/
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_conversation_created
+    ON public.chat_messages(conversation_id, created_at DESC);
+DROP INDEX IF EXISTS public.idx_chat_messages_conversation_id;
+
+CREATE INDEX IF NOT EXISTS idx_notifications_user_created
+    ON public.notifications(user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_notifications_user_unread
+    ON public.notifications(user_id, created_at DESC)
+    WHERE read_at IS NULL;
+DROP INDEX IF EXISTS public.idx_notifications_user_id;
+
+CREATE INDEX IF NOT EXISTS idx_case_activities_case_created
+    ON public.case_activities(case_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_case_notes_case_created
+    ON public.case_notes(case_id, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_documents_case_status_created
+    ON public.documents(case_id, verification_status, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_documents_agency_pending
+    ON public.documents(agency_id, created_at)
+    WHERE verification_status = 'pending';
+DROP INDEX IF EXISTS public.idx_documents_case_id;
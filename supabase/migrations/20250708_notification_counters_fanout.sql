@@ -0,0 +1,221 @@
+/*
+  # Unread counters and asynchronous staff fan-out
+
+  `get_unread_notification_count()` counted a user's unread rows on every
+  call. The notification bell calls it after every change, and
+  `handle_document_upload` inserted one notification per active staff
+  member inside the upload transaction, so upload latency grew with agency
+  size.
+
+  1. New Tables
+    - `notification_counters`: unread notifications per user, maintained by
+      statement-level triggers on `notifications` (one upsert per statement
+      and user, however many rows the statement touched)
+    - `notification_events`: an outbox of agency-wide events. Uploads append
+      one row; `communication/notifications/fanout.py` claims batches,
+      writes the staff notifications (a digest when a burst arrives) and
+      marks the events processed. The worker deletes processed events
+      after a retention period (7 days by default)
+
+  2. Functions
+    - `apply_unread_deltas(deltas)` adds per-user deltas to the counters.
+      Only the counting triggers (which run as the owner) and
+      `service_role` may execute it; anyone else could rewrite another
+      user's unread count
+    - `get_unread_notification_count()` reads the counter row
+    - `handle_document_upload()` still notifies the uploading client directly,
+      but queues the staff notification as one `notification_events` row and
+      wakes the worker with `pg_notify('notification_events', ...)`
+
+  3. Security
+    - Users can read their own counter; events are service-role only
+*/
+
+CREATE TABLE IF NOT EXISTS public.notification_counters (
+    user_id uuid PRIMARY KEY REFERENCES public.users(id) ON DELETE CASCADE,
+    unread integer NOT NULL DEFAULT 0 CHECK (unread >= 0),
+    updated_at timestamp with time zone DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS public.notification_events (
+    id bigserial PRIMARY KEY,
+    agency_id uuid REFERENCES public.agencies(id) ON DELETE CASCADE NOT NULL,
+    type text NOT NULL,
+    payload jsonb NOT NULL DEFAULT '{}',
+    created_at timestamp with time zone DEFAULT now(),
+    processed_at timestamp with time zone
+);
+
+CREATE INDEX IF NOT EXISTS idx_notification_events_pending
+    ON public.notification_events(id)
+    WHERE processed_at IS NULL;
+
+-- Retention purge: oldest processed events first
+CREATE INDEX IF NOT EXISTS idx_notification_events_processed
+    ON public.notification_events(processed_at)
+    WHERE processed_at IS NOT NULL;
+
+ALTER TABLE public.notification_counters ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.notification_events ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own notification counter" ON public.notification_counters
+    FOR SELECT USING (user_id = (SELECT auth.uid()));
+
+-- -- counters ---------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION public.apply_unread_deltas(p_deltas jsonb)
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    -- Upserts in user_id order so concurrent statements lock counters in the same order
+    INSERT INTO public.notification_counters AS c (user_id, unread)
+    SELECT key::uuid, GREATEST(value::int, 0)
+    FROM jsonb_each_text(p_deltas)
+    WHERE value::int <> 0
+    ORDER BY key::uuid
+    ON CONFLICT (user_id) DO UPDATE
+        SET unread = GREATEST(c.unread + (p_deltas ->> c.user_id::text)::int, 0), updated_at = now();
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.apply_unread_deltas(jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.apply_unread_deltas(jsonb) TO service_role;
+
+CREATE OR REPLACE FUNCTION public.count_inserted_notifications()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    PERFORM public.apply_unread_deltas(COALESCE(
+        (SELECT jsonb_object_agg(user_id, n) FROM (
+            SELECT user_id, count(*) AS n FROM new_rows WHERE read_at IS NULL GROUP BY user_id) d),
+        '{}'));
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.count_updated_notifications()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    PERFORM public.apply_unread_deltas(COALESCE(
+        (SELECT jsonb_object_agg(user_id, n) FROM (
+            SELECT user_id, sum(delta) AS n FROM (
+                SELECT user_id, -1 AS delta FROM old_rows WHERE read_at IS NULL
+                UNION ALL
+                SELECT user_id, 1 FROM new_rows WHERE read_at IS NULL
+            ) changes GROUP BY user_id HAVING sum(delta) <> 0) d),
+        '{}'));
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.count_deleted_notifications()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    PERFORM public.apply_unread_deltas(COALESCE(
+        (SELECT jsonb_object_agg(user_id, -n) FROM (
+            SELECT user_id, count(*) AS n FROM old_rows WHERE read_at IS NULL GROUP BY user_id) d),
+        '{}'));
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS notifications_count_insert ON public.notifications;
+CREATE TRIGGER notifications_count_insert
+    AFTER INSERT ON public.notifications
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.count_inserted_notifications();
+
+DROP TRIGGER IF EXISTS notifications_count_update ON public.notifications;
+CREATE TRIGGER notifications_count_update
+    AFTER UPDATE ON public.notifications
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.count_updated_notifications();
+
+DROP TRIGGER IF EXISTS notifications_count_delete ON public.notifications;
+CREATE TRIGGER notifications_count_delete
+    AFTER DELETE ON public.notifications
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.count_deleted_notifications();
+
+INSERT INTO public.notification_counters (user_id, unread)
+SELECT user_id, count(*) FROM public.notifications WHERE read_at IS NULL GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE SET unread = EXCLUDED.unread, updated_at = now();
+
+CREATE OR REPLACE FUNCTION public.get_unread_notification_count()
+RETURNS integer
+LANGUAGE sql
+SECURITY DEFINER
+STABLE
+SET search_path = public
+AS $$
+    SELECT COALESCE((SELECT unread FROM public.notification_counters WHERE user_id = auth.uid()), 0);
+$$;
+
+-- -- upload fan-out -----------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION public.handle_document_upload()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    client_user_id uuid;
+    client_name text;
+    document_type_formatted text;
+BEGIN
+    SELECT
+        c.user_id,
+        u.first_name || ' ' || u.last_name
+    INTO client_user_id, client_name
+    FROM public.clients c
+    LEFT JOIN public.users u ON c.user_id = u.id
+    WHERE c.id = NEW.client_id;
+
+    document_type_formatted := INITCAP(REPLACE(NEW.document_type::text, '_', ' '));
+
+    IF client_user_id IS NOT NULL THEN
+        PERFORM public.create_notification(
+            client_user_id,
+            NEW.agency_id,
+            'document_uploaded',
+            'Document Uploaded Successfully',
+            'Your ' || document_type_formatted || ' (' || NEW.file_name || ') has been uploaded successfully and is pending review.',
+            jsonb_build_object(
+                'document_id', NEW.id,
+                'document_type', NEW.document_type,
+                'file_name', NEW.file_name
+            )
+        );
+    END IF;
+
+    -- Staff are notified by the fan-out worker, outside this transaction
+    INSERT INTO public.notification_events (agency_id, type, payload)
+    VALUES (
+        NEW.agency_id,
+        'document_review_needed',
+        jsonb_build_object(
+            'document_id', NEW.id,
+            'client_id', NEW.client_id,
+            'document_type', NEW.document_type,
+            'document_type_label', document_type_formatted,
+            'file_name', NEW.file_name,
+            'client_name', client_name
+        )
+    );
+    PERFORM pg_notify('notification_events', NEW.agency_id::text);
+
+    RETURN NEW;
+END;
+$$;
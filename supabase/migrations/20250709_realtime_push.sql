@@ -0,0 +1,103 @@
+/*
+  # Change feed for the realtime push hub
+
+  Each API process holds one `LISTEN realtime` connection
+  (`communication/notifications/pusher.py`) and fans messages out to its
+  WebSocket/SSE subscribers by channel. Clients no longer need to poll, and
+  the database has one subscription per process, not one per browser tab.
+
+  1. Functions
+    - `publish_realtime(channel, event, data)` sends `{channel, event, data}`
+      on the `realtime` NOTIFY channel. NOTIFY payloads are limited to 8000
+      bytes, so larger `data` is replaced by `{"truncated": true}` and the
+      client refetches. Only the trigger functions below (which run as
+      their owner) and `service_role` may execute it; clients could
+      otherwise push arbitrary events onto any user's or agency's channel
+
+  2. Triggers
+    - `notifications` inserts publish `notification` on `user:<user_id>`,
+      with the user's unread count from `notification_counters`. One
+      statement-level trigger covers a whole fan-out batch
+    - `documents` inserts and `verification_status` changes publish
+      `document` on `agency:<agency_id>`
+*/
+
+CREATE OR REPLACE FUNCTION public.publish_realtime(p_channel text, p_event text, p_data jsonb)
+RETURNS void
+LANGUAGE plpgsql
+SET search_path = public
+AS $$
+DECLARE
+    payload text;
+BEGIN
+    payload := jsonb_build_object('channel', p_channel, 'event', p_event, 'data', p_data)::text;
+    IF octet_length(payload) > 7900 THEN
+        payload := jsonb_build_object('channel', p_channel, 'event', p_event,
+                                      'data', jsonb_build_object('truncated', true))::text;
+    END IF;
+    PERFORM pg_notify('realtime', payload);
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.publish_realtime(text, text, jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.publish_realtime(text, text, jsonb) TO service_role;
+
+CREATE OR REPLACE FUNCTION public.publish_inserted_notifications()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    -- Runs after notifications_count_insert (triggers fire in name order), so counts are current
+    PERFORM public.publish_realtime(
+        'user:' || n.user_id,
+        'notification',
+        jsonb_build_object(
+            'id', n.id,
+            'type', n.type,
+            'title', n.title,
+            'message', n.message,
+            'data', n.data,
+            'created_at', n.created_at,
+            'unread', COALESCE(c.unread, 0)
+        ))
+    FROM new_rows n
+    LEFT JOIN public.notification_counters c ON c.user_id = n.user_id
+    ORDER BY n.created_at;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS notifications_publish_insert ON public.notifications;
+CREATE TRIGGER notifications_publish_insert
+    AFTER INSERT ON public.notifications
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.publish_inserted_notifications();
+
+CREATE OR REPLACE FUNCTION public.publish_document_change()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    PERFORM public.publish_realtime(
+        'agency:' || NEW.agency_id,
+        'document',
+        jsonb_build_object(
+            'id', NEW.id,
+            'client_id', NEW.client_id,
+            'case_id', NEW.case_id,
+            'document_type', NEW.document_type,
+            'verification_status', NEW.verification_status,
+            'action', lower(TG_OP)
+        ));
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS documents_publish_change ON public.documents;
+CREATE TRIGGER documents_publish_change
+    AFTER INSERT OR UPDATE OF verification_status ON public.documents
+    FOR EACH ROW EXECUTE FUNCTION public.publish_document_change();
@@ -0,0 +1,70 @@
+/*
+  # Durable email outbox and per-agency template overrides
+
+  Bulk sends (case updates, document requests, reminders) are rendered once
+  and written to `email_outbox`. The delivery engine in
+  `communication/email/sender.py` claims due rows in batches and sends them
+  over pooled, pipelined SMTP connections. Failures are rescheduled with
+  exponential backoff, so a crash or a provider outage loses nothing.
+
+  1. New Tables
+    - `email_outbox`: one row per message. A claim pushes
+      `next_attempt_at` forward by a lease and counts the attempt, so rows
+      held by a worker that died become due again on their own
+    - `email_templates`: an agency's overrides of the built-in templates,
+      keyed by template name
+
+  2. Indexes
+    - Partial index on due `pending` rows, which is all the claim query reads
+    - `dedupe_key` is unique per agency, so re-running a bulk send cannot
+      mail a client twice
+
+  3. Security
+    - The outbox is service-role only
+    - Agency admins manage their own agency's templates; staff can read them
+*/
+
+CREATE TABLE IF NOT EXISTS public.email_outbox (
+    id bigserial PRIMARY KEY,
+    agency_id uuid REFERENCES public.agencies(id) ON DELETE CASCADE,
+    template_key text,
+    dedupe_key text,
+    provider text NOT NULL DEFAULT 'default',
+    to_address text NOT NULL,
+    subject text NOT NULL,
+    text_body text NOT NULL,
+    html_body text,
+    status text NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed')),
+    attempts integer NOT NULL DEFAULT 0,
+    next_attempt_at timestamp with time zone NOT NULL DEFAULT now(),
+    last_error text,
+    created_at timestamp with time zone DEFAULT now(),
+    sent_at timestamp with time zone,
+    UNIQUE (agency_id, dedupe_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due
+    ON public.email_outbox(provider, next_attempt_at)
+    WHERE status = 'pending';
+
+CREATE TABLE IF NOT EXISTS public.email_templates (
+    agency_id uuid REFERENCES public.agencies(id) ON DELETE CASCADE NOT NULL,
+    key text NOT NULL,
+    subject text NOT NULL,
+    text_body text NOT NULL,
+    html_body text,
+    updated_at timestamp with time zone DEFAULT now(),
+    PRIMARY KEY (agency_id, key)
+);
+
+ALTER TABLE public.email_outbox ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.email_templates ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Agency users can view their agency's email templates" ON public.email_templates
+    FOR SELECT USING (agency_id = (SELECT public.auth_agency_id()));
+
+CREATE POLICY "Agency admins can manage their agency's email templates" ON public.email_templates
+    FOR ALL USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) = 'agency_admin'
+    );
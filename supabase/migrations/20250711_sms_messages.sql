@@ -0,0 +1,76 @@
+/*
+  # SMS send results and delivery receipts
+
+  `communication/sms/sender.py` dispatches texts asynchronously and keeps
+  one row per message here. Send results and the provider's delivery
+  receipts are buffered and written in batches, never one statement per
+  message. Message bodies are not stored, because OTP texts carry live
+  passcodes.
+
+  1. New Tables
+    - `sms_messages`: provider, idempotency key, destination, sender number,
+      provider message id, status and attempt count
+    - `sms_early_receipts`: delivery receipts that arrived before their send
+      result was written. The receipt webhook only acknowledges a receipt
+      once it is stored here or applied to `sms_messages`. Recording the
+      send result applies and removes its parked receipt. Receipts that
+      never match are purged after a day
+
+  2. Indexes
+    - `(provider, idempotency_key)` is unique, so a resubmitted message
+      updates its row instead of adding one
+    - Partial unique index on `(provider, provider_sid)` for receipt lookups
+
+  3. Security
+    - Writes are service-role only; `sms_early_receipts` has no policies
+    - Agency staff can read their agency's messages
+*/
+
+CREATE TABLE IF NOT EXISTS public.sms_messages (
+    id bigserial PRIMARY KEY,
+    provider text NOT NULL,
+    idempotency_key text NOT NULL,
+    agency_id uuid REFERENCES public.agencies(id) ON DELETE CASCADE,
+    sender text,
+    to_number text NOT NULL,
+    priority smallint NOT NULL DEFAULT 10,
+    provider_sid text,
+    status text NOT NULL CHECK (status IN ('queued', 'sending', 'sent', 'delivered', 'undelivered', 'failed')),
+    attempts integer NOT NULL DEFAULT 0,
+    last_error text,
+    error_code text,
+    created_at timestamp with time zone DEFAULT now(),
+    updated_at timestamp with time zone DEFAULT now(),
+    sent_at timestamp with time zone,
+    delivered_at timestamp with time zone,
+    UNIQUE (provider, idempotency_key)
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sms_messages_provider_sid
+    ON public.sms_messages(provider, provider_sid)
+    WHERE provider_sid IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_sms_messages_agency_created
+    ON public.sms_messages(agency_id, created_at DESC);
+
+ALTER TABLE public.sms_messages ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Agency users can view their agency's text messages" ON public.sms_messages
+    FOR SELECT USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+CREATE TABLE IF NOT EXISTS public.sms_early_receipts (
+    provider text NOT NULL,
+    provider_sid text NOT NULL,
+    status text NOT NULL CHECK (status IN ('queued', 'sending', 'sent', 'delivered', 'undelivered', 'failed')),
+    error_code text,
+    received_at timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (provider, provider_sid)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sms_early_receipts_received
+    ON public.sms_early_receipts(received_at);
+
+ALTER TABLE public.sms_early_receipts ENABLE ROW LEVEL SECURITY;
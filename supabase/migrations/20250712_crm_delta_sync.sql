@@ -0,0 +1,236 @@
+/*
+  # Incremental CRM sync
+
+  `crm/sync.py` keeps clients and cases in step with an agency's HubSpot or
+  Salesforce account. The cost of a run follows what changed, not the size
+  of the client book: statement-level triggers record which clients and
+  cases changed, and each integration keeps cursors into that log and into
+  the CRM's modification times.
+
+  1. New Tables
+    - `crm_integrations`: one row per agency and provider, with the conflict
+      policy and non-secret adapter settings (deal stages). Agency admins
+      can edit it, so it never names a secret or a host.
+    - `crm_credentials`: the integration's access token, held in Supabase
+      Vault and referenced by secret id, and the Salesforce instance URL.
+      Only the service role reads it. Admins write it through
+      `set_crm_credentials`, which cannot read a token back.
+    - `crm_sync_state`: per integration and entity type, the CRM
+      modified-since watermark (`pull_since`) and the `(push_txid, push_id)`
+      position in the change log
+    - `crm_change_log`: entity ids changed since the slowest cursor, stamped
+      with the writing transaction's id. The sync reads only below the oldest
+      transaction still running, so it never skips a row that commits late.
+    - `crm_links`: local entity ↔ CRM record, plus the field values both
+      sides last agreed on (the base of the three-way merge)
+
+  2. Triggers
+    - `clients` and `cases` INSERT/UPDATE, and `users` UPDATE (names and
+      phone belong to the client), log one row per changed entity
+    - Only agencies with an enabled integration are logged. Updates that
+      leave every synced column unchanged are not logged.
+    - Writes made by the sync itself set `immigration_ai.crm_sync` and are
+      skipped, so pulled changes are not pushed back
+
+  3. Security
+    - Agency admins manage their integrations and set, but never read,
+      their credentials. Salesforce instance URLs must be https on
+      `*.my.salesforce.com`; HubSpot always uses api.hubapi.com.
+    - Sync state, the change log and links are service-role only
+*/
+
+CREATE TABLE IF NOT EXISTS public.crm_integrations (
+    agency_id uuid NOT NULL REFERENCES public.agencies(id) ON DELETE CASCADE,
+    provider text NOT NULL CHECK (provider IN ('hubspot', 'salesforce')),
+    enabled boolean NOT NULL DEFAULT true,
+    conflict_policy text NOT NULL DEFAULT 'newest' CHECK (conflict_policy IN ('newest', 'local', 'remote')),
+    config jsonb NOT NULL DEFAULT '{}'::jsonb,
+    last_synced_at timestamp with time zone,
+    last_error text,
+    created_at timestamp with time zone DEFAULT now(),
+    updated_at timestamp with time zone DEFAULT now(),
+    PRIMARY KEY (agency_id, provider)
+);
+
+CREATE TABLE IF NOT EXISTS public.crm_sync_state (
+    agency_id uuid NOT NULL,
+    provider text NOT NULL,
+    entity_type text NOT NULL CHECK (entity_type IN ('client', 'case')),
+    pull_since timestamp with time zone,
+    push_txid bigint NOT NULL DEFAULT 0,
+    push_id bigint NOT NULL DEFAULT 0,
+    updated_at timestamp with time zone DEFAULT now(),
+    PRIMARY KEY (agency_id, provider, entity_type),
+    FOREIGN KEY (agency_id, provider) REFERENCES public.crm_integrations(agency_id, provider) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS public.crm_change_log (
+    id bigserial PRIMARY KEY,
+    agency_id uuid NOT NULL,
+    entity_type text NOT NULL CHECK (entity_type IN ('client', 'case')),
+    entity_id uuid NOT NULL,
+    txid bigint NOT NULL DEFAULT txid_current(),
+    changed_at timestamp with time zone DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_crm_change_log_cursor
+    ON public.crm_change_log(agency_id, entity_type, txid, id);
+
+CREATE TABLE IF NOT EXISTS public.crm_links (
+    agency_id uuid NOT NULL,
+    provider text NOT NULL,
+    entity_type text NOT NULL CHECK (entity_type IN ('client', 'case')),
+    entity_id uuid NOT NULL,
+    remote_id text NOT NULL,
+    synced jsonb NOT NULL DEFAULT '{}'::jsonb,
+    remote_modified_at timestamp with time zone,
+    synced_at timestamp with time zone DEFAULT now(),
+    PRIMARY KEY (agency_id, provider, entity_type, entity_id),
+    UNIQUE (agency_id, provider, entity_type, remote_id),
+    FOREIGN KEY (agency_id, provider) REFERENCES public.crm_integrations(agency_id, provider) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS public.crm_credentials (
+    agency_id uuid NOT NULL,
+    provider text NOT NULL,
+    token_secret_id uuid NOT NULL,
+    instance_url text CHECK (instance_url ~ '^https://[a-z0-9-]+(\.sandbox)?\.my\.salesforce\.com$'),
+    updated_at timestamp with time zone DEFAULT now(),
+    PRIMARY KEY (agency_id, provider),
+    FOREIGN KEY (agency_id, provider) REFERENCES public.crm_integrations(agency_id, provider) ON DELETE CASCADE
+);
+
+-- Store an integration's token in Vault; callers can replace it but never read it
+CREATE OR REPLACE FUNCTION public.set_crm_credentials(p_provider text, p_token text, p_instance_url text DEFAULT NULL)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_agency_id uuid := public.auth_agency_id();
+    v_secret_id uuid;
+BEGIN
+    IF v_agency_id IS NULL OR public.auth_role() <> 'agency_admin' THEN
+        RAISE EXCEPTION 'Only agency admins can set CRM credentials' USING ERRCODE = '42501';
+    END IF;
+    IF coalesce(p_token, '') = '' THEN
+        RAISE EXCEPTION 'A CRM access token is required' USING ERRCODE = '22023';
+    END IF;
+    IF p_provider = 'hubspot' THEN
+        p_instance_url := NULL;
+    ELSIF p_provider <> 'salesforce'
+          OR coalesce(p_instance_url, '') !~ '^https://[a-z0-9-]+(\.sandbox)?\.my\.salesforce\.com$' THEN
+        RAISE EXCEPTION 'Salesforce needs an https://<domain>.my.salesforce.com instance URL' USING ERRCODE = '22023';
+    END IF;
+
+    SELECT token_secret_id INTO v_secret_id
+    FROM public.crm_credentials WHERE agency_id = v_agency_id AND provider = p_provider;
+    IF v_secret_id IS NULL THEN
+        v_secret_id := vault.create_secret(p_token, format('crm:%s:%s', v_agency_id, p_provider));
+    ELSE
+        PERFORM vault.update_secret(v_secret_id, p_token);
+    END IF;
+
+    INSERT INTO public.crm_credentials (agency_id, provider, token_secret_id, instance_url)
+    VALUES (v_agency_id, p_provider, v_secret_id, p_instance_url)
+    ON CONFLICT (agency_id, provider) DO UPDATE
+    SET token_secret_id = EXCLUDED.token_secret_id, instance_url = EXCLUDED.instance_url, updated_at = now();
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.set_crm_credentials(text, text, text) FROM PUBLIC, anon;
+GRANT EXECUTE ON FUNCTION public.set_crm_credentials(text, text, text) TO authenticated;
+
+-- Log changed clients and cases for agencies that sync to a CRM
+CREATE OR REPLACE FUNCTION public.log_crm_changes()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    IF current_setting('immigration_ai.crm_sync', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_TABLE_NAME = 'users' THEN
+        INSERT INTO public.crm_change_log (agency_id, entity_type, entity_id)
+        SELECT c.agency_id, 'client', c.id
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        JOIN public.clients c ON c.user_id = n.id
+        WHERE (n.first_name, n.last_name, n.phone) IS DISTINCT FROM (o.first_name, o.last_name, o.phone)
+        AND EXISTS (SELECT 1 FROM public.crm_integrations i WHERE i.agency_id = c.agency_id AND i.enabled);
+    ELSIF TG_OP = 'INSERT' THEN
+        INSERT INTO public.crm_change_log (agency_id, entity_type, entity_id)
+        SELECT n.agency_id, TG_ARGV[0], n.id
+        FROM new_rows n
+        WHERE EXISTS (SELECT 1 FROM public.crm_integrations i WHERE i.agency_id = n.agency_id AND i.enabled);
+    ELSIF TG_TABLE_NAME = 'clients' THEN
+        INSERT INTO public.crm_change_log (agency_id, entity_type, entity_id)
+        SELECT n.agency_id, 'client', n.id
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        WHERE (n.date_of_birth, n.country_of_birth, n.nationality, n.immigration_status)
+            IS DISTINCT FROM (o.date_of_birth, o.country_of_birth, o.nationality, o.immigration_status)
+        AND EXISTS (SELECT 1 FROM public.crm_integrations i WHERE i.agency_id = n.agency_id AND i.enabled);
+    ELSE
+        INSERT INTO public.crm_change_log (agency_id, entity_type, entity_id)
+        SELECT n.agency_id, 'case', n.id
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        WHERE (n.case_number, n.title, n.status, n.case_type, n.priority, n.due_date, n.client_id)
+            IS DISTINCT FROM (o.case_number, o.title, o.status, o.case_type, o.priority, o.due_date, o.client_id)
+        AND EXISTS (SELECT 1 FROM public.crm_integrations i WHERE i.agency_id = n.agency_id AND i.enabled);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- Transition tables allow one event per trigger
+DROP TRIGGER IF EXISTS crm_log_client_inserts ON public.clients;
+CREATE TRIGGER crm_log_client_inserts
+    AFTER INSERT ON public.clients
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.log_crm_changes('client');
+
+DROP TRIGGER IF EXISTS crm_log_client_updates ON public.clients;
+CREATE TRIGGER crm_log_client_updates
+    AFTER UPDATE ON public.clients
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.log_crm_changes('client');
+
+DROP TRIGGER IF EXISTS crm_log_case_inserts ON public.cases;
+CREATE TRIGGER crm_log_case_inserts
+    AFTER INSERT ON public.cases
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.log_crm_changes('case');
+
+DROP TRIGGER IF EXISTS crm_log_case_updates ON public.cases;
+CREATE TRIGGER crm_log_case_updates
+    AFTER UPDATE ON public.cases
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.log_crm_changes('case');
+
+DROP TRIGGER IF EXISTS crm_log_user_updates ON public.users;
+CREATE TRIGGER crm_log_user_updates
+    AFTER UPDATE ON public.users
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.log_crm_changes('client');
+
+ALTER TABLE public.crm_integrations ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.crm_credentials ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.crm_sync_state ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.crm_change_log ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.crm_links ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Agency admins can manage their CRM integrations" ON public.crm_integrations
+    FOR ALL USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) = 'agency_admin'
+    )
+    WITH CHECK (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) = 'agency_admin'
+    );
@@ -0,0 +1,100 @@
+/*
+  # Staff tasks and workload profiles
+
+  `crm/tasks.py` assigns tasks to staff by open workload, skills and due
+  dates, from an in-memory index of each agency's open tasks. Until now
+  the task views in the CRM dashboard had no table behind them.
+
+  1. New Tables
+    - `tasks`: title, category, optional case and client, the skill the
+      assignee needs (`skill`, usually the case type), priority, effort,
+      due date, status and assignee. `assignment` records how the assignee
+      was chosen: manual, auto or rebalance.
+    - `staff_workload_profiles`: per staff member, their skills, their
+      capacity (total effort of open tasks they can carry) and whether they
+      are taking work
+
+  2. Indexes
+    - Partial index on open tasks by `(agency_id, assigned_to, due_date)`.
+      The assignment index loads from it, and it serves per-assignee lists
+      outside the index.
+
+  3. Security
+    - Agency staff can read their agency's tasks and workload profiles
+    - Agency staff can create tasks and update their agency's tasks
+    - Agency admins manage workload profiles
+*/
+
+CREATE TABLE IF NOT EXISTS public.tasks (
+    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    agency_id uuid NOT NULL REFERENCES public.agencies(id) ON DELETE CASCADE,
+    title text NOT NULL,
+    description text,
+    category text,
+    case_id uuid REFERENCES public.cases(id) ON DELETE SET NULL,
+    client_id uuid REFERENCES public.clients(id) ON DELETE SET NULL,
+    skill text,
+    priority text NOT NULL DEFAULT 'medium' CHECK (priority IN ('urgent', 'high', 'medium', 'low')),
+    effort numeric NOT NULL DEFAULT 1 CHECK (effort > 0),
+    status text NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'in_progress', 'done', 'cancelled')),
+    assigned_to uuid REFERENCES public.users(id) ON DELETE SET NULL,
+    assignment text CHECK (assignment IN ('manual', 'auto', 'rebalance')),
+    due_date timestamp with time zone,
+    created_by uuid REFERENCES public.users(id) ON DELETE SET NULL,
+    created_at timestamp with time zone DEFAULT now(),
+    updated_at timestamp with time zone DEFAULT now(),
+    completed_at timestamp with time zone
+);
+
+CREATE INDEX IF NOT EXISTS idx_tasks_open_by_assignee
+    ON public.tasks(agency_id, assigned_to, due_date)
+    WHERE status IN ('open', 'in_progress');
+
+CREATE TABLE IF NOT EXISTS public.staff_workload_profiles (
+    user_id uuid PRIMARY KEY REFERENCES public.users(id) ON DELETE CASCADE,
+    agency_id uuid NOT NULL REFERENCES public.agencies(id) ON DELETE CASCADE,
+    skills text[] NOT NULL DEFAULT '{}',
+    capacity numeric NOT NULL DEFAULT 20 CHECK (capacity > 0),
+    available boolean NOT NULL DEFAULT true,
+    updated_at timestamp with time zone DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_staff_workload_profiles_agency
+    ON public.staff_workload_profiles(agency_id);
+
+ALTER TABLE public.tasks ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.staff_workload_profiles ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Agency staff can view their agency's tasks" ON public.tasks
+    FOR SELECT USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+CREATE POLICY "Agency staff can create tasks" ON public.tasks
+    FOR INSERT WITH CHECK (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+CREATE POLICY "Agency staff can update their agency's tasks" ON public.tasks
+    FOR UPDATE USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+CREATE POLICY "Agency staff can view workload profiles" ON public.staff_workload_profiles
+    FOR SELECT USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+CREATE POLICY "Agency admins can manage workload profiles" ON public.staff_workload_profiles
+    FOR ALL USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) = 'agency_admin'
+    )
+    WITH CHECK (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) = 'agency_admin'
+    );
@@ -0,0 +1,91 @@
+/*
+  # Duplicate client candidates
+
+  `crm/dedupe.py` finds clients who are probably the same person, by
+  blocking keys and a sorted neighbourhood rather than comparing every
+  pair. The pairs it finds are stored here for staff to review.
+
+  1. New Tables
+    - `client_duplicates`: one row per likely duplicate pair. `client_id`
+      is the older client and `duplicate_id` the newer one. `score` is
+      between 0 and 1, and `reasons` lists the fields that agreed. Rescans
+      refresh pending pairs and leave reviewed (merged or dismissed) pairs
+      alone.
+    - `client_dedupe_keys`: the detection index, one row per client and
+      key. `kind` is `block` for a blocking key, or `last`/`first` for a
+      sorted-neighbourhood key. A check for new clients reads only the rows
+      its keys touch, so no process has to load every client first. Keys
+      use the "C" collation to sort the way the Python index does.
+    - `client_dedupe_state`: per agency, the (created_at, id) of the last
+      client indexed
+
+  2. Indexes
+    - `clients(agency_id, created_at, id)`: incremental checks read only
+      clients created since the last check
+    - Pending pairs per agency, best score first, for the review queue
+
+  3. Security
+    - Agency staff can view and review their agency's duplicate pairs
+    - `client_dedupe_keys` and `client_dedupe_state` are service-role only
+      and have no policies
+*/
+
+CREATE TABLE IF NOT EXISTS public.client_duplicates (
+    agency_id uuid NOT NULL REFERENCES public.agencies(id) ON DELETE CASCADE,
+    client_id uuid NOT NULL REFERENCES public.clients(id) ON DELETE CASCADE,
+    duplicate_id uuid NOT NULL REFERENCES public.clients(id) ON DELETE CASCADE,
+    score numeric(5, 4) NOT NULL CHECK (score >= 0 AND score <= 1),
+    reasons text[] NOT NULL DEFAULT '{}',
+    status text NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'merged', 'dismissed')),
+    reviewed_by uuid REFERENCES public.users(id) ON DELETE SET NULL,
+    reviewed_at timestamp with time zone,
+    created_at timestamp with time zone DEFAULT now(),
+    updated_at timestamp with time zone DEFAULT now(),
+    PRIMARY KEY (client_id, duplicate_id),
+    CHECK (client_id <> duplicate_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_client_duplicates_pending
+    ON public.client_duplicates(agency_id, score DESC)
+    WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_client_duplicates_duplicate
+    ON public.client_duplicates(duplicate_id);
+
+CREATE TABLE IF NOT EXISTS public.client_dedupe_keys (
+    agency_id uuid NOT NULL REFERENCES public.agencies(id) ON DELETE CASCADE,
+    client_id uuid NOT NULL REFERENCES public.clients(id) ON DELETE CASCADE,
+    kind text NOT NULL CHECK (kind IN ('block', 'last', 'first')),
+    key text COLLATE "C" NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    PRIMARY KEY (agency_id, kind, key, client_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_client_dedupe_keys_client
+    ON public.client_dedupe_keys(client_id);
+
+CREATE TABLE IF NOT EXISTS public.client_dedupe_state (
+    agency_id uuid PRIMARY KEY REFERENCES public.agencies(id) ON DELETE CASCADE,
+    watermark_at timestamp with time zone NOT NULL,
+    watermark_id uuid NOT NULL,
+    updated_at timestamp with time zone DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_clients_agency_created
+    ON public.clients(agency_id, created_at, id);
+
+ALTER TABLE public.client_duplicates ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.client_dedupe_keys ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.client_dedupe_state ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Agency staff can view duplicate clients" ON public.client_duplicates
+    FOR SELECT USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
+
+CREATE POLICY "Agency staff can review duplicate clients" ON public.client_duplicates
+    FOR UPDATE USING (
+        agency_id = (SELECT public.auth_agency_id())
+        AND (SELECT public.auth_role()) IN ('agency_admin', 'agency_staff')
+    );
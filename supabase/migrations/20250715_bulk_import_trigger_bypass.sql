@@ -0,0 +1,40 @@
+/*
+  # Let bulk imports skip per-row triggers without locking the tables
+
+  `tools/data_migration.py` used `ALTER TABLE ... DISABLE TRIGGER` while it
+  copied rows in. That takes an ACCESS EXCLUSIVE lock on `cases` and
+  `documents` until the import commits, which blocks every read and write
+  of those tables for the length of the import, and it also disables the
+  triggers for every other session.
+
+  1. Triggers
+    - `set_case_number_trigger`, `document_upload_notification_trigger`
+      and `document_blob_refs_trigger` are recreated with
+      `WHEN (current_setting('app.bulk_import', true) IS DISTINCT FROM 'on')`.
+      The importer runs `set_config('app.bulk_import', 'on', true)`, which
+      only lasts until its own transaction ends, and applies the triggers'
+      effects set-based itself. Other sessions are unaffected
+    - Only direct database connections can set the flag. API clients
+      cannot, since PostgREST does not expose `set_config`
+*/
+
+DROP TRIGGER IF EXISTS set_case_number_trigger ON public.cases;
+CREATE TRIGGER set_case_number_trigger
+    BEFORE INSERT ON public.cases
+    FOR EACH ROW
+    WHEN (current_setting('app.bulk_import', true) IS DISTINCT FROM 'on')
+    EXECUTE FUNCTION public.set_case_number();
+
+DROP TRIGGER IF EXISTS document_upload_notification_trigger ON public.documents;
+CREATE TRIGGER document_upload_notification_trigger
+    AFTER INSERT ON public.documents
+    FOR EACH ROW
+    WHEN (current_setting('app.bulk_import', true) IS DISTINCT FROM 'on')
+    EXECUTE FUNCTION public.handle_document_upload();
+
+DROP TRIGGER IF EXISTS document_blob_refs_trigger ON public.documents;
+CREATE TRIGGER document_blob_refs_trigger
+    AFTER INSERT OR DELETE OR UPDATE OF content_sha256 ON public.documents
+    FOR EACH ROW
+    WHEN (current_setting('app.bulk_import', true) IS DISTINCT FROM 'on')
+    EXECUTE FUNCTION public.update_document_blob_refs();
@@ -0,0 +1,43 @@
+/*
+  # Count the case dashboard in the database
+
+  `CaseService.get_dashboard` used to select the status, priority and due
+  date of every case in the agency and count them in Python. That costs
+  O(cases) on every cache miss, and PostgREST cuts the response off at
+  `max-rows` (1000 by default), so larger agencies got wrong totals.
+
+  1. Functions
+    - `case_dashboard(p_agency_id, p_today)`: one row per status with its
+      case count, plus how many of the open cases have priority 4 or 5
+      and how many are past their due date. It runs as the caller, so row
+      level security still applies
+
+  2. Indexes
+    - `cases(agency_id, status) INCLUDE (priority, due_date)`, which lets
+      the counts come from an index-only scan
+*/
+
+CREATE INDEX IF NOT EXISTS idx_cases_dashboard
+    ON public.cases(agency_id, status) INCLUDE (priority, due_date);
+
+CREATE OR REPLACE FUNCTION public.case_dashboard(p_agency_id uuid, p_today date)
+RETURNS TABLE (status text, cases bigint, high_priority bigint, overdue bigint)
+LANGUAGE sql
+STABLE
+SET search_path = public
+AS $$
+    SELECT
+        c.status::text,
+        count(*),
+        count(*) FILTER (
+            WHERE c.priority >= 4 AND c.status NOT IN ('approved', 'rejected', 'completed')
+        ),
+        count(*) FILTER (
+            WHERE c.due_date < p_today AND c.status NOT IN ('approved', 'rejected', 'completed')
+        )
+    FROM public.cases c
+    WHERE c.agency_id = p_agency_id
+    GROUP BY c.status;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.case_dashboard(uuid, date) TO authenticated, service_role;
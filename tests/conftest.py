@@ -5,6 +5,7 @@ Test configuration and fixtures
 import pytest
 import os
 import sys
+from datetime import datetime, timezone
 
 # Add src to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
@@ -103,3 +104,223 @@ def sample_document_data():
         'document_type': 'passport',
         'verification_status': 'pending'
     }
+
+def build_pdf(pages, compress=False):
+    """Build a minimal valid PDF whose pages each show the given lines of text"""
+    import zlib
+
+    objects = {}
+    page_refs = []
+    next_num = 3
+    for lines in pages:
+        content = b'BT /F1 12 Tf 72 720 Td\n'
+        for line in lines:
+            escaped = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            content += b'(' + escaped.encode('latin-1') + b') Tj T*\n'
+        content += b'ET\n'
+        stream_dict = b''
+        if compress:
+            content = zlib.compress(content)
+            stream_dict = b' /Filter /FlateDecode'
+        content_num, page_num = next_num, next_num + 1
+        next_num += 2
+        objects[content_num] = (b'<< /Length %d%s >>\nstream\n' % (len(content), stream_dict)
+                                + content + b'\nendstream')
+        objects[page_num] = b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R >>' % content_num
+        page_refs.append(page_num)
+    objects[1] = b'<< /Type /Catalog /Pages 2 0 R >>'
+    kids = b' '.join(b'%d 0 R' % num for num in page_refs)
+    objects[2] = b'<< /Type /Pages /Kids [' + kids + b'] /Count %d >>' % len(page_refs)
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = {}
+    for num in sorted(objects):
+        offsets[num] = len(out)
+        out += b'%d 0 obj\n' % num + objects[num] + b'\nendobj\n'
+    xref_at = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for num in sorted(objects):
+        out += b'%010d 00000 n \n' % offsets[num]
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref_at)
+    return bytes(out)
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """Factory writing a generated PDF to a temporary file"""
+    def factory(pages, compress=False, name='document.pdf'):
+        path = tmp_path / name
+        path.write_bytes(build_pdf(pages, compress=compress))
+        return path
+    return factory
+
+class FakeSupabase:
+    """In-memory stand-in for the Supabase query builder used by the services
+
+    Supports the subset of PostgREST calls the services make and records
+    every executed query in ``queries`` as ``(table, operation)``. Database
+    functions called through ``rpc`` are looked up in ``functions`` and
+    recorded as ``(function, 'rpc')``.
+    """
+
+    def __init__(self, tables=None):
+        import itertools
+
+        self.tables = {name: list(rows) for name, rows in (tables or {}).items()}
+        self.queries = []
+        self.functions = {'case_dashboard': _case_dashboard}
+        self._ids = itertools.count(1)
+
+    def table(self, name):
+        return _FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return _FakeRpc(self, name, params or {})
+
+    def next_id(self):
+        return f'00000000-0000-0000-0000-{next(self._ids):012d}'
+
+
+def _case_dashboard(db, params):
+    """``public.case_dashboard``: per-status counts of the agency's cases"""
+    closed = ('approved', 'rejected', 'completed')
+    counts = {}
+    for row in db.tables.get('cases', []):
+        if row.get('agency_id') != params['p_agency_id']:
+            continue
+        entry = counts.setdefault(row['status'], {'status': row['status'], 'cases': 0, 'high_priority': 0,
+                                                  'overdue': 0})
+        entry['cases'] += 1
+        if row['status'] not in closed:
+            entry['high_priority'] += (row.get('priority') or 1) >= 4
+            entry['overdue'] += bool(row.get('due_date')) and str(row['due_date']) < params['p_today']
+    return list(counts.values())
+
+
+class _FakeRpc:
+    def __init__(self, db, name, params):
+        self.db, self.name, self.params = db, name, params
+
+    def execute(self):
+        self.db.queries.append((self.name, 'rpc'))
+        return _FakeResponse(self.db.functions[self.name](self.db, self.params))
+
+
+class _FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class _FakeQuery:
+    def __init__(self, db, table):
+        self.db, self.name = db, table
+        self.operation, self.payload, self.columns = 'select', None, '*'
+        self.filters, self.ordering, self.row_limit = [], [], None
+
+    def select(self, columns='*', count=None):
+        self.operation, self.columns = 'select', columns
+        return self
+
+    def insert(self, rows):
+        self.operation, self.payload = 'insert', rows
+        return self
+
+    def update(self, changes):
+        self.operation, self.payload = 'update', changes
+        return self
+
+    def delete(self):
+        self.operation = 'delete'
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and str(row[column]) > str(value))
+        return self
+
+    def or_(self, expression):
+        predicate = _parse_postgrest_or(expression)
+        self.filters.append(predicate)
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def _project(self, row):
+        if self.columns.strip() == '*':
+            return dict(row)
+        return {c.strip(): row.get(c.strip()) for c in self.columns.split(',')}
+
+    def execute(self):
+        self.db.queries.append((self.name, self.operation))
+        rows = self.db.tables.setdefault(self.name, [])
+        if self.operation == 'insert':
+            new = self.payload if isinstance(self.payload, list) else [self.payload]
+            now = datetime.now(timezone.utc).isoformat()
+            new = [{'id': self.db.next_id(), 'created_at': now, 'updated_at': now, **row} for row in new]
+            rows.extend(new)
+            return _FakeResponse([dict(r) for r in new])
+        matched = [row for row in rows if all(f(row) for f in self.filters)]
+        if self.operation == 'update':
+            for row in matched:
+                row.update(self.payload)
+            return _FakeResponse([dict(r) for r in matched])
+        if self.operation == 'delete':
+            self.db.tables[self.name] = [row for row in rows if row not in matched]
+            return _FakeResponse([dict(r) for r in matched])
+        for column, desc in reversed(self.ordering):
+            matched.sort(key=lambda row: (row.get(column) is None, row.get(column) or ''), reverse=desc)
+        if self.row_limit is not None:
+            matched = matched[:self.row_limit]
+        return _FakeResponse([self._project(r) for r in matched], count=len(matched))
+
+def _split_top_level(text):
+    parts, depth, quoted, current = [], 0, False, ''
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(current)
+            current = ''
+            continue
+        current += char
+    return parts + [current]
+
+
+def _parse_postgrest_or(expression, combine=any):
+    """Parse PostgREST ``or=(...)`` syntax into a row predicate"""
+    import operator
+
+    ops = {'eq': operator.eq, 'lt': operator.lt, 'gt': operator.gt, 'lte': operator.le, 'gte': operator.ge}
+    predicates = []
+    for part in _split_top_level(expression):
+        if part.startswith(('and(', 'or(')):
+            name, inner = part.split('(', 1)
+            predicates.append(_parse_postgrest_or(inner[:-1], all if name == 'and' else any))
+            continue
+        column, op, value = part.split('.', 2)
+        if value.startswith('"'):
+            value = value[1:-1].replace('\\"', '"')
+        predicates.append(lambda row, c=column, o=ops[op], v=value: row.get(c) is not None and o(str(row[c]), v))
+    return lambda row: combine(p(row) for p in predicates)
+
+@pytest.fixture
+def fake_db():
+    return FakeSupabase()
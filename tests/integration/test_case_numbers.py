@@ -0,0 +1,84 @@
+"""
+Integration tests for per-agency case number allocation
+
+Runs against a Postgres with the supabase migrations applied (``supabase
+start``); set ``DATABASE_URL`` to enable.
+"""
+import asyncio
+import os
+
+import pytest
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason='DATABASE_URL is not set')
+
+
+async def _with_agencies(count, body):
+    import asyncpg
+
+    connection = await asyncpg.connect(DATABASE_URL)
+    agency_ids = [await connection.fetchval(
+        'INSERT INTO public.agencies (name) VALUES ($1) RETURNING id', f'Case Number Test {n}')
+        for n in range(count)]
+    try:
+        client_ids = [await connection.fetchval(
+            'INSERT INTO public.clients (agency_id) VALUES ($1) RETURNING id', agency_id)
+            for agency_id in agency_ids]
+        return await body(connection, agency_ids, client_ids)
+    finally:
+        await connection.execute('DELETE FROM public.agencies WHERE id = ANY($1::uuid[])', agency_ids)
+        await connection.close()
+
+
+class TestCaseNumbers:
+    """Test that concurrent inserts and bulk reservations never share a number"""
+
+    def test_concurrent_inserts_get_unique_consecutive_numbers(self):
+        """Cases inserted from many connections are numbered 1..n per agency without duplicates"""
+        asyncpg = pytest.importorskip('asyncpg')
+        per_agency, connections = 50, 10
+
+        async def body(connection, agency_ids, client_ids):
+            async def insert_many(worker):
+                own = await asyncpg.connect(DATABASE_URL)
+                try:
+                    for n in range(worker, per_agency * len(agency_ids), connections):
+                        await own.execute(
+                            "INSERT INTO public.cases (client_id, agency_id, case_type, title) "
+                            "VALUES ($1, $2, 'other', 'Concurrent')",
+                            client_ids[n % len(agency_ids)], agency_ids[n % len(agency_ids)])
+                finally:
+                    await own.close()
+
+            await asyncio.gather(*(insert_many(worker) for worker in range(connections)))
+            return await connection.fetch(
+                'SELECT agency_id, array_agg(case_number ORDER BY case_number) AS numbers '
+                'FROM public.cases WHERE agency_id = ANY($1::uuid[]) GROUP BY agency_id', agency_ids)
+
+        rows = asyncio.run(_with_agencies(2, body))
+        assert len(rows) == 2
+        for row in rows:
+            suffixes = sorted(int(number.rsplit('-', 1)[1]) for number in row['numbers'])
+            assert suffixes == list(range(1, per_agency + 1))
+
+    def test_bulk_reservations_do_not_overlap(self):
+        """Concurrent range reservations are disjoint and leave no gaps"""
+        asyncpg = pytest.importorskip('asyncpg')
+
+        async def body(connection, agency_ids, client_ids):
+            async def reserve(count):
+                own = await asyncpg.connect(DATABASE_URL)
+                try:
+                    first = await own.fetchval('SELECT public.allocate_case_numbers($1, 2099, $2)',
+                                               agency_ids[0], count)
+                    return set(range(first, first + count))
+                finally:
+                    await own.close()
+
+            return await asyncio.gather(*(reserve(count) for count in (1, 100, 7, 1000, 1, 25)))
+
+        ranges = asyncio.run(_with_agencies(1, body))
+        allocated = set().union(*ranges)
+        assert len(allocated) == sum(len(r) for r in ranges)
+        assert allocated == set(range(1, len(allocated) + 1))
@@ -1 +1,128 @@
+"""
+Integration tests for the pooled database layer
+"""
+import asyncio
 
+import pytest
+
+from immigration_ai.utils.database import Database, DatabaseSettings
+
+
+class FakeTransaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def __aenter__(self):
+        self.connection.log.append('BEGIN' if self.connection.depth == 0 else 'SAVEPOINT')
+        self.connection.depth += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.connection.depth -= 1
+        self.connection.log.append(('ROLLBACK' if exc_type else 'COMMIT') if self.connection.depth == 0
+                                   else 'RELEASE')
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number, self.depth, self.log = number, 0, []
+
+    def transaction(self, **options):
+        return FakeTransaction(self)
+
+    async def fetchval(self, query, *args, timeout=None):
+        self.log.append(query)
+        await asyncio.sleep(0.01)
+        return self.number
+
+
+class FakePool:
+    """Minimal asyncpg-style pool handing out a fixed set of connections"""
+
+    def __init__(self, size):
+        self.connections = [FakeConnection(i) for i in range(size)]
+        self.idle = asyncio.Queue()
+        for connection in self.connections:
+            self.idle.put_nowait(connection)
+
+    async def acquire(self, timeout=None):
+        return await asyncio.wait_for(self.idle.get(), timeout)
+
+    async def release(self, connection):
+        self.idle.put_nowait(connection)
+
+    def get_size(self):
+        return len(self.connections)
+
+    def get_idle_size(self):
+        return self.idle.qsize()
+
+    async def close(self):
+        pass
+
+
+def make_database(size=2, acquire_timeout=1.0):
+    pools = []
+
+    async def factory(dsn, **options):
+        pools.append(FakePool(size))
+        return pools[-1]
+
+    settings = DatabaseSettings(dsn='postgresql://localhost/test', min_size=1, max_size=size,
+                                acquire_timeout=acquire_timeout)
+    return Database(settings, pool_factory=factory), pools
+
+
+class TestDatabasePool:
+    """Test request-scoped transactions and pool metrics"""
+
+    def test_request_transaction_reuses_one_connection(self):
+        """Every query in a request transaction runs on the same connection"""
+        database, pools = make_database()
+
+        async def handle_request():
+            async with database.transaction() as connection:
+                first = await database.fetchval('SELECT 1')
+                async with database.transaction():
+                    second = await database.fetchval('SELECT 2')
+                return connection, first, second
+
+        connection, first, second = asyncio.run(handle_request())
+        assert first == second == connection.number
+        assert connection.log == ['BEGIN', 'SELECT 1', 'SAVEPOINT', 'SELECT 2', 'RELEASE', 'COMMIT']
+        assert database.metrics().acquisitions == 1
+
+    def test_concurrent_requests_get_separate_transactions(self):
+        """Concurrent tasks never share a transaction"""
+        database, _ = make_database(size=2)
+
+        async def handle_request():
+            async with database.transaction():
+                return await database.fetchval('SELECT 1')
+
+        async def main():
+            return await asyncio.gather(handle_request(), handle_request())
+
+        assert sorted(asyncio.run(main())) == [0, 1]
+
+    def test_saturation_metrics(self):
+        """Waiting callers and exhaustion timeouts are recorded"""
+        database, _ = make_database(size=1, acquire_timeout=0.05)
+
+        async def hold():
+            async with database.acquire():
+                await asyncio.sleep(0.2)
+
+        async def main():
+            holder = asyncio.ensure_future(hold())
+            await asyncio.sleep(0.01)
+            with pytest.raises(asyncio.TimeoutError):
+                await database.fetchval('SELECT 1')
+            snapshot = database.metrics()
+            await holder
+            return snapshot
+
+        snapshot = asyncio.run(main())
+        assert snapshot.timeouts == 1
+        assert snapshot.peak_in_use == 1 and snapshot.saturation == 1.0
+        assert snapshot.peak_waiting == 1
+        assert database.metrics().in_use == 0
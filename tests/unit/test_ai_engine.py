@@ -1 +1,111 @@
+"""
+Unit tests for the AI engine models and model registry
+"""
+import pytest
 
+from immigration_ai.ai_engine.models.case_classifier import CaseClassifier
+from immigration_ai.ai_engine.models.document_analyzer import DocumentAnalyzer
+from immigration_ai.ai_engine.models.eligibility_predictor import EligibilityPredictor
+from immigration_ai.ai_engine.models.registry import ModelRegistry, activate_version, save_model
+from immigration_ai.ai_engine.utils.embeddings import hashed_bag_of_words
+from immigration_ai.core.exceptions import ConfigurationError, ModelNotFoundError
+
+
+def publish_classifier(root, name, version, labels, keyword_by_label, n_features=64, activate=True):
+    """Publish a linear text model that fires on one keyword per label"""
+    weights = [0.0] * (len(labels) * n_features)
+    for row, label in enumerate(labels):
+        for index in hashed_bag_of_words(keyword_by_label[label], n_features):
+            weights[row * n_features + index] = 5.0
+    return save_model(root, name, version, {
+        'weights': ((len(labels), n_features), weights),
+        'bias': ((len(labels),), [0.0] * len(labels)),
+    }, metadata={'labels': labels, 'n_features': n_features}, activate=activate)
+
+
+class TestModelRegistry:
+    """Test lazy loading, mapping and hot-swapping of model artifacts"""
+
+    def test_models_are_mapped_lazily(self, tmp_path):
+        """Test nothing is loaded until a model is first used"""
+        publish_classifier(tmp_path, 'case_classifier', 'v1', ['asylum'], {'asylum': 'asylum'})
+        registry = ModelRegistry(tmp_path)
+
+        assert registry.loaded() == {}
+        CaseClassifier(registry).classify('asylum claim')
+        assert registry.loaded() == {'case_classifier': 'v1'}
+
+    def test_weights_are_read_only_views(self, tmp_path):
+        """Test tensors are zero-copy views that cannot be mutated"""
+        save_model(tmp_path, 'm', 'v1', {'coef': ((3,), [1.0, 2.0, 3.0])})
+        tensor = ModelRegistry(tmp_path).get('m').tensor('coef')
+
+        assert tensor.tolist() == [1.0, 2.0, 3.0]
+        with pytest.raises(TypeError):
+            tensor.values[0] = 9.0
+
+    def test_hot_swap_without_restart(self, tmp_path):
+        """Test activating a new version is picked up by a running registry"""
+        labels = ['asylum', 'naturalization']
+        publish_classifier(tmp_path, 'case_classifier', 'v1', labels,
+                           {'asylum': 'refugee', 'naturalization': 'citizenship'})
+        registry = ModelRegistry(tmp_path, check_interval=0)
+        classifier = CaseClassifier(registry)
+        assert classifier.classify('refugee')['case_type'] == 'asylum'
+
+        publish_classifier(tmp_path, 'case_classifier', 'v2', labels,
+                           {'asylum': 'citizenship', 'naturalization': 'refugee'})
+        result = classifier.classify('refugee')
+
+        assert result['model_version'] == 'v2'
+        assert result['case_type'] == 'naturalization'
+
+    def test_rollback_to_previous_version(self, tmp_path):
+        """Test re-activating an older version swaps back"""
+        save_model(tmp_path, 'm', 'v1', {'coef': ((1,), [1.0])})
+        save_model(tmp_path, 'm', 'v2', {'coef': ((1,), [2.0])})
+        registry = ModelRegistry(tmp_path, check_interval=0)
+        assert registry.get('m').version == 'v2'
+
+        activate_version(tmp_path, 'm', 'v1')
+        assert registry.get('m').tensor('coef')[0] == 1.0
+
+    def test_unpublished_model(self, tmp_path):
+        """Test a missing model raises a not-found error"""
+        with pytest.raises(ModelNotFoundError):
+            ModelRegistry(tmp_path).get('missing')
+
+    def test_shape_mismatch_is_rejected(self, tmp_path):
+        """Test save_model validates tensor sizes"""
+        with pytest.raises(ConfigurationError):
+            save_model(tmp_path, 'm', 'v1', {'coef': ((2, 2), [1.0, 2.0])})
+
+
+class TestModels:
+    """Test predictors and classifiers on registry-managed weights"""
+
+    def test_eligibility_predictor(self, tmp_path):
+        """Test logistic scoring uses feature order from the manifest"""
+        save_model(tmp_path, 'eligibility_predictor', 'v1', {
+            'coef': ((2,), [2.0, -1.0]),
+            'intercept': ((1,), [-1.0]),
+        }, metadata={'features': ['language_score', 'criminal_record']})
+        predictor = EligibilityPredictor(ModelRegistry(tmp_path))
+
+        strong = predictor.predict({'language_score': 3, 'criminal_record': False})
+        weak = predictor.predict({'language_score': 0, 'criminal_record': True})
+
+        assert strong['eligible'] and not weak['eligible']
+        assert strong['top_factors'][0]['feature'] == 'language_score'
+
+    def test_document_analyzer(self, tmp_path):
+        """Test document type classification and field extraction"""
+        publish_classifier(tmp_path, 'document_analyzer', 'v1', ['passport', 'diploma'],
+                           {'passport': 'passport', 'diploma': 'degree'})
+        analyzer = DocumentAnalyzer(ModelRegistry(tmp_path))
+
+        result = analyzer.analyze('PASSPORT No: CA1234567 Date of expiry 2030-05-14')
+
+        assert result['document_type'] == 'passport'
+        assert result['fields']['passport_number'] == 'CA1234567'
+        assert result['fields']['expiry_date'] == '2030-05-14'
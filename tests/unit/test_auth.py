@@ -2,6 +2,13 @@
 """
 Unit tests for authentication functionality
 """
+import base64
+import hashlib
+import hmac
+import json
+import random
+import time
+
 import pytest
 from unittest.mock import Mock, patch
 import sys
@@ -10,6 +17,15 @@ import os
 # Add src to path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
 
+from immigration_ai.core.exceptions import (AuthenticationError, ConfigurationError, PermissionDeniedError,
+                                         ServiceUnavailableError, ValidationError)
+from immigration_ai.crm.services import ClientService
+from immigration_ai.security import permissions
+from immigration_ai.security.encryption import (UNIQUE_VIOLATION, FieldEncryptor, InMemoryKeyStore,
+                                                SupabaseKeyStore)
+from immigration_ai.security.auth import Authenticator, JWKSCache, Principal, TokenCache, encode_jwt
+from immigration_ai.utils.cache import InMemoryBackend, TwoTierCache
+
 class TestAuthentication:
     """Test authentication workflows"""
     
@@ -74,3 +90,344 @@ class TestAuthentication:
         assert mock_session['user_id'] is not None
         assert mock_session['role'] in ['client', 'agency_staff', 'agency_admin']
         assert mock_session['agency_id'] is not None
+
+
+SECRET = 'test-jwt-secret'
+
+
+def _is_probable_prime(n, rounds=20):
+    if n < 4:
+        return n in (2, 3)
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d, r = d // 2, r + 1
+    for _ in range(rounds):
+        x = pow(random.randrange(2, n - 1), d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _prime(bits):
+    while True:
+        candidate = random.getrandbits(bits) | (1 << (bits - 1)) | 1
+        if _is_probable_prime(candidate):
+            return candidate
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _rsa_signer(kid='key-1', bits=1024):
+    """An RSA JWK and a function signing claims as RS256 with it"""
+    e = 65537
+    while True:
+        p, q = _prime(bits // 2), _prime(bits // 2)
+        phi = (p - 1) * (q - 1)
+        if p != q and phi % e:
+            break
+    n, d = p * q, pow(e, -1, (p - 1) * (q - 1))
+    size = (n.bit_length() + 7) // 8
+    jwk = {'kty': 'RSA', 'kid': kid, 'alg': 'RS256',
+           'n': _b64(n.to_bytes(size, 'big')), 'e': _b64(e.to_bytes(3, 'big'))}
+
+    def sign(claims):
+        header = _b64(json.dumps({'alg': 'RS256', 'typ': 'JWT', 'kid': kid}).encode())
+        payload = _b64(json.dumps(claims).encode())
+        digest_info = bytes.fromhex('3031300d060960864801650304020105000420') + hashlib.sha256(
+            f'{header}.{payload}'.encode()).digest()
+        padded = b'\x00\x01' + b'\xff' * (size - len(digest_info) - 3) + b'\x00' + digest_info
+        signature = pow(int.from_bytes(padded, 'big'), d, n).to_bytes(size, 'big')
+        return f'{header}.{payload}.{_b64(signature)}'
+
+    return jwk, sign
+
+
+def _claims(sub='user-1', ttl=3600, **extra):
+    return {'sub': sub, 'aud': 'authenticated', 'exp': time.time() + ttl, **extra}
+
+
+class TestTokenVerification:
+    """Test verified-token caching, claim-derived principals and JWKS keys"""
+
+    def test_repeat_requests_skip_verification_and_lookup(self):
+        """A token is verified and its user looked up once, then served from the cache"""
+        lookups = []
+
+        def lookup(user_id):
+            lookups.append(user_id)
+            return {'id': user_id, 'agency_id': 'agency-1', 'role': 'agency_staff', 'is_active': True}
+
+        auth = Authenticator(SECRET, user_lookup=lookup)
+        token = encode_jwt(_claims(), SECRET)
+        principals = [auth.authenticate(token) for _ in range(5)]
+        assert lookups == ['user-1']
+        assert all(p is principals[0] for p in principals)
+        assert principals[0].agency_id == 'agency-1' and principals[0].is_agency_user
+        assert auth.cache.hits == 4
+
+    def test_principal_from_token_claims(self):
+        """Role and agency set by the access token hook need no user lookup"""
+        auth = Authenticator(SECRET)
+        principal = auth.authenticate(encode_jwt(
+            _claims(iat=time.time(), app_metadata={'agency_id': 'agency-9', 'role': 'agency_admin'}), SECRET))
+        assert (principal.agency_id, principal.role) == ('agency-9', 'agency_admin')
+
+    def test_old_token_claims_are_revalidated(self):
+        """Past max_age the claims give way to the user row, so demotion and deactivation apply"""
+        users = {'user-1': {'agency_id': 'agency-9', 'role': 'client', 'is_active': True}}
+        auth = Authenticator(SECRET, user_lookup=users.get)
+        claims = _claims(iat=time.time() - 120, app_metadata={'agency_id': 'agency-9', 'role': 'agency_admin'})
+        assert auth.authenticate(encode_jwt(claims, SECRET)).role == 'client'
+
+        users['user-1']['is_active'] = False
+        with pytest.raises(AuthenticationError):
+            auth._principal(claims)
+        assert auth._principal(claims, now=claims['iat'] + 30).role == 'agency_admin'
+
+    def test_entries_bounded_by_expiry_max_age_and_size(self):
+        """Cached principals expire with the token or max_age, and the LRU is bounded"""
+        auth = Authenticator(SECRET, user_lookup=lambda user_id: {'role': 'client'})
+        cache = TokenCache(max_entries=2, max_age=60)
+        short = auth._principal(_claims(ttl=10))
+        cache.put('short', short, now=time.time())
+        assert cache.get('short', now=time.time() + 5) is short
+        assert cache.get('short', now=time.time() + 11) is None
+
+        long = auth._principal(_claims(ttl=3600))
+        cache.put('long', long, now=0)
+        assert cache.get('long', now=61) is None
+
+        for key in ('a', 'b', 'c'):
+            cache.put(key, long)
+        assert len(cache) == 2 and cache.get('a') is None
+
+    def test_rejected_tokens_are_not_cached(self):
+        """Bad signatures fail every time and never populate the cache"""
+        auth = Authenticator(SECRET, user_lookup=lambda user_id: {'role': 'client'})
+        forged = encode_jwt(_claims(), 'other-secret')
+        for _ in range(2):
+            with pytest.raises(AuthenticationError):
+                auth.authenticate(forged)
+        assert len(auth.cache) == 0
+
+    def test_tokens_without_expiry_are_rejected(self):
+        """A correctly signed token with no exp claim is not accepted"""
+        auth = Authenticator(SECRET, user_lookup=lambda user_id: {'role': 'client'})
+        claims = _claims()
+        del claims['exp']
+        with pytest.raises(AuthenticationError, match='no expiry'):
+            auth.authenticate(encode_jwt(claims, SECRET))
+        assert len(auth.cache) == 0
+
+    def test_rs256_with_jwks_and_key_rotation(self):
+        """RS256 tokens verify against cached JWKS; an unknown kid triggers one refresh"""
+        old_key, sign_old = _rsa_signer('key-1')
+        new_key, sign_new = _rsa_signer('key-2')
+        published = {'keys': [old_key]}
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            return published
+
+        jwks = JWKSCache(fetch=fetch, refresh_interval=3600, min_refresh_interval=0)
+        try:
+            auth = Authenticator(jwks=jwks, user_lookup=lambda user_id: {'role': 'client'})
+            assert auth.authenticate(sign_old(_claims())).user_id == 'user-1'
+            assert len(fetches) == 1
+
+            published = {'keys': [old_key, new_key]}
+            assert auth.authenticate(sign_new(_claims(sub='user-2'))).user_id == 'user-2'
+            assert len(fetches) == 2
+
+            tampered = sign_old(_claims(sub='user-3')).rsplit('.', 1)[0] + '.' + _b64(b'\x00' * 128)
+            with pytest.raises(AuthenticationError):
+                auth.authenticate(tampered)
+        finally:
+            jwks.stop()
+
+
+ADMIN = Principal('admin-1', 'agency-1', 'agency_admin')
+STAFF = Principal('staff-1', 'agency-1', 'agency_staff')
+CLIENT = Principal('client-user-1', 'agency-1', 'client')
+
+
+class TestPermissions:
+    """Test the compiled role/permission bitmasks"""
+
+    def test_bits_are_unique_and_roles_compiled(self):
+        """Every resource action has its own bit and every role compiles to masks"""
+        bits = list(permissions.BITS.values())
+        assert len(set(bits)) == len(bits) and all(bit & (bit - 1) == 0 for bit in bits)
+        assert set(permissions.ROLE_MASKS) == set(permissions.ROLES)
+        admin = permissions.masks_for('agency_admin')
+        assert permissions.decode(admin.agency, 'users') == list(permissions.ACTIONS)
+        assert permissions.masks_for('unknown').all == 0
+
+    def test_checks_follow_rls_policies(self):
+        """Agency scope, ownership and role differences match the database policies"""
+        own_client = {'id': 'c1', 'agency_id': 'agency-1', 'user_id': 'client-user-1'}
+        other_client = {'id': 'c2', 'agency_id': 'agency-1', 'user_id': 'client-user-2'}
+        foreign_client = {'id': 'c3', 'agency_id': 'agency-2', 'user_id': 'x'}
+        assert permissions.can(STAFF, 'clients', 'delete', other_client)
+        assert not permissions.can(STAFF, 'clients', 'read', foreign_client)
+        assert permissions.can(CLIENT, 'clients', 'read', own_client)
+        assert not permissions.can(CLIENT, 'clients', 'read', other_client)
+        assert not permissions.can(CLIENT, 'clients', 'update', own_client)
+        assert permissions.can(ADMIN, 'users', 'update', {'id': 'staff-1', 'agency_id': 'agency-1'})
+        assert not permissions.can(STAFF, 'users', 'update', {'id': 'admin-1', 'agency_id': 'agency-1'})
+        assert permissions.can(CLIENT, 'faq', 'read', {'id': 'f1'})
+        assert permissions.can(CLIENT, 'documents', 'create') and not permissions.can(CLIENT, 'cases', 'update')
+        with pytest.raises(PermissionDeniedError):
+            permissions.require(CLIENT, 'agencies', 'update', {'id': 'agency-1', 'agency_id': 'agency-1'})
+
+    def test_filter_matches_per_row_checks(self):
+        """The one-pass filter and row masks agree with individual checks"""
+        rows = [{'id': f'case-{i}', 'agency_id': f'agency-{i % 3}', 'client_user_id': f'client-user-{i % 4}'}
+                for i in range(60)]
+        for principal in (ADMIN, STAFF, CLIENT):
+            for action in permissions.ACTIONS:
+                expected = [row for row in rows if permissions.can(principal, 'cases', action, row)]
+                assert permissions.filter_authorized(principal, 'cases', action, rows) == expected
+            masks = permissions.row_permissions(principal, 'cases', rows)
+            read = permissions.permission('cases', 'read')
+            assert [row for row, mask in zip(rows, masks) if mask & read] == \
+                permissions.filter_authorized(principal, 'cases', 'read', rows)
+
+
+class _TestAEAD:
+    """SHA-256 keystream with an HMAC tag, standing in for AESGCM where cryptography is absent"""
+
+    def __init__(self, key):
+        self.key = key
+
+    def _xor(self, nonce, data):
+        stream = b''.join(hashlib.sha256(self.key + nonce + i.to_bytes(4, 'big')).digest()
+                          for i in range(len(data) // 32 + 1))
+        return bytes(a ^ b for a, b in zip(data, stream))
+
+    def encrypt(self, nonce, data, aad):
+        sealed = self._xor(nonce, data)
+        return sealed + hmac.new(self.key, nonce + aad + sealed, hashlib.sha256).digest()[:16]
+
+    def decrypt(self, nonce, data, aad):
+        sealed, tag = data[:-16], data[-16:]
+        if not hmac.compare_digest(tag, hmac.new(self.key, nonce + aad + sealed, hashlib.sha256).digest()[:16]):
+            raise ValueError('InvalidTag')
+        return self._xor(nonce, sealed)
+
+
+@pytest.fixture
+def encryptor():
+    return FieldEncryptor(b'k' * 32, b'i' * 32, store=InMemoryKeyStore(), aead=_TestAEAD)
+
+
+class TestFieldEncryption:
+    """Test envelope encryption, key caching and rotation, and blind indexes"""
+
+    def test_batch_round_trip_unwraps_key_once(self, encryptor):
+        """A column encrypts and decrypts with one key unwrap, keeping None values"""
+        values = [f'P{n:07d}' for n in range(500)] + [None]
+        tokens = encryptor.encrypt_many('agency-1', 'passport_number', values)
+        assert tokens[-1] is None and all(t.startswith('enc:v1:') for t in tokens[:-1])
+        assert len(set(tokens[:-1])) == 500 and 'P0000001' not in ''.join(tokens[:-1])
+        assert encryptor.decrypt_many('agency-1', 'passport_number', tokens) == values
+        assert encryptor.unwraps == 1
+
+    def test_ciphertext_bound_to_agency_and_field(self, encryptor):
+        """Ciphertext cannot be replayed into another agency or column"""
+        token = encryptor.encrypt('agency-1', 'passport_number', 'X1234567')
+        encryptor.encrypt('agency-2', 'passport_number', 'seed key')
+        with pytest.raises(ValidationError):
+            encryptor.decrypt('agency-1', 'date_of_birth', token)
+        with pytest.raises(ValidationError):
+            encryptor.decrypt('agency-2', 'passport_number', token)
+        with pytest.raises(ValidationError):
+            encryptor.decrypt('agency-1', 'passport_number', 'plaintext')
+
+    def test_rotation_keeps_old_ciphertext_readable(self, encryptor):
+        """New writes use the rotated key; earlier versions still decrypt"""
+        old = encryptor.encrypt('agency-1', 'passport_number', 'A1111111')
+        assert encryptor.rotate('agency-1') == 2
+        new = encryptor.encrypt('agency-1', 'passport_number', 'B2222222')
+        assert old.startswith('enc:v1:') and new.startswith('enc:v2:')
+        assert encryptor.decrypt_many('agency-1', 'passport_number', [old, new]) == ['A1111111', 'B2222222']
+
+    def test_blind_index_supports_equality_lookup(self, encryptor):
+        """Blind indexes match across formatting and rotations but differ per agency"""
+        first = encryptor.blind_index('agency-1', 'passport_number', 'ab 123-4567')
+        assert first == encryptor.blind_index('agency-1', 'passport_number', 'AB1234567')
+        encryptor.rotate('agency-1')
+        assert first == encryptor.blind_index('agency-1', 'passport_number', 'AB1234567')
+        assert first != encryptor.blind_index('agency-2', 'passport_number', 'AB1234567')
+
+        rows = encryptor.encrypt_rows('agency-1', [{'id': 'c1', 'passport_number': 'AB1234567'}, {'id': 'c2'}])
+        assert rows[0]['passport_number_bidx'] == first and 'passport_number' not in rows[1]
+        assert encryptor.decrypt_rows('agency-1', rows)[0]['passport_number'] == 'AB1234567'
+
+    def test_index_key_is_separate_from_master_key(self):
+        """Blind indexes need their own key; reusing the master key is refused"""
+        with pytest.raises(ConfigurationError):
+            FieldEncryptor(b'k' * 32, b'k' * 32, store=InMemoryKeyStore(), aead=_TestAEAD)
+        other = FieldEncryptor(b'k' * 32, b'j' * 32, store=InMemoryKeyStore(), aead=_TestAEAD)
+        encryptor = FieldEncryptor(b'k' * 32, b'i' * 32, store=InMemoryKeyStore(), aead=_TestAEAD)
+        assert (other.blind_index('agency-1', 'passport_number', 'AB1234567')
+                != encryptor.blind_index('agency-1', 'passport_number', 'AB1234567'))
+
+    def test_key_store_failures_are_not_cached(self):
+        """Only a lost creation race is tolerated; other failures surface and the next write retries"""
+        class FailingInsert:
+            def __init__(self, error):
+                self.error = error
+
+            def table(self, name):
+                return self
+
+            def insert(self, row):
+                return self
+
+            def execute(self):
+                raise self.error
+
+        conflict = RuntimeError('duplicate key value')
+        conflict.code = UNIQUE_VIOLATION
+        assert SupabaseKeyStore(FailingInsert(conflict)).add('agency-1', 1, b'wrapped') is False
+        with pytest.raises(OSError):
+            SupabaseKeyStore(FailingInsert(OSError('connection reset'))).add('agency-1', 1, b'wrapped')
+
+        store = InMemoryKeyStore()
+        store.add = lambda agency_id, version, wrapped: False
+        encryptor = FieldEncryptor(b'k' * 32, b'i' * 32, store=store, aead=_TestAEAD)
+        for _ in range(2):
+            with pytest.raises(ServiceUnavailableError):
+                encryptor.current_version('agency-1')
+        del store.add
+        assert encryptor.current_version('agency-1') == 1
+
+    def test_client_service_stores_ciphertext(self, encryptor, fake_db):
+        """Updates store the passport number encrypted with its index; reads decrypt, legacy plaintext too"""
+        fake_db.tables['clients'] = [{'id': 'c1', 'agency_id': 'agency-1', 'passport_number': 'LEGACY1'}]
+        service = ClientService(db=fake_db, cache=TwoTierCache(InMemoryBackend()), encryptor=encryptor)
+        assert service.get_client('agency-1', 'c1')['passport_number'] == 'LEGACY1'
+
+        updated = service.update_client('agency-1', 'c1', {'passport_number': 'AB1234567'})
+        stored = fake_db.tables['clients'][0]
+        assert stored['passport_number'].startswith('enc:v1:') and 'AB1234567' not in stored['passport_number']
+        assert stored['passport_number_bidx'] == encryptor.blind_index('agency-1', 'passport_number', 'AB1234567')
+        assert updated['passport_number'] == 'AB1234567'
+        assert service.get_client('agency-1', 'c1')['passport_number'] == 'AB1234567'
+
+    def test_aes_gcm_backend(self):
+        """The default backend seals with AES-GCM"""
+        pytest.importorskip('cryptography')
+        real = FieldEncryptor(os.urandom(32), os.urandom(32), store=InMemoryKeyStore())
+        token = real.encrypt('agency-1', 'passport_number', 'AB1234567')
+        assert real.decrypt('agency-1', 'passport_number', token) == 'AB1234567'
@@ -0,0 +1,211 @@
+"""
+Unit tests for blocking-indexed duplicate client detection
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
+
+from immigration_ai.crm.dedupe import (
+    ClientIdentity,
+    DuplicateIndex,
+    cluster,
+    jaro_winkler,
+    normalize_email,
+    soundex,
+)
+from immigration_ai.crm import services
+from immigration_ai.crm.services import DuplicateClientService
+
+START = datetime(2025, 7, 1, tzinfo=timezone.utc)
+
+
+def _client(client_id, first, last, email=None, dob=None, passport=None, phone=None, minutes=0):
+    return ClientIdentity(client_id, first, last, email, phone, dob, passport, START + timedelta(minutes=minutes))
+
+
+def _crowd(count):
+    """Distinct people whose names sort close together"""
+    return [_client(f'c{n}', f'Maria{chr(65 + n % 26)}', f'Santos{n // 26}', f'maria{n}@example.com',
+                    (date(1950, 1, 1) + timedelta(days=37 * n)).isoformat(), minutes=n) for n in range(count)]
+
+
+def _pairs(matches):
+    return {(match.client_id, match.duplicate_id) for match in matches}
+
+
+class TestNormalization:
+    """Test the keys the blocks are built from"""
+
+    def test_email_normalization(self):
+        """Case, +tags and gmail dots do not separate one mailbox"""
+        assert normalize_email(' Ana.Silva+crm@GoogleMail.com ') == 'anasilva@gmail.com'
+        assert normalize_email('ana.silva@example.com') == 'ana.silva@example.com'
+        assert normalize_email('not-an-email') == ''
+
+    def test_soundex_and_similarity(self):
+        """Spelling variants share a code; transposed letters stay similar"""
+        assert soundex('Robert') == soundex('Rupert') == 'R163'
+        assert soundex('Tymczak') == 'T522' and soundex('Ashcraft') == 'A261'
+        assert soundex('José') == soundex('Jose')
+        assert soundex('') == ''
+        assert round(jaro_winkler('MARTHA', 'MARHTA'), 3) == 0.961
+
+
+class TestDuplicateIndex:
+    """Test candidate generation and scoring"""
+
+    def test_finds_variants_of_one_person(self):
+        """Email, name-and-birthday and passport blocks each find their duplicate"""
+        index = DuplicateIndex()
+        index.extend(_crowd(200) + [
+            _client('ana', 'Ana', 'Silva', 'ana.silva@gmail.com', '1990-04-02', phone='+55 11 91234-5678'),
+            _client('ana-crm', 'Anna', 'Silva', 'anasilva+hubspot@gmail.com', minutes=1),
+            _client('ana-form', 'Silva', 'Ana', dob='1990-04-02', phone='011 91234 5678', minutes=2),
+            _client('ana-passport', 'A.', 'Silva-Costa', 'other@example.com', '1990-04-02', passport='bidx-1'),
+            _client('ana-again', 'Ana', 'Silva Costa', dob='1990-04-02', passport='bidx-1', minutes=3),
+        ])
+        matches = index.find_duplicates()
+        assert {('ana', 'ana-crm'), ('ana', 'ana-form'), ('ana-passport', 'ana-again')} <= _pairs(matches)
+        assert not any(match.client_id.startswith('c') for match in matches)
+        assert 'passport' in next(m for m in matches if m.duplicate_id == 'ana-again').reasons
+        assert ['ana', 'ana-crm', 'ana-form'] in cluster(matches)
+
+    def test_compares_candidates_not_every_pair(self):
+        """Comparisons grow with the window, not with the square of the clients"""
+        people = _crowd(2000)
+        index = DuplicateIndex(window=4)
+        index.extend(people)
+        assert index.find_duplicates() == []
+        assert index.comparisons < 2000 * 4 * 3
+        assert index.comparisons < 2000 * 1999 // 2 // 100
+
+    def test_typos_are_caught_by_the_sorted_neighbourhood(self):
+        """A misspelt surname with no shared key still sorts next to the original"""
+        index = DuplicateIndex()
+        index.extend([
+            _client('a', 'Oluwaseun', 'Adeyemi', dob='1985-11-30', phone='+234 803 555 0101'),
+            _client('b', 'Oluwaseun', 'Adeyemmi', dob='1985-11-30', phone='0803 555 0101'),
+        ])
+        match, = index.find_duplicates()
+        assert (match.client_id, match.duplicate_id) == ('a', 'b')
+        assert set(match.reasons) == {'phone', 'date_of_birth', 'name'}
+
+    def test_oversized_blocks_are_windowed(self):
+        """A shared family email does not compare every member with every other"""
+        family = [_client(f'k{n}', f'Child{n:03d}', 'Kowalski', 'family@example.com', f'2010-01-{1 + n % 28:02d}')
+                  for n in range(300)]
+        index = DuplicateIndex(max_block=20, window=3)
+        index.extend(family)
+        assert len(index.candidate_pairs()) < 300 * 3 * 3
+
+    def test_incremental_add_matches_batch(self):
+        """Adding clients one at a time finds the same pairs as a batch run"""
+        crowd = _crowd(300)
+        people = crowd + [
+            _client('dup-1', 'MariaC', 'Santos0', 'maria2@example.com', minutes=500),
+            _client('dup-2', 'Mariaa', 'Santos1', dob=crowd[27].date_of_birth, minutes=501),
+        ]
+        batch = DuplicateIndex()
+        batch.extend(people)
+        incremental = DuplicateIndex()
+        incremental.extend(people[:250])
+        found = [match for person in people[250:] for match in incremental.add(person)]
+        assert _pairs(found) == _pairs(batch.find_duplicates()) == {('c2', 'dup-1'), ('c27', 'dup-2')}
+        assert incremental.add(people[-1]) == []
+
+
+class _Database:
+    """Answers the duplicate service's queries from a list of clients, with the stored index in memory"""
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.fetches = []
+        self.by_id = []
+        self.saved = []
+        self.keys = []
+        self.watermarks = {}
+
+    def _row(self, c):
+        return {'id': c.id, 'first_name': c.first_name, 'last_name': c.last_name, 'email': c.email,
+                'phone': c.phone, 'date_of_birth': c.date_of_birth, 'passport_number_bidx': c.passport_hash,
+                'created_at': c.created_at}
+
+    async def fetch(self, query, agency_id, *args):
+        rows = sorted(self.clients, key=lambda c: (c.created_at, c.id))
+        if query is services.LOAD_IDENTITIES_SQL:
+            created_at, client_id, limit = args
+            self.fetches.append((created_at, client_id))
+            return [self._row(c) for c in rows if (c.created_at, c.id) > (created_at, client_id)][:limit]
+        if query is services.LOAD_IDENTITIES_BY_ID_SQL:
+            self.by_id.append(args[0])
+            return [self._row(c) for c in rows if c.id in args[0]]
+        if query is services.KEYED_CLIENTS_SQL:
+            return [{'client_id': client_id} for client_id in {key[1] for key in self.keys} & set(args[0])]
+        assert query is services.FIND_CANDIDATES_SQL
+        kinds, keys, max_block, window = args
+        found = set()
+        for kind, key in zip(kinds, keys):
+            if kind == 'block':
+                block = sorted((k for k in self.keys if k[2:4] == (kind, key)), key=lambda k: k[4])
+                found.update(k[1] for k in block[-max_block:])
+            else:
+                entries = sorted((k[3], k[1]) for k in self.keys if k[2] == kind)
+                below = [e for e in entries if e[0] < key][-window:]
+                found.update(client_id for _, client_id in below + [e for e in entries if e[0] >= key][:window])
+        return [{'client_id': client_id} for client_id in found]
+
+    async def fetchrow(self, query, agency_id):
+        assert query is services.LOAD_WATERMARK_SQL
+        watermark = self.watermarks.get(agency_id)
+        return {'watermark_at': watermark[0], 'watermark_id': watermark[1]} if watermark else None
+
+    async def execute(self, query, agency_id, *args):
+        if query is services.CLEAR_KEYS_SQL:
+            self.keys = [key for key in self.keys if key[0] != agency_id]
+        else:
+            assert query is services.SAVE_WATERMARK_SQL
+            self.watermarks[agency_id] = max(args, self.watermarks.get(agency_id, args))
+
+    async def executemany(self, query, args):
+        if query is services.SAVE_KEYS_SQL:
+            self.keys.extend(args)
+        else:
+            self.saved.extend(args)
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield self
+
+
+class TestDuplicateClientService:
+    """Test scans and incremental checks against a stand-in database"""
+
+    def test_scan_then_check_new_clients(self, monkeypatch):
+        """A scan pages through everyone; a check reads and compares only new clients"""
+        monkeypatch.setattr(services, 'IDENTITY_PAGE_SIZE', 50)
+        database = _Database(_crowd(120) + [_client('dup', 'MariaB', 'Santos0', 'maria1@example.com',
+                                                    minutes=119)])
+        service = DuplicateClientService(database)
+        summary = asyncio.run(service.scan('agency-1'))
+        assert summary['clients'] == 121 and summary['matches'] == 1
+        assert len(database.fetches) == 3
+        assert database.saved == [('agency-1', 'c1', 'dup', database.saved[0][3], ['email', 'name'])]
+
+        database.clients.append(_client('new', 'Maria F', 'Santos0', 'maria5+web@example.com', minutes=600))
+        database.saved.clear()
+        matches = asyncio.run(service.check_new_clients('agency-1'))
+        assert [(m.client_id, m.duplicate_id) for m in matches] == [('c5', 'new')]
+        assert database.fetches[-1][0] > START + timedelta(minutes=100)
+        assert [row[1:3] for row in database.saved] == [('c5', 'new')]
+        assert asyncio.run(service.check_new_clients('agency-1')) == []
+
+    def test_cold_process_reads_only_candidates(self):
+        """Another process checks new clients from the stored index without loading every client"""
+        database = _Database(_crowd(300))
+        asyncio.run(DuplicateClientService(database).scan('agency-1'))
+        database.clients.append(_client('new', 'MariaC', 'Santos0', 'maria2@example.com', minutes=900))
+        matches = asyncio.run(DuplicateClientService(database).check_new_clients('agency-1'))
+        assert [(m.client_id, m.duplicate_id) for m in matches] == [('c2', 'new')]
+        read, = database.by_id
+        assert 'c2' in read and len(read) < 40
+        assert 'new' in {key[1] for key in database.keys}
@@ -0,0 +1,268 @@
+"""
+Unit tests for incremental HubSpot/Salesforce sync against local fake CRMs
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../tools'))
+
+from fake_crm import FakeHubSpot, FakeSalesforce  # noqa: E402
+
+from immigration_ai.core.exceptions import IntegrationError, ValidationError  # noqa: E402
+from immigration_ai.crm.integrations import hubspot  # noqa: E402
+from immigration_ai.crm.integrations.http import JSONClient  # noqa: E402
+from immigration_ai.crm.integrations.hubspot import HubSpotAdapter  # noqa: E402
+from immigration_ai.crm.integrations.salesforce import SalesforceAdapter  # noqa: E402
+from immigration_ai.crm.sync import CRMSyncEngine, InMemorySyncStore, merge_fields  # noqa: E402
+
+AGENCY = 'agency-1'
+
+
+def _client(i):
+    return {'first_name': f'Ana{i}', 'last_name': f'Silva{i}', 'email': f'ana{i}@example.com',
+            'phone': f'+1555{i:07d}', 'nationality': 'BR', 'immigration_status': 'visa_pending'}
+
+
+def _book(store, clients, cases=0):
+    for i in range(clients):
+        store.put(AGENCY, 'client', f'client-{i}', _client(i))
+    for i in range(cases):
+        store.put(AGENCY, 'case', f'case-{i}', {'case_number': f'IMM-{i:05d}', 'title': f'Work visa {i}',
+                                                'status': 'new', 'case_type': 'work_visa', 'priority': 3},
+                  client_id=f'client-{i}')
+
+
+def _hubspot(fake):
+    return HubSpotAdapter('token', client=JSONClient(fake.url, headers={'Authorization': 'Bearer token'},
+                                                     retry_base=0.01))
+
+
+def _salesforce(fake):
+    return SalesforceAdapter(fake.url, 'token', client=JSONClient(fake.url, retry_base=0.01))
+
+
+def _run(engine):
+    async def run():
+        try:
+            return await engine.run_once()
+        finally:
+            await engine.adapter.close()
+    return asyncio.run(run())
+
+
+class TestMergeFields:
+    """Test the three-way field merge"""
+
+    def test_one_sided_changes_flow_to_the_other_side(self):
+        """A field changed on one side only takes that side's value"""
+        base = {'phone': '1', 'nationality': 'BR'}
+        merged = merge_fields(base, {'phone': '2', 'nationality': 'BR'}, {'phone': '1', 'nationality': 'PT'},
+                              pullable=('phone', 'nationality'))
+        assert merged.to_remote == {'phone': '2'}
+        assert merged.to_local == {'nationality': 'PT'}
+        assert merged.conflicts == []
+
+    def test_conflicts_follow_the_policy(self):
+        """Both sides changed: newest wins by timestamp, or a fixed side wins"""
+        earlier = datetime.now(timezone.utc)
+        later = earlier + timedelta(seconds=5)
+        args = ({'phone': '1'}, {'phone': 'local'}, {'phone': 'remote'}, ('phone',))
+        assert merge_fields(*args, policy='newest', local_modified=later,
+                            remote_modified=earlier).to_remote == {'phone': 'local'}
+        assert merge_fields(*args, policy='newest', local_modified=earlier,
+                            remote_modified=later).to_local == {'phone': 'remote'}
+        assert merge_fields(*args, policy='local').to_remote == {'phone': 'local'}
+        remote = merge_fields(*args, policy='remote')
+        assert remote.to_local == {'phone': 'remote'} and remote.conflicts == ['phone']
+        with pytest.raises(ValidationError):
+            merge_fields(*args, policy='coin-toss')
+
+    def test_platform_owned_fields_are_pushed_back(self):
+        """A CRM edit to a field the platform owns is overwritten"""
+        merged = merge_fields({'email': 'a@x'}, {'email': 'a@x'}, {'email': 'b@x'}, pullable=('phone',))
+        assert merged.to_remote == {'email': 'a@x'} and not merged.to_local
+
+
+class TestHubSpotSync:
+    """Test delta sync against the HubSpot fake"""
+
+    def test_initial_sync_batches_and_quiet_runs_write_nothing(self):
+        """The first run creates in batches of 100; a run with no changes only searches"""
+        store = InMemorySyncStore()
+        _book(store, clients=250, cases=30)
+        with FakeHubSpot() as fake:
+            stats = _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            assert stats.created == 280 and stats.failed == 0
+            assert len(fake.objects['contacts']) == 250 and len(fake.objects['deals']) == 30
+            assert fake.requests['batch/create contacts'] == 3
+            assert fake.requests['batch/create deals'] == 1
+            deal = fake.find('deals', 'case-7')
+            contact = fake.find('contacts', 'client-7')
+            assert (deal['id'], contact['id'], 3) in fake.associations
+            assert deal['properties']['dealstage'] == 'appointmentscheduled'
+
+            # Our own writes come back on the next pull and merge to nothing
+            _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            fake.requests.clear()
+            quiet = _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            assert quiet.pushed == 0 and quiet.applied == 0
+            assert set(fake.requests) == {'search contacts', 'search deals'}
+            assert store.changes == []
+
+    def test_delta_push_sends_only_changed_fields(self):
+        """Local edits to three clients go out as one batch update of just those fields"""
+        store = InMemorySyncStore()
+        _book(store, clients=120)
+        with FakeHubSpot() as fake:
+            _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            for i in (3, 50, 99):
+                store.put(AGENCY, 'client', f'client-{i}', {'phone': f'+44{i}'})
+            fake.requests.clear()
+            stats = _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            assert stats.pushed == 3 and stats.created == 0
+            assert fake.requests['batch/update contacts'] == 1
+            assert 'batch/create contacts' not in fake.requests
+            assert fake.find('contacts', 'client-50')['properties']['phone'] == '+4450'
+
+    def test_remote_edits_are_pulled_and_not_echoed(self):
+        """A CRM edit updates the local record without being written back"""
+        store = InMemorySyncStore()
+        _book(store, clients=5, cases=5)
+        with FakeHubSpot() as fake:
+            _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            fake.edit('contacts', fake.find('contacts', 'client-2')['id'], {'phone': '+351900'})
+            fake.edit('deals', fake.find('deals', 'case-1')['id'], {'immigration_ai_status': 'approved',
+                                                                    'closedate': '2025-09-30T00:00:00Z'})
+            fake.requests.clear()
+            stats = _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            assert stats.applied == 2 and stats.pushed == 0
+            assert store.records[('client', 'client-2')]['fields']['phone'] == '+351900'
+            case = store.records[('case', 'case-1')]['fields']
+            assert case['status'] == 'approved' and case['due_date'] == '2025-09-30'
+            assert not any(name.startswith('batch/') for name in fake.requests)
+
+    def test_conflicting_edits_resolve_to_the_newest(self):
+        """Both sides edit one field; the later edit wins on both sides"""
+        store = InMemorySyncStore()
+        _book(store, clients=2)
+        with FakeHubSpot() as fake:
+            _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            contact_id = fake.find('contacts', 'client-0')['id']
+            fake.edit('contacts', contact_id, {'phone': '+1-crm'})
+            store.put(AGENCY, 'client', 'client-0', {'phone': '+1-platform'})
+            stats = _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            assert stats.conflicts == 1
+            assert fake.objects['contacts'][contact_id]['properties']['phone'] == '+1-platform'
+            assert store.records[('client', 'client-0')]['fields']['phone'] == '+1-platform'
+
+    def test_invalid_remote_values_are_not_applied(self):
+        """A status the platform does not know is overwritten from the platform"""
+        store = InMemorySyncStore()
+        _book(store, clients=1, cases=1)
+        with FakeHubSpot() as fake:
+            _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            deal_id = fake.find('deals', 'case-0')['id']
+            fake.edit('deals', deal_id, {'immigration_ai_status': 'maybe'})
+            _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            assert store.records[('case', 'case-0')]['fields']['status'] == 'new'
+            assert fake.objects['deals'][deal_id]['properties']['immigration_ai_status'] == 'new'
+
+    def test_pull_restarts_past_the_search_window(self, monkeypatch):
+        """More changes than one search can page through are read by restarting from the last timestamp"""
+        monkeypatch.setattr(hubspot, 'SEARCH_WINDOW', 300)
+        store = InMemorySyncStore()
+        _book(store, clients=450)
+        with FakeHubSpot() as fake:
+            fake.SEARCH_WINDOW = 300
+            fake.TICK = timedelta(milliseconds=1)
+            _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            for record in list(fake.objects['contacts'].values()):
+                fake.edit('contacts', record['id'], {'immigration_ai_immigration_status': 'approved'})
+            stats = _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            assert stats.applied == 450
+            assert all(record['fields']['immigration_status'] == 'approved'
+                       for (kind, _), record in store.records.items() if kind == 'client')
+
+    def test_throttled_requests_are_retried(self):
+        """429 answers are retried after Retry-After"""
+        store = InMemorySyncStore()
+        _book(store, clients=3)
+        with FakeHubSpot() as fake:
+            fake.throttle_next = 2
+            stats = _run(CRMSyncEngine(_hubspot(fake), store, AGENCY))
+            assert fake.throttled == 2 and stats.created == 3
+
+
+class TestSalesforceSync:
+    """Test delta sync against the Salesforce fake"""
+
+    def test_initial_sync_and_paged_pull(self):
+        """Upserts go out 200 at a time; pulls follow nextRecordsUrl"""
+        store = InMemorySyncStore()
+        _book(store, clients=450, cases=3)
+        with FakeSalesforce(query_batch_size=100) as fake:
+            stats = _run(CRMSyncEngine(_salesforce(fake), store, AGENCY))
+            assert stats.created == 453
+            assert fake.requests['upsert Contact'] == 3 and fake.requests['upsert Opportunity'] == 1
+            opportunity = fake.find('Opportunity', 'case-2')
+            assert opportunity['ContactId'] == fake.find('Contact', 'client-2')['Id']
+            assert opportunity['StageName'] == 'Prospecting' and opportunity['Priority__c'] == 3
+
+            for record in list(fake.objects['Contact'].values())[:250]:
+                fake.edit('Contact', record['Id'], {'Nationality__c': 'PT'})
+            fake.requests.clear()
+            stats = _run(CRMSyncEngine(_salesforce(fake), store, AGENCY))
+            assert stats.applied == 250 and stats.pushed == 0
+            # The 450 echoes of the first run's writes plus 250 edits, 100 per page
+            assert fake.requests['query more'] >= 2
+
+    def test_rejected_records_are_retried_next_run(self):
+        """A record the CRM rejects stays queued while the cursor moves on"""
+        store = InMemorySyncStore()
+        _book(store, clients=3)
+        store.put(AGENCY, 'client', 'client-1', {'last_name': None})
+        with FakeSalesforce() as fake:
+            stats = _run(CRMSyncEngine(_salesforce(fake), store, AGENCY))
+            assert stats.created == 2 and stats.failed == 1
+            assert fake.find('Contact', 'client-1') is None
+
+            store.put(AGENCY, 'client', 'client-1', {'last_name': 'Silva'})
+            stats = _run(CRMSyncEngine(_salesforce(fake), store, AGENCY))
+            assert stats.created == 1 and stats.failed == 0
+            assert fake.find('Contact', 'client-1')['LastName'] == 'Silva'
+
+    def test_rejected_credentials_raise(self):
+        """A 401 surfaces as an IntegrationError instead of being retried"""
+        store = InMemorySyncStore()
+        _book(store, clients=1)
+        with FakeSalesforce(token='secret') as fake:
+            with pytest.raises(IntegrationError) as raised:
+                _run(CRMSyncEngine(_salesforce(fake), store, AGENCY))
+            assert raised.value.status == 401 and fake.total_requests == 0
+
+
+class TestAdapterConfig:
+    """Test that tenant-editable config cannot pick a secret or a host"""
+
+    def test_hubspot_host_is_fixed(self):
+        """base_url and token_env in config are ignored"""
+        adapter = HubSpotAdapter.from_config({'base_url': 'http://attacker.example', 'token_env': 'SECRET'},
+                                             'token')
+        assert adapter.client.base_url == hubspot.DEFAULT_BASE_URL
+        assert adapter.client.headers['Authorization'] == 'Bearer token'
+        with pytest.raises(IntegrationError):
+            HubSpotAdapter.from_config({'token_env': 'SUPABASE_SERVICE_ROLE_KEY'}, None)
+
+    def test_salesforce_instance_must_be_https_salesforce(self):
+        """Only https *.my.salesforce.com instance URLs are accepted"""
+        adapter = SalesforceAdapter.from_config({}, 'token', 'https://acme.my.salesforce.com')
+        assert adapter.client.base_url == 'https://acme.my.salesforce.com'
+        SalesforceAdapter.from_config({}, 'token', 'https://acme--dev.sandbox.my.salesforce.com')
+        for url in ('http://acme.my.salesforce.com', 'https://attacker.example',
+                    'https://acme.my.salesforce.com.attacker.example', 'https://a.my.salesforce.com/x'):
+            with pytest.raises(IntegrationError):
+                SalesforceAdapter.from_config({'instance_url': url}, 'token', url)
@@ -0,0 +1,230 @@
+"""
+Unit tests for the workload-aware task assignment engine and TaskService
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from immigration_ai.core.exceptions import ResourceNotFoundError, ValidationError
+from immigration_ai.crm.services import TaskService
+from immigration_ai.crm.tasks import AssignmentEngine, StaffMember, Task
+
+NOW = datetime(2025, 7, 1, 12, tzinfo=timezone.utc)
+
+
+def _due(days):
+    return NOW + timedelta(days=days)
+
+
+def _team():
+    return [
+        StaffMember('ana', frozenset({'work_visa'}), capacity=5),
+        StaffMember('ben', frozenset({'asylum'}), capacity=5),
+        StaffMember('cat', capacity=5),
+    ]
+
+
+class TestAssignmentEngine:
+    """Test choosing assignees, the task views and rebalancing"""
+
+    def test_tasks_go_to_the_least_loaded(self):
+        """Tasks without a skill spread across the team by workload"""
+        engine = AssignmentEngine(_team())
+        owners = [engine.add_task(Task(f't{i}')) for i in range(6)]
+        assert sorted(owners) == ['ana', 'ana', 'ben', 'ben', 'cat', 'cat']
+        assert {member.load for member in engine.workload()} == {2.0}
+
+    def test_skilled_staff_first_then_the_team(self):
+        """A skill goes to staff who have it until they are full"""
+        engine = AssignmentEngine(_team())
+        owners = [engine.add_task(Task(f't{i}', skill='work_visa', effort=2)) for i in range(4)]
+        assert owners[:2] == ['ana', 'ana']
+        assert 'ana' not in owners[2:]
+        assert engine.staff['ana'].load == 4
+
+    def test_nobody_takes_work_past_capacity(self):
+        """With everyone full the task stays unassigned"""
+        engine = AssignmentEngine([StaffMember('ana', capacity=2)])
+        assert engine.add_task(Task('a', effort=2)) == 'ana'
+        assert engine.add_task(Task('b')) is None
+        assert [task.id for task in engine.my_tasks(None)] == ['b']
+
+    def test_suggestions_skip_unavailable_staff(self):
+        """Candidates are the least loaded staff who are in"""
+        engine = AssignmentEngine(_team())
+        engine.add_task(Task('t', assigned_to='cat'))
+        engine.set_available('ben', False)
+        assert [member.id for member in engine.candidates(limit=3)] == ['ana', 'cat']
+
+    def test_views_order_by_due_date_and_priority(self):
+        """My tasks run due soonest first; overdue is the prefix before now"""
+        engine = AssignmentEngine(_team())
+        engine.add_task(Task('later', due_date=_due(3), assigned_to='ana'))
+        engine.add_task(Task('undated', assigned_to='ana'))
+        engine.add_task(Task('late-low', due_date=_due(-1), priority='low', assigned_to='ana'))
+        engine.add_task(Task('late-urgent', due_date=_due(-1), priority='urgent', assigned_to='ana'))
+        engine.add_task(Task('late-other', due_date=_due(-2), assigned_to='ben'))
+        assert [task.id for task in engine.my_tasks('ana')] == ['late-urgent', 'late-low', 'later', 'undated']
+        assert engine.next_task('ana').id == 'late-urgent'
+        assert [task.id for task in engine.overdue(NOW)][0] == 'late-other'
+        assert {task.id for task in engine.overdue(NOW, 'ana')} == {'late-low', 'late-urgent'}
+
+        engine.remove_task('late-urgent')
+        assert engine.next_task('ana').id == 'late-low'
+        assert 'late-urgent' not in {task.id for task in engine.overdue(NOW)}
+        assert engine.staff['ana'].open_tasks == 3
+
+    def test_rebalance_moves_urgent_work_first(self):
+        """Tasks of staff who are out go to the others, earliest due first"""
+        engine = AssignmentEngine([StaffMember('ana', capacity=10), StaffMember('ben', capacity=2)])
+        for i in range(4):
+            engine.add_task(Task(f't{i}', due_date=_due(i), assigned_to='ana'))
+        moves = engine.rebalance(['ana'])
+        assert [(move.task_id, move.to) for move in moves] == [('t0', 'ben'), ('t1', 'ben'), ('t2', None),
+                                                               ('t3', None)]
+        assert engine.staff['ana'].load == 0 and engine.staff['ben'].load == 2
+
+        engine.add_staff(StaffMember('cat', capacity=5))
+        assert {move.task_id for move in engine.assign_unassigned()} == {'t2', 't3'}
+        assert engine.my_tasks(None) == []
+
+    def test_reassignment_keeps_heaps_consistent(self):
+        """Moving tasks back and forth leaves loads and choices right"""
+        engine = AssignmentEngine(_team())
+        for i in range(300):
+            engine.add_task(Task(f't{i}', effort=0.01))
+        for i in range(0, 300, 2):
+            engine.assign(f't{i}', 'ana')
+        loads = {member.id: round(member.load, 2) for member in engine.staff.values()}
+        assert sum(loads.values()) == 3.0
+        assert engine.choose().id != 'ana'
+        assert max(len(heap.heap) for heap in engine._heaps.values()) < 4 * len(engine.staff) + 4
+
+    def test_bad_input_raises(self):
+        """Unknown priorities, tasks and staff are rejected"""
+        engine = AssignmentEngine(_team())
+        with pytest.raises(ValidationError):
+            engine.add_task(Task('x', priority='whenever'))
+        with pytest.raises(ResourceNotFoundError):
+            engine.assign('missing')
+        engine.add_task(Task('t'))
+        with pytest.raises(ResourceNotFoundError):
+            engine.assign('t', 'nobody')
+
+
+@pytest.fixture
+def task_db(fake_db):
+    fake_db.tables['users'] = [
+        {'id': 'ana', 'agency_id': 'agency-1', 'role': 'agency_staff'},
+        {'id': 'ben', 'agency_id': 'agency-1', 'role': 'agency_admin'},
+        {'id': 'client-user', 'agency_id': 'agency-1', 'role': 'client'},
+    ]
+    fake_db.tables['staff_workload_profiles'] = [
+        {'user_id': 'ana', 'agency_id': 'agency-1', 'skills': ['work_visa'], 'capacity': 10, 'available': True},
+    ]
+    fake_db.tables['tasks'] = [
+        {'id': f'old-{i}', 'agency_id': 'agency-1', 'title': f'Old {i}', 'priority': 'high', 'effort': 1,
+         'status': 'open', 'assigned_to': 'ana', 'due_date': _due(i - 2).isoformat()}
+        for i in range(4)
+    ] + [{'id': 'done', 'agency_id': 'agency-1', 'title': 'Done', 'status': 'done', 'assigned_to': 'ana'}]
+    return fake_db
+
+
+class TestTaskService:
+    """Test TaskService against the fake Supabase client"""
+
+    def test_views_come_from_the_index(self, task_db):
+        """After one load, my tasks and overdue run no queries"""
+        service = TaskService(db=task_db)
+        assert [task['id'] for task in service.my_tasks('agency-1', 'ana')] == ['old-0', 'old-1', 'old-2',
+                                                                                'old-3']
+        loaded = len(task_db.queries)
+        overdue = service.overdue_tasks('agency-1', now=NOW)
+        assert [task['id'] for task in overdue] == ['old-0', 'old-1']
+        assert service.my_tasks('agency-1', 'ben') == []
+        assert len(task_db.queries) == loaded
+
+    def test_create_auto_assigns_and_persists(self, task_db):
+        """A new task goes to the least loaded staff member and is stored with who chose"""
+        service = TaskService(db=task_db)
+        created = service.create_task('agency-1', {'title': 'Collect payslips', 'skill': 'asylum'})
+        assert created['assigned_to'] == 'ben' and created['assignment'] == 'auto'
+        assert [task['id'] for task in service.my_tasks('agency-1', 'ben')] == [created['id']]
+        assert service.suggest_assignees('agency-1')[0]['staff_id'] == 'ben'
+
+        with pytest.raises(ValidationError):
+            service.create_task('agency-1', {'title': 'x', 'status': 'done'})
+
+    def test_manual_assignee_must_be_agency_staff(self, task_db):
+        """A task cannot be created for a client user or someone outside the agency"""
+        service = TaskService(db=task_db)
+        for outsider in ('client-user', 'someone-else'):
+            with pytest.raises(ValidationError):
+                service.create_task('agency-1', {'title': 'x', 'assigned_to': outsider})
+        assert not any(row.get('title') == 'x' for row in task_db.tables['tasks'])
+        created = service.create_task('agency-1', {'title': 'y', 'assigned_to': 'ben'})
+        assert created['assignment'] == 'manual' and service.index('agency-1').staff['ben'].open_tasks == 1
+
+    def test_assignment_writes_before_the_index_changes(self, task_db, monkeypatch):
+        """A failed update leaves the index as it was; a successful one moves the task"""
+        service = TaskService(db=task_db)
+        engine = service.index('agency-1')
+
+        def fail(*args):
+            raise OSError('database unavailable')
+
+        monkeypatch.setattr(service, '_update', fail)
+        with pytest.raises(OSError):
+            service.assign_task('agency-1', 'old-0', 'ben')
+        assert engine.get('old-0').assigned_to == 'ana' and engine.staff['ben'].load == 0
+
+        monkeypatch.undo()
+        assert service.assign_task('agency-1', 'old-0', 'ben')['assigned_to'] == 'ben'
+        assert engine.get('old-0').assigned_to == 'ben' and engine.staff['ben'].load == 1
+        auto = service.assign_task('agency-1', 'old-1')
+        assert auto['assignment'] == 'auto' and engine.get('old-1').assigned_to == auto['assigned_to'] == 'ben'
+
+    def test_staff_out_rebalances_in_bulk(self, task_db):
+        """Tasks of someone going out move with one update per new assignee"""
+        service = TaskService(db=task_db)
+        service.my_tasks('agency-1', 'ana')
+        task_db.queries.clear()
+        moves = service.set_staff_availability('agency-1', ['ana'], False)
+        assert [move.to for move in moves] == ['ben'] * 4
+        assert task_db.queries.count(('tasks', 'update')) == 1
+        assert {row['assigned_to'] for row in task_db.tables['tasks'] if row['status'] == 'open'} == {'ben'}
+        assert task_db.tables['staff_workload_profiles'][0]['available'] is False
+        assert {row['user_id'] for row in task_db.tables['staff_workload_profiles']} == {'ana'}
+
+    def test_tasks_created_by_another_process(self, task_db):
+        """A task created through another service instance can be assigned and completed at once"""
+        first, second = TaskService(db=task_db), TaskService(db=task_db)
+        second.my_tasks('agency-1', 'ana')
+        created = first.create_task('agency-1', {'title': 'Translate diploma', 'assigned_to': 'ana'})
+        assert second.assign_task('agency-1', created['id'], 'ben')['assigned_to'] == 'ben'
+        assert created['id'] in {task['id'] for task in second.my_tasks('agency-1', 'ben')}
+        other = first.create_task('agency-1', {'title': 'Book biometrics'})
+        assert second.complete_task('agency-1', other['id'])['status'] == 'done'
+        with pytest.raises(ResourceNotFoundError):
+            second.complete_task('agency-1', 'missing')
+
+    def test_load_reads_past_the_row_cap(self, task_db, monkeypatch):
+        """The index load pages instead of trusting one capped response"""
+        from immigration_ai.utils import pagination
+
+        monkeypatch.setattr(pagination, 'MAX_ROWS', 3)
+        task_db.tables['tasks'] += [{'id': f'new-{i}', 'agency_id': 'agency-1', 'title': f'New {i}',
+                                     'status': 'open', 'assigned_to': None} for i in range(5)]
+        task_db.queries.clear()
+        assert len(TaskService(db=task_db).index('agency-1').tasks) == 9
+        assert task_db.queries.count(('tasks', 'select')) == 4
+
+    def test_complete_drops_the_task(self, task_db):
+        """A completed task leaves the views and frees its assignee's capacity"""
+        service = TaskService(db=task_db)
+        service.complete_task('agency-1', 'old-0')
+        assert 'old-0' not in {task['id'] for task in service.my_tasks('agency-1', 'ana')}
+        assert service.index('agency-1').staff['ana'].load == 3
+        assert task_db.tables['tasks'][0]['status'] == 'done'
+        with pytest.raises(ResourceNotFoundError):
+            service.complete_task('agency-1', 'done')
@@ -0,0 +1,151 @@
+"""
+Unit tests for the bulk import/export tool's streaming readers and row conversion
+"""
+import asyncio
+import os
+import sys
+import uuid
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../tools'))
+
+import data_migration  # noqa: E402
+from data_migration import (  # noqa: E402
+    TABLES,
+    TableReport,
+    TableSpool,
+    batched,
+    convert_record,
+    encrypt_batch,
+    fixture_uuid,
+    iter_table,
+)
+
+FIXTURES = Path(__file__).resolve().parents[2] / 'data' / 'fixtures'
+
+
+class TestDataMigration:
+    """Test the parts of the bulk loader that run without Postgres"""
+
+    def test_yaml_reader_streams_items_per_table(self):
+        """YAML fixtures yield one record per list item, tagged with their table"""
+        cases = list(iter_table([FIXTURES / 'cases.yaml'], 'cases'))
+        assert cases and all(isinstance(case, dict) for case in cases)
+        assert cases[0]['id'] == 'case-001'
+        assert list(iter_table([FIXTURES / 'cases.yaml'], 'clients')) == []
+
+    def test_yaml_reader_keeps_nested_values(self, tmp_path):
+        """Nested mappings and lists inside an item survive the event stream"""
+        path = tmp_path / 'agencies.yaml'
+        path.write_text('agencies:\n'
+                        '  - id: a1\n    address: {city: Toronto, lines: [1 Main St, Unit 2]}\n'
+                        '  - id: a2\n    name: Second\n')
+        records = list(iter_table([path], 'agencies'))
+        assert records == [{'id': 'a1', 'address': {'city': 'Toronto', 'lines': ['1 Main St', 'Unit 2']}},
+                           {'id': 'a2', 'name': 'Second'}]
+
+    def test_csv_reader_uses_file_name_as_table(self, tmp_path):
+        """CSV rows load into the table the file is named after, empty cells as NULL"""
+        (tmp_path / 'clients.csv').write_text('id,nationality,passport_number\nc1,CA,\n')
+        (tmp_path / 'cases.csv').write_text('id\nx1\n')
+        records = list(iter_table(sorted(tmp_path.iterdir()), 'clients'))
+        assert records == [{'id': 'c1', 'nationality': 'CA', 'passport_number': None}]
+
+    def test_spool_parses_each_yaml_file_once(self, tmp_path, monkeypatch):
+        """Several tables from one YAML file cost one parse, read back in any order"""
+        path = tmp_path / 'fixtures.yaml'
+        path.write_text('cases:\n  - id: x1\n    opened: 2025-07-01\nclients:\n  - id: c1\n  - id: c2\n')
+        (tmp_path / 'clients.csv').write_text('id\nc0\n')
+        parses = []
+        real_iter_yaml = data_migration.iter_yaml
+        monkeypatch.setattr(data_migration, 'iter_yaml', lambda p: parses.append(p) or real_iter_yaml(p))
+
+        with TableSpool([tmp_path / 'clients.csv', path]) as spool:
+            assert [r['id'] for r in spool.iter_table('clients')] == ['c0', 'c1', 'c2']
+            assert list(spool.iter_table('cases')) == [{'id': 'x1', 'opened': date(2025, 7, 1)}]
+            assert list(spool.iter_table('agencies')) == []
+        assert parses == [path]
+
+    def test_fixture_ids_map_to_stable_uuids(self):
+        """Fixture ids become deterministic UUIDs so foreign keys line up; real UUIDs pass through"""
+        real = uuid.uuid4()
+        assert fixture_uuid(str(real)) == real
+        assert fixture_uuid('agency-001') == fixture_uuid('agency-001') != fixture_uuid('agency-002')
+        assert fixture_uuid('') is None
+
+    def test_convert_record_types_and_coerces_enums(self):
+        """Records become typed tuples; unknown columns are reported and bad enum values fall back"""
+        spec = TABLES['cases']
+        report = TableReport('cases')
+        row = dict(zip(spec.column_names, convert_record(spec, {
+            'id': 'case-001', 'client_id': 'client-001', 'agency_id': 'agency-001',
+            'case_type': 'express_entry', 'status': 'approved', 'title': 'T', 'priority': '3',
+            'due_date': '2024-06-15', 'created_at': '2024-01-15T10:00:00Z', 'notes': 'ignored',
+        }, report)))
+        assert row['client_id'] == fixture_uuid('client-001')
+        assert row['case_type'] == 'other' and row['status'] == 'approved'
+        assert row['priority'] == 3
+        assert row['due_date'] == date(2024, 6, 15)
+        assert row['created_at'] == datetime(2024, 1, 15, 10, tzinfo=timezone.utc)
+        assert row['case_number'] is None
+        assert report.coerced == {'case_type': 1}
+        assert report.ignored_columns == ['notes']
+
+    def test_encrypt_batch_seals_plaintext_per_agency(self):
+        """Plaintext passport numbers are sealed per agency with a blind index; ciphertext passes through"""
+        class Encryptor:
+            def __init__(self):
+                self.calls = []
+
+            def encrypt_many(self, agency_id, field, values):
+                self.calls.append(agency_id)
+                return [f'enc:v1:{agency_id}:{value}' for value in values]
+
+            def blind_index_many(self, agency_id, field, values):
+                return [f'bidx:{value}' for value in values]
+
+        spec = TABLES['clients']
+        names = spec.column_names
+        encryptor = Encryptor()
+
+        def row(client_id, agency_id, passport):
+            return convert_record(spec, {'id': client_id, 'agency_id': agency_id, 'passport_number': passport},
+                                  TableReport('clients'))
+
+        rows = [dict(zip(names, values)) for values in encrypt_batch(spec, [
+            row('c1', 'agency-1', 'AB123'), row('c2', 'agency-2', 'CD456'), row('c3', 'agency-1', None),
+            row('c4', 'agency-1', 'enc:v1:already'),
+        ], lambda: encryptor)]
+        assert rows[0]['passport_number'] == f"enc:v1:{fixture_uuid('agency-1')}:AB123"
+        assert rows[0]['passport_number_bidx'] == 'bidx:AB123'
+        assert rows[2]['passport_number'] is None and rows[2]['passport_number_bidx'] is None
+        assert rows[3]['passport_number'] == 'enc:v1:already'
+        assert sorted(encryptor.calls) == sorted(str(fixture_uuid(a)) for a in ('agency-1', 'agency-2'))
+
+    def test_load_skips_triggers_without_locking_the_table(self):
+        """Deferred triggers are skipped through a transaction-local setting, never ALTER TABLE"""
+        class Connection:
+            def __init__(self):
+                self.statements = []
+                self.copied = 0
+
+            async def execute(self, query, *args):
+                self.statements.append((' '.join(query.split()), args))
+
+            async def copy_records_to_table(self, table, records, columns):
+                self.copied += len(records)
+
+        connection = Connection()
+        report = asyncio.run(data_migration.load_table(connection, TABLES['documents'], [
+            {'id': f'doc-{n}', 'client_id': 'client-001', 'agency_id': 'agency-001'} for n in range(3)
+        ], batch_size=2, notify=False))
+        assert (report.rows, report.batches, connection.copied) == (3, 2, 3)
+        assert not any('ALTER TABLE public.' in query for query, _ in connection.statements)
+        switches = [args for query, args in connection.statements if query == data_migration.BULK_IMPORT_SQL]
+        assert switches == [('on',), ('off',)]
+
+    def test_batched_bounds_batch_size(self):
+        """Batches never exceed the requested size and the remainder is flushed"""
+        assert [len(b) for b in batched(iter(range(12)), 5)] == [5, 5, 2]
+        assert data_migration.LOAD_ORDER.index('agencies') < data_migration.LOAD_ORDER.index('cases')
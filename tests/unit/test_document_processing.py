@@ -0,0 +1,136 @@
+"""
+Unit tests for document processors
+"""
+import pytest
+
+from immigration_ai.ai_engine.processors.form_extractor import FormExtractor, ParallelFormExtractor, extract_page
+from immigration_ai.ai_engine.processors.pdf_processor import PDFProcessor, StreamingPDFReader
+from immigration_ai.core.exceptions import DocumentProcessingError, ExtractionTimeoutError, MemoryLimitExceededError
+
+
+class TestStreamingPDFProcessor:
+    """Test page-streaming PDF extraction"""
+
+    def test_pages_are_extracted_in_order(self, make_pdf):
+        """Test text is extracted per page, in document order"""
+        path = make_pdf([['Bank statement', 'January'], ['Balance (CAD) 1,200.00']])
+
+        pages = list(PDFProcessor().iter_pages(path))
+
+        assert [p.number for p in pages] == [1, 2]
+        assert pages[0].text == 'Bank statement\nJanuary'
+        assert pages[1].text == 'Balance (CAD) 1,200.00'
+
+    def test_compressed_content_streams(self, make_pdf):
+        """Test FlateDecode content streams are decoded"""
+        path = make_pdf([['Employment reference letter']], compress=True)
+        assert PDFProcessor().extract_text(path) == 'Employment reference letter'
+
+    def test_stages_run_before_next_page_is_read(self, make_pdf, monkeypatch):
+        """Test each page flows through all stages before the next page is parsed"""
+        path = make_pdf([[f'page {i}'] for i in range(1, 4)])
+        events = []
+        original = StreamingPDFReader._page_content
+
+        def tracking_page_content(self, page):
+            events.append('read')
+            return original(self, page)
+
+        monkeypatch.setattr(StreamingPDFReader, '_page_content', tracking_page_content)
+        stages = [lambda page: events.append(f'ocr {page.number}') or page,
+                  lambda page: events.append(f'store {page.number}') or page.number]
+
+        assert list(PDFProcessor(stages=stages).process(path)) == [1, 2, 3]
+        assert events == ['read', 'ocr 1', 'store 1', 'read', 'ocr 2', 'store 2',
+                          'read', 'ocr 3', 'store 3']
+
+    def test_large_bundle_page_count(self, make_pdf):
+        """Test a 150 page bundle streams without error"""
+        path = make_pdf([[f'Statement page {i}'] for i in range(150)], compress=True)
+        processor = PDFProcessor()
+
+        assert processor.page_count(path) == 150
+        assert sum(1 for _ in processor.iter_pages(path)) == 150
+
+    def test_memory_ceiling(self, make_pdf):
+        """Test pages whose content exceeds the ceiling are rejected"""
+        path = make_pdf([['x' * 5000]], compress=True)
+
+        with pytest.raises(MemoryLimitExceededError):
+            list(PDFProcessor(memory_limit_bytes=1024).iter_pages(path))
+
+    def test_cyclic_page_tree(self, make_pdf):
+        """A page tree whose kids refer back to it is a processing error, not a RecursionError"""
+        path = make_pdf([['Cover letter']])
+        data = path.read_bytes()
+        path.write_bytes(data.replace(b'/Kids [4 0 R] /Count 1', b'/Kids [2 0 R] /Cnt   1'))
+
+        with pytest.raises(DocumentProcessingError, match='cyclic'):
+            PDFProcessor().page_count(path)
+        with pytest.raises(DocumentProcessingError, match='cyclic'):
+            list(PDFProcessor().iter_pages(path))
+
+    def test_rejects_non_pdf(self, tmp_path):
+        """Test non-PDF uploads raise a processing error"""
+        path = tmp_path / 'fake.pdf'
+        path.write_bytes(b'MZ\x90\x00 not a pdf')
+
+        with pytest.raises(DocumentProcessingError):
+            PDFProcessor().page_count(path)
+
+
+FORM_PAGE = [
+    'IMM 0008 Generic Application Form',
+    'Family name: Doe',
+    'Given names: Jane Marie',
+    'Date of birth: 1990-0I-15',
+    'Passport number: ca 12345678',
+    '[X] Permanent residence',
+    '[ ] Temporary residence',
+]
+
+
+class TestFormExtraction:
+    """Test serial and parallel form extraction"""
+
+    def test_page_extraction(self):
+        """Test layout analysis, field matching and OCR clean-up"""
+        result = extract_page(1, '\n'.join(FORM_PAGE + ['Email address', 'jane@example.com']))
+
+        assert result.fields['family_name'] == 'Doe'
+        assert result.fields['given_names'] == 'Jane Marie'
+        assert result.fields['date_of_birth'] == '1990-01-15'
+        assert result.fields['passport_number'] == 'CA12345678'
+        assert result.fields['email'] == 'jane@example.com'
+        assert result.checkboxes == {'Permanent residence': True, 'Temporary residence': False}
+
+    def test_parallel_matches_serial_in_page_order(self):
+        """Test the process pool reassembles results in page order"""
+        pages = [(n, f'Family name: Page{n}\n' + 'filler line: x\n' * (n % 7) * 50) for n in range(1, 41)]
+
+        serial = FormExtractor().extract_pages(pages)
+        with ParallelFormExtractor(max_workers=2) as extractor:
+            parallel = extractor.extract_pages(iter(pages))
+
+        assert [p.page_number for p in parallel.pages] == list(range(1, 41))
+        assert [p.fields for p in parallel.pages] == [p.fields for p in serial.pages]
+        assert parallel.fields['family_name'] == 'Page1'
+
+    def test_document_deadline(self):
+        """Test a document that misses its deadline raises with partial results"""
+        pages = [(n, 'Family name: Doe\n' * 2000) for n in range(1, 50)]
+
+        with ParallelFormExtractor(max_workers=1, prefetch=1) as extractor:
+            with pytest.raises(ExtractionTimeoutError) as excinfo:
+                extractor.extract_pages(pages, deadline_seconds=0.0)
+
+        assert len(excinfo.value.partial) < len(pages)
+
+    def test_extract_document_from_pdf(self, make_pdf):
+        """Test pages streamed from a PDF feed the extractor"""
+        path = make_pdf([FORM_PAGE[:3], ['Nationality: Canadian']])
+
+        with ParallelFormExtractor(max_workers=2) as extractor:
+            result = extractor.extract_document(path)
+
+        assert result.fields == {'family_name': 'Doe', 'given_names': 'Jane Marie', 'nationality': 'Canadian'}
@@ -5,6 +5,11 @@ Unit tests for document upload and validation
 import pytest
 from unittest.mock import Mock
 
+from immigration_ai.core.exceptions import ConflictError, PermissionDeniedError, ValidationError
+from immigration_ai.core.services.document_service import DocumentStore
+from immigration_ai.core.services.upload_service import ChunkedUploadService
+from immigration_ai.utils.storage import LocalBlobStorage
+
 class TestDocumentValidation:
     """Test document upload validation"""
     
@@ -73,3 +78,103 @@ class TestDocumentValidation:
         for filename in infected_files:
             # Simulate infected file detection
             assert filename.endswith('.exe') or filename.endswith('.zip')
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    return ChunkedUploadService(DocumentStore(LocalBlobStorage(tmp_path)), chunk_size=16)
+
+
+class TestChunkedUploads:
+    """Test resumable chunked uploads"""
+
+    PDF = b'%PDF-1.4\n' + b'x' * 30
+
+    def test_resume_after_interruption(self, uploads):
+        """A client that lost its place resumes from the committed offset"""
+        session = uploads.create('agency-1', 'client-1', 'passport.pdf', len(self.PDF), 'application/pdf')
+        uploads.put_chunk('agency-1', 'client-1', session.id, 0, self.PDF[:16])
+
+        with pytest.raises(ConflictError):
+            uploads.put_chunk('agency-1', 'client-1', session.id, 0, self.PDF[:16])
+        offset = uploads.status('agency-1', 'client-1', session.id).committed_offset
+        assert offset == 16
+
+        uploads.put_chunk('agency-1', 'client-1', session.id, offset, self.PDF[16:32])
+        uploads.put_chunk('agency-1', 'client-1', session.id, 32, iter([self.PDF[32:36], self.PDF[36:]]))
+        record, deduplicated = uploads.complete('agency-1', 'client-1', session.id)
+
+        assert deduplicated is False
+        assert record.file_size == len(self.PDF)
+        assert b''.join(uploads.document_store.iter_chunks('agency-1', record.id)) == self.PDF
+        assert list(uploads.storage.list(f'uploads/{session.id}/part')) == []
+
+    def test_wrong_magic_bytes_rejected_on_first_chunk(self, uploads):
+        """A file that is not what it claims is rejected and the session aborted"""
+        session = uploads.create('agency-1', 'client-1', 'scan.png', 40, 'image/png')
+        with pytest.raises(ValidationError):
+            uploads.put_chunk('agency-1', 'client-1', session.id, 0, b'MZ\x90\x00' + b'\x00' * 12)
+        assert uploads.status('agency-1', 'client-1', session.id).status == 'aborted'
+
+    def test_size_limits_enforced_while_streaming(self, uploads):
+        """Oversized chunks and files beyond their declared size are refused"""
+        with pytest.raises(ValidationError):
+            uploads.create('agency-1', 'client-1', 'big.pdf', 11 * 1024 * 1024, 'application/pdf')
+
+        session = uploads.create('agency-1', 'client-1', 'a.pdf', 20, 'application/pdf')
+        with pytest.raises(ValidationError):
+            uploads.put_chunk('agency-1', 'client-1', session.id, 0, self.PDF[:17])
+
+        session = uploads.create('agency-1', 'client-1', 'b.pdf', 20, 'application/pdf')
+        uploads.put_chunk('agency-1', 'client-1', session.id, 0, self.PDF[:16])
+        with pytest.raises(ValidationError):
+            uploads.put_chunk('agency-1', 'client-1', session.id, 16, self.PDF[16:24])
+
+    def test_complete_is_idempotent_and_deduplicated(self, uploads):
+        """Completing twice returns the same document; a re-upload shares the blob"""
+        ids = []
+        for _ in range(2):
+            session = uploads.create('agency-1', 'client-1', 'p.pdf', 16, 'application/pdf')
+            uploads.put_chunk('agency-1', 'client-1', session.id, 0, self.PDF[:16])
+            record, _ = uploads.complete('agency-1', 'client-1', session.id)
+            again, _ = uploads.complete('agency-1', 'client-1', session.id)
+            assert again.id == record.id
+            ids.append(uploads.complete('agency-1', 'client-1', session.id)[1])
+
+        assert ids == [False, True]
+        assert len(list(uploads.storage.list('blobs'))) == 1
+
+    def test_sessions_are_per_tenant(self, uploads):
+        """Another agency cannot write to or inspect an upload"""
+        session = uploads.create('agency-1', 'client-1', 'p.pdf', 16, 'application/pdf')
+        with pytest.raises(PermissionDeniedError):
+            uploads.put_chunk('agency-2', 'client-1', session.id, 0, self.PDF[:16])
+        with pytest.raises(PermissionDeniedError):
+            uploads.status('agency-2', 'client-1', session.id)
+        with pytest.raises(PermissionDeniedError):
+            uploads.put_chunk('agency-1', 'client-2', session.id, 0, self.PDF[:16])
+        with pytest.raises(PermissionDeniedError):
+            uploads.complete('agency-1', 'client-2', session.id)
+
+    def test_racing_chunks_commit_once(self, uploads, monkeypatch):
+        """Of two writers at one offset only one commits; a lost session save is recovered"""
+        session = uploads.create('agency-1', 'client-1', 'p.pdf', len(self.PDF), 'application/pdf')
+        other = ChunkedUploadService(uploads.document_store, chunk_size=16)
+        begin_chunk = uploads.begin_chunk
+
+        def racing_begin_chunk(*args):
+            validator = begin_chunk(*args)
+            other.put_chunk('agency-1', 'client-1', session.id, 0, self.PDF[:16])
+            return validator
+
+        monkeypatch.setattr(uploads, 'begin_chunk', racing_begin_chunk)
+        with pytest.raises(ConflictError):
+            uploads.put_chunk('agency-1', 'client-1', session.id, 0, b'%PDF-1.4\n' + b'y' * 7)
+        monkeypatch.undo()
+
+        # A part written without its session save still counts as committed
+        uploads.storage.create(f'uploads/{session.id}/part-{16:012d}', self.PDF[16:32])
+        assert uploads.status('agency-1', 'client-1', session.id).committed_offset == 32
+        uploads.put_chunk('agency-1', 'client-1', session.id, 32, self.PDF[32:], validated=True)
+        record, _ = uploads.complete('agency-1', 'client-1', session.id)
+        assert b''.join(uploads.document_store.iter_chunks('agency-1', record.id)) == self.PDF
@@ -0,0 +1,191 @@
+"""
+Unit tests for email templates and pooled delivery
+"""
+import asyncio
+import email
+import os
+import sys
+from email import policy
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../tools'))
+
+from smtp_sink import SMTPSink  # noqa: E402
+
+from immigration_ai.communication.email.sender import (EmailDeliveryEngine, EmailProviderSettings,  # noqa: E402
+                                                       EmailSender, OutgoingEmail, SMTPTransport)
+from immigration_ai.communication.email.templates import TemplateRegistry  # noqa: E402
+from immigration_ai.core.exceptions import ResourceNotFoundError, ValidationError  # noqa: E402
+from immigration_ai.utils.rate_limit import TokenBucket, backoff_delay  # noqa: E402
+
+CASE_UPDATE = {'client_name': 'Ana <Silva>', 'case_number': 'CASE-2025-0001', 'case_title': 'Work permit',
+               'status': 'approved', 'agency_name': 'Maple Immigration'}
+
+
+class FakeOutbox:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.enqueued = []
+        self.recorded = None
+
+    async def enqueue(self, rows):
+        self.enqueued.extend(rows)
+
+    async def claim(self, provider, limit, lease_seconds):
+        claimed, self.rows = self.rows[:limit], self.rows[limit:]
+        return claimed
+
+    async def record(self, sent, retries, failures):
+        self.recorded = (sent, retries, failures)
+
+
+def _transport(sink, **overrides):
+    settings = dict(host='127.0.0.1', port=sink.port, starttls=False, pool_size=2, batch_size=3,
+                    rate_per_second=1e6)
+    settings.update(overrides)
+    return SMTPTransport(EmailProviderSettings(**settings))
+
+
+class TestEmailTemplates:
+    """Test template compilation, escaping and per-agency overrides"""
+
+    def test_render_escapes_html_and_flattens_subject(self):
+        """HTML values are escaped, text values are not, and subjects stay on one line"""
+        registry = TemplateRegistry()
+        rendered = asyncio.run(registry.render(None, 'case_update', CASE_UPDATE))
+        assert rendered.subject == 'Update on your case CASE-2025-0001'
+        assert 'Hello Ana <Silva>,' in rendered.text
+        assert '<p>Hello Ana &lt;Silva&gt;,</p>' in rendered.html
+
+        injected = asyncio.run(registry.render(None, 'reminder', {
+            'subject': 'Appointment\r\nBcc: everyone@example.test', 'client_name': 'Ana',
+            'message': 'Tomorrow at 10', 'agency_name': 'Maple'}))
+        assert injected.subject == 'Reminder: Appointment Bcc: everyone@example.test'
+
+    def test_missing_values_and_unknown_templates(self):
+        """Rendering without a placeholder's value or with an unknown key fails loudly"""
+        registry = TemplateRegistry()
+        with pytest.raises(ValidationError):
+            asyncio.run(registry.render(None, 'case_update', {'client_name': 'Ana'}))
+        with pytest.raises(ResourceNotFoundError):
+            asyncio.run(registry.get(None, 'no_such_template'))
+        assert registry.defaults['document_request'].fields[:2] == ('document_label', 'client_name')
+
+    def test_agency_overrides_are_loaded_once_and_invalidated(self):
+        """One loader call per agency until invalidated; other agencies keep the default"""
+        calls = []
+
+        async def loader(agency_id):
+            calls.append(agency_id)
+            return [{'key': 'case_update', 'subject': '{{ agency_name }}: {{ case_number }}',
+                     'text_body': 'Case {{ case.status }}', 'html_body': None}]
+
+        registry = TemplateRegistry(loader=loader)
+
+        async def run():
+            first = await registry.render('agency-1', 'case_update', {**CASE_UPDATE, 'case': {'status': 'open'}})
+            await registry.get('agency-1', 'case_update')
+            default = await registry.get('agency-1', 'reminder')
+            registry.invalidate('agency-1')
+            await registry.get('agency-1', 'case_update')
+            return first, default
+
+        first, default = asyncio.run(run())
+        assert (first.subject, first.text, first.html) == ('Maple Immigration: CASE-2025-0001', 'Case open', None)
+        assert default is registry.defaults['reminder']
+        assert calls == ['agency-1', 'agency-1']
+
+
+class TestEmailDelivery:
+    """Test MIME assembly, rate limiting, the pooled SMTP transport and outbox handling"""
+
+    def test_message_bytes_parse_back(self):
+        """Assembled messages parse with the stdlib and keep non-ASCII text intact"""
+        message = OutgoingEmail(to='ana@example.test', subject='Atualização', text='Olá\n.leading dot',
+                                html='<p>Olá</p>')
+        parsed = email.message_from_bytes(message.to_bytes('agency@example.test'), policy=policy.default)
+        assert (parsed['from'], parsed['to'], parsed['subject']) == (
+            'agency@example.test', 'ana@example.test', 'Atualização')
+        assert parsed.get_body(('plain',)).get_content().splitlines() == ['Olá', '.leading dot']
+        assert parsed.get_body(('html',)).get_content() == '<p>Olá</p>'
+        with pytest.raises(ValidationError):
+            OutgoingEmail(to='a@example.test\r\nBcc: b@example.test', subject='s', text='t').to_bytes('x@y.test')
+        with pytest.raises(ValidationError):
+            OutgoingEmail(to='a@example.test', subject='Hi\r\nBcc: b@example.test', text='t').to_bytes('x@y.test')
+
+    def test_token_bucket_and_backoff(self):
+        """Buckets allow a burst then refill at the rate; backoff doubles up to its cap"""
+        now = [0.0]
+        bucket = TokenBucket(rate=2, burst=3, clock=lambda: now[0])
+        assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+        assert bucket.delay() == pytest.approx(0.5)
+        now[0] += 0.5
+        assert bucket.try_acquire()
+
+        assert backoff_delay(1, base=10, cap=600, jitter=0) == 10
+        assert backoff_delay(4, base=10, cap=600, jitter=0) == 80
+        assert backoff_delay(30, base=10, cap=600, jitter=0) == 600
+
+    @pytest.mark.parametrize('pipelining', [True, False])
+    def test_pooled_transport_delivers_and_classifies_failures(self, pipelining):
+        """Messages share pooled sessions; 5xx refusals are permanent, 4xx are temporary"""
+        async def run():
+            sink = await SMTPSink(reject='^bounce', defer='^later').start()
+            transport = _transport(sink, pipelining=pipelining)
+            addresses = ['a@x.test', 'bounce@x.test', 'b@x.test', 'later@x.test', 'c@x.test', 'd@x.test', 'e@x.test']
+            try:
+                first = await transport.send([OutgoingEmail(to=address, subject='Hi', text='.\nbody', id=n)
+                                              for n, address in enumerate(addresses)])
+                second = await transport.send([OutgoingEmail(to='f@x.test', subject='Hi', text='x', id=99)])
+            finally:
+                await transport.close()
+                await sink.stop()
+            return sink, transport, first, second
+
+        sink, transport, first, second = asyncio.run(run())
+        assert [r.id for r in first] == list(range(7))
+        assert [(r.ok, r.code, r.temporary) for r in first if not r.ok] == [(False, 550, False), (False, 451, True)]
+        assert second[0].ok
+        assert sink.messages == 6 and sorted(sink.recipients)[:2] == ['a@x.test', 'b@x.test']
+        # Seven messages in batches of three over a pool of two, then reused for the next send
+        assert sink.connections == transport.pool.opened == 2
+
+    def test_unreachable_server_defers_the_whole_batch(self):
+        """A connection failure is a temporary failure for every message in the chunk"""
+        transport = SMTPTransport(EmailProviderSettings(host='127.0.0.1', port=1, starttls=False, timeout=2))
+        results = asyncio.run(transport.send([OutgoingEmail(to='a@x.test', subject='s', text='t', id=1)]))
+        assert [(r.id, r.ok, r.temporary) for r in results] == [(1, False, True)]
+
+    def test_engine_records_sent_retried_and_failed_rows(self):
+        """Temporary failures are rescheduled until max_attempts, permanent ones fail at once"""
+        rows = [{'id': n, 'to_address': address, 'subject': 'Hi', 'text_body': 'x', 'html_body': None,
+                 'attempts': attempts}
+                for n, (address, attempts) in enumerate([('ok@x.test', 1), ('later@x.test', 1),
+                                                         ('later@x.test', 3), ('bounce@x.test', 1)])]
+        outbox = FakeOutbox(rows)
+
+        async def run():
+            sink = await SMTPSink(reject='^bounce', defer='^later').start()
+            engine = EmailDeliveryEngine(outbox, _transport(sink), max_attempts=3, backoff_base=10)
+            try:
+                return await engine.drain()
+            finally:
+                await engine.transport.close()
+                await sink.stop()
+
+        stats = asyncio.run(run())
+        sent, retries, failures = outbox.recorded
+        assert (stats.claimed, stats.sent, stats.retried, stats.failed) == (4, 1, 1, 2)
+        assert sent == [0] and [r[0] for r in retries] == [1] and 8 <= retries[0][1] <= 12
+        assert sorted(f[0] for f in failures) == [2, 3] and failures[0][1].startswith('451')
+
+    def test_bulk_send_renders_once_per_recipient_into_the_outbox(self):
+        """A bulk send queues one rendered row per recipient with per-recipient dedupe keys"""
+        outbox = FakeOutbox()
+        sender = EmailSender(outbox, TemplateRegistry())
+        recipients = [{**CASE_UPDATE, 'email': f'client{n}@x.test', 'client_name': f'Client {n}'} for n in range(3)]
+        assert asyncio.run(sender.send_bulk('agency-1', 'case_update', recipients, dedupe_key='approved')) == 3
+        assert [row.to for row in outbox.enqueued] == ['client0@x.test', 'client1@x.test', 'client2@x.test']
+        assert outbox.enqueued[1].dedupe_key == 'approved:client1@x.test'
+        assert 'Hello Client 1,' in outbox.enqueued[1].text and outbox.enqueued[1].agency_id == 'agency-1'
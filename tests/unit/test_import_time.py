@@ -0,0 +1,66 @@
+"""
+Cold-start import budget tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../tools'))
+
+from import_profiler import parse_importtime, profile_imports  # noqa: E402
+
+# Generous enough for a loaded CI runner; tighten with COLD_START_BUDGET_MS
+BUDGET_MS = float(os.environ.get('COLD_START_BUDGET_MS', 400))
+SERVICE_MODULES = (
+    'immigration_ai.core.services.case_service',
+    'immigration_ai.core.services.agency_service',
+    'immigration_ai.core.services.upload_service',
+    'immigration_ai.crm.services',
+    'immigration_ai.security.auth',
+    'immigration_ai.core.schemas.encoding',
+)
+# Loaded on first use only, never by the API or worker entry points
+LAZY_PACKAGES = ('immigration_ai.ai_engine', 'psutil', 'aiohttp', 'supabase', 'asyncpg', 'redis')
+
+
+def _assert_lazy(profile):
+    assert profile.error is None, profile.error
+    for package in LAZY_PACKAGES:
+        assert profile.loaded(package) == [], f'{package} imported at startup'
+
+
+class TestColdStart:
+    """Test that entry points import within budget and defer heavy stacks"""
+
+    def test_parse_importtime(self):
+        """Per-module costs and nesting depth are read from -X importtime output"""
+        modules = parse_importtime('import time: self [us] | cumulative | imported package\n'
+                                   'import time:       120 |        120 |   zlib\n'
+                                   'import time:       300 |        420 | gzip\n')
+        assert [(m.module, m.self_us, m.cumulative_us, m.depth) for m in modules] == [
+            ('zlib', 120, 120, 1), ('gzip', 300, 420, 0)]
+
+    def test_service_layer_within_budget(self):
+        """Everything the API wires up at startup imports within the cold-start budget"""
+        profile = profile_imports(SERVICE_MODULES)
+        _assert_lazy(profile)
+        assert profile.total_ms < BUDGET_MS, profile.to_dict(top=10)
+
+    def test_monitoring_defers_client_libraries(self):
+        """Health checks and alerts import without psutil, aiohttp or supabase"""
+        _assert_lazy(profile_imports(('monitoring.health_checks', 'monitoring.alerts')))
+
+    def test_api_entry_point_defers_ai_engine(self):
+        """The FastAPI app starts without loading AI models or integration clients"""
+        pytest.importorskip('fastapi')
+        profile = profile_imports(('immigration_ai.api.main',))
+        _assert_lazy(profile)
+        assert profile.total_ms < BUDGET_MS * 3, profile.to_dict(top=10)
+
+    def test_celery_app_defers_task_modules(self):
+        """Importing the Celery app to enqueue work loads no task module"""
+        pytest.importorskip('celery')
+        profile = profile_imports(('immigration_ai.workers.celery_app',))
+        _assert_lazy(profile)
+        assert profile.loaded('immigration_ai.workers.tasks') == []
@@ -0,0 +1,194 @@
+"""
+Unit tests for notification fan-out
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from immigration_ai.communication.notifications.fanout import (CLAIM_EVENTS_SQL, INSERT_NOTIFICATIONS_SQL,
+                                                                MARK_PROCESSED_SQL, PURGE_BATCH_SIZE,
+                                                                PURGE_PROCESSED_SQL, STAFF_SQL,
+                                                                NotificationFanout, build_notifications)
+from immigration_ai.communication.notifications.pusher import PushHub
+from immigration_ai.security.auth import Principal
+
+STAFF = Principal('staff-1', 'agency-1', 'agency_staff')
+CLIENT = Principal('client-1', 'agency-1', 'client')
+
+
+def _upload_event(event_id, agency_id, client_name='Ana Silva'):
+    return {'id': event_id, 'agency_id': agency_id, 'type': 'document_review_needed', 'payload': {
+        'document_id': f'doc-{event_id}', 'client_id': f'client-{event_id}', 'document_type': 'passport',
+        'document_type_label': 'Passport', 'file_name': f'scan-{event_id}.pdf', 'client_name': client_name,
+    }}
+
+
+class FakeConnection:
+    def __init__(self, events, staff):
+        self.events = events
+        self.staff = staff
+        self.executed = []
+        self.expired = []
+
+    async def fetch(self, query, *args):
+        if query == CLAIM_EVENTS_SQL:
+            return self.events[:args[0]]
+        if query == STAFF_SQL:
+            return [{'id': user_id, 'agency_id': agency_id} for agency_id in args[0]
+                    for user_id in self.staff.get(agency_id, [])]
+        raise AssertionError(query)
+
+    async def execute(self, query, *args):
+        self.executed.append((query, args))
+        if query == MARK_PROCESSED_SQL:
+            self.events = [event for event in self.events if event['id'] not in args[0]]
+
+
+class FakeDatabase:
+    def __init__(self, connection):
+        self.connection = connection
+        self.transactions = 0
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.transactions += 1
+        yield self.connection
+
+    async def fetchval(self, query, *args):
+        assert query == PURGE_PROCESSED_SQL
+        self.connection.executed.append((query, args))
+        purged, self.connection.expired = self.connection.expired[:args[1]], self.connection.expired[args[1]:]
+        return len(purged)
+
+
+class TestNotificationFanout:
+    """Test batched staff fan-out and burst digests"""
+
+    def test_small_batches_keep_the_per_upload_message(self):
+        """Below the threshold each upload notifies every staff member as before"""
+        rows, stats = build_notifications([_upload_event(1, 'a1'), _upload_event(2, 'a1')],
+                                          {'a1': ['s1', 's2']}, digest_threshold=3)
+        assert [(user, event_type) for user, _, event_type, *_ in rows] == [
+            ('s1', 'document_review_needed'), ('s2', 'document_review_needed')] * 2
+        _, agency_id, _, title, message, data = rows[0]
+        assert (agency_id, title) == ('a1', 'New Document Requires Review')
+        assert message == 'Ana Silva has uploaded a new Passport document that requires review.'
+        assert data == {'document_id': 'doc-1', 'client_id': 'client-1', 'document_type': 'passport',
+                        'file_name': 'scan-1.pdf', 'client_name': 'Ana Silva'}
+        assert (stats.events, stats.notifications, stats.digests) == (2, 4, 0)
+
+    def test_bursts_collapse_into_one_digest_per_agency(self):
+        """A burst becomes one digest per staff member; other agencies are unaffected"""
+        names = ['Ana Silva', 'Li Wei', 'Omar Haddad', 'Ana Silva', None]
+        events = [_upload_event(n, 'a1', name) for n, name in enumerate(names)] + [_upload_event(9, 'a2')]
+        rows, stats = build_notifications(events, {'a1': ['s1', 's2'], 'a2': ['s3']}, digest_threshold=5)
+
+        digests = [row for row in rows if row[1] == 'a1']
+        assert [row[0] for row in digests] == ['s1', 's2']
+        _, _, event_type, title, message, data = digests[0]
+        assert (event_type, title) == ('document_review_digest', '5 New Documents Require Review')
+        assert message == 'Ana Silva, Li Wei, Omar Haddad and 1 more uploaded 5 documents that require review.'
+        assert data['count'] == 5 and data['document_ids'] == [f'doc-{n}' for n in range(5)]
+        assert [(row[0], row[2]) for row in rows if row[1] == 'a2'] == [('s3', 'document_review_needed')]
+        assert (stats.notifications, stats.digests) == (3, 2)
+
+    def test_unknown_event_types_are_skipped(self):
+        """Events without a renderer are counted as skipped, not rendered"""
+        rows, stats = build_notifications([{'id': 1, 'agency_id': 'a1', 'type': 'mystery', 'payload': {}}],
+                                          {'a1': ['s1']})
+        assert rows == [] and stats.skipped == 1
+
+    def test_run_once_writes_one_insert_per_batch(self):
+        """A batch is claimed, inserted with one statement and marked processed in one transaction"""
+        connection = FakeConnection([_upload_event(n, f'a{n % 2}') for n in range(6)],
+                                    {'a0': ['s1', 's2'], 'a1': ['s3']})
+        database = FakeDatabase(connection)
+        fanout = NotificationFanout(database, batch_size=4, digest_threshold=10)
+
+        first = asyncio.run(fanout.run_once())
+        assert (first.events, first.notifications) == (4, 6)
+        inserts = [args for query, args in connection.executed if query == INSERT_NOTIFICATIONS_SQL]
+        assert len(inserts) == 1
+        user_ids, agency_ids = inserts[0][0], inserts[0][1]
+        assert sorted(user_ids) == ['s1', 's1', 's2', 's2', 's3', 's3'] and len(agency_ids) == 6
+
+        rest = asyncio.run(fanout.drain())
+        assert (rest.events, rest.notifications) == (2, 3)
+        assert connection.events == [] and database.transactions == 2
+
+    def test_purge_deletes_old_processed_events_in_batches(self):
+        """Processed events past retention are deleted in bounded batches"""
+        connection = FakeConnection([], {})
+        connection.expired = list(range(PURGE_BATCH_SIZE + 10))
+        fanout = NotificationFanout(FakeDatabase(connection), retention=3600)
+        assert asyncio.run(fanout.purge()) == PURGE_BATCH_SIZE + 10
+        assert [args for _, args in connection.executed] == [(3600.0, PURGE_BATCH_SIZE)] * 2
+        assert connection.expired == []
+
+
+class TestPushHub:
+    """Test realtime channel routing, slow-consumer eviction and heartbeats"""
+
+    def test_staff_get_agency_channel_and_clients_do_not(self):
+        """Agency broadcasts reach staff only; user messages reach only that user"""
+        hub = PushHub()
+        staff, client = hub.subscribe(STAFF), hub.subscribe(CLIENT)
+        assert hub.publish('agency:agency-1', 'document', {'id': 'd1'}) == 1
+        assert hub.publish('user:client-1', 'notification', {'unread': 3}) == 1
+        assert hub.publish('user:nobody', 'notification', {}) == 0
+        assert (staff.pending, client.pending) == (1, 1)
+
+        hub.unsubscribe(staff)
+        stats = hub.stats()
+        assert (stats.connections, stats.channels, stats.published, stats.delivered) == (1, 1, 3, 2)
+
+    def test_slow_consumer_is_evicted_without_affecting_others(self):
+        """A full buffer evicts that subscriber and removes it from every channel"""
+        hub = PushHub(max_buffer=2)
+        slow, fast = hub.subscribe(STAFF), hub.subscribe(Principal('staff-2', 'agency-1', 'agency_staff'))
+        for n in range(3):
+            hub.publish('agency:agency-1', 'document', {'n': n})
+            asyncio.run(fast.next())
+        assert slow.evicted and slow.closed and not fast.evicted
+        assert hub.stats().evicted == 1 and hub.publish('user:staff-1', 'notification', {}) == 0
+
+    def test_notify_payload_is_forwarded_without_reencoding(self):
+        """The change feed's JSON text is what subscribers receive; malformed payloads are dropped"""
+        hub = PushHub()
+        subscriber = hub.subscribe(CLIENT)
+        payload = '{"channel": "user:client-1", "event": "notification", "data": {"unread": 1}}'
+        assert hub.dispatch(payload) == 1 and hub.dispatch('not json') == 0 and hub.dispatch('{}') == 0
+        message = asyncio.run(subscriber.next())
+        assert message.text is payload
+        assert message.sse == f'event: notification\ndata: {payload}\n\n'.encode()
+
+    def test_stream_sends_heartbeats_and_ends_on_eviction(self):
+        """Idle streams yield None on the shared heartbeat and stop once evicted"""
+        hub = PushHub(max_buffer=1, heartbeat=0.01)
+
+        async def run():
+            subscriber = hub.subscribe(CLIENT)
+            received = []
+            async for message in hub.stream(subscriber):
+                received.append(message)
+                if len(received) == 1:
+                    hub.publish('user:client-1', 'notification', {'n': 1})
+                    hub.publish('user:client-1', 'notification', {'n': 2})
+            return received
+
+        received = asyncio.run(run())
+        assert received == [None] and hub.stats().connections == 0
+
+    def test_stream_closes_when_the_token_expires(self):
+        """A stream opened with a token ends on the first heartbeat after the token expires"""
+        hub = PushHub(heartbeat=0.01)
+
+        async def run():
+            subscriber = hub.subscribe(Principal('client-1', 'agency-1', 'client', expires_at=time.time() + 0.05))
+            received = [message async for message in hub.stream(subscriber)]
+            return subscriber, received
+
+        subscriber, received = asyncio.run(run())
+        assert subscriber.expired and not subscriber.evicted
+        assert 0 < len(received) < 20 and set(received) == {None}
+        assert hub.stats().connections == 0
@@ -0,0 +1,98 @@
+"""
+Unit tests for the query-plan checker's plan analysis and index suggestions
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../tools'))
+
+from query_plans import (SHAPES, SeedScale, analyze_plan, baseline_from, compare_to_baseline,  # noqa: E402
+                         migration_paths)
+
+TABLES = ('chat_messages', 'notifications')
+
+
+def _explain(plan, execution_ms=12.5):
+    return [{'Plan': plan, 'Execution Time': execution_ms}]
+
+
+SORTED_FROM_SINGLE_COLUMN_INDEX = _explain({
+    'Node Type': 'Limit', 'Total Cost': 900.0, 'Actual Rows': 50, 'Actual Loops': 1,
+    'Plans': [{
+        'Node Type': 'Sort', 'Sort Key': ['created_at DESC'], 'Total Cost': 899.0,
+        'Actual Rows': 50, 'Actual Loops': 1,
+        'Plans': [{'Node Type': 'Bitmap Heap Scan', 'Relation Name': 'chat_messages', 'Total Cost': 700.0,
+                   'Actual Rows': 4200, 'Actual Loops': 1,
+                   'Plans': [{'Node Type': 'Bitmap Index Scan', 'Index Name': 'idx_chat_messages_conversation_id',
+                              'Actual Rows': 4200, 'Actual Loops': 1, 'Total Cost': 40.0}]}],
+    }],
+})
+
+FILTERED_SEQ_SCAN = _explain({
+    'Node Type': 'Aggregate', 'Total Cost': 5000.0, 'Actual Rows': 1, 'Actual Loops': 1,
+    'Plans': [{'Node Type': 'Seq Scan', 'Relation Name': 'notifications', 'Total Cost': 4900.0,
+               'Filter': '((read_at IS NULL) AND (user_id = $1))', 'Actual Rows': 30,
+               'Rows Removed by Filter': 99970, 'Actual Loops': 1}],
+})
+
+INDEX_FILTERS_MOST_ROWS = _explain({
+    'Node Type': 'Index Scan', 'Relation Name': 'notifications', 'Index Name': 'idx_notifications_user_id',
+    'Total Cost': 300.0, 'Filter': '(read_at IS NULL)', 'Actual Rows': 90, 'Rows Removed by Filter': 810,
+    'Actual Loops': 1,
+})
+
+CLEAN = _explain({
+    'Node Type': 'Limit', 'Total Cost': 4.1, 'Actual Rows': 50, 'Actual Loops': 1,
+    'Plans': [{'Node Type': 'Index Scan', 'Relation Name': 'chat_messages', 'Total Cost': 4.0,
+               'Index Name': 'idx_chat_messages_conversation_created', 'Actual Rows': 50, 'Actual Loops': 1}],
+}, execution_ms=0.2)
+
+
+class TestQueryPlans:
+    """Test plan findings, index suggestions and baseline comparison"""
+
+    def test_flags_sort_over_single_column_index(self):
+        """A large sort above an index lookup is flagged with its sort key"""
+        report = analyze_plan('chat_history', SORTED_FROM_SINGLE_COLUMN_INDEX, TABLES)
+        assert [(f.kind, f.relation, f.rows, f.detail) for f in report.findings] == [
+            ('sort', 'chat_messages', 4200, 'created_at DESC')]
+        assert report.indexes == ['idx_chat_messages_conversation_id']
+        assert report.total_cost == 900.0 and report.execution_ms == 12.5
+
+    def test_flags_seq_scans_and_wasteful_filters(self):
+        """Sequential scans of seeded tables and filters that drop most index rows are flagged"""
+        seq = analyze_plan('unread_count', FILTERED_SEQ_SCAN, TABLES)
+        assert [(f.kind, f.rows) for f in seq.findings] == [('seq_scan', 100000)]
+        assert analyze_plan('unread_count', FILTERED_SEQ_SCAN, ('cases',)).findings == []
+
+        filtered = analyze_plan('unread_notifications', INDEX_FILTERS_MOST_ROWS, TABLES)
+        assert [(f.kind, f.rows) for f in filtered.findings] == [('filtered', 810)]
+        assert not analyze_plan('unread_notifications', INDEX_FILTERS_MOST_ROWS, TABLES, min_rows=1000).flagged
+        assert not analyze_plan('chat_history', CLEAN, TABLES).flagged
+
+    def test_index_suggestions_follow_the_access_pattern(self):
+        """Suggested indexes lead with equality columns, then the sort order, with a partial predicate"""
+        shapes = {shape.name: shape for shape in SHAPES}
+        assert shapes['chat_history'].index_definition() == (
+            'CREATE INDEX IF NOT EXISTS idx_chat_messages_conversation_id_created_at '
+            'ON public.chat_messages(conversation_id, created_at DESC)')
+        assert shapes['unread_notifications'].index_definition() == (
+            'CREATE INDEX IF NOT EXISTS idx_notifications_user_id_created_at_partial '
+            'ON public.notifications(user_id, created_at DESC) WHERE read_at IS NULL')
+        assert len({shape.name for shape in SHAPES}) == len(SHAPES)
+
+    def test_baseline_comparison(self):
+        """New findings or a cost blow-up against the baseline are regressions"""
+        baseline = baseline_from([analyze_plan('chat_history', CLEAN, TABLES)])
+        assert compare_to_baseline([analyze_plan('chat_history', CLEAN, TABLES)], baseline) == []
+        regressions = compare_to_baseline([analyze_plan('chat_history', SORTED_FROM_SINGLE_COLUMN_INDEX, TABLES)],
+                                          baseline)
+        assert regressions == ['chat_history: new sort', 'chat_history: cost 4 -> 900']
+
+    def test_migrations_and_scale(self):
+        """Migrations apply in file-name order and can stop before a given one"""
+        names = [path.name for path in migration_paths()]
+        assert names == sorted(names) and '20250707_hot_query_indexes.sql' in names
+        assert all(name < '20250707' for name in (path.name for path in migration_paths(before='20250707')))
+        scale = SeedScale.from_cases(10000)
+        assert (scale.agencies, scale.clients, scale.messages) == (5, 5000, 200000)
@@ -1 +1,479 @@
+"""
+Unit tests for core services
+"""
+import io
+import json
+import threading
+import time
+import uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal
 
+import pytest
+
+from immigration_ai.ai_engine.agents.document_reviewer import DocumentReviewer
+from immigration_ai.ai_engine.models.document_analyzer import DocumentAnalyzer
+from immigration_ai.ai_engine.models.registry import ModelRegistry, save_model
+from immigration_ai.ai_engine.utils.embeddings import hashed_bag_of_words
+from immigration_ai.core.exceptions import PermissionDeniedError, ResourceNotFoundError, ValidationError
+from immigration_ai.core.schemas.encoding import encode_page, iter_json_array, row_encoder
+from immigration_ai.core.services.agency_service import AgencyService
+from immigration_ai.core.services.case_service import CaseService
+from immigration_ai.core.services.document_service import DocumentRecord, DocumentStore, SupabaseDocumentIndex
+from immigration_ai.crm.services import ClientService
+from immigration_ai.utils.cache import InMemoryBackend, TwoTierCache
+from immigration_ai.utils.database import QueryCounter, assert_num_queries
+from immigration_ai.utils.dataloader import DataLoader
+from immigration_ai.utils.storage import BlobStorage, LocalBlobStorage
+
+PASSPORT_TEXT = b'PASSPORT No: CA1234567 Date of expiry 2031-01-01'
+
+
+@pytest.fixture
+def document_store(tmp_path):
+    return DocumentStore(LocalBlobStorage(tmp_path / 'storage'))
+
+
+@pytest.fixture
+def analyzer(tmp_path):
+    labels, n_features = ['passport', 'diploma'], 64
+    weights = [0.0] * (len(labels) * n_features)
+    for row, keyword in enumerate(['passport', 'degree']):
+        for index in hashed_bag_of_words(keyword, n_features):
+            weights[row * n_features + index] = 5.0
+    save_model(tmp_path / 'models', 'document_analyzer', 'v1', {
+        'weights': ((len(labels), n_features), weights),
+        'bias': ((len(labels),), [0.0, 0.0]),
+    }, metadata={'labels': labels, 'n_features': n_features})
+    return DocumentAnalyzer(ModelRegistry(tmp_path / 'models'))
+
+
+class TestDocumentDeduplication:
+    """Test content-addressed storage and artifact reuse"""
+
+    def test_reupload_stores_single_blob(self, document_store):
+        """Test identical uploads share one blob but get separate records"""
+        first, first_dup = document_store.put('agency-1', PASSPORT_TEXT, 'passport.txt', 'text/plain')
+        second, second_dup = document_store.put('agency-2', io.BytesIO(PASSPORT_TEXT), 'scan.txt', 'text/plain')
+
+        third, third_dup = document_store.put('agency-2', PASSPORT_TEXT, 'again.txt', 'text/plain')
+
+        # Deduplication is reported per agency: agency-2 learns nothing about agency-1's files
+        assert (first_dup, second_dup, third_dup) == (False, False, True)
+        assert first.id != second.id
+        assert first.file_path == second.file_path == third.file_path
+        assert first.content_sha256 == second.content_sha256
+        assert len(list(document_store.storage.list('blobs'))) == 1
+        assert list(document_store.storage.list('staging')) == []
+
+    def test_access_is_per_tenant(self, document_store):
+        """Test agencies cannot read documents or artifacts they do not own"""
+        record, _ = document_store.put('agency-1', PASSPORT_TEXT, 'passport.txt', 'text/plain')
+
+        with pytest.raises(PermissionDeniedError):
+            document_store.open('agency-2', record.id)
+        with pytest.raises(PermissionDeniedError):
+            document_store.get_artifact('agency-2', record.content_sha256, 'document_analysis', 'v1')
+
+    def test_analysis_is_reused_across_uploads(self, document_store, analyzer, monkeypatch):
+        """Test a re-upload reuses the prior analysis without reprocessing"""
+        first, _ = document_store.put('agency-1', PASSPORT_TEXT, 'passport.txt', 'text/plain')
+        second, _ = document_store.put('agency-2', PASSPORT_TEXT, 'passport.txt', 'text/plain')
+        calls = []
+        original = DocumentAnalyzer.analyze
+        monkeypatch.setattr(DocumentAnalyzer, 'analyze', lambda self, text: calls.append(text) or original(self, text))
+
+        fresh = analyzer.analyze_document(document_store, 'agency-1', first.id)
+        reused = analyzer.analyze_document(document_store, 'agency-2', second.id)
+
+        assert len(calls) == 1
+        assert (fresh['cached'], reused['cached']) == (False, True)
+        assert reused['fields']['passport_number'] == 'CA1234567'
+
+    def test_review_is_cached_per_hash(self, document_store, analyzer):
+        """Test document reviews are computed once per content and review date"""
+        record, _ = document_store.put('agency-1', PASSPORT_TEXT, 'p.txt', 'text/plain', document_type='passport')
+        reviewer = DocumentReviewer(analyzer)
+
+        first = reviewer.review_document(document_store, 'agency-1', record.id, as_of=date(2030, 12, 1))
+        again = reviewer.review_document(document_store, 'agency-1', record.id, as_of=date(2030, 12, 1))
+
+        assert first['status'] == 'needs_attention'
+        assert first['findings'][0]['code'] == 'expiring_soon'
+        assert again['cached'] and not first['cached']
+
+    def test_last_reference_releases_blob_for_collection(self, document_store):
+        """Test the shared blob is collected once its last document is gone"""
+        first, _ = document_store.put('agency-1', PASSPORT_TEXT, 'a.txt')
+        second, _ = document_store.put('agency-1', PASSPORT_TEXT, 'b.txt')
+        document_store.put_artifact('agency-1', first.content_sha256, 'document_analysis', 'v1', {'ok': True})
+
+        assert document_store.delete('agency-1', first.id) is False
+        assert document_store.delete('agency-1', second.id) is True
+        assert document_store.collect_garbage() == 0
+        assert document_store.collect_garbage(grace_seconds=0) == 1
+        assert list(document_store.storage.list('blobs')) == []
+        assert document_store.index.get_artifact(first.content_sha256, 'document_analysis', 'v1') is None
+
+    def test_reupload_during_grace_keeps_blob(self, document_store):
+        """Test a released blob reused by a new upload is not collected"""
+        first, _ = document_store.put('agency-1', PASSPORT_TEXT, 'a.txt')
+        document_store.delete('agency-1', first.id)
+        again, deduplicated = document_store.put('agency-1', io.BytesIO(PASSPORT_TEXT), 'a.txt')
+
+        assert deduplicated is False and again.file_path == first.file_path
+        assert document_store.collect_garbage(grace_seconds=0) == 0
+        assert b''.join(document_store.iter_chunks('agency-1', again.id)) == PASSPORT_TEXT
+        assert list(document_store.storage.list('staging')) == []
+
+    def test_database_index_reads_and_deletes_document_rows(self, fake_db):
+        """Test the Supabase index maps records to ``documents`` rows and deletes each once"""
+        index = SupabaseDocumentIndex(db=fake_db)
+        record = DocumentRecord('doc-1', 'agency-1', 'a' * 64, 'p.pdf', 10, 'blobs/sha256/aa/aa/x.1')
+        index.add(record)
+
+        assert fake_db.tables['documents'][0]['document_type'] == 'other'
+        assert index.get('doc-1').file_path == record.file_path
+        assert [r.id for r in index.find('agency-1', 'a' * 64)] == ['doc-1']
+        assert index.find('agency-2', 'a' * 64) == []
+        assert index.remove('doc-1').id == 'doc-1'
+        assert index.remove('doc-1') is None
+
+    def test_storage_backends_implement_the_interface(self):
+        """Test BlobStorage cannot be used without its abstract methods"""
+        with pytest.raises(TypeError):
+            BlobStorage()
+
+
+@pytest.fixture
+def shared_backend():
+    return InMemoryBackend()
+
+
+@pytest.fixture
+def cache(shared_backend):
+    return TwoTierCache(shared_backend)
+
+
+class TestTwoTierCache:
+    """Test the local/shared cache tiers and tag invalidation"""
+
+    def test_shared_tier_serves_other_processes(self, shared_backend):
+        """A value loaded by one worker is a shared hit for another"""
+        first, second = TwoTierCache(shared_backend), TwoTierCache(shared_backend)
+        first.set('case:1', {'id': '1'}, tags=['case:1'])
+
+        assert second.get('case:1') == {'id': '1'}
+        assert second.stats.shared_hits == 1
+        assert second.get('case:1') == {'id': '1'}
+        assert second.stats.local_hits == 1
+
+    def test_tag_invalidation_reaches_shared_entries(self, shared_backend):
+        """Invalidating a tag expires every entry carrying it, in any worker"""
+        writer, reader = TwoTierCache(shared_backend), TwoTierCache(shared_backend, local_ttl=0)
+        writer.set('a', 1, tags=['agency:1'])
+        writer.set('b', 2, tags=['agency:1', 'case:9'])
+        writer.set('c', 3, tags=['agency:2'])
+
+        writer.invalidate_tags('agency:1')
+        assert writer.get('a') is None and writer.get('b') is None
+        assert reader.get('b') is None
+        assert reader.get('c') == 3
+
+    def test_load_racing_an_invalidation_is_discarded(self, cache):
+        """A value loaded before a concurrent mutation is not served afterwards"""
+        def stale_loader():
+            cache.invalidate_tags('case:1')
+            return 'stale'
+
+        assert cache.get_or_load('k', stale_loader, tags=['case:1']) == 'stale'
+        assert cache.get_or_load('k', lambda: 'fresh', tags=['case:1']) == 'fresh'
+
+    def test_concurrent_misses_are_coalesced(self, cache):
+        """Many callers missing the same hot key trigger a single load"""
+        calls = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.05)
+            return {'open': 3}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('dash', loader)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert results == [{'open': 3}] * 8
+
+    def test_cross_process_lock_waits_for_leader(self, shared_backend):
+        """A worker that loses the rebuild lock reads the winner's value"""
+        leader, follower = TwoTierCache(shared_backend), TwoTierCache(shared_backend)
+        shared_backend.set(leader._lock_key('dash'), b'1', ex=10, nx=True)
+        threading.Timer(0.05, lambda: leader.set('dash', 'built')).start()
+
+        assert follower.get_or_load('dash', lambda: 'duplicate') == 'built'
+        assert follower.stats.loads == 0
+        assert (follower.stats.misses, follower.stats.coalesced, follower.stats.shared_hits) == (1, 1, 0)
+
+    def test_slow_load_keeps_a_newer_lock(self, shared_backend):
+        """A load outliving its lock does not release the lock another worker took since"""
+        cache = TwoTierCache(shared_backend)
+        lock_key = cache._lock_key('dash')
+
+        def slow_loader():
+            shared_backend.delete(lock_key)
+            shared_backend.set(lock_key, b'other-worker', ex=10, nx=True)
+            return 'built'
+
+        assert cache.get_or_load('dash', slow_loader) == 'built'
+        assert shared_backend.get(lock_key) == b'other-worker'
+        cache.get_or_load('next', lambda: 1)
+        assert shared_backend.get(cache._lock_key('next')) is None
+
+    def test_tag_versions_expire_after_entries(self, shared_backend):
+        """Tag keys carry a TTL longer than any entry may live"""
+        from immigration_ai.utils import cache as cache_module
+
+        cache = TwoTierCache(shared_backend)
+        cache.invalidate_tags('case:1')
+        expires_at = shared_backend._data[cache._tag_key('case:1')][1]
+        assert expires_at is not None
+        assert expires_at - time.monotonic() > cache_module.MAX_TTL_SECONDS * (1 + cache_module.TTL_JITTER)
+
+
+class TestCachedServices:
+    """Test that service mutations invalidate cached reads"""
+
+    def test_case_reads_are_cached_until_mutation(self, fake_db, cache):
+        """Repeated reads hit the cache; an update invalidates the case and dashboard"""
+        service = CaseService(fake_db, cache)
+        case = service.create_case('agency-1', 'client-1', 'asylum', 'Asylum claim', priority=5)
+
+        service.get_case('agency-1', case['id'])
+        assert service.get_dashboard('agency-1')['high_priority'] == 1
+        reads = len(fake_db.queries)
+        service.get_case('agency-1', case['id'])
+        service.get_dashboard('agency-1')
+        assert len(fake_db.queries) == reads
+
+        service.update_case('agency-1', case['id'], {'status': 'approved'})
+        assert service.get_case('agency-1', case['id'])['status'] == 'approved'
+        assert service.get_dashboard('agency-1')['by_status']['approved'] == 1
+
+    def test_dashboard_is_counted_by_the_database(self, fake_db, cache):
+        """One call returns per-status counts; no case rows are read"""
+        service = CaseService(fake_db, cache)
+        service.create_case('agency-1', 'client-1', 'asylum', 'Late', priority=4, due_date='2025-01-01')
+        service.create_case('agency-1', 'client-1', 'asylum', 'Done', priority=5, due_date='2025-01-01')
+        service.create_case('agency-2', 'client-2', 'asylum', 'Elsewhere', priority=5)
+        service.update_case('agency-1', fake_db.tables['cases'][1]['id'], {'status': 'completed'})
+        fake_db.queries.clear()
+        dashboard = service.get_dashboard('agency-1', today=date(2025, 7, 1))
+        assert fake_db.queries == [('case_dashboard', 'rpc')]
+        assert dashboard['total'] == 2 and dashboard['open'] == 1
+        assert dashboard['by_status']['completed'] == 1 and dashboard['by_status']['new'] == 1
+        assert (dashboard['high_priority'], dashboard['overdue']) == (1, 1)
+
+    def test_case_update_keeps_other_cases_cached(self, fake_db, cache):
+        """Changing one case expires the agency's lists but not its other cases"""
+        service = CaseService(fake_db, cache)
+        first = service.create_case('agency-1', 'client-1', 'asylum', 'First')
+        second = service.create_case('agency-1', 'client-2', 'other', 'Second')
+        service.get_case('agency-1', second['id'])
+        assert service.list_cases('agency-1').items[0]['title'] == 'Second'
+
+        service.update_case('agency-1', first['id'], {'title': 'First, renamed'})
+        reads = len(fake_db.queries)
+        assert service.get_case('agency-1', second['id'])['title'] == 'Second'
+        assert len(fake_db.queries) == reads
+        assert 'First, renamed' in {case['title'] for case in service.list_cases('agency-1').items}
+        assert len(fake_db.queries) == reads + 1
+
+    def test_cases_are_scoped_to_agency(self, fake_db, cache):
+        """Another agency never sees a cached case"""
+        service = CaseService(fake_db, cache)
+        case = service.create_case('agency-1', 'client-1', 'other', 'Visa')
+        service.get_case('agency-1', case['id'])
+        with pytest.raises(ResourceNotFoundError):
+            service.get_case('agency-2', case['id'])
+
+    def test_agency_update_invalidates_profile(self, fake_db, cache):
+        """Updating an agency evicts its cached profile"""
+        fake_db.tables['agencies'] = [{'id': 'agency-1', 'name': 'Old Name'}]
+        service = AgencyService(fake_db, cache)
+        assert service.get_agency('agency-1')['name'] == 'Old Name'
+
+        service.update_agency('agency-1', {'name': 'New Name'})
+        assert service.get_agency('agency-1')['name'] == 'New Name'
+        assert cache.stats.invalidations == 1
+
+
+class TestKeysetPagination:
+    """Test cursor pagination and sparse fieldsets on list services"""
+
+    @pytest.fixture
+    def seeded_db(self, fake_db):
+        # Several rows share an updated_at so the id tie-breaker matters
+        fake_db.tables['cases'] = [
+            {'id': f'case-{i:03d}', 'agency_id': 'agency-1', 'case_number': f'CASE-2025-{i:04d}',
+             'title': f'Case {i}', 'case_type': 'other', 'status': 'new', 'priority': 1,
+             'client_id': 'client-1', 'description': 'x' * 500,
+             'updated_at': f'2025-07-01T00:00:{i // 3:02d}+00:00'}
+            for i in range(25)
+        ] + [{'id': 'case-other', 'agency_id': 'agency-2', 'status': 'new',
+              'updated_at': '2025-07-01T00:00:00+00:00'}]
+        return fake_db
+
+    def test_pages_cover_every_row_once(self, seeded_db, cache):
+        """Walking the cursor returns each row exactly once in (updated_at, id) order"""
+        service = CaseService(seeded_db, cache)
+        seen, cursor = [], None
+        while True:
+            page = service.list_cases('agency-1', cursor=cursor, limit=7)
+            seen.extend(row['id'] for row in page.items)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
+        expected = sorted(seeded_db.tables['cases'][:25], key=lambda r: (r['updated_at'], r['id']), reverse=True)
+        assert seen == [row['id'] for row in expected]
+
+    def test_sparse_fieldsets(self, seeded_db, cache):
+        """Only requested columns are returned; unknown columns are rejected"""
+        service = CaseService(seeded_db, cache)
+        page = service.list_cases('agency-1', limit=5, fields='id,status')
+        assert all(set(row) == {'id', 'status'} for row in page.items)
+        assert page.next_cursor is not None
+        assert 'description' not in service.list_cases('agency-1', limit=5).items[0]
+
+        with pytest.raises(ValidationError):
+            service.list_cases('agency-1', fields='id,passwd')
+        with pytest.raises(ValidationError):
+            ClientService(seeded_db, cache).list_clients('agency-1', fields='passport_number')
+
+    def test_bad_cursor_is_rejected(self, seeded_db, cache):
+        """A tampered cursor is a validation error, not a server error"""
+        with pytest.raises(ValidationError):
+            CaseService(seeded_db, cache).list_cases('agency-1', cursor='not-a-cursor!')
+
+    def test_iter_cases_streams_every_row(self, seeded_db, cache):
+        """Exports walk the keyset in batches and validate before the first row"""
+        service = CaseService(seeded_db, cache)
+        seeded_db.queries.clear()
+        rows = list(service.iter_cases('agency-1', batch_size=10))
+        assert len(rows) == 25 and len({row['id'] for row in rows}) == 25
+        assert len(seeded_db.queries) == 3
+
+        with pytest.raises(ValidationError):
+            service.iter_cases('agency-1', status='bogus')
+
+
+class TestBatchedLoaders:
+    """Test DataLoader batching of case and client relations"""
+
+    @pytest.fixture
+    def crm_db(self, fake_db):
+        users = [{'id': f'user-{i}', 'first_name': f'First{i}', 'last_name': 'Last', 'role': 'client'}
+                 for i in range(12)]
+        clients = [{'id': f'client-{i}', 'user_id': f'user-{i}', 'agency_id': 'agency-1'} for i in range(10)]
+        cases = [{'id': f'case-{i}', 'client_id': f'client-{i % 10}', 'agency_id': 'agency-1',
+                  'assigned_to': 'user-10', 'status': 'new', 'updated_at': f'2025-07-01T00:{i:02d}'}
+                 for i in range(20)]
+        fake_db.tables.update({
+            'users': users, 'clients': clients, 'cases': cases,
+            'documents': [{'id': f'doc-{i}', 'case_id': f'case-{i}', 'agency_id': 'agency-1'} for i in range(20)],
+            'case_notes': [{'id': f'note-{i}', 'case_id': f'case-{i % 5}', 'author_id': 'user-11',
+                            'is_private': i % 2 == 0} for i in range(10)],
+            'case_activities': [{'id': f'act-{i}', 'case_id': f'case-{i}', 'user_id': 'user-10'}
+                                for i in range(20)],
+        })
+        return QueryCounter(fake_db)
+
+    def test_dataloader_batches_and_memoizes(self):
+        """Keys queued together resolve in one batch; repeats hit the memo"""
+        batches = []
+
+        def load(keys):
+            batches.append(keys)
+            return {key: key * 2 for key in keys}
+
+        loader = DataLoader(load, max_batch_size=3)
+        pending = loader.load_many([1, 2, 2, 3, 4])
+        assert [p.result() for p in pending] == [2, 4, 4, 6, 8]
+        assert batches == [[1, 2, 3], [4]]
+        assert loader.get(3) == 6 and len(batches) == 2
+
+    def test_case_details_query_count_is_constant(self, crm_db, cache):
+        """Twenty cases with every relation cost one query per relation"""
+        service = CaseService(crm_db, cache)
+        with assert_num_queries(crm_db, 6) as queries:
+            details = service.get_case_details('agency-1', [f'case-{i}' for i in range(20)])
+
+        assert sorted(queries) == ['case_activities', 'case_notes', 'cases', 'clients', 'documents', 'users']
+        assert len(details) == 20
+        assert details[0]['client']['user']['first_name'] == 'First0'
+        assert details[0]['assigned_user']['id'] == 'user-10'
+        assert [n['author']['id'] for n in details[0]['notes']] == ['user-11', 'user-11']
+        assert len(details[0]['documents']) == 1 and len(details[0]['activities']) == 1
+
+    def test_private_notes_and_foreign_cases_filtered(self, crm_db, cache):
+        """Clients don't see private notes; another agency's cases are skipped"""
+        crm_db.client.tables['cases'].append({'id': 'case-x', 'client_id': 'client-0', 'agency_id': 'agency-2'})
+        service = CaseService(crm_db, cache)
+        details = service.get_case_details('agency-1', ['case-0', 'case-x'], include_private_notes=False)
+        assert [d['id'] for d in details] == ['case-0']
+        assert all(not note['is_private'] for note in details[0]['notes'])
+        with pytest.raises(ResourceNotFoundError):
+            service.get_case_detail('agency-1', 'case-x')
+
+    def test_client_profiles_query_count(self, crm_db, cache):
+        """Client profiles batch clients, users and cases"""
+        service = ClientService(crm_db, cache)
+        with assert_num_queries(crm_db, 3):
+            profiles = service.get_client_profiles('agency-1', [f'client-{i}' for i in range(10)])
+        assert [len(p['cases']) for p in profiles] == [2] * 10
+        assert profiles[3]['user']['id'] == 'user-3'
+
+
+class TestResponseEncoding:
+    """Test the compiled row encoders and streamed JSON arrays"""
+
+    def test_row_encoder_matches_json_dumps(self):
+        """Compiled encoders emit the same JSON as json.dumps for native values"""
+        row = {'id': 'c-1', 'title': 'Visa "H-1B" \u00e9t\u00e9', 'priority': 3, 'score': 0.5,
+               'is_verified': False, 'due_date': None, 'address': {'city': 'Toronto'}, 'extra': 'dropped'}
+        fields = ('id', 'title', 'priority', 'score', 'is_verified', 'due_date', 'address', 'missing')
+        expected = json.dumps({f: row.get(f) for f in fields}, separators=(',', ':'))
+        assert row_encoder(fields)(row) == expected
+        assert row_encoder(fields) is row_encoder(fields)
+
+    def test_row_encoder_handles_database_types(self):
+        """Datetimes, dates, UUIDs and decimals from asyncpg encode as strings"""
+        value = uuid.UUID('12345678-1234-5678-1234-567812345678')
+        encoded = row_encoder(('id', 'at', 'on', 'fee'))({
+            'id': value, 'at': datetime(2025, 7, 1, 12, tzinfo=timezone.utc), 'on': date(2025, 7, 2),
+            'fee': Decimal('10.50')})
+        assert json.loads(encoded) == {'id': str(value), 'at': '2025-07-01T12:00:00+00:00',
+                                       'on': '2025-07-02', 'fee': 10.5}
+
+    def test_json_array_is_chunked_and_valid(self):
+        """Streamed arrays parse as one document and arrive in bounded chunks"""
+        rows = ({'id': f'case-{i}', 'status': 'new'} for i in range(5000))
+        chunks = list(iter_json_array(rows, row_encoder(('id', 'status')), chunk_bytes=4096))
+        assert len(chunks) > 10
+        assert max(len(chunk) for chunk in chunks) < 4096 + 100
+        parsed = json.loads(b''.join(chunks))
+        assert len(parsed) == 5000 and parsed[-1] == {'id': 'case-4999', 'status': 'new'}
+        assert json.loads(b''.join(iter_json_array([], row_encoder(('id',))))) == []
+
+    def test_encode_page(self):
+        """Page bodies match the PageOut shape and always carry the page's fieldset"""
+        assert json.loads(encode_page([{'id': 'a', 'status': 'new'}], 'cursor', ('id', 'status'))) == {
+            'items': [{'id': 'a', 'status': 'new'}], 'next_cursor': 'cursor'}
+        assert json.loads(encode_page([{'id': 'a'}, {'status': 'new', 'id': 'b'}], None, ('id', 'status'))) == {
+            'items': [{'id': 'a', 'status': None}, {'id': 'b', 'status': 'new'}], 'next_cursor': None}
+        assert json.loads(encode_page([], None, ('id',))) == {'items': [], 'next_cursor': None}
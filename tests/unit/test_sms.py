@@ -0,0 +1,316 @@
+"""
+Unit tests for rate-aware SMS dispatch and receipt ingestion
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../tools'))
+
+from sms_provider_stub import InProcessProvider, SMSProviderStub  # noqa: E402
+
+from immigration_ai.communication.sms.sender import (APPLY_EARLY_RECEIPTS_SQL,  # noqa: E402
+                                                     APPLY_RECEIPTS_SQL, PURGE_EARLY_RECEIPTS_SQL,
+                                                     RECORD_RESULTS_SQL, DeliveryReceipt, HTTPSMSProvider,
+                                                     SMSDispatcher, SMSMessage, SMSProviderSettings, SMSResult,
+                                                     SMSStatusLog, provider_result)
+from immigration_ai.core.exceptions import ServiceUnavailableError, ValidationError  # noqa: E402
+
+
+def _settings(**overrides):
+    values = dict(base_url='http://127.0.0.1', senders=['+15550001'], rate_per_second=1e6,
+                  sender_rate_per_second=1e6, concurrency=4)
+    values.update(overrides)
+    return SMSProviderSettings(**values)
+
+
+class RecordingProvider:
+    """Answers from ``script`` (one list of results per destination) after ``delay`` seconds"""
+
+    def __init__(self, delay=0.0, script=None):
+        self.delay = delay
+        self.script = script or {}
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+
+    async def send(self, message, sender):
+        self.calls.append((message.to, sender, time.monotonic()))
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        outcomes = self.script.get(message.to)
+        if outcomes:
+            return outcomes.pop(0)
+        return SMSResult(message.idempotency_key, True, sid=f'SM-{message.to}', sender=sender)
+
+
+class FakeConnection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.executed = []
+
+    async def execute(self, query, *args):
+        if self.fail:
+            raise OSError('connection reset')
+        self.executed.append((query, args))
+
+
+class FakeDatabase:
+    def __init__(self, connection):
+        self.connection = connection
+        self.transactions = 0
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.transactions += 1
+        yield self.connection
+
+
+class TestSMSDispatcher:
+    """Test priority, rate limits, concurrency, idempotency and retries"""
+
+    def test_otp_jumps_ahead_of_queued_reminders(self):
+        """An OTP submitted behind a reminder batch is sent with the next free slot"""
+        provider = RecordingProvider(delay=0.01)
+        dispatcher = SMSDispatcher(provider, _settings(concurrency=1))
+
+        async def run():
+            bulk = [dispatcher.submit(SMSMessage(f'+1416000{n}', 'Reminder')) for n in range(5)]
+            await asyncio.sleep(0.001)
+            otp = await dispatcher.send(SMSMessage.otp('+14169999', 'Code 123456'))
+            await asyncio.gather(*bulk)
+            await dispatcher.close()
+            return otp
+
+        otp = asyncio.run(run())
+        assert otp.ok and otp.attempts == 1
+        assert [to for to, _, _ in provider.calls][:2] == ['+14160000', '+14169999']
+
+    def test_sender_buckets_spread_load_without_exceeding_limits(self):
+        """Each number stays within its own rate; free numbers are used in rotation"""
+        provider = RecordingProvider()
+        settings = _settings(senders=['+1555A', '+1555B'], sender_rate_per_second=50, sender_burst=1,
+                             concurrency=8)
+        dispatcher = SMSDispatcher(provider, settings)
+
+        async def run():
+            results = await dispatcher.send_many(SMSMessage(f'+1416000{n}', 'Reminder') for n in range(10))
+            await dispatcher.close()
+            return results
+
+        results = asyncio.run(run())
+        assert all(result.ok for result in results)
+        by_sender = {}
+        for _, sender, at in provider.calls:
+            by_sender.setdefault(sender, []).append(at)
+        assert sorted(len(times) for times in by_sender.values()) == [5, 5]
+        # Five sends on one number at 50/s with no burst take at least four intervals
+        assert all(times[-1] - times[0] >= 0.075 for times in by_sender.values())
+
+    def test_concurrency_is_bounded(self):
+        """No more than ``concurrency`` requests are in flight at once"""
+        provider = RecordingProvider(delay=0.005)
+        dispatcher = SMSDispatcher(provider, _settings(concurrency=3))
+
+        async def run():
+            await dispatcher.send_many(SMSMessage(f'+1416000{n}', 'Reminder') for n in range(12))
+            await dispatcher.close()
+
+        asyncio.run(run())
+        assert provider.peak == 3 and len(provider.calls) == 12
+
+    def test_idempotency_keys_send_once(self):
+        """Queued and recently finished keys return the same result without another request"""
+        provider = RecordingProvider(delay=0.005)
+        seen = []
+        dispatcher = SMSDispatcher(provider, _settings(), on_result=lambda message, result: seen.append(result))
+
+        async def run():
+            first = dispatcher.submit(SMSMessage('+14160001', 'Reminder', idempotency_key='k1'))
+            second = dispatcher.submit(SMSMessage('+14160001', 'Reminder', idempotency_key='k1'))
+            results = await asyncio.gather(first, second)
+            again = await dispatcher.send(SMSMessage('+14160001', 'Reminder', idempotency_key='k1'))
+            await dispatcher.close()
+            return results, again
+
+        (first, second), again = asyncio.run(run())
+        assert first is second is again
+        assert len(provider.calls) == 1 and len(seen) == 1
+        stats = dispatcher.stats()
+        assert (stats.submitted, stats.deduplicated, stats.sent) == (3, 2, 1)
+
+    def test_temporary_failures_are_retried_with_the_same_key(self):
+        """Throttling honours Retry-After; permanent failures and exhausted retries are final"""
+        def throttled():
+            return SMSResult('ignored', False, temporary=True, retry_after=0.01, error='429 slow down')
+
+        provider = RecordingProvider(script={
+            '+1416A': [throttled()],
+            '+1416B': [SMSResult('ignored', False, temporary=False, error='400 invalid number', code='21211')],
+            '+1416C': [throttled() for _ in range(3)],
+        })
+        dispatcher = SMSDispatcher(provider, _settings(), max_attempts=3)
+
+        async def run():
+            results = await dispatcher.send_many([SMSMessage(to, 'Reminder') for to in ('+1416A', '+1416B', '+1416C')])
+            await dispatcher.close()
+            return results
+
+        retried, rejected, exhausted = asyncio.run(run())
+        assert (retried.ok, retried.attempts) == (True, 2)
+        assert (rejected.ok, rejected.attempts, rejected.code) == (False, 1, '21211')
+        assert (exhausted.ok, exhausted.temporary, exhausted.attempts) == (False, True, 3)
+        assert dispatcher.stats().retried == 3
+
+    def test_stand_in_accepts_within_limits_and_throttles_beyond(self):
+        """Through the stand-in, the dispatcher paces one number; firing directly earns 429s"""
+        async def run():
+            stub = SMSProviderStub(sender_rate=20)
+            direct = InProcessProvider(stub)
+            burst = await asyncio.gather(*(direct.send(SMSMessage(f'+1416{n}', 'x'), '+1555X') for n in range(25)))
+            # Configured a little under the provider's limit, as in production
+            paced = SMSDispatcher(InProcessProvider(stub), _settings(senders=['+1555Y'], sender_rate_per_second=19,
+                                                                     sender_burst=19))
+            results = await paced.send_many(SMSMessage(f'+1417{n}', 'x') for n in range(25))
+            await paced.close()
+            return stub, burst, results
+
+        stub, burst, results = asyncio.run(run())
+        assert sum(not result.ok for result in burst) == 5
+        assert burst[-1].retry_after == 1.0 and burst[-1].temporary
+        assert all(result.ok for result in results) and stub.throttled == 5
+
+
+class TestSMSProvider:
+    """Test response classification and the HTTP stand-in"""
+
+    def test_provider_responses_are_classified(self):
+        """2xx is sent, 408/429/5xx are temporary, other 4xx are permanent"""
+        message = SMSMessage('+14160001', 'x', idempotency_key='k')
+        sent = provider_result(message, '+1555', 201, {'sid': 'SM1'})
+        throttled = provider_result(message, '+1555', 429, {'error': 'slow'}, retry_after='2')
+        unavailable = provider_result(message, '+1555', 503, None)
+        invalid = provider_result(message, '+1555', 400, {'error': 'bad number', 'code': 21211})
+        assert (sent.ok, sent.sid, sent.sender) == (True, 'SM1', '+1555')
+        assert (throttled.temporary, throttled.retry_after, throttled.error) == (True, 2.0, '429 slow')
+        assert (unavailable.temporary, unavailable.code) == (True, '503')
+        assert (invalid.temporary, invalid.code) == (False, '21211')
+
+    def test_stand_in_speaks_http_with_keep_alive(self):
+        """Several requests share one connection; idempotent repeats return the original sid"""
+        async def run():
+            stub = await SMSProviderStub(api_key='secret', reject='^\\+999').start()
+            reader, writer = await asyncio.open_connection(stub.host, stub.port)
+
+            async def post(payload, key):
+                body = json.dumps(payload).encode()
+                writer.write((f'POST /v1/messages HTTP/1.1\r\nHost: x\r\nAuthorization: Bearer secret\r\n'
+                              f'Idempotency-Key: {key}\r\nContent-Length: {len(body)}\r\n\r\n').encode() + body)
+                status = int((await reader.readline()).split()[1])
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.lower()] = value.strip()
+                return status, json.loads(await reader.readexactly(int(headers['content-length'])))
+
+            try:
+                replies = [await post({'to': '+14160001', 'from': '+1555', 'body': 'hi'}, 'k1'),
+                           await post({'to': '+14160001', 'from': '+1555', 'body': 'hi'}, 'k1'),
+                           await post({'to': '+9990001', 'from': '+1555', 'body': 'hi'}, 'k2')]
+            finally:
+                writer.close()
+                await stub.stop()
+            return stub, replies
+
+        stub, ((created, first), (repeated, second), (rejected, error)) = asyncio.run(run())
+        assert (created, repeated, rejected) == (201, 200, 400)
+        assert first == second and error['code'] == 21211
+        assert stub.connections == 1 and len(stub.messages) == 1
+        assert stub.drain_receipts() == [{'sid': first['sid'], 'status': 'delivered', 'error_code': None}]
+
+    def test_http_provider_against_stand_in(self):
+        """The aiohttp client sends the key, bearer token and body the API expects"""
+        pytest.importorskip('aiohttp')
+
+        async def run():
+            stub = await SMSProviderStub(api_key='secret').start()
+            provider = HTTPSMSProvider(_settings(base_url=stub.url, api_key='secret'))
+            try:
+                message = SMSMessage('+14160001', 'hi', idempotency_key='k1')
+                return stub, await provider.send(message, '+1555'), await provider.send(message, '+1555')
+            finally:
+                await provider.close()
+                await stub.stop()
+
+        stub, first, repeat = asyncio.run(run())
+        assert first.ok and first.sid == repeat.sid and len(stub.messages) == 1
+
+
+class TestSMSStatusLog:
+    """Test batched writes of send results and delivery receipts"""
+
+    def test_receipt_payloads_are_validated(self):
+        """Both plain and Twilio-style field names are accepted; unknown statuses are not"""
+        assert DeliveryReceipt.from_payload({'MessageSid': 'SM1', 'MessageStatus': 'Delivered', 'ErrorCode': ''}) \
+            == DeliveryReceipt('SM1', 'delivered', None)
+        assert DeliveryReceipt.from_payload({'sid': 'SM2', 'status': 'undelivered', 'error_code': 30003}) \
+            == DeliveryReceipt('SM2', 'undelivered', '30003')
+        for payload in ({'sid': 'SM3', 'status': 'exploded'}, {'status': 'delivered'}, ['SM4']):
+            with pytest.raises(ValidationError):
+                DeliveryReceipt.from_payload(payload)
+
+    def test_flush_writes_one_batch_and_applies_parked_receipts(self):
+        """Results and receipts share a transaction; recorded sids pick up receipts that came first"""
+        connection = FakeConnection()
+        log = SMSStatusLog(FakeDatabase(connection))
+        message = SMSMessage('+14160001', 'x', idempotency_key='k1', agency_id='agency-1')
+        log.record_result('default', message, SMSResult('k1', False, temporary=True, error='429', code='20429'))
+        log.record_result('default', message, SMSResult('k1', True, sid='SM1', sender='+1555', attempts=2))
+        log.add_receipts('default', [DeliveryReceipt('SM1', 'delivered'), DeliveryReceipt('SM1', 'sent'),
+                                     DeliveryReceipt('SM9', 'delivered')])
+
+        assert asyncio.run(log.flush()) == (1, 2)
+        [(results_sql, results_args), (early_sql, early_args), (receipts_sql, receipts_args),
+         (purge_sql, _)] = connection.executed
+        assert results_sql == RECORD_RESULTS_SQL and receipts_sql == APPLY_RECEIPTS_SQL
+        assert results_args == ('default', ['k1'], ['agency-1'], ['+1555'], ['+14160001'], [10], ['SM1'],
+                                ['sent'], [2], [None], [None])
+        assert (early_sql, early_args) == (APPLY_EARLY_RECEIPTS_SQL, ('default', ['SM1']))
+        assert receipts_args == ('default', ['SM1', 'SM9'], ['delivered', 'delivered'], [None, None])
+        assert purge_sql == PURGE_EARLY_RECEIPTS_SQL
+
+        assert log.pending() == 0 and asyncio.run(log.flush()) == (0, 0)
+
+    def test_webhook_write_waits_for_commit_and_pushes_back(self):
+        """Concurrent receipt writes share one commit; a failed write or a full buffer refuses them"""
+        async def run():
+            connection = FakeConnection()
+            log = SMSStatusLog(FakeDatabase(connection), flush_interval=60, max_pending=3)
+            await asyncio.gather(log.write_receipts('default', [DeliveryReceipt('SM1', 'delivered')]),
+                                 log.write_receipts('default', [DeliveryReceipt('SM2', 'sent')]))
+            written = [args[1] for query, args in connection.executed if query == APPLY_RECEIPTS_SQL]
+            assert written == [['SM1', 'SM2']] and log.database.transactions == 1
+
+            connection.fail = True
+            with pytest.raises(ServiceUnavailableError):
+                await log.write_receipts('default', [DeliveryReceipt('SM3', 'delivered')])
+            assert log.pending() == 1
+            with pytest.raises(ServiceUnavailableError):
+                await log.write_receipts('default', [DeliveryReceipt(f'SM{n}', 'sent') for n in range(4, 7)])
+            connection.fail = False
+            await log.close()
+            assert log.pending() == 0
+
+        asyncio.run(run())
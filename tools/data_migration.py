@@ -1 +1,714 @@
+#!/usr/bin/env python3
+"""
+Streaming bulk import/export of agency data
 
+Onboarding an agency means loading tens of thousands of clients and their
+case history. Row-by-row inserts pay a round trip per row and fire the
+per-row triggers from ``supabase/migrations`` (``set_case_number`` takes
+the agency's counter row once per case). This tool instead:
+
+* reads CSV or YAML (the ``data/fixtures`` format) through generators, so
+  input size does not change memory use. A YAML file can hold several
+  tables in any order, so it is parsed once and its records spooled to
+  per-table temporary files, which are read back in load order;
+* loads each table in bounded batches with ``COPY`` into a temporary
+  staging table inside one transaction;
+* has the expensive user triggers skip its rows while it copies (the
+  transaction-local ``app.bulk_import`` setting, which they check in their
+  ``WHEN`` clause, so no table lock is taken and other sessions still fire
+  them), then applies their side effects set-based: case numbers come from one reserved
+  range per agency and year (``allocate_case_numbers``) and one windowed
+  ``UPDATE`` per batch, and document reference counts, client upload
+  notifications and staff fan-out events with one ``INSERT ... SELECT``;
+* encrypts client PII (``passport_number``) per agency batch with
+  ``security/encryption.py`` and fills its blind index, so imported rows
+  match what ``ClientService`` writes;
+* exports with ``COPY ... TO STDOUT`` (CSV) or a server-side cursor (YAML).
+
+``encrypt-clients`` backfills rows written before field encryption: it
+pages through clients whose passport number is still plaintext and
+rewrites each batch, leaving any row changed in the meantime alone.
+
+Fixture ids such as ``agency-001`` are mapped to stable UUIDs
+(``uuid5``), so foreign keys between files still line up.
+
+Usage::
+
+    python tools/data_migration.py import data/fixtures --dsn postgresql://...
+    python tools/data_migration.py export cases --agency-id <uuid> -o cases.csv
+    python tools/data_migration.py encrypt-clients --dsn postgresql://...
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 5000
+# allocate_case_numbers refuses larger reservations
+MAX_BATCH_SIZE = 100000
+FIXTURE_NAMESPACE = uuid.UUID('6f1c2a52-38a4-4b8e-9d0a-3c2f6b1e7d10')
+
+
+# -- value conversion -------------------------------------------------
+
+def fixture_uuid(value: Any) -> Optional[uuid.UUID]:
+    """Return ``value`` as a UUID, deriving a stable one for fixture ids like ``agency-001``"""
+    if value in (None, ''):
+        return None
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return uuid.uuid5(FIXTURE_NAMESPACE, str(value))
+
+
+def _timestamp(value: Any) -> Optional[datetime]:
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+
+
+def _date(value: Any) -> Optional[date]:
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _int(value: Any) -> Optional[int]:
+    return None if value in (None, '') else int(value)
+
+
+def _bool(value: Any) -> Optional[bool]:
+    if value in (None, ''):
+        return None
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 't', 'true', 'yes', 'y')
+
+
+def _json(value: Any) -> Optional[str]:
+    if value in (None, ''):
+        return None
+    # CSV exports carry JSON as text already
+    return value if isinstance(value, str) else json.dumps(value, default=str)
+
+
+def _text(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    'uuid': fixture_uuid, 'text': _text, 'int': _int, 'bool': _bool,
+    'date': _date, 'timestamp': _timestamp, 'json': _json,
+}
+
+
+# -- table specs ------------------------------------------------------
+
+@dataclass
+class TableSpec:
+    """How one table is loaded: typed columns, enum fallbacks and deferred triggers"""
+    name: str
+    columns: Tuple[Tuple[str, str], ...]
+    # Column -> (allowed values, fallback for anything else)
+    enums: Dict[str, Tuple[Tuple[str, ...], str]] = field(default_factory=dict)
+    # References to public.users that are nulled when the user does not exist
+    user_columns: Tuple[str, ...] = ()
+    # NOT NULL columns the set-based post-processing fills in
+    generated: Tuple[str, ...] = ()
+    # User triggers skipped for imported rows; their effects are applied afterwards
+    deferred_triggers: Tuple[str, ...] = ()
+    # Filter column for agency-scoped exports
+    agency_column: str = 'agency_id'
+    # Columns encrypted per agency on import, each with a ``{column}_bidx`` column
+    encrypted: Tuple[str, ...] = ()
+
+    @property
+    def column_names(self) -> List[str]:
+        return [name for name, _ in self.columns]
+
+
+CASE_TYPES = ('family_based', 'employment_based', 'asylum', 'naturalization', 'other')
+CASE_STATUSES = ('new', 'in_progress', 'under_review', 'approved', 'rejected', 'completed')
+DOCUMENT_TYPES = ('passport', 'birth_certificate', 'marriage_certificate', 'diploma', 'employment_letter',
+                  'financial_statement', 'other')
+
+TABLES: Dict[str, TableSpec] = {
+    'agencies': TableSpec('agencies', (
+        ('id', 'uuid'), ('name', 'text'), ('email', 'text'), ('phone', 'text'), ('address', 'json'),
+        ('website', 'text'), ('created_at', 'timestamp'), ('updated_at', 'timestamp'),
+    ), agency_column='id'),
+    'clients': TableSpec('clients', (
+        ('id', 'uuid'), ('user_id', 'uuid'), ('agency_id', 'uuid'), ('date_of_birth', 'date'),
+        ('country_of_birth', 'text'), ('nationality', 'text'), ('passport_number', 'text'),
+        ('passport_number_bidx', 'text'), ('address', 'json'), ('emergency_contact', 'json'),
+        ('immigration_status', 'text'), ('created_at', 'timestamp'), ('updated_at', 'timestamp'),
+    ), user_columns=('user_id',), encrypted=('passport_number',)),
+    'cases': TableSpec('cases', (
+        ('id', 'uuid'), ('case_number', 'text'), ('client_id', 'uuid'), ('agency_id', 'uuid'),
+        ('case_type', 'text'), ('status', 'text'), ('title', 'text'), ('description', 'text'),
+        ('priority', 'int'), ('assigned_to', 'uuid'), ('due_date', 'date'),
+        ('created_at', 'timestamp'), ('updated_at', 'timestamp'),
+    ), enums={'case_type': (CASE_TYPES, 'other'), 'status': (CASE_STATUSES, 'in_progress')},
+        user_columns=('assigned_to',), generated=('case_number',),
+        deferred_triggers=('set_case_number_trigger',)),
+    'documents': TableSpec('documents', (
+        ('id', 'uuid'), ('client_id', 'uuid'), ('case_id', 'uuid'), ('agency_id', 'uuid'),
+        ('document_type', 'text'), ('file_name', 'text'), ('file_path', 'text'), ('file_size', 'int'),
+        ('mime_type', 'text'), ('uploaded_by', 'uuid'), ('is_verified', 'bool'), ('notes', 'text'),
+        ('content_sha256', 'text'), ('created_at', 'timestamp'), ('updated_at', 'timestamp'),
+    ), enums={'document_type': (DOCUMENT_TYPES, 'other')}, user_columns=('uploaded_by',),
+        deferred_triggers=('document_upload_notification_trigger', 'document_blob_refs_trigger')),
+}
+# Parents before children so foreign keys resolve
+LOAD_ORDER = ('agencies', 'clients', 'cases', 'documents')
+
+
+@dataclass
+class TableReport:
+    table: str
+    rows: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    coerced: Dict[str, int] = field(default_factory=dict)
+    ignored_columns: List[str] = field(default_factory=list)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'table': self.table, 'rows': self.rows, 'batches': self.batches, 'seconds': self.seconds,
+                'rows_per_second': self.rows_per_second, 'coerced': self.coerced,
+                'ignored_columns': self.ignored_columns}
+
+
+def convert_record(spec: TableSpec, record: Dict[str, Any], report: TableReport) -> Tuple[Any, ...]:
+    """Turn one input record into a typed tuple in ``spec`` column order"""
+    for key in record:
+        if key not in spec.column_names and key not in report.ignored_columns:
+            report.ignored_columns.append(key)
+    values = []
+    for name, kind in spec.columns:
+        value = CONVERTERS[kind](record.get(name))
+        if name in spec.enums and value is not None:
+            allowed, fallback = spec.enums[name]
+            if value not in allowed:
+                report.coerced[name] = report.coerced.get(name, 0) + 1
+                value = fallback
+        values.append(value)
+    return tuple(values)
+
+
+def encrypt_batch(spec: TableSpec, batch: Sequence[Tuple[Any, ...]],
+                  encryptor: Callable[[], Any]) -> List[Tuple[Any, ...]]:
+    """Encrypt ``spec.encrypted`` columns of converted rows per agency and fill their blind indexes
+
+    Values that are already ciphertext (a re-imported export) pass through.
+    ``encryptor`` returns the ``FieldEncryptor`` and is only called when
+    there is plaintext to seal.
+    """
+    from immigration_ai.security.encryption import is_encrypted
+
+    names = spec.column_names
+    agency = names.index(spec.agency_column)
+    rows = [list(row) for row in batch]
+    for name in spec.encrypted:
+        column, index = names.index(name), names.index(f'{name}_bidx')
+        by_agency: Dict[str, List[List[Any]]] = {}
+        for row in rows:
+            if row[column] is not None and not is_encrypted(row[column]):
+                by_agency.setdefault(str(row[agency]), []).append(row)
+        for agency_id, group in by_agency.items():
+            values = [row[column] for row in group]
+            tokens = encryptor().encrypt_many(agency_id, name, values)
+            for row, token, bidx in zip(group, tokens, encryptor().blind_index_many(agency_id, name, values)):
+                row[column], row[index] = token, bidx
+    return [tuple(row) for row in rows]
+
+
+# -- streaming readers ------------------------------------------------
+
+def iter_csv(path: Path) -> Iterator[Dict[str, Any]]:
+    with open(path, newline='', encoding='utf-8') as fh:
+        for row in csv.DictReader(fh):
+            yield {key: (value if value != '' else None) for key, value in row.items()}
+
+
+def iter_yaml(path: Path) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield ``(table, record)`` from a fixtures file one list item at a time
+
+    The file is parsed as an event stream; only the current item's events
+    are held in memory, however long the list.
+    """
+    import yaml
+    from yaml import events
+
+    with open(path, encoding='utf-8') as fh:
+        parser = yaml.parse(fh, Loader=yaml.SafeLoader)
+        depth, table, item = 0, None, None
+        for event in parser:
+            if item is not None:
+                item.append(event)
+                if isinstance(event, (events.MappingStartEvent, events.SequenceStartEvent)):
+                    depth += 1
+                elif isinstance(event, (events.MappingEndEvent, events.SequenceEndEvent)):
+                    depth -= 1
+                if depth == 2:
+                    document = [events.StreamStartEvent(), events.DocumentStartEvent(), *item,
+                                events.DocumentEndEvent(), events.StreamEndEvent()]
+                    yield table, yaml.safe_load(yaml.emit(document))
+                    item = None
+                continue
+            if isinstance(event, (events.MappingStartEvent, events.SequenceStartEvent)):
+                depth += 1
+                if depth == 3 and isinstance(event, events.MappingStartEvent):
+                    item = [event]
+            elif isinstance(event, (events.MappingEndEvent, events.SequenceEndEvent)):
+                depth -= 1
+            elif isinstance(event, events.ScalarEvent) and depth == 1:
+                table = event.value
+
+
+def iter_source(path: Path) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield ``(table, record)`` from a CSV file (named after its table) or a YAML fixtures file"""
+    if path.suffix.lower() == '.csv':
+        for record in iter_csv(path):
+            yield path.stem, record
+    elif path.suffix.lower() in ('.yaml', '.yml'):
+        yield from iter_yaml(path)
+    else:
+        raise ValueError(f'Unsupported input file {path}')
+
+
+def iter_table(paths: Sequence[Path], table: str) -> Iterator[Dict[str, Any]]:
+    """One table's records; every YAML file is parsed per call, so use :class:`TableSpool` for several"""
+    for path in paths:
+        if path.suffix.lower() == '.csv' and path.stem != table:
+            continue
+        for source_table, record in iter_source(path):
+            if source_table == table:
+                yield record
+
+
+class TableSpool:
+    """Records of every table in ``paths``, each input file parsed once
+
+    CSV files hold one table each and are read in place. YAML files are
+    parsed on the first :meth:`iter_table` call, and their records are
+    pickled to one temporary file per (file, table). Tables are then read
+    back in any order with memory bounded by one record. Records keep the
+    order of ``paths``.
+    """
+
+    def __init__(self, paths: Sequence[Path]):
+        self.paths = list(paths)
+        self._directory: Optional[tempfile.TemporaryDirectory] = None
+        self._spooled: Dict[Tuple[int, str], Path] = {}
+
+    def __enter__(self) -> 'TableSpool':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _spool(self) -> None:
+        if self._directory is not None:
+            return
+        self._directory = tempfile.TemporaryDirectory(prefix='data-migration-')
+        for position, path in enumerate(self.paths):
+            if path.suffix.lower() == '.csv':
+                continue
+            files: Dict[str, Any] = {}
+            try:
+                for table, record in iter_source(path):
+                    fh = files.get(table)
+                    if fh is None:
+                        spool_path = Path(self._directory.name) / f'{position}-{len(files)}.pickle'
+                        fh = files[table] = open(spool_path, 'wb')
+                        self._spooled[(position, table)] = spool_path
+                    pickle.dump(record, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            finally:
+                for fh in files.values():
+                    fh.close()
+
+    def iter_table(self, table: str) -> Iterator[Dict[str, Any]]:
+        self._spool()
+        for position, path in enumerate(self.paths):
+            if path.suffix.lower() == '.csv':
+                if path.stem == table:
+                    yield from iter_csv(path)
+                continue
+            spool_path = self._spooled.get((position, table))
+            if spool_path is None:
+                continue
+            with open(spool_path, 'rb') as fh:
+                while True:
+                    try:
+                        yield pickle.load(fh)
+                    except EOFError:
+                        break
+
+    def close(self) -> None:
+        if self._directory is not None:
+            self._directory.cleanup()
+            self._directory = None
+            self._spooled.clear()
+
+
+def batched(records: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# -- import -----------------------------------------------------------
+
+async def _apply_case_numbers(connection, stage: str) -> None:
+    """Number staged cases like ``set_case_number`` does, but for the whole batch at once
+
+    Each agency and year reserves one range from ``case_number_counters``;
+    cases take consecutive numbers from it in creation order. Cases that
+    arrive with a ``CASE-YYYY-N`` number first move their counter up to
+    ``N``, so the reserved range cannot collide with them.
+    """
+    await connection.execute(f"""
+        INSERT INTO public.case_number_counters AS c (agency_id, year, last_value)
+        SELECT agency_id, (m[1])::int, max((m[2])::int)
+        FROM {stage}, regexp_match(case_number, '^CASE-(\\d{{4}})-(\\d{{1,9}})$') AS m
+        WHERE m IS NOT NULL
+        GROUP BY agency_id, (m[1])::int
+        ON CONFLICT (agency_id, year) DO UPDATE
+            SET last_value = GREATEST(c.last_value, EXCLUDED.last_value)
+    """)
+    await connection.execute(f"""
+        WITH pending AS (
+            SELECT id, agency_id, year,
+                   row_number() OVER (PARTITION BY agency_id, year ORDER BY created_at, id) AS seq
+            FROM (SELECT id, agency_id, created_at,
+                         EXTRACT(YEAR FROM COALESCE(created_at, now()))::int AS year
+                  FROM {stage}
+                  WHERE case_number IS NULL OR case_number = '') staged
+        ), ranges AS MATERIALIZED (
+            SELECT agency_id, year, public.allocate_case_numbers(agency_id, year, count(*)::int) AS first
+            FROM pending
+            GROUP BY agency_id, year
+        )
+        UPDATE {stage} s
+        SET case_number = public.format_case_number(p.year, (r.first + p.seq - 1)::int)
+        FROM pending p JOIN ranges r ON r.agency_id = p.agency_id AND r.year = p.year
+        WHERE s.id = p.id
+    """)
+
+
+async def _apply_document_effects(connection, stage: str, notify: bool) -> None:
+    """Set-based equivalent of the per-row document triggers"""
+    await connection.execute(f"""
+        UPDATE public.document_blobs b
+        SET ref_count = b.ref_count + s.n
+        FROM (SELECT content_sha256, count(*) AS n FROM {stage}
+              WHERE content_sha256 IS NOT NULL GROUP BY 1) s
+        WHERE b.content_sha256 = s.content_sha256
+    """)
+    if not notify:
+        return
+    await connection.execute(f"""
+        WITH docs AS (
+            SELECT d.id, d.client_id, d.agency_id, d.document_type, d.file_name, c.user_id,
+                   u.first_name || ' ' || u.last_name AS client_name,
+                   INITCAP(REPLACE(d.document_type::text, '_', ' ')) AS type_label
+            FROM {stage} d
+            JOIN public.clients c ON c.id = d.client_id
+            LEFT JOIN public.users u ON u.id = c.user_id
+        ), client_notifications AS (
+            INSERT INTO public.notifications (user_id, agency_id, type, title, message, data)
+            SELECT user_id, agency_id, 'document_uploaded', 'Document Uploaded Successfully',
+                   'Your ' || type_label || ' (' || file_name || ') has been uploaded successfully and is pending review.',
+                   jsonb_build_object('document_id', id, 'document_type', document_type, 'file_name', file_name)
+            FROM docs
+            WHERE user_id IS NOT NULL
+        )
+        INSERT INTO public.notification_events (agency_id, type, payload)
+        SELECT agency_id, 'document_review_needed',
+               jsonb_build_object('document_id', id, 'client_id', client_id, 'document_type', document_type,
+                                  'document_type_label', type_label, 'file_name', file_name,
+                                  'client_name', client_name)
+        FROM docs
+    """)
+    # Staff notifications are written by the fan-out worker (digests for a load this size)
+    await connection.execute("SELECT pg_notify('notification_events', '')")
+
+
+class _LazyEncryptor:
+    """Creates the ``FieldEncryptor`` (and so requires its keys) on first use"""
+
+    def __init__(self, encryptor=None):
+        self._encryptor = encryptor
+
+    def __call__(self):
+        if self._encryptor is None:
+            from immigration_ai.security.encryption import FieldEncryptor
+            self._encryptor = FieldEncryptor()
+        return self._encryptor
+
+
+# Transaction-local; the deferred triggers' WHEN clauses skip rows while it is 'on'
+BULK_IMPORT_SQL = "SELECT set_config('app.bulk_import', $1, true)"
+
+
+async def load_table(connection, spec: TableSpec, records: Iterable[Dict[str, Any]],
+                     batch_size: int = DEFAULT_BATCH_SIZE, notify: bool = True,
+                     encryptor: Optional[Callable[[], Any]] = None) -> TableReport:
+    """COPY ``records`` into ``spec.name`` in batches through a staging table
+
+    Must run inside a transaction: the staging table and the
+    ``app.bulk_import`` setting only last until it ends.
+    """
+    if not 0 < batch_size <= MAX_BATCH_SIZE:
+        raise ValueError(f'batch_size must be between 1 and {MAX_BATCH_SIZE}')
+    report = TableReport(spec.name)
+    stage = f'_import_{spec.name}'
+    columns = spec.column_names
+    started = time.perf_counter()
+
+    await connection.execute(
+        f'CREATE TEMP TABLE {stage} (LIKE public.{spec.name} INCLUDING DEFAULTS) ON COMMIT DROP')
+    for column in spec.generated:
+        await connection.execute(f'ALTER TABLE {stage} ALTER COLUMN {column} DROP NOT NULL')
+    if spec.deferred_triggers:
+        await connection.execute(BULK_IMPORT_SQL, 'on')
+
+    column_list = ', '.join(columns)
+    encryptor = encryptor or _LazyEncryptor()
+    for batch in batched((convert_record(spec, record, report) for record in records), batch_size):
+        if spec.encrypted:
+            batch = encrypt_batch(spec, batch, encryptor)
+        await connection.copy_records_to_table(stage, records=batch, columns=columns)
+        for column in spec.user_columns:
+            await connection.execute(
+                f'UPDATE {stage} s SET {column} = NULL WHERE {column} IS NOT NULL '
+                f'AND NOT EXISTS (SELECT 1 FROM public.users u WHERE u.id = s.{column})')
+        if spec.name == 'cases':
+            await _apply_case_numbers(connection, stage)
+        await connection.execute(f'INSERT INTO public.{spec.name} ({column_list}) '
+                                 f'SELECT {column_list} FROM {stage}')
+        if spec.name == 'documents':
+            await _apply_document_effects(connection, stage, notify)
+        await connection.execute(f'TRUNCATE {stage}')
+        report.rows += len(batch)
+        report.batches += 1
+        logger.info(f"{spec.name}: {report.rows} rows loaded")
+
+    if spec.deferred_triggers:
+        await connection.execute(BULK_IMPORT_SQL, 'off')
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+async def import_paths(dsn: str, paths: Sequence[Path], batch_size: int = DEFAULT_BATCH_SIZE,
+                       tables: Sequence[str] = LOAD_ORDER, notify: bool = True) -> Dict[str, Any]:
+    """Import every table found in ``paths`` in one transaction"""
+    import asyncpg
+
+    started = time.perf_counter()
+    encryptor = _LazyEncryptor()
+    connection = await asyncpg.connect(dsn)
+    try:
+        with TableSpool(paths) as spool:
+            async with connection.transaction():
+                reports = []
+                for table in tables:
+                    report = await load_table(connection, TABLES[table], spool.iter_table(table),
+                                              batch_size=batch_size, notify=notify, encryptor=encryptor)
+                    if report.rows:
+                        reports.append(report)
+    finally:
+        await connection.close()
+    total_rows = sum(r.rows for r in reports)
+    elapsed = time.perf_counter() - started
+    return {
+        'tables': [r.to_dict() for r in reports],
+        'rows': total_rows,
+        'seconds': elapsed,
+        'rows_per_second': total_rows / elapsed if elapsed else 0.0,
+    }
+
+
+# -- encryption backfill ----------------------------------------------
+
+PLAINTEXT_CLIENTS_SQL = """
+SELECT id, agency_id, passport_number
+FROM public.clients
+WHERE passport_number IS NOT NULL AND passport_number NOT LIKE 'enc:%'
+  AND ($1::uuid IS NULL OR id > $1)
+ORDER BY id
+LIMIT $2
+"""
+
+# The backfill's rows: (id, agency_id, passport_number, passport_number_bidx)
+BACKFILL_SPEC = TableSpec('clients', (
+    ('id', 'uuid'), ('agency_id', 'uuid'), ('passport_number', 'text'), ('passport_number_bidx', 'text'),
+), encrypted=('passport_number',))
+
+# Conditioned on the old value so a concurrent ClientService write is not overwritten
+ENCRYPT_CLIENT_SQL = """
+UPDATE public.clients SET passport_number = $2, passport_number_bidx = $3
+WHERE id = $1 AND passport_number = $4
+"""
+
+
+async def encrypt_existing(dsn: str, batch_size: int = DEFAULT_BATCH_SIZE, encryptor=None) -> Dict[str, Any]:
+    """Encrypt plaintext passport numbers already in ``public.clients``, one committed batch at a time"""
+    import asyncpg
+
+    if not 0 < batch_size <= MAX_BATCH_SIZE:
+        raise ValueError(f'batch_size must be between 1 and {MAX_BATCH_SIZE}')
+    encryptor = encryptor or _LazyEncryptor()
+    started = time.perf_counter()
+    connection = await asyncpg.connect(dsn)
+    rows, batches, last_id = 0, 0, None
+    try:
+        while True:
+            records = await connection.fetch(PLAINTEXT_CLIENTS_SQL, last_id, batch_size)
+            if not records:
+                break
+            last_id = records[-1]['id']
+            staged = [(r['id'], r['agency_id'], r['passport_number'], None) for r in records]
+            sealed = encrypt_batch(BACKFILL_SPEC, staged, encryptor)
+            await connection.executemany(ENCRYPT_CLIENT_SQL, [
+                (client_id, token, bidx, old[2]) for (client_id, _, token, bidx), old in zip(sealed, staged)])
+            rows += len(records)
+            batches += 1
+            logger.info(f"clients: {rows} passport numbers encrypted")
+    finally:
+        await connection.close()
+    elapsed = time.perf_counter() - started
+    return {'table': 'clients', 'rows': rows, 'batches': batches, 'seconds': elapsed,
+            'rows_per_second': rows / elapsed if elapsed else 0.0}
+
+
+# -- export -----------------------------------------------------------
+
+async def export_table(dsn: str, table: str, output: TextIO, fmt: str = 'csv',
+                       agency_id: Optional[str] = None) -> Dict[str, Any]:
+    """Stream ``table`` (optionally one agency's rows) to ``output`` as CSV or fixtures YAML"""
+    import asyncpg
+
+    spec = TABLES[table]
+    columns = ', '.join(spec.column_names)
+    where, args = '', []
+    if agency_id:
+        where, args = f' WHERE {spec.agency_column} = $1', [fixture_uuid(agency_id)]
+    query = f'SELECT {columns} FROM public.{table}{where} ORDER BY updated_at, id'
+
+    started = time.perf_counter()
+    connection = await asyncpg.connect(dsn)
+    rows = 0
+    try:
+        if fmt == 'csv':
+            async def write(data: bytes) -> None:
+                output.write(data.decode('utf-8'))
+
+            status = await connection.copy_from_query(query, *args, output=write, format='csv', header=True)
+            rows = int(status.split()[-1])  # 'COPY <n>'
+        else:
+            import yaml
+
+            output.write(f'{table}:\n')
+            async with connection.transaction():
+                async for record in connection.cursor(query, *args, prefetch=DEFAULT_BATCH_SIZE):
+                    row = {key: (str(value) if isinstance(value, (uuid.UUID, datetime, date)) else value)
+                           for key, value in dict(record).items()}
+                    for name, kind in spec.columns:
+                        if kind == 'json' and isinstance(row.get(name), str):
+                            row[name] = json.loads(row[name])
+                    output.write(yaml.safe_dump([row], default_flow_style=False, sort_keys=False))
+                    rows += 1
+    finally:
+        await connection.close()
+    elapsed = time.perf_counter() - started
+    return {'table': table, 'rows': rows, 'seconds': elapsed,
+            'rows_per_second': rows / elapsed if elapsed else 0.0}
+
+
+def _expand_paths(inputs: Sequence[str]) -> List[Path]:
+    paths = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            paths.extend(sorted(p for p in path.iterdir() if p.suffix.lower() in ('.csv', '.yaml', '.yml')))
+        else:
+            paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import/export of agency data')
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help='Postgres DSN (default $DATABASE_URL)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    importer = commands.add_parser('import', help='Load CSV/YAML files or directories')
+    importer.add_argument('inputs', nargs='+')
+    importer.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    importer.add_argument('--no-notify', action='store_true', help='Skip upload notifications for imported documents')
+
+    exporter = commands.add_parser('export', help='Stream one table to a file')
+    exporter.add_argument('table', choices=sorted(TABLES))
+    exporter.add_argument('--agency-id')
+    exporter.add_argument('--format', choices=('csv', 'yaml'), default='csv')
+    exporter.add_argument('--output', '-o', default='-')
+
+    backfill = commands.add_parser('encrypt-clients', help='Encrypt passport numbers stored as plaintext')
+    backfill.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('--dsn or DATABASE_URL is required')
+
+    if args.command == 'import':
+        report = asyncio.run(import_paths(args.dsn, _expand_paths(args.inputs), batch_size=args.batch_size,
+                                          notify=not args.no_notify))
+    elif args.command == 'encrypt-clients':
+        report = asyncio.run(encrypt_existing(args.dsn, batch_size=args.batch_size))
+    else:
+        output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+        try:
+            report = asyncio.run(export_table(args.dsn, args.table, output, fmt=args.format,
+                                              agency_id=args.agency_id))
+        finally:
+            if output is not sys.stdout:
+                output.close()
+    print(json.dumps(report, indent=2, default=str), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
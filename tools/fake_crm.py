@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Local HubSpot and Salesforce fakes
+
+Threaded HTTP/1.1 servers that implement the parts of each CRM's REST API
+that ``crm/integrations`` uses, for tests and benchmarks without a real
+account:
+
+    FakeHubSpot      POST /crm/v3/objects/{contacts,deals}/search
+                     POST /crm/v3/objects/{contacts,deals}/batch/{create,update}
+    FakeSalesforce   GET  /services/data/v59.0/query?q=SOQL, GET nextRecordsUrl
+                     PATCH /services/data/v59.0/composite/sobjects/{Contact,Opportunity}/Immigration_AI_Id__c
+
+Each fake enforces the real per-call limits: 100 results per search page
+and a 10,000-result search window, 100 records per HubSpot batch and 200
+per Salesforce collection. Every write stamps a modification time.
+:meth:`edit` stands in for a person changing a record in the CRM.
+``requests`` counts calls per route. Setting ``throttle_next`` answers
+that many requests with 429.
+
+    python tools/fake_crm.py hubspot --port 8030
+"""
+
+import argparse
+import json
+import logging
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+HUBSPOT_MODIFIED = {'contacts': 'lastmodifieddate', 'deals': 'hs_lastmodifieddate'}
+SALESFORCE_PREFIX = '/services/data/v59.0'
+SALESFORCE_EXTERNAL_ID = 'Immigration_AI_Id__c'
+SALESFORCE_REQUIRED = {'Contact': ('LastName',), 'Opportunity': ('Name', 'StageName', 'CloseDate')}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _dispatch(self):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        extra = {}
+        if fake.token and self.headers.get('Authorization') != f'Bearer {fake.token}':
+            status, payload = 401, {'message': 'unauthorized'}
+        elif fake.throttle_next > 0:
+            fake.throttle_next -= 1
+            fake.throttled += 1
+            status, payload, extra = 429, {'message': 'rate limit exceeded'}, {'Retry-After': '0'}
+        else:
+            try:
+                status, payload = fake.handle(self.command, self.path, json.loads(body) if body else None,
+                                              dict(self.headers))
+            except (ValueError, KeyError, TypeError) as e:
+                status, payload = 400, {'message': f'bad request: {str(e)}'}
+        data = json.dumps(payload).encode() if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in extra.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PATCH = _dispatch
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _FakeCRM:
+    """Server plumbing and the modification clock shared by both fakes"""
+
+    # Smallest step between two modification times
+    TICK = timedelta(microseconds=1)
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, token: Optional[str] = None):
+        self.token = token
+        self.requests: Counter = Counter()
+        # Answer this many requests with 429, as a burst limit would
+        self.throttle_next = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self._last_modified = datetime.now(timezone.utc)
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def total_requests(self) -> int:
+        return sum(self.requests.values())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def tick(self) -> datetime:
+        # Strictly increasing, like a commit timestamp
+        now = datetime.now(timezone.utc)
+        self._last_modified = max(now, self._last_modified + self.TICK)
+        return self._last_modified
+
+    def handle(self, method: str, path: str, body: Any, headers: Dict[str, str]) -> Tuple[int, Any]:
+        raise NotImplementedError
+
+
+class FakeHubSpot(_FakeCRM):
+    """Contacts and deals behind HubSpot's CRM v3 search and batch endpoints"""
+
+    SEARCH_LIMIT = 100
+    SEARCH_WINDOW = 10_000
+    BATCH_LIMIT = 100
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, token: Optional[str] = None):
+        super().__init__(host, port, token)
+        self.objects: Dict[str, Dict[str, Dict[str, Any]]] = {'contacts': {}, 'deals': {}}
+        self.associations: List[Tuple[str, str, int]] = []
+        self._next_id = 1000
+
+    def _stamp(self, kind: str, record: Dict[str, Any]) -> None:
+        modified = self.tick()
+        record['modified'] = modified
+        record['properties'][HUBSPOT_MODIFIED[kind]] = modified.isoformat(timespec='milliseconds').replace(
+            '+00:00', 'Z')
+
+    def _view(self, kind: str, record: Dict[str, Any], names=None) -> Dict[str, Any]:
+        properties = record['properties']
+        if names is not None:
+            properties = {name: properties.get(name) for name in names}
+        return {'id': record['id'], 'properties': dict(properties),
+                'updatedAt': record['properties'][HUBSPOT_MODIFIED[kind]]}
+
+    def edit(self, kind: str, record_id: str, properties: Dict[str, Any]) -> None:
+        with self.lock:
+            record = self.objects[kind][record_id]
+            record['properties'].update(properties)
+            self._stamp(kind, record)
+
+    def find(self, kind: str, local_id: str) -> Optional[Dict[str, Any]]:
+        return next((record for record in self.objects[kind].values()
+                     if record['properties'].get('immigration_ai_id') == local_id), None)
+
+    def handle(self, method, path, body, headers):
+        match = re.fullmatch(r'/crm/v3/objects/(contacts|deals)/(search|batch/create|batch/update)', path)
+        if method != 'POST' or not match:
+            return 404, {'message': 'not found'}
+        kind, action = match.groups()
+        self.requests[f'{action} {kind}'] += 1
+        with self.lock:
+            if action == 'search':
+                return self._search(kind, body)
+            return self._batch(kind, action, body['inputs'])
+
+    def _search(self, kind, body):
+        limit = min(int(body.get('limit', 10)), self.SEARCH_LIMIT)
+        offset = int(body.get('after') or 0)
+        if offset + limit > self.SEARCH_WINDOW:
+            return 400, {'message': f'Search results are limited to {self.SEARCH_WINDOW}'}
+        matches = list(self.objects[kind].values())
+        for group in body.get('filterGroups', []):
+            for condition in group['filters']:
+                name = condition['propertyName']
+                if condition['operator'] == 'HAS_PROPERTY':
+                    matches = [record for record in matches if record['properties'].get(name)]
+                elif condition['operator'] == 'GTE' and name == HUBSPOT_MODIFIED[kind]:
+                    since = datetime.fromtimestamp(int(condition['value']) / 1000, timezone.utc)
+                    matches = [record for record in matches if record['modified'] >= since]
+        matches.sort(key=lambda record: (record['modified'], int(record['id'])))
+        page = matches[offset:offset + limit]
+        response = {'total': len(matches),
+                    'results': [self._view(kind, record, body.get('properties')) for record in page]}
+        if offset + limit < len(matches):
+            response['paging'] = {'next': {'after': str(offset + limit)}}
+        return 200, response
+
+    def _batch(self, kind, action, inputs):
+        if len(inputs) > self.BATCH_LIMIT:
+            return 400, {'message': f'Batch size is limited to {self.BATCH_LIMIT}'}
+        results, errors = [], []
+        for item in inputs:
+            if action == 'batch/create':
+                self._next_id += 1
+                record = {'id': str(self._next_id), 'properties': dict(item['properties'])}
+                self.objects[kind][record['id']] = record
+                for association in item.get('associations', []):
+                    self.associations.append((record['id'], association['to']['id'],
+                                              association['types'][0]['associationTypeId']))
+            else:
+                record = self.objects[kind].get(str(item['id']))
+                if record is None:
+                    errors.append({'status': 'error', 'message': f"Object {item['id']} not found"})
+                    continue
+                record['properties'].update(item['properties'])
+            self._stamp(kind, record)
+            results.append(self._view(kind, record))
+        # The real API does not promise input order either
+        results.reverse()
+        status = 207 if errors else 201 if action == 'batch/create' else 200
+        return status, {'status': 'COMPLETE', 'results': results, 'errors': errors}
+
+
+class FakeSalesforce(_FakeCRM):
+    """Contacts and opportunities behind Salesforce's query and sObject Collections endpoints"""
+
+    BATCH_LIMIT = 200
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, token: Optional[str] = None,
+                 query_batch_size: int = 2000):
+        super().__init__(host, port, token)
+        self.query_batch_size = query_batch_size
+        self.objects: Dict[str, Dict[str, Dict[str, Any]]] = {'Contact': {}, 'Opportunity': {}}
+        self._cursors: Dict[str, List[Dict[str, Any]]] = {}
+        self._next_id = 0
+
+    def _stamp(self, record: Dict[str, Any]) -> None:
+        modified = self.tick()
+        record['SystemModstamp'] = modified.strftime('%Y-%m-%dT%H:%M:%S.') + f'{modified.microsecond // 1000:03d}+0000'
+
+    def edit(self, sobject: str, record_id: str, fields: Dict[str, Any]) -> None:
+        with self.lock:
+            record = self.objects[sobject][record_id]
+            record.update(fields)
+            self._stamp(record)
+
+    def find(self, sobject: str, local_id: str) -> Optional[Dict[str, Any]]:
+        return next((record for record in self.objects[sobject].values()
+                     if record.get(SALESFORCE_EXTERNAL_ID) == local_id), None)
+
+    def handle(self, method, path, body, headers):
+        parts = urlsplit(path)
+        with self.lock:
+            if method == 'GET' and parts.path == f'{SALESFORCE_PREFIX}/query':
+                self.requests['query'] += 1
+                return self._query(parse_qs(parts.query)['q'][0], headers)
+            if method == 'GET' and parts.path.startswith(f'{SALESFORCE_PREFIX}/query/'):
+                self.requests['query more'] += 1
+                return self._more(parts.path.rsplit('/', 1)[1])
+            match = re.fullmatch(rf'{SALESFORCE_PREFIX}/composite/sobjects/(\w+)/{SALESFORCE_EXTERNAL_ID}',
+                                 parts.path)
+            if method == 'PATCH' and match and match.group(1) in self.objects:
+                self.requests[f'upsert {match.group(1)}'] += 1
+                return self._upsert(match.group(1), body)
+        return 404, [{'errorCode': 'NOT_FOUND', 'message': 'The requested resource does not exist'}]
+
+    def _query(self, soql, headers):
+        columns = [column.strip() for column in re.search(r'SELECT (.+?) FROM', soql).group(1).split(',')]
+        sobject = re.search(r'FROM (\w+)', soql).group(1)
+        rows = list(self.objects[sobject].values())
+        if f'{SALESFORCE_EXTERNAL_ID} != null' in soql:
+            rows = [row for row in rows if row.get(SALESFORCE_EXTERNAL_ID)]
+        since = re.search(r'SystemModstamp >= (\S+)', soql)
+        if since:
+            # Literals carry whole seconds; stamps are compared at the same precision
+            bound = since.group(1).rstrip('Z')
+            rows = [row for row in rows if row['SystemModstamp'][:19] >= bound]
+        rows.sort(key=lambda row: (row['SystemModstamp'], row['Id']))
+        rows = [{'attributes': {'type': sobject}, **{column: row.get(column) for column in columns}}
+                for row in rows]
+        size = self.query_batch_size
+        match = re.search(r'batchSize=(\d+)', headers.get('Sforce-Query-Options', ''))
+        if match:
+            size = min(size, int(match.group(1)))
+        locator = f'01gFAKE{len(self._cursors) + 1}'
+        self._cursors[locator] = rows
+        return self._more(locator, total=len(rows), size=size)
+
+    def _more(self, locator, total=None, size=None):
+        rows = self._cursors.get(locator.split('-')[0])
+        if rows is None:
+            return 400, [{'errorCode': 'INVALID_QUERY_LOCATOR', 'message': 'invalid query locator'}]
+        size = size or self.query_batch_size
+        offset = int(locator.split('-')[1]) if '-' in locator else 0
+        page = rows[offset:offset + size]
+        done = offset + size >= len(rows)
+        response = {'totalSize': len(rows) if total is None else total, 'done': done, 'records': page}
+        if not done:
+            response['nextRecordsUrl'] = f"{SALESFORCE_PREFIX}/query/{locator.split('-')[0]}-{offset + size}"
+        return 200, response
+
+    def _upsert(self, sobject, body):
+        records = body['records']
+        if len(records) > self.BATCH_LIMIT:
+            return 400, [{'errorCode': 'EXCEEDED_ID_LIMIT', 'message': f'Up to {self.BATCH_LIMIT} records'}]
+        results = []
+        for item in records:
+            fields = {name: value for name, value in item.items() if name != 'attributes'}
+            record = self.find(sobject, fields[SALESFORCE_EXTERNAL_ID])
+            created = record is None
+            if created:
+                missing = [name for name in SALESFORCE_REQUIRED[sobject] if not fields.get(name)]
+                if missing:
+                    results.append({'success': False, 'created': False, 'errors': [
+                        {'statusCode': 'REQUIRED_FIELD_MISSING', 'message': f'Required fields are missing: {missing}',
+                         'fields': missing}]})
+                    continue
+                self._next_id += 1
+                record = {'Id': f"{'003' if sobject == 'Contact' else '006'}{self._next_id:015d}"}
+                self.objects[sobject][record['Id']] = record
+            record.update(fields)
+            self._stamp(record)
+            results.append({'id': record['Id'], 'success': True, 'created': created, 'errors': []})
+        return 200, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local HubSpot or Salesforce fake for development and tests')
+    parser.add_argument('provider', choices=('hubspot', 'salesforce'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8030)
+    parser.add_argument('--token', default=None, help='Require this bearer token')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    fake = (FakeHubSpot if args.provider == 'hubspot' else FakeSalesforce)(args.host, args.port, args.token)
+    logger.info(f"Fake {args.provider} listening on {fake.url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake._server.server_close()
+
+
+if __name__ == '__main__':
+    main()
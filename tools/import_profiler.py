@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Import-time profiler
+
+Cold starts (new API workers, autoscaled Celery workers, test collection)
+pay for every module imported at startup. This runs ``python -X importtime``
+for the given modules in a fresh interpreter and reports the most expensive
+modules and the cost per top-level package. With ``--budget-ms`` it exits
+non-zero when the total import time is over budget.
+
+Usage::
+
+    python tools/import_profiler.py immigration_ai.api.main --top 20
+    python tools/import_profiler.py immigration_ai.workers.celery_app --budget-ms 300
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+@dataclass
+class ModuleCost:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+@dataclass
+class ImportProfile:
+    """What importing some modules cost in a fresh interpreter"""
+    targets: List[str]
+    modules: List[ModuleCost] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def total_ms(self) -> float:
+        """Cumulative time of the top-level imports, i.e. the cold-start cost"""
+        return sum(m.cumulative_us for m in self.modules if m.depth == 0) / 1000
+
+    def loaded(self, prefix: str) -> List[str]:
+        """Imported modules named ``prefix`` or inside that package"""
+        return [m.module for m in self.modules if m.module == prefix or m.module.startswith(prefix + '.')]
+
+    def top(self, n: int = 20) -> List[ModuleCost]:
+        return sorted(self.modules, key=lambda m: m.self_us, reverse=True)[:n]
+
+    def by_package(self) -> Dict[str, float]:
+        """Self time in ms per top-level package, most expensive first"""
+        totals: Dict[str, int] = defaultdict(int)
+        for m in self.modules:
+            totals[m.module.split('.')[0]] += m.self_us
+        return {name: us / 1000 for name, us in sorted(totals.items(), key=lambda item: -item[1])}
+
+    def to_dict(self, top: int = 20) -> Dict:
+        return {'targets': self.targets, 'total_ms': self.total_ms, 'error': self.error,
+                'by_package_ms': self.by_package(), 'top_modules': [asdict(m) for m in self.top(top)]}
+
+
+def parse_importtime(output: str) -> List[ModuleCost]:
+    modules = []
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            # Nesting is shown as two spaces per level after the first
+            modules.append(ModuleCost(module, int(self_us), int(cumulative_us), max(0, (len(indent) - 1) // 2)))
+    return modules
+
+
+def profile_imports(targets: Sequence[str], python: str = sys.executable) -> ImportProfile:
+    """Import ``targets`` in a fresh interpreter with ``-X importtime`` and parse the report"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(REPO_ROOT / 'src'), str(REPO_ROOT),
+                                                      env.get('PYTHONPATH')]))
+    # Compiled bytecode is assumed to exist, as it does in a built image
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    code = '; '.join(f'import {target}' for target in targets)
+    completed = subprocess.run([python, '-X', 'importtime', '-c', code], env=env, cwd=REPO_ROOT,
+                               capture_output=True, text=True)
+    profile = ImportProfile(list(targets), parse_importtime(completed.stderr))
+    if completed.returncode != 0:
+        profile.error = completed.stderr.strip().splitlines()[-1]
+    return profile
+
+
+def _print_report(profile: ImportProfile, top: int) -> None:
+    print(f"Import of {', '.join(profile.targets)}: {profile.total_ms:.1f} ms")
+    if profile.error:
+        print(f'  failed: {profile.error}')
+    print('\nBy package (self time):')
+    for name, ms in list(profile.by_package().items())[:top]:
+        print(f'  {ms:8.1f} ms  {name}')
+    print(f'\nTop {top} modules (self / cumulative):')
+    for m in profile.top(top):
+        print(f'  {m.self_us / 1000:8.1f} / {m.cumulative_us / 1000:8.1f} ms  {m.module}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report per-module import cost in a fresh interpreter')
+    parser.add_argument('modules', nargs='+', help='Modules to import, e.g. immigration_ai.api.main')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--budget-ms', type=float, help='Exit 1 if the total import time exceeds this')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    # The first run may write bytecode; measure a warm-disk cold start like a deployed worker
+    profile_imports(args.modules)
+    profile = profile_imports(args.modules)
+    if args.json:
+        print(json.dumps(profile.to_dict(args.top), indent=2))
+    else:
+        _print_report(profile, args.top)
+
+    if profile.error:
+        sys.exit(2)
+    if args.budget_ms is not None and profile.total_ms > args.budget_ms:
+        print(f'\nOver budget: {profile.total_ms:.1f} ms > {args.budget_ms:.1f} ms', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
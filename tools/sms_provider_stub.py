@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Local SMS provider stand-in
+
+A small HTTP/1.1 server that speaks the JSON API
+``communication/sms/sender.py`` expects from a provider, for tests and
+benchmarks without a real account:
+
+    POST /v1/messages  {"to", "from", "body", "status_callback"?}
+        201 {"sid", "status": "queued"}    accepted
+        200 (same body)                    repeat of an Idempotency-Key
+        400 {"error", "code"}              destination matches ``reject``
+        401                                wrong bearer token
+        429 + Retry-After                  sender over ``sender_rate``/s
+
+Connections are kept alive. ``latency`` delays every response. Each
+accepted message gets a delivery receipt in :attr:`receipts`. Destinations
+matching ``undeliverable`` get ``undelivered`` receipts. Tests hand the
+receipts to the receipt ingester themselves, the way the provider's
+webhook would. :class:`InProcessProvider` calls the same request handler
+without HTTP, for environments without aiohttp.
+
+    python tools/sms_provider_stub.py --port 8025 --latency 0.05 --sender-rate 1
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import re
+import time
+from typing import Dict, List, Optional, Pattern, Tuple
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_PATH = '/v1/messages'
+
+
+class SMSProviderStub:
+    """An asyncio HTTP server imitating an SMS provider's send API"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 sender_rate: Optional[float] = None, api_key: Optional[str] = None,
+                 reject: Optional[str] = None, undeliverable: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.sender_rate = sender_rate
+        self.api_key = api_key
+        self.reject: Optional[Pattern] = re.compile(reject) if reject else None
+        self.undeliverable: Optional[Pattern] = re.compile(undeliverable) if undeliverable else None
+        self.messages: List[dict] = []
+        self.receipts: List[dict] = []
+        self.requests = 0
+        self.throttled = 0
+        self.connections = 0
+        self._responses: Dict[str, dict] = {}
+        self._allowance: Dict[str, Tuple[float, float]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self) -> 'SMSProviderStub':
+        self._server = await asyncio.start_server(self._session, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def drain_receipts(self) -> List[dict]:
+        receipts, self.receipts = self.receipts, []
+        return receipts
+
+    def _allow(self, sender: str) -> bool:
+        # One token bucket per sender number, burst of one second's worth
+        if not self.sender_rate:
+            return True
+        now = time.monotonic()
+        tokens, updated = self._allowance.get(sender, (self.sender_rate, now))
+        tokens = min(self.sender_rate, tokens + (now - updated) * self.sender_rate)
+        if tokens < 1:
+            self._allowance[sender] = (tokens, now)
+            return False
+        self._allowance[sender] = (tokens - 1, now)
+        return True
+
+    def handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, dict, dict]:
+        """Answer one request: ``(status, json body, extra headers)``"""
+        self.requests += 1
+        if method != 'POST' or path != MESSAGES_PATH:
+            return 404, {'error': 'not found'}, {}
+        if self.api_key and headers.get('authorization') != f'Bearer {self.api_key}':
+            return 401, {'error': 'unauthorized'}, {}
+        key = headers.get('idempotency-key')
+        if key and key in self._responses:
+            return 200, self._responses[key], {}
+        try:
+            payload = json.loads(body or b'{}')
+            to, sender, text = payload['to'], payload['from'], payload['body']
+        except (ValueError, KeyError, TypeError):
+            return 400, {'error': 'to, from and body are required', 'code': 21604}, {}
+        if self.reject and self.reject.search(to):
+            return 400, {'error': f'{to} is not a valid mobile number', 'code': 21211}, {}
+        if not self._allow(sender):
+            self.throttled += 1
+            return 429, {'error': 'too many requests', 'code': 20429}, {'Retry-After': '1'}
+        sid = f'SM{len(self.messages) + 1:032x}'
+        self.messages.append({'sid': sid, 'to': to, 'from': sender, 'body': text, 'idempotency_key': key})
+        delivered = not (self.undeliverable and self.undeliverable.search(to))
+        self.receipts.append({'sid': sid, 'status': 'delivered' if delivered else 'undelivered',
+                              'error_code': None if delivered else '30003'})
+        response = {'sid': sid, 'status': 'queued'}
+        if key:
+            self._responses[key] = response
+        return 201, response, {}
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    return
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload, extra = self.handle(method, path, headers, body)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                data = json.dumps(payload).encode()
+                head = [f'HTTP/1.1 {status} {"OK" if status < 400 else "Error"}',
+                        'Content-Type: application/json', f'Content-Length: {len(data)}']
+                head.extend(f'{name}: {value}' for name, value in extra.items())
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+class InProcessProvider:
+    """An ``SMSDispatcher`` provider that calls :meth:`SMSProviderStub.handle` directly
+
+    ``latency`` (default: the stub's) stands in for the API round trip.
+    """
+
+    def __init__(self, stub: SMSProviderStub, latency: Optional[float] = None):
+        self.stub = stub
+        self.latency = stub.latency if latency is None else latency
+
+    async def send(self, message, sender: str):
+        from immigration_ai.communication.sms.sender import MESSAGES_PATH as path, provider_result
+
+        headers = {'idempotency-key': message.idempotency_key}
+        if self.stub.api_key:
+            headers['authorization'] = f'Bearer {self.stub.api_key}'
+        body = json.dumps({'to': message.to, 'from': sender, 'body': message.body}).encode()
+        status, payload, extra = self.stub.handle('POST', path, headers, body)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return provider_result(message, sender, status, payload, extra.get('Retry-After'))
+
+
+async def _serve(args) -> None:
+    stub = await SMSProviderStub(args.host, args.port, args.latency, args.sender_rate, args.api_key).start()
+    logger.info(f"SMS provider stand-in listening on {stub.url}{MESSAGES_PATH}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            logger.info(f"{len(stub.messages)} accepted, {stub.throttled} throttled over "
+                        f"{stub.connections} connections")
+    finally:
+        await stub.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SMS provider stand-in for development and tests')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--sender-rate', type=float, default=None, help='Messages per second per sender')
+    parser.add_argument('--api-key', default=None, help='Require this bearer token')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Local SMTP sink
+
+Accepts mail and discards it, counting messages, for developing and
+benchmarking the email delivery engine without a real provider. It
+advertises PIPELINING and handles pipelined commands. ``latency`` delays
+each read from the socket, not each reply, which mimics one network round
+trip per batch of commands the client sends. Recipients matching
+``reject`` get a 550 and recipients matching ``defer`` get a 451.
+
+    python tools/smtp_sink.py --port 2525 --latency 0.005
+"""
+
+import argparse
+import asyncio
+import logging
+import re
+from typing import List, Optional, Pattern
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPSink:
+    """An asyncio SMTP server that counts and drops messages"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, pipelining: bool = True,
+                 reject: Optional[str] = None, defer: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.pipelining = pipelining
+        self.reject: Optional[Pattern] = re.compile(reject) if reject else None
+        self.defer: Optional[Pattern] = re.compile(defer) if defer else None
+        self.messages = 0
+        self.connections = 0
+        self.recipients: List[str] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> 'SMTPSink':
+        self._server = await asyncio.start_server(self._session, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        writer.write(b'220 sink ESMTP\r\n')
+        sender, recipients, in_data = None, [], False
+        buffer = b''
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    return
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                buffer += chunk
+                replies = []
+                while True:
+                    if in_data:
+                        end = buffer.find(b'\r\n.\r\n')
+                        if buffer.startswith(b'.\r\n'):
+                            end, skip = 0, 3
+                        elif end < 0:
+                            break
+                        else:
+                            skip = end + 5
+                        buffer = buffer[skip:]
+                        in_data = False
+                        self.messages += 1
+                        self.recipients.extend(recipients)
+                        sender, recipients = None, []
+                        replies.append(b'250 queued')
+                        continue
+                    line, found, rest = buffer.partition(b'\r\n')
+                    if not found:
+                        break
+                    buffer = rest
+                    command = line.decode('utf-8', 'replace')
+                    verb = command[:4].upper()
+                    if verb == 'EHLO':
+                        extensions = ['250-sink', '250-8BITMIME']
+                        if self.pipelining:
+                            extensions.append('250-PIPELINING')
+                        replies.append(('\r\n'.join(extensions) + '\r\n250 SIZE 10485760').encode())
+                    elif verb == 'HELO':
+                        replies.append(b'250 sink')
+                    elif verb == 'MAIL':
+                        sender, recipients = command[10:].strip(), []
+                        replies.append(b'250 ok')
+                    elif verb == 'RCPT':
+                        address = command[8:].strip().strip('<>')
+                        if sender is None:
+                            replies.append(b'503 need MAIL first')
+                        elif self.reject and self.reject.search(address):
+                            replies.append(b'550 no such user')
+                        elif self.defer and self.defer.search(address):
+                            replies.append(b'451 try again later')
+                        else:
+                            recipients.append(address)
+                            replies.append(b'250 ok')
+                    elif verb == 'DATA':
+                        if not recipients:
+                            replies.append(b'554 no valid recipients')
+                        else:
+                            in_data = True
+                            replies.append(b'354 go ahead')
+                    elif verb == 'RSET':
+                        sender, recipients = None, []
+                        replies.append(b'250 ok')
+                    elif verb == 'NOOP':
+                        replies.append(b'250 ok')
+                    elif verb == 'QUIT':
+                        writer.write(b'221 bye\r\n')
+                        await writer.drain()
+                        return
+                    else:
+                        replies.append(b'502 not implemented')
+                if replies:
+                    writer.write(b'\r\n'.join(replies) + b'\r\n')
+                    await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _serve(args) -> None:
+    sink = await SMTPSink(args.host, args.port, args.latency, not args.no_pipelining).start()
+    logger.info(f"SMTP sink listening on {sink.host}:{sink.port}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            logger.info(f"{sink.messages} messages over {sink.connections} connections")
+    finally:
+        await sink.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SMTP sink for email delivery development')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every socket read')
+    parser.add_argument('--no-pipelining', action='store_true', help='Do not advertise PIPELINING')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()